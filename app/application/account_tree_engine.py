@@ -0,0 +1,54 @@
+"""
+Labeeb ERP - Account Tree Engine
+Cached chart-of-accounts subtree membership from the account closure table
+"""
+
+from typing import Dict, FrozenSet
+
+from app.infrastructure.cache import LoadOnceCache
+from app.infrastructure.database import get_session
+from app.infrastructure.repositories import AccountClosureRepository
+
+
+def load_subtrees() -> Dict[int, FrozenSet[int]]:
+    """Descendants of every account, the account itself included"""
+    subtrees: Dict[int, set] = {}
+    with get_session() as db:
+        for ancestor_id, descendant_id in AccountClosureRepository(db).get_links():
+            subtrees.setdefault(ancestor_id, set()).add(descendant_id)
+    return {account_id: frozenset(members) for account_id, members in subtrees.items()}
+
+
+class AccountTree:
+    """Answers "is this account under that group" with a set lookup, for the accounts tree and report filters.
+
+    Loaded on first use and dropped by invalidate(), which the account service
+    calls after every change to the chart.
+    """
+
+    def __init__(self, loader=load_subtrees):
+        self._subtrees: LoadOnceCache[Dict[int, FrozenSet[int]]] = LoadOnceCache(loader)
+
+    def _get_subtrees(self) -> Dict[int, FrozenSet[int]]:
+        return self._subtrees.get()
+
+    def invalidate(self):
+        self._subtrees.invalidate()
+
+    def subtree(self, account_id: int) -> FrozenSet[int]:
+        """The account and all accounts below it"""
+        return self._get_subtrees().get(account_id, frozenset((account_id,)))
+
+    def is_in_subtree(self, ancestor_id: int, account_id: int) -> bool:
+        return account_id in self.subtree(ancestor_id)
+
+
+# Global account tree instance
+_account_tree = None
+
+def get_account_tree() -> AccountTree:
+    """Get the global account tree instance"""
+    global _account_tree
+    if _account_tree is None:
+        _account_tree = AccountTree()
+    return _account_tree
@@ -0,0 +1,334 @@
+"""
+Labeeb ERP - Bank Reconciliation Engine
+Bank statement import (CSV / MT940 / CAMT.053) and automatic matching against book transactions
+"""
+
+import csv
+import hashlib
+import os
+import re
+import xml.etree.ElementTree as ET
+from bisect import bisect_left
+from collections import defaultdict
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Dict, Iterator, List, Optional, Tuple
+
+AMOUNT_SCALE = 1000 # Amounts are compared as integers in Numeric(18,3) units
+
+# BankTransaction.transaction_type: 0 Deposit, 1 Withdrawal, 2 Transfer In, 3 Transfer Out
+CREDIT_TRANSACTION_TYPES = (0, 2)
+
+
+def signed_book_amount(transaction_type: int, amount: Decimal) -> Decimal:
+    return amount if transaction_type in CREDIT_TRANSACTION_TYPES else -amount
+
+
+def normalize_ref(ref: Optional[str]) -> Optional[str]:
+    if not ref:
+        return None
+    ref = re.sub(r'[^0-9A-Za-z]', '', ref).upper()
+    return ref or None
+
+
+# ==================== Statement Parsers ====================
+
+def _open_text(source):
+    if isinstance(source, (str, os.PathLike)):
+        return open(source, 'r', encoding='utf-8-sig', newline='')
+    return source
+
+
+def parse_csv_statement(source, date_column: str = 'date', amount_column: str = 'amount',
+                        ref_column: str = 'ref_no', description_column: str = 'description',
+                        date_format: str = '%Y-%m-%d', debit_column: str = None, credit_column: str = None,
+                        delimiter: str = ',') -> Iterator[dict]:
+    """Stream statement lines from a CSV file with a header row.
+
+    Either a signed amount column or separate debit/credit columns can be used.
+    """
+    stream = _open_text(source)
+    try:
+        for row in csv.DictReader(stream, delimiter=delimiter):
+            if debit_column or credit_column:
+                credit = Decimal(row.get(credit_column) or 0) if credit_column else Decimal(0)
+                debit = Decimal(row.get(debit_column) or 0) if debit_column else Decimal(0)
+                amount = credit - debit
+            else:
+                amount = Decimal(row[amount_column].replace(',', ''))
+            yield {
+                'statement_date': datetime.strptime(row[date_column].strip(), date_format).date(),
+                'amount': amount,
+                'ref_no': (row.get(ref_column) or '').strip() or None,
+                'description': (row.get(description_column) or '').strip() or None
+            }
+    finally:
+        if stream is not source:
+            stream.close()
+
+
+# :61:YYMMDD[MMDD]<C|D|RC|RD>[funds code]<amount>N<type code><customer ref>[//<bank ref>]
+_MT940_61 = re.compile(r'^(\d{6})(\d{4})?(RC|RD|C|D)([A-Z])?(\d+,\d*)([A-Z]\w{3})([^/\n]*)(?://(.*))?')
+
+
+def parse_mt940_statement(source) -> Iterator[dict]:
+    """Stream statement lines from a SWIFT MT940 file (:61: entries with their :86: details)"""
+    stream = _open_text(source)
+    current = None
+    current_tag = None
+    try:
+        for raw_line in stream:
+            line = raw_line.rstrip('\r\n')
+            tag_match = re.match(r'^:(\d{2}[A-Z]?):(.*)$', line)
+            if tag_match:
+                current_tag, value = tag_match.groups()
+                if current_tag == '61':
+                    if current:
+                        yield current
+                    match = _MT940_61.match(value)
+                    if not match:
+                        current = None
+                        continue
+                    value_date, _, mark, _, amount, _, customer_ref, bank_ref = match.groups()
+                    amount = Decimal(amount.replace(',', '.'))
+                    # D and RC reduce the balance, C and RD increase it
+                    if mark in ('D', 'RC'):
+                        amount = -amount
+                    ref = customer_ref.strip()
+                    if not ref or ref == 'NONREF':
+                        ref = (bank_ref or '').strip() or None
+                    current = {
+                        'statement_date': datetime.strptime(value_date, '%y%m%d').date(),
+                        'amount': amount,
+                        'ref_no': ref,
+                        'description': None
+                    }
+                elif current_tag == '86' and current:
+                    current['description'] = value.strip()
+                elif current_tag in ('62F', '62M') and current:
+                    yield current
+                    current = None
+            elif current_tag == '86' and current and line and not line.startswith('-'):
+                current['description'] = f"{current['description'] or ''} {line.strip()}".strip()
+        if current:
+            yield current
+    finally:
+        if stream is not source:
+            stream.close()
+
+
+def _local(tag: str) -> str:
+    return tag.rsplit('}', 1)[-1]
+
+
+def _find_text(element, *paths) -> Optional[str]:
+    for path in paths:
+        node = element
+        for part in path.split('/'):
+            node = next((child for child in node if _local(child.tag) == part), None)
+            if node is None:
+                break
+        if node is not None and node.text and node.text.strip():
+            return node.text.strip()
+    return None
+
+
+def parse_camt053_statement(source) -> Iterator[dict]:
+    """Stream statement lines from an ISO 20022 camt.053 XML file, one <Ntry> at a time"""
+    for event, element in ET.iterparse(source, events=('end',)):
+        if _local(element.tag) != 'Ntry':
+            continue
+        amount = Decimal(_find_text(element, 'Amt'))
+        if _find_text(element, 'CdtDbtInd') == 'DBIT':
+            amount = -amount
+        booking_date = _find_text(element, 'BookgDt/Dt', 'BookgDt/DtTm', 'ValDt/Dt', 'ValDt/DtTm')
+        yield {
+            'statement_date': date.fromisoformat(booking_date[:10]),
+            'amount': amount,
+            'ref_no': _find_text(element, 'NtryDtls/TxDtls/Refs/EndToEndId', 'AcctSvcrRef', 'NtryRef'),
+            'description': _find_text(element, 'AddtlNtryInf', 'NtryDtls/TxDtls/RmtInf/Ustrd')
+        }
+        element.clear() # Keep memory flat on large statements
+
+
+STATEMENT_PARSERS = {
+    'csv': parse_csv_statement,
+    'mt940': parse_mt940_statement,
+    'camt053': parse_camt053_statement,
+}
+
+
+def detect_statement_format(file_path: str) -> str:
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension == '.csv':
+        return 'csv'
+    if extension == '.xml':
+        return 'camt053'
+    if extension in ('.sta', '.mt940', '.940', '.txt'):
+        return 'mt940'
+    raise ValueError(f"Unsupported bank statement format: {extension}")
+
+
+def parse_statement(file_path: str, file_format: str = None, **options) -> Iterator[dict]:
+    file_format = file_format or detect_statement_format(file_path)
+    parser = STATEMENT_PARSERS.get(file_format)
+    if parser is None:
+        raise ValueError(f"Unsupported bank statement format: {file_format}")
+    return parser(file_path, **options)
+
+
+def with_line_hashes(lines: Iterator[dict]) -> Iterator[dict]:
+    """Add a line_hash identifying each line within its bank account.
+
+    The hash covers date, amount, normalized reference and description, plus
+    how many identical lines came before it in the file, so two equal fees on
+    one day stay two lines while the same line in an overlapping or repeated
+    statement gets the same hash.
+    """
+    seen: Dict[bytes, int] = defaultdict(int)
+    for line in lines:
+        key = '|'.join((line['statement_date'].isoformat(), str(Decimal(line['amount']).quantize(Decimal('0.001'))),
+                        normalize_ref(line.get('ref_no')) or '', line.get('description') or ''))
+        digest = hashlib.sha256(key.encode('utf-8')).digest()
+        occurrence = seen[digest]
+        seen[digest] = occurrence + 1
+        line['line_hash'] = hashlib.sha256(digest + occurrence.to_bytes(4, 'big')).hexdigest()
+        yield line
+
+
+# ==================== Matching ====================
+
+class MatchEntry:
+    """Compact representation of a statement line or book transaction used by the matcher"""
+
+    __slots__ = ('id', 'amount', 'day', 'ref')
+
+    def __init__(self, id: int, amount: Decimal, day: date, ref: Optional[str]):
+        self.id = id
+        self.amount = int(amount * AMOUNT_SCALE)
+        self.day = day.toordinal()
+        self.ref = normalize_ref(ref)
+
+
+class ReconciliationMatcher:
+    """Matches statement lines to book transactions with hash and date-window indexes.
+
+    Passes, each only over what is still unmatched:
+      1. ref:          same reference and amount, within the date window
+      2. amount_date:  same amount, nearest date within the window
+      3. one_to_many:  one statement line equal to the sum of book transactions
+                       sharing a date or reference (e.g. a batched deposit)
+      4. many_to_one:  several statement lines sharing a date or reference equal
+                       to one book transaction (e.g. a payment split by the bank)
+    Every pass is a hash lookup plus a bisect, and a matched book transaction is
+    removed from its date-sorted bucket, so equal amounts do not rescan it and
+    the whole run is O(n log n).
+    """
+
+    def __init__(self, date_window_days: int = 3):
+        self.window = date_window_days
+
+    def match(self, statement_lines: List[MatchEntry], book_entries: List[MatchEntry]) -> List[Tuple[str, List[int], List[int]]]:
+        self.matched_lines = set()
+        self.matched_book = set()
+        results = []
+        self._match_by_ref(statement_lines, book_entries, results)
+        self._match_by_amount_date(statement_lines, book_entries, results)
+        self._match_groups(statement_lines, book_entries, results)
+        return results
+
+    def _nearest(self, bucket: Tuple[List[MatchEntry], List[int]], day: int) -> Optional[int]:
+        """Position of the bucket entry nearest to day within the window; the earlier date wins a tie"""
+        candidates, days = bucket
+        idx = bisect_left(days, day)
+        best = None
+        if idx > 0 and day - days[idx - 1] <= self.window:
+            best = bisect_left(days, days[idx - 1]) # First entry of that date
+        if idx < len(days) and days[idx] - day <= self.window and (best is None or days[idx] - day < day - days[best]):
+            best = idx
+        return best
+
+    @staticmethod
+    def _take(bucket: Tuple[List[MatchEntry], List[int]], position: int) -> MatchEntry:
+        candidates, days = bucket
+        days.pop(position)
+        return candidates.pop(position)
+
+    @staticmethod
+    def _index(entries, key) -> Dict:
+        index = defaultdict(list)
+        for entry in sorted(entries, key=lambda e: e.day):
+            index[key(entry)].append(entry)
+        return {k: (v, [e.day for e in v]) for k, v in index.items()}
+
+    def _match_by_ref(self, lines, book, results):
+        index = self._index((b for b in book if b.ref), lambda e: (e.ref, e.amount))
+        for line in lines:
+            if not line.ref:
+                continue
+            bucket = index.get((line.ref, line.amount))
+            if not bucket:
+                continue
+            position = self._nearest(bucket, line.day)
+            if position is not None:
+                self._record(results, 'ref', [line], [self._take(bucket, position)])
+
+    def _match_by_amount_date(self, lines, book, results):
+        index = self._index((b for b in book if b.id not in self.matched_book), lambda e: e.amount)
+        for line in lines:
+            if line.id in self.matched_lines:
+                continue
+            bucket = index.get(line.amount)
+            if not bucket:
+                continue
+            position = self._nearest(bucket, line.day)
+            if position is not None:
+                self._record(results, 'amount_date', [line], [self._take(bucket, position)])
+
+    @staticmethod
+    def _groups(entries) -> List[List[MatchEntry]]:
+        # Candidate groups: same-sign entries sharing a date, and entries sharing a reference
+        by_key = defaultdict(list)
+        for entry in entries:
+            by_key[('day', entry.day, entry.amount > 0)].append(entry)
+            if entry.ref:
+                by_key[('ref', entry.ref)].append(entry)
+        return [group for group in by_key.values() if len(group) > 1]
+
+    def _match_groups(self, lines, book, results):
+        remaining_lines = [l for l in lines if l.id not in self.matched_lines]
+        remaining_book = [b for b in book if b.id not in self.matched_book]
+
+        # One statement line <-> many book transactions
+        book_groups = defaultdict(list)
+        for group in self._groups(remaining_book):
+            book_groups[sum(e.amount for e in group)].append(group)
+        for line in remaining_lines:
+            for group in book_groups.get(line.amount, ()):
+                if self._group_available(group, self.matched_book) and self._within_window(group, line.day):
+                    self._record(results, 'one_to_many', [line], group)
+                    break
+
+        # Many statement lines <-> one book transaction
+        book_index = self._index((b for b in remaining_book if b.id not in self.matched_book), lambda e: e.amount)
+        for group in self._groups([l for l in remaining_lines if l.id not in self.matched_lines]):
+            if not self._group_available(group, self.matched_lines):
+                continue
+            bucket = book_index.get(sum(e.amount for e in group))
+            if not bucket:
+                continue
+            position = self._nearest(bucket, max(e.day for e in group))
+            if position is not None and self._within_window(group, bucket[1][position]):
+                self._record(results, 'many_to_one', group, [self._take(bucket, position)])
+
+    @staticmethod
+    def _group_available(group, matched: set) -> bool:
+        return all(e.id not in matched for e in group)
+
+    def _within_window(self, group, day: int) -> bool:
+        return all(abs(e.day - day) <= self.window for e in group)
+
+    def _record(self, results, rule, line_group, book_group):
+        self.matched_lines.update(e.id for e in line_group)
+        self.matched_book.update(e.id for e in book_group)
+        results.append((rule, [e.id for e in line_group], [e.id for e in book_group]))
@@ -0,0 +1,104 @@
+"""
+Labeeb ERP - Consolidation Engine
+Group account balances: per-company ledger aggregation in parallel, currency translation and intercompany elimination
+"""
+
+import contextvars
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Callable, Dict, Iterable, List
+
+from app.infrastructure.database import get_session, engine
+from app.infrastructure.repositories import PeriodCloseRepository
+
+MONEY_QUANT = Decimal('0.001') # Matches Numeric(18,3) used for amounts
+ZERO = Decimal(0)
+CONSOLIDATION_WORKERS = int(os.getenv("CONSOLIDATION_WORKERS", "0")) # 0: as many as the connection pool allows
+
+
+def fetch_company_balances(company_id: int, as_of: date, branch_id: int = None) -> Dict[int, Decimal]:
+    """Posted balance (debit - credit) per account of one company, aggregated by the database from the nearest snapshot"""
+    with get_session() as db:
+        rows = PeriodCloseRepository(db).get_account_balances(company_id, as_of, branch_id)
+        return {row.account_id: (row.debit or ZERO) - (row.credit or ZERO) for row in rows}
+
+
+def default_workers() -> int:
+    if CONSOLIDATION_WORKERS > 0:
+        return CONSOLIDATION_WORKERS
+    pool = engine.pool
+    size = getattr(pool, 'size', None)
+    overflow = getattr(pool, '_max_overflow', 0)
+    # Leave one connection for the GUI thread
+    return max(1, (size() if callable(size) else 4) + max(overflow, 0) - 1)
+
+
+def parallel_balances(company_ids: Iterable[int], as_of: date, workers: int = None,
+                      fetch: Callable[[int, date], Dict[int, Decimal]] = fetch_company_balances) -> Dict[int, Dict[int, Decimal]]:
+    """Run fetch for every company concurrently, each on its own pooled connection.
+
+    The aggregation itself runs inside the database, so threads waiting on their
+    queries overlap fully; wall time follows the slowest company rather than the
+    sum. The caller's context (e.g. read_only replica routing) is carried into
+    every worker.
+    """
+    company_ids = list(company_ids)
+    if not company_ids:
+        return {}
+    workers = min(workers or default_workers(), len(company_ids))
+    if workers == 1:
+        return {company_id: fetch(company_id, as_of) for company_id in company_ids}
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="consolidation") as executor:
+        futures = {company_id: executor.submit(contextvars.copy_context().run, fetch, company_id, as_of) for company_id in company_ids}
+        return {company_id: future.result() for company_id, future in futures.items()}
+
+
+def translate(balances: Dict[int, Decimal], rate: Decimal) -> Dict[int, Decimal]:
+    """Balances in the presentation currency. All accounts use the closing rate, so a balanced ledger stays balanced."""
+    if rate == 1:
+        return dict(balances)
+    return {account_id: (balance * rate).quantize(MONEY_QUANT, rounding=ROUND_HALF_UP) for account_id, balance in balances.items()}
+
+
+def apply_eliminations(totals: Dict[int, Decimal], rules) -> List[dict]:
+    """Remove intercompany balances from the group totals in place and return the elimination lines.
+
+    account_id normally carries a debit and counterpart_account_id a credit.
+    With a difference account both are cleared and the remainder moves there;
+    without one only the matched amount is removed.
+    """
+    eliminations = []
+    for rule in rules:
+        receivable = totals.get(rule.account_id, ZERO)
+        payable = totals.get(rule.counterpart_account_id, ZERO)
+        if rule.difference_account_id:
+            difference = receivable + payable
+            cleared_receivable, cleared_payable = receivable, payable
+        else:
+            matched = min(receivable, -payable) if receivable > 0 and payable < 0 else ZERO
+            difference = ZERO
+            cleared_receivable, cleared_payable = matched, -matched
+        if not cleared_receivable and not cleared_payable:
+            continue
+        totals[rule.account_id] = receivable - cleared_receivable
+        totals[rule.counterpart_account_id] = payable - cleared_payable
+        if difference:
+            totals[rule.difference_account_id] = totals.get(rule.difference_account_id, ZERO) + difference
+        eliminations.append({'rule_id': rule.id, 'name': rule.name, 'account_id': rule.account_id,
+                             'counterpart_account_id': rule.counterpart_account_id, 'eliminated': cleared_receivable,
+                             'counterpart_eliminated': cleared_payable, 'difference_account_id': rule.difference_account_id,
+                             'difference': difference})
+    return eliminations
+
+
+def consolidate(company_balances: Dict[int, Dict[int, Decimal]], rates: Dict[int, Decimal], rules) -> dict:
+    """Merge translated company balances into group totals and apply the elimination rules"""
+    by_company = {company_id: translate(balances, rates.get(company_id, Decimal(1))) for company_id, balances in company_balances.items()}
+    totals: Dict[int, Decimal] = {}
+    for balances in by_company.values():
+        for account_id, balance in balances.items():
+            totals[account_id] = totals.get(account_id, ZERO) + balance
+    eliminations = apply_eliminations(totals, rules)
+    return {'by_company': by_company, 'eliminations': eliminations, 'totals': totals}
@@ -0,0 +1,179 @@
+"""
+Labeeb ERP - Inventory Costing Engine
+FIFO cost layers and perpetual weighted average cost per (item, warehouse)
+"""
+
+import json
+from collections import deque
+from datetime import date
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Iterable, List, Optional, Tuple
+
+ZERO = Decimal(0)
+MONEY_QUANT = Decimal('0.001') # Numeric(18,3)
+COST_QUANT = Decimal('0.000001') # Numeric(18,6) unit costs
+
+# Item.costing_method
+FIFO = 0
+WEIGHTED_AVERAGE = 1
+SPECIFIC = 2 # No lot tracking yet: costed as FIFO
+
+# StockMovement.movement_type as used by the inventory and sales backends:
+# 0 In and 2 Transfer In add stock, 1 Out, 3 Transfer Out / Adjustment and 4 Waste remove it.
+# A negative quantity reverses the direction (e.g. a positive adjustment entered as -qty on type 3).
+INBOUND_MOVEMENT_TYPES = (0, 2)
+
+# A new checkpoint is written once the previous one is this old, which bounds
+# how many days of movements a backdated entry has to replay.
+CHECKPOINT_INTERVAL_DAYS = 7
+
+
+def signed_movement_quantity(movement_type: int, quantity: Decimal) -> Decimal:
+    """Quantity added to (positive) or removed from (negative) stock by a movement"""
+    return quantity if movement_type in INBOUND_MOVEMENT_TYPES else -quantity
+
+
+class CostLayer:
+    """Remaining quantity of one receipt, keyed by the inbound movement that created it"""
+
+    __slots__ = ('movement_id', 'layer_date', 'remaining', 'unit_cost', 'original')
+
+    def __init__(self, movement_id: int, layer_date: date, remaining: Decimal, unit_cost: Decimal, original: Decimal = None):
+        self.movement_id = movement_id
+        self.layer_date = layer_date
+        self.remaining = remaining
+        self.unit_cost = unit_cost
+        self.original = remaining if original is None else original
+
+    def __repr__(self):
+        return f"<CostLayer(movement_id={self.movement_id}, remaining={self.remaining}, unit_cost={self.unit_cost})>"
+
+
+class CostState:
+    """On-hand quantity, value and open FIFO layers of one (item, warehouse).
+
+    receive() and issue() are O(1) amortized: FIFO issues pop layers from the
+    front of a deque, weighted average issues use the running average. Stock
+    may go negative; the backlog is costed at the last known unit cost and
+    absorbed by the next receipt.
+    """
+
+    __slots__ = ('method', 'quantity', 'value', 'average_cost', 'layers', 'touched')
+
+    def __init__(self, method: int = FIFO, quantity: Decimal = ZERO, value: Decimal = ZERO,
+                 average_cost: Decimal = ZERO, layers: Iterable[CostLayer] = ()):
+        self.method = WEIGHTED_AVERAGE if method == WEIGHTED_AVERAGE else FIFO
+        self.quantity = quantity
+        self.value = value
+        self.average_cost = average_cost
+        self.layers = deque(layers)
+        self.touched = {} # movement_id -> layer changed since load, for write-back
+
+    def receive(self, movement_id: int, movement_date: date, quantity: Decimal, unit_cost: Decimal):
+        if self.quantity < 0:
+            # Cover the negative backlog first; only the surplus opens a layer
+            covered = min(quantity, -self.quantity)
+            self.quantity += covered
+            self.value += covered * unit_cost
+            quantity -= covered
+            if self.quantity == 0:
+                self.value = ZERO
+        if quantity > 0:
+            self.quantity += quantity
+            self.value += quantity * unit_cost
+            if self.method == FIFO:
+                layer = CostLayer(movement_id, movement_date, quantity, unit_cost)
+                self.layers.append(layer)
+                self.touched[movement_id] = layer
+        if self.quantity > 0:
+            self.average_cost = (self.value / self.quantity).quantize(COST_QUANT, rounding=ROUND_HALF_UP)
+        elif unit_cost:
+            self.average_cost = unit_cost
+
+    def issue(self, quantity: Decimal) -> Decimal:
+        """Remove quantity from stock and return its cost"""
+        cost = ZERO
+        remaining = quantity
+        if self.method == FIFO:
+            layers = self.layers
+            while remaining > 0 and layers:
+                layer = layers[0]
+                taken = min(remaining, layer.remaining)
+                cost += taken * layer.unit_cost
+                layer.remaining -= taken
+                remaining -= taken
+                self.touched[layer.movement_id] = layer
+                if layer.remaining == 0:
+                    layers.popleft()
+        else:
+            available = max(min(quantity, self.quantity), ZERO)
+            if available == self.quantity:
+                cost = self.value
+            else:
+                cost = available * self.average_cost
+            remaining -= available
+        if remaining > 0:
+            cost += remaining * self.average_cost
+        self.quantity -= quantity
+        self.value -= cost
+        if self.quantity > 0:
+            self.average_cost = (self.value / self.quantity).quantize(COST_QUANT, rounding=ROUND_HALF_UP)
+        else:
+            self.value = self.quantity * self.average_cost
+        return cost.quantize(MONEY_QUANT, rounding=ROUND_HALF_UP)
+
+    def peek_issue_cost(self, quantity: Decimal) -> Decimal:
+        """Cost an issue of quantity would have, without changing the state"""
+        if self.method != FIFO:
+            if 0 < quantity <= self.quantity:
+                return (quantity * self.value / self.quantity).quantize(MONEY_QUANT, rounding=ROUND_HALF_UP)
+            return (quantity * self.average_cost).quantize(MONEY_QUANT, rounding=ROUND_HALF_UP)
+        cost = ZERO
+        remaining = quantity
+        for layer in self.layers:
+            if remaining <= 0:
+                break
+            taken = min(remaining, layer.remaining)
+            cost += taken * layer.unit_cost
+            remaining -= taken
+        if remaining > 0:
+            cost += remaining * self.average_cost
+        return cost.quantize(MONEY_QUANT, rounding=ROUND_HALF_UP)
+
+    def apply(self, movement_id: int, movement_type: int, movement_date: date, quantity: Decimal,
+              unit_cost: Optional[Decimal]) -> Tuple[Decimal, Decimal]:
+        """Apply one movement and return its (unit cost, total cost)"""
+        signed = signed_movement_quantity(movement_type, quantity)
+        if signed >= 0:
+            unit_cost = unit_cost if unit_cost else self.average_cost
+            self.receive(movement_id, movement_date, signed, unit_cost)
+            return unit_cost, (signed * unit_cost).quantize(MONEY_QUANT, rounding=ROUND_HALF_UP)
+        total = self.issue(-signed)
+        return (total / -signed).quantize(COST_QUANT, rounding=ROUND_HALF_UP), total
+
+    # ---- Checkpoint serialization ----
+
+    def layers_to_json(self) -> str:
+        return json.dumps([[l.movement_id, l.layer_date.isoformat(), str(l.remaining), str(l.unit_cost), str(l.original)]
+                           for l in self.layers])
+
+    @staticmethod
+    def layers_from_json(payload: Optional[str]) -> List[CostLayer]:
+        if not payload:
+            return []
+        return [CostLayer(movement_id, date.fromisoformat(layer_date), Decimal(remaining), Decimal(unit_cost), Decimal(original))
+                for movement_id, layer_date, remaining, unit_cost, original in json.loads(payload)]
+
+
+def replay_movements(state: CostState, movements: Iterable) -> List[Tuple[int, Decimal]]:
+    """Apply movements (ordered by date, id) to a state and return the (movement_id, unit cost) of each.
+
+    Inbound movements keep the unit cost they were entered with; outbound
+    movements are re-costed from the replayed layers or average.
+    """
+    costs = []
+    for movement in movements:
+        unit_cost, _ = state.apply(movement.id, movement.movement_type, movement.movement_date,
+                                   movement.quantity, movement.cost)
+        costs.append((movement.id, unit_cost))
+    return costs
@@ -0,0 +1,266 @@
+"""
+Labeeb ERP - Export Engine
+Streams report rows to CSV, XLSX or PDF in fixed-size chunks so memory stays flat regardless of row count
+"""
+
+import csv
+import os
+import re
+import zipfile
+from datetime import date, datetime
+from decimal import Decimal
+from itertools import islice
+from typing import Callable, Iterable, List, Optional, Sequence
+from xml.sax.saxutils import escape
+
+CHUNK_SIZE = 5000 # Rows fetched, written and reported per step
+XLSX_MAX_ROWS = 1_048_576 # Rows per worksheet, header included; longer exports continue on a new sheet
+
+
+class ExportCancelled(Exception):
+    """Raised inside an export when its cancelled() callback returns True"""
+
+
+def _text(value) -> str:
+    if value is None:
+        return ''
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return str(value)
+
+
+class CsvExportWriter:
+    def __init__(self, file_path: str, headers: Sequence[str], **options):
+        self._file = open(file_path, 'w', newline='', encoding='utf-8')
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(headers)
+
+    def write_rows(self, rows: List[Sequence]):
+        self._writer.writerows(rows)
+
+    def close(self):
+        self._file.close()
+
+
+_XML_ILLEGAL = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+class XlsxExportWriter:
+    """Minimal SpreadsheetML writer: each worksheet is streamed straight into the zip entry.
+
+    Strings are written inline (no shared-strings table to hold in memory)
+    and numbers as numbers; dates are written as ISO text.
+    """
+
+    def __init__(self, file_path: str, headers: Sequence[str], sheet_name: str = 'Report', **options):
+        self._zip = zipfile.ZipFile(file_path, 'w', zipfile.ZIP_DEFLATED)
+        self._headers = list(headers)
+        self._sheet_name = re.sub(r'[\[\]:*?/\\]', '_', sheet_name)[:25] or 'Report'
+        self._sheets = 0
+        self._sheet = None
+        self._sheet_rows = 0
+        self._new_sheet()
+
+    @staticmethod
+    def _cell(value) -> str:
+        if value is None:
+            return '<c/>'
+        if isinstance(value, bool):
+            return f'<c t="b"><v>{int(value)}</v></c>'
+        if isinstance(value, (int, float, Decimal)):
+            return f'<c><v>{value}</v></c>'
+        return f'<c t="inlineStr"><is><t xml:space="preserve">{escape(_XML_ILLEGAL.sub("", _text(value)))}</t></is></c>'
+
+    def _row(self, values: Sequence) -> str:
+        return '<row>' + ''.join(self._cell(v) for v in values) + '</row>'
+
+    def _new_sheet(self):
+        if self._sheet is not None:
+            self._end_sheet()
+        self._sheets += 1
+        self._sheet = self._zip.open(f'xl/worksheets/sheet{self._sheets}.xml', 'w', force_zip64=True)
+        self._sheet.write(('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                           '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+                           + self._row(self._headers)).encode('utf-8'))
+        self._sheet_rows = 1
+
+    def _end_sheet(self):
+        self._sheet.write(b'</sheetData></worksheet>')
+        self._sheet.close()
+        self._sheet = None
+
+    def write_rows(self, rows: List[Sequence]):
+        start = 0
+        while start < len(rows):
+            if self._sheet_rows >= XLSX_MAX_ROWS:
+                self._new_sheet()
+            take = min(len(rows) - start, XLSX_MAX_ROWS - self._sheet_rows)
+            self._sheet.write(''.join(self._row(r) for r in rows[start:start + take]).encode('utf-8'))
+            self._sheet_rows += take
+            start += take
+
+    def close(self):
+        self._end_sheet()
+        sheets = range(1, self._sheets + 1)
+        self._zip.writestr('[Content_Types].xml', (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+            + ''.join(f'<Override PartName="/xl/worksheets/sheet{i}.xml" '
+                      'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>' for i in sheets)
+            + '</Types>'))
+        self._zip.writestr('_rels/.rels', (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+            '</Relationships>'))
+        self._zip.writestr('xl/workbook.xml', (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+            'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships"><sheets>'
+            + ''.join(f'<sheet name="{escape(self._sheet_name)}{"" if i == 1 else f" {i}"}" sheetId="{i}" r:id="rId{i}"/>' for i in sheets)
+            + '</sheets></workbook>'))
+        self._zip.writestr('xl/_rels/workbook.xml.rels', (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            + ''.join(f'<Relationship Id="rId{i}" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+                      f'Target="worksheets/sheet{i}.xml"/>' for i in sheets)
+            + '</Relationships>'))
+        self._zip.close()
+
+
+class TablePageRenderer:
+    """Paints rows as a paginated table on any QPaintDevice (QPdfWriter, QPrinter).
+
+    Each page is finished before the next starts, so only one page of rows
+    is held at a time. Headers and the page number repeat on every page.
+    """
+
+    def __init__(self, device, headers: Sequence[str], title: str = '', rtl: bool = False):
+        from PySide6.QtGui import QPainter, QFont
+        from PySide6.QtCore import Qt
+
+        self._Qt = Qt
+        self.device = device
+        self.headers = list(headers)
+        self.title = title
+        self.painter = QPainter(device)
+        font = QFont(self.painter.font())
+        font.setPointSize(8)
+        self.painter.setFont(font)
+        self.metrics = self.painter.fontMetrics()
+        self.row_height = int(self.metrics.height() * 1.4)
+        self.width = device.width()
+        self.height = device.height()
+        self.column_width = self.width / max(len(self.headers), 1)
+        self.alignment = (Qt.AlignRight if rtl else Qt.AlignLeft) | Qt.AlignVCenter
+        self.rtl = rtl
+        self.page = 0
+        self.y = 0
+        self._start_page()
+
+    def _start_page(self):
+        if self.page:
+            self.device.newPage()
+        self.page += 1
+        self.y = 0
+        if self.title:
+            self._line([f"{self.title} - {self.page}"], bold=True, full_width=True)
+        self._line(self.headers, bold=True)
+        self.painter.drawLine(0, self.y, self.width, self.y)
+
+    def _line(self, values: Sequence, bold: bool = False, full_width: bool = False):
+        painter = self.painter
+        font = painter.font()
+        if font.bold() != bold:
+            font.setBold(bold)
+            painter.setFont(font)
+        count = len(values)
+        for i, value in enumerate(values):
+            column = count - 1 - i if self.rtl else i
+            width = self.width if full_width else self.column_width
+            x = 0 if full_width else int(column * self.column_width)
+            text = self.metrics.elidedText(_text(value), self._Qt.ElideRight, int(width) - 8)
+            painter.drawText(x + 4, self.y, int(width) - 8, self.row_height, self.alignment, text)
+        self.y += self.row_height
+
+    def write_rows(self, rows: List[Sequence]):
+        for row in rows:
+            if self.y + self.row_height > self.height:
+                self._start_page()
+            self._line(row)
+
+    def close(self):
+        self.painter.end()
+
+
+class PdfExportWriter(TablePageRenderer):
+    def __init__(self, file_path: str, headers: Sequence[str], title: str = '', rtl: bool = False, **options):
+        from PySide6.QtGui import QPdfWriter, QPageSize, QPageLayout
+        from PySide6.QtCore import QMarginsF
+
+        self._pdf = QPdfWriter(file_path)
+        self._pdf.setPageSize(QPageSize(QPageSize.A4))
+        self._pdf.setPageOrientation(QPageLayout.Landscape)
+        self._pdf.setPageMargins(QMarginsF(10, 10, 10, 10), QPageLayout.Millimeter)
+        self._pdf.setResolution(150)
+        super().__init__(self._pdf, headers, title, rtl)
+
+
+WRITERS = {
+    'csv': CsvExportWriter,
+    'xlsx': XlsxExportWriter,
+    'pdf': PdfExportWriter,
+}
+
+
+def export_format(file_path: str) -> str:
+    fmt = os.path.splitext(file_path)[1].lstrip('.').lower()
+    if fmt not in WRITERS:
+        raise ValueError(f"Unsupported export format: {fmt or file_path}")
+    return fmt
+
+
+def _chunks(rows: Iterable, size: int):
+    if hasattr(rows, 'partitions'): # SQLAlchemy Result streamed with yield_per
+        yield from rows.partitions(size)
+        return
+    iterator = iter(rows)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def export_rows(file_path: str, headers: Sequence[str], rows: Iterable[Sequence], total: int = None,
+                progress: Optional[Callable[[int, Optional[int]], None]] = None,
+                cancelled: Optional[Callable[[], bool]] = None, chunk_size: int = CHUNK_SIZE, **options) -> int:
+    """Write rows to file_path in the format of its extension (csv, xlsx, pdf) and return the row count.
+
+    rows may be any iterable or a streamed SQLAlchemy Result; only one chunk
+    is in memory at a time. progress(done, total) is called after every
+    chunk. When cancelled() turns True the partial file is removed and
+    ExportCancelled is raised.
+    """
+    writer = WRITERS[export_format(file_path)](file_path, headers, **options)
+    done = 0
+    try:
+        for chunk in _chunks(rows, chunk_size):
+            if cancelled is not None and cancelled():
+                raise ExportCancelled()
+            writer.write_rows(chunk)
+            done += len(chunk)
+            if progress is not None:
+                progress(done, total)
+    except BaseException:
+        try:
+            writer.close()
+        finally:
+            if os.path.exists(file_path):
+                os.remove(file_path)
+        raise
+    writer.close()
+    return done
@@ -0,0 +1,113 @@
+"""
+Labeeb ERP - Order Fulfilment Engine
+Per-order outcome report and posting lines for converting sales / purchase orders into invoices
+"""
+
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Dict, List, NamedTuple, Optional, Sequence
+
+from app.application.export_engine import export_rows
+
+SALES_ORDER = 0 # OrderConversion.order_type
+PURCHASE_ORDER = 1
+CHUNK_SIZE = 200 # Orders per transaction
+MONEY_QUANT = Decimal('0.001') # Matches Numeric(18,3) used for amounts
+HUNDRED = Decimal(100)
+ZERO = Decimal(0)
+
+CONVERTED = 'converted'
+SKIPPED = 'skipped' # Converted by an earlier run
+FAILED = 'failed'
+
+# Per order type: invoice_type, stock movement_type, order status once converted
+SALES_CONVERSION = {'invoice_type': 0, 'movement_type': 1, 'status': 2, 'prefix': 'INV'}
+PURCHASE_CONVERSION = {'invoice_type': 1, 'movement_type': 0, 'status': 2, 'prefix': 'PINV'}
+
+
+class OrderOutcome(NamedTuple):
+    order_id: int
+    order_no: Optional[str]
+    status: str
+    invoice_id: Optional[int]
+    message: Optional[str]
+
+
+class ConversionReport:
+    """Outcome of every order of one conversion run"""
+
+    def __init__(self, order_type: int):
+        self.order_type = order_type
+        self.outcomes: List[OrderOutcome] = []
+        self.cancelled = False
+
+    def add(self, order_id: int, order_no: Optional[str], status: str, invoice_id: int = None, message: str = None):
+        self.outcomes.append(OrderOutcome(order_id, order_no, status, invoice_id, message))
+
+    def count(self, status: str) -> int:
+        return sum(1 for outcome in self.outcomes if outcome.status == status)
+
+    @property
+    def failures(self) -> List[OrderOutcome]:
+        return [outcome for outcome in self.outcomes if outcome.status == FAILED]
+
+    def as_dict(self) -> dict:
+        return {
+            'order_type': self.order_type,
+            'processed': len(self.outcomes),
+            'converted': self.count(CONVERTED),
+            'skipped': self.count(SKIPPED),
+            'failed': self.count(FAILED),
+            'cancelled': self.cancelled
+        }
+
+    def write(self, file_path: str, headers: Sequence[str] = ('Order ID', 'Order No', 'Status', 'Invoice ID', 'Message')) -> int:
+        """Write the per-order outcomes to a CSV/XLSX/PDF report"""
+        return export_rows(file_path, headers, self.outcomes, len(self.outcomes))
+
+
+def chunked(values: list, size: int = CHUNK_SIZE):
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def net_unit_price(line) -> Decimal:
+    """Unit price after the line discount"""
+    price = Decimal(line.unit_price or 0)
+    discount = Decimal(line.discount_percentage or 0)
+    if discount:
+        price -= price * discount / HUNDRED
+    return price
+
+
+def to_base(amount: Decimal, fx_rate: Decimal) -> Decimal:
+    return (Decimal(amount or 0) * Decimal(fx_rate or 1)).quantize(MONEY_QUANT, rounding=ROUND_HALF_UP)
+
+
+def _line(account_id: int, debit: Decimal, credit: Decimal, currency: str, memo: str) -> dict:
+    return {'account_id': account_id, 'debit': debit, 'credit': credit, 'currency': currency, 'fx_rate': 1, 'memo': memo}
+
+
+def posting_lines(order_type: int, accounts: Dict[str, int], total: Decimal, tax: Decimal, cost: Decimal,
+                  currency: str, memo: str) -> list:
+    """Balanced journal lines of one converted order, amounts in the company base currency.
+
+    accounts: 'receivable', 'revenue', 'output_tax' and optionally 'cogs' with
+    'inventory' for sales; 'payable', 'inventory' and 'input_tax' for purchases.
+    Tax lines are dropped when the tax is zero.
+    """
+    net = total - tax
+    lines = []
+    if order_type == SALES_ORDER:
+        lines.append(_line(accounts['receivable'], total, ZERO, currency, memo))
+        lines.append(_line(accounts['revenue'], ZERO, net, currency, memo))
+        if tax:
+            lines.append(_line(accounts['output_tax'], ZERO, tax, currency, memo))
+        if cost and accounts.get('cogs') and accounts.get('inventory'):
+            lines.append(_line(accounts['cogs'], cost, ZERO, currency, memo))
+            lines.append(_line(accounts['inventory'], ZERO, cost, currency, memo))
+    else:
+        lines.append(_line(accounts['inventory'], net, ZERO, currency, memo))
+        if tax:
+            lines.append(_line(accounts['input_tax'], tax, ZERO, currency, memo))
+        lines.append(_line(accounts['payable'], ZERO, total, currency, memo))
+    return lines
@@ -0,0 +1,135 @@
+"""
+Labeeb ERP - Exchange Rate Engine
+As-of-date currency conversion from the exchange rate history, cached in memory per currency pair
+"""
+
+from bisect import bisect_right
+from datetime import date
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Dict, List, Optional, Tuple
+
+from app.infrastructure.cache import LoadOnceCache
+from app.infrastructure.database import get_session
+from app.infrastructure.repositories import CurrencyRepository, ExchangeRateRepository, CompanyRepository
+
+RATE_QUANT = Decimal('0.000001') # Matches Numeric(18,6) used for rates
+ONE = Decimal(1)
+
+
+class RateSeries:
+    """Rates of one currency pair sorted by effective date; rate_on() bisects.
+
+    before is the rate for dates earlier than the first entry.
+    """
+
+    __slots__ = ('dates', 'rates', 'before')
+
+    def __init__(self, dates: List[date], rates: List[Decimal], before: Decimal):
+        self.dates = dates
+        self.rates = rates
+        self.before = before
+
+    def rate_on(self, on: date) -> Decimal:
+        position = bisect_right(self.dates, on)
+        return self.rates[position - 1] if position else self.before
+
+
+class RateSnapshot:
+    """Currencies, their rate history and company base currencies as loaded from the database"""
+
+    def __init__(self, currencies: Dict[str, Tuple[int, Decimal]], history: Dict[int, RateSeries], company_base: Dict[int, str]):
+        self.currencies = currencies # code -> (id, current exchange_rate)
+        self.history = history # currency id -> rates against the reference currency
+        self.company_base = company_base # company id -> base currency code
+
+
+def load_rate_snapshot() -> RateSnapshot:
+    with get_session() as db:
+        currencies = {c.code: (c.id, Decimal(c.exchange_rate or 1)) for c in CurrencyRepository(db).get_all_currencies()}
+        codes = {currency_id: code for code, (currency_id, _) in currencies.items()}
+        dates: Dict[int, list] = {}
+        rates: Dict[int, list] = {}
+        for row in ExchangeRateRepository(db).get_all_rates(): # Ordered by currency and date
+            dates.setdefault(row.currency_id, []).append(row.rate_date)
+            rates.setdefault(row.currency_id, []).append(Decimal(row.rate))
+        history = {currency_id: RateSeries(dates[currency_id], rates[currency_id], currencies[codes[currency_id]][1])
+                   for currency_id in dates if currency_id in codes}
+        company_base = {c.id: codes.get(c.base_currency_id) for c in CompanyRepository(db).get_all_companies()}
+    return RateSnapshot(currencies, history, company_base)
+
+
+class ExchangeRateTable:
+    """As-of-date exchange rates between any two currencies.
+
+    The snapshot is loaded on first use. A pair's series is built on first
+    lookup by crossing both currencies' histories on the union of their
+    dates, so later lookups are a single bisection. Before a currency's first
+    history entry its current Currency.exchange_rate applies. invalidate() is
+    called by the currency and company services after every change.
+    """
+
+    def __init__(self, loader=load_rate_snapshot):
+        self._snapshot: LoadOnceCache[RateSnapshot] = LoadOnceCache(loader)
+        self._pairs: Dict[Tuple[str, str], RateSeries] = {}
+
+    def snapshot(self) -> RateSnapshot:
+        return self._snapshot.get()
+
+    def invalidate(self):
+        self._snapshot.invalidate()
+        self._pairs = {}
+
+    def _unit_series(self, snapshot: RateSnapshot, code: str) -> RateSeries:
+        if code not in snapshot.currencies:
+            raise ValueError(f"العملة غير معرفة: {code}")
+        currency_id, current = snapshot.currencies[code]
+        return snapshot.history.get(currency_id) or RateSeries([], [], current)
+
+    def pair_series(self, from_currency: str, to_currency: str) -> RateSeries:
+        key = (from_currency, to_currency)
+        pairs = self._pairs
+        series = pairs.get(key)
+        if series is not None:
+            return series
+        snapshot = self.snapshot()
+        source = self._unit_series(snapshot, from_currency)
+        target = self._unit_series(snapshot, to_currency)
+        dates = sorted(set(source.dates) | set(target.dates))
+        series = RateSeries(dates, [self._cross(source.rate_on(d), target.rate_on(d)) for d in dates],
+                            self._cross(source.before, target.before))
+        pairs[key] = series # A concurrent invalidate() replaces the dict, so a stale pair is never kept
+        return series
+
+    @staticmethod
+    def _cross(source_rate: Decimal, target_rate: Decimal) -> Decimal:
+        return (source_rate / target_rate).quantize(RATE_QUANT, rounding=ROUND_HALF_UP) if target_rate else ONE
+
+    def rate(self, from_currency: str, to_currency: str, on: date = None) -> Decimal:
+        """Value of one unit of from_currency in to_currency on a date (today by default)"""
+        if not from_currency or not to_currency or from_currency == to_currency:
+            return ONE
+        return self.pair_series(from_currency, to_currency).rate_on(on or date.today())
+
+    def base_currency(self, company_id: int) -> Optional[str]:
+        return self.snapshot().company_base.get(company_id)
+
+    def base_rate(self, company_id: int, currency: str, on: date = None) -> Decimal:
+        """Rate from currency to the company's base currency; 1 for companies without one"""
+        base = self.base_currency(company_id) if company_id else None
+        if base is None:
+            return ONE
+        return self.rate(currency, base, on)
+
+    def convert(self, amount: Decimal, from_currency: str, to_currency: str, on: date = None) -> Decimal:
+        return Decimal(amount) * self.rate(from_currency, to_currency, on)
+
+
+# Global exchange rate table instance
+_exchange_rates = None
+
+def get_exchange_rates() -> ExchangeRateTable:
+    """Get the global exchange rate table instance"""
+    global _exchange_rates
+    if _exchange_rates is None:
+        _exchange_rates = ExchangeRateTable()
+    return _exchange_rates
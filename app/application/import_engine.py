@@ -0,0 +1,437 @@
+"""
+Labeeb ERP - Import Engine
+Reads master data from CSV/XLSX in chunks and validates each row against cached reference data
+"""
+
+import csv
+import os
+import re
+import zipfile
+from datetime import date, datetime, timedelta
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+from xml.etree.ElementTree import iterparse
+
+from app.application.export_engine import export_rows
+
+CHUNK_SIZE = 5000 # Rows validated and written per transaction
+MAX_REPORTED_ERRORS = 10_000 # Further errors are counted but not kept
+
+_DIGITS = str.maketrans('٠١٢٣٤٥٦٧٨٩٫', '0123456789.', '٬,')
+_TRUE = {'1', 'true', 'yes', 'y', 'نعم'}
+_FALSE = {'0', 'false', 'no', 'n', 'لا'}
+_EXCEL_EPOCH = date(1899, 12, 30)
+
+
+class RowError(NamedTuple):
+    row: int # Line in the source file, header = 1
+    field: Optional[str]
+    message: str
+
+
+class ImportResult:
+    """Counters and per-row errors of one import run"""
+
+    def __init__(self, entity: str):
+        self.entity = entity
+        self.processed = 0
+        self.inserted = 0
+        self.updated = 0
+        self.skipped = 0 # Superseded by a later row with the same code
+        self.error_count = 0
+        self.errors: List[RowError] = []
+        self.cancelled = False
+
+    @property
+    def failed_rows(self) -> int:
+        return len({error.row for error in self.errors})
+
+    def add_error(self, row: int, field: Optional[str], message: str):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append(RowError(row, field, message))
+
+    def as_dict(self) -> dict:
+        return {
+            'entity': self.entity,
+            'processed': self.processed,
+            'inserted': self.inserted,
+            'updated': self.updated,
+            'skipped': self.skipped,
+            'errors': self.error_count,
+            'cancelled': self.cancelled
+        }
+
+    def write_errors(self, file_path: str, headers: Sequence[str] = ('Row', 'Field', 'Error')) -> int:
+        """Write the kept row errors to a CSV/XLSX/PDF report"""
+        return export_rows(file_path, headers, self.errors, len(self.errors))
+
+
+# ---- Readers ----
+
+def normalize_header(value) -> str:
+    return re.sub(r'[\s\-]+', '_', str(value or '').strip().lower())
+
+
+def _csv_rows(file_path: str) -> Iterator[Tuple[int, list]]:
+    with open(file_path, newline='', encoding='utf-8-sig') as f:
+        reader = csv.reader(f)
+        for values in reader:
+            yield reader.line_num, values
+
+
+_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+_REL_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+
+
+def _column_index(reference: str) -> int:
+    index = 0
+    for ch in reference:
+        if not ch.isalpha():
+            break
+        index = index * 26 + ord(ch.upper()) - 64
+    return index - 1
+
+
+def _first_sheet_path(archive: zipfile.ZipFile) -> str:
+    try:
+        with archive.open('xl/workbook.xml') as f:
+            sheet = next(e for _, e in iterparse(f) if e.tag == _NS + 'sheet')
+        relation_id = sheet.get(_REL_NS + 'id')
+        with archive.open('xl/_rels/workbook.xml.rels') as f:
+            for _, e in iterparse(f):
+                if e.get('Id') == relation_id:
+                    target = e.get('Target')
+                    return target.lstrip('/') if target.startswith('/') else 'xl/' + target
+    except (KeyError, StopIteration):
+        pass
+    return 'xl/worksheets/sheet1.xml'
+
+
+def _shared_strings(archive: zipfile.ZipFile) -> List[str]:
+    if 'xl/sharedStrings.xml' not in archive.namelist():
+        return []
+    strings = []
+    with archive.open('xl/sharedStrings.xml') as f:
+        for _, e in iterparse(f):
+            if e.tag == _NS + 'si':
+                strings.append(''.join(t.text or '' for t in e.iter(_NS + 't')))
+                e.clear()
+    return strings
+
+
+def _xlsx_rows(file_path: str) -> Iterator[Tuple[int, list]]:
+    """Rows of the first worksheet, parsed incrementally (only the current row is kept in memory)"""
+    with zipfile.ZipFile(file_path) as archive:
+        shared = _shared_strings(archive)
+        with archive.open(_first_sheet_path(archive)) as f:
+            sheet_data = None
+            line = 0
+            for event, e in iterparse(f, events=('start', 'end')):
+                if event == 'start':
+                    if e.tag == _NS + 'sheetData':
+                        sheet_data = e
+                    continue
+                if e.tag != _NS + 'row':
+                    continue
+                line = int(e.get('r') or line + 1)
+                values = []
+                for cell in e.iter(_NS + 'c'):
+                    reference = cell.get('r')
+                    column = _column_index(reference) if reference else len(values)
+                    kind = cell.get('t')
+                    if kind == 'inlineStr':
+                        value = ''.join(t.text or '' for t in cell.iter(_NS + 't'))
+                    else:
+                        raw = cell.findtext(_NS + 'v')
+                        if raw is None:
+                            value = None
+                        elif kind == 's':
+                            value = shared[int(raw)]
+                        elif kind == 'b':
+                            value = raw == '1'
+                        else:
+                            value = raw
+                    values.extend([None] * (column - len(values)))
+                    values.append(value)
+                yield line, values
+                if sheet_data is not None:
+                    sheet_data.clear()
+
+
+READERS = {
+    'csv': _csv_rows,
+    'xlsx': _xlsx_rows,
+}
+
+
+def read_rows(file_path: str) -> Iterator[Tuple[int, Dict[str, object]]]:
+    """Yield (line, {normalized header: value}) for every non-empty data row of a CSV or XLSX file"""
+    fmt = os.path.splitext(file_path)[1].lstrip('.').lower()
+    if fmt not in READERS:
+        raise ValueError(f"صيغة ملف الاستيراد غير مدعومة: {fmt or file_path}")
+    headers = None
+    for line, values in READERS[fmt](file_path):
+        if headers is None:
+            headers = [normalize_header(v) for v in values]
+            continue
+        if not any(v not in (None, '') for v in values):
+            continue
+        if len(values) < len(headers):
+            values = list(values) + [None] * (len(headers) - len(values))
+        yield line, dict(zip(headers, values))
+
+
+def read_chunks(file_path: str, size: int = CHUNK_SIZE) -> Iterator[List[Tuple[int, Dict[str, object]]]]:
+    rows = read_rows(file_path)
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+# ---- Field parsers ----
+
+class FieldError(ValueError):
+    pass
+
+
+def _clean(value) -> str:
+    return str(value).strip().translate(_DIGITS)
+
+
+def parse_text(max_length: int = None) -> Callable:
+    def parse(value):
+        value = str(value).strip()
+        if max_length and len(value) > max_length:
+            raise FieldError(f"النص أطول من {max_length} حرفاً")
+        return value
+    return parse
+
+
+def parse_decimal(minimum: Decimal = None, positive: bool = False) -> Callable:
+    def parse(value):
+        try:
+            number = value if isinstance(value, Decimal) else Decimal(_clean(value))
+        except InvalidOperation:
+            raise FieldError("قيمة رقمية غير صالحة")
+        if not number.is_finite():
+            raise FieldError("قيمة رقمية غير صالحة")
+        if positive and number <= 0:
+            raise FieldError("يجب أن تكون القيمة أكبر من صفر")
+        if minimum is not None and number < minimum:
+            raise FieldError(f"يجب ألا تقل القيمة عن {minimum}")
+        return number
+    return parse
+
+
+def parse_integer(choices: Iterable[int] = None) -> Callable:
+    allowed = set(choices) if choices is not None else None
+
+    def parse(value):
+        number = parse_decimal()(value)
+        if number != number.to_integral_value():
+            raise FieldError("يجب أن تكون القيمة عدداً صحيحاً")
+        number = int(number)
+        if allowed is not None and number not in allowed:
+            raise FieldError(f"القيمة يجب أن تكون إحدى: {', '.join(str(c) for c in sorted(allowed))}")
+        return number
+    return parse
+
+
+def parse_boolean(value) -> bool:
+    if isinstance(value, bool):
+        return value
+    text = _clean(value).lower()
+    if text in _TRUE:
+        return True
+    if text in _FALSE:
+        return False
+    raise FieldError("قيمة منطقية غير صالحة")
+
+
+def parse_date(value) -> date:
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    text = _clean(value)
+    try:
+        if re.fullmatch(r'\d+(\.\d+)?', text): # Excel serial day number
+            return _EXCEL_EPOCH + timedelta(days=int(float(text)))
+        return date.fromisoformat(text[:10])
+    except ValueError:
+        raise FieldError("تاريخ غير صالح (الصيغة YYYY-MM-DD)")
+
+
+# ---- Reference data ----
+
+class ReferenceData:
+    """Units, warehouses and currencies keyed by id, code and names, loaded once per import"""
+
+    def __init__(self, units=(), warehouses=(), currencies=()):
+        self.units = self._index(units, ('id', 'code', 'name_ar', 'name_en'))
+        self.warehouses = {w.id: w for w in warehouses}
+        self.warehouse_keys = self._index(warehouses, ('id', 'name_ar', 'name_en'))
+        self.currencies = {c.id: c for c in currencies}
+        self.currency_keys = self._index(currencies, ('id', 'code', 'name_ar', 'name_en'))
+
+    @staticmethod
+    def _index(rows, attributes: Sequence[str]) -> Dict[str, int]:
+        keys = {}
+        for row in rows:
+            for attribute in attributes:
+                value = getattr(row, attribute, None)
+                if value not in (None, ''):
+                    keys.setdefault(_clean(value).lower(), row.id)
+        return keys
+
+    @staticmethod
+    def _lookup(keys: Dict[str, int], value, message: str) -> int:
+        found = keys.get(_clean(value).lower())
+        if found is None:
+            raise FieldError(message)
+        return found
+
+    def unit_id(self, value) -> int:
+        return self._lookup(self.units, value, "الوحدة غير موجودة")
+
+    def warehouse_id(self, value) -> int:
+        return self._lookup(self.warehouse_keys, value, "المستودع غير موجود في هذه الشركة")
+
+    def currency_id(self, value) -> int:
+        return self._lookup(self.currency_keys, value, "العملة غير موجودة")
+
+    def convert(self, amount: Decimal, from_currency_id: int, to_currency_id: int) -> Decimal:
+        """Convert through the exchange rates (value of one unit in the reference currency)"""
+        if not from_currency_id or not to_currency_id or from_currency_id == to_currency_id:
+            return amount
+        rate_from = self.currencies[from_currency_id].exchange_rate or Decimal(1)
+        rate_to = self.currencies[to_currency_id].exchange_rate or Decimal(1)
+        return (amount * Decimal(rate_from) / Decimal(rate_to)).quantize(Decimal('0.000001'))
+
+
+# ---- Row validation ----
+
+class Field:
+    __slots__ = ('name', 'parse', 'required', 'default', 'aliases')
+
+    def __init__(self, name: str, parse: Callable, required: bool = False, default=None, aliases: Sequence[str] = ()):
+        self.name = name
+        self.parse = parse
+        self.required = required
+        self.default = default
+        self.aliases = tuple(aliases)
+
+
+class RowValidator:
+    """Maps file columns to fields and parses every row into a dict of field values.
+
+    Fields whose column is absent from the file are left out of the result
+    (so an upsert only overwrites the columns that were imported) unless
+    they have a default.
+    """
+
+    def __init__(self, fields: Sequence[Field]):
+        self.fields = list(fields)
+        self.columns: Dict[str, str] = {}
+
+    def bind(self, headers: Iterable[str]):
+        headers = set(headers)
+        self.columns = {}
+        missing = []
+        for field in self.fields:
+            column = next((c for c in (field.name,) + field.aliases if c in headers), None)
+            if column is not None:
+                self.columns[field.name] = column
+            elif field.required and field.default is None:
+                missing.append(field.name)
+        if missing:
+            raise ValueError(f"أعمدة مطلوبة غير موجودة في الملف: {', '.join(missing)}")
+
+    def validate(self, raw: Dict[str, object]) -> Tuple[dict, List[Tuple[str, str]]]:
+        values = {}
+        errors = []
+        for field in self.fields:
+            column = self.columns.get(field.name)
+            value = raw.get(column) if column else None
+            if isinstance(value, str) and not value.strip():
+                value = None
+            if value is None:
+                if field.default is not None:
+                    values[field.name] = field.default
+                elif field.required:
+                    errors.append((field.name, "حقل مطلوب"))
+                elif column:
+                    values[field.name] = None
+                continue
+            try:
+                values[field.name] = field.parse(value)
+            except FieldError as e:
+                errors.append((field.name, str(e)))
+        return values, errors
+
+
+def _money():
+    return parse_decimal(minimum=Decimal(0))
+
+
+def item_fields(references: ReferenceData, default_warehouse_id: int = None) -> List[Field]:
+    return [
+        Field('code', parse_integer(), aliases=('item_code',)),
+        Field('name_ar', parse_text(), required=True, aliases=('name',)),
+        Field('name_en', parse_text()),
+        Field('barcode', parse_text(50)),
+        Field('unit_id', references.unit_id, required=True, aliases=('unit', 'unit_code')),
+        Field('warehouse_id', references.warehouse_id, required=True, default=default_warehouse_id, aliases=('warehouse',)),
+        Field('sale_price', _money()),
+        Field('min_sale_price', _money()),
+        Field('cost_price', _money()),
+        Field('reorder_level', _money()),
+        Field('free_quantity_level', _money()),
+        Field('costing_method', parse_integer((0, 1, 2))),
+        Field('is_active', parse_boolean),
+    ]
+
+
+def _party_fields() -> List[Field]:
+    return [
+        Field('code', parse_integer()),
+        Field('name_ar', parse_text(), required=True, aliases=('name',)),
+        Field('name_en', parse_text()),
+        Field('credit_limit', _money()),
+        Field('payment_terms', parse_text()),
+        Field('is_active', parse_boolean),
+        Field('address', parse_text()),
+        Field('phone_number', parse_text(50), aliases=('phone',)),
+        Field('email', parse_text(100)),
+    ]
+
+
+def customer_fields() -> List[Field]:
+    return _party_fields() + [
+        Field('customer_group', parse_text(50), aliases=('group',)),
+        Field('type', parse_integer((0, 1))),
+    ]
+
+
+def supplier_fields() -> List[Field]:
+    return _party_fields() + [
+        Field('contact_person', parse_text()),
+        Field('tax_id', parse_text(50)),
+        Field('supplier_group', parse_text(50), aliases=('group',)),
+    ]
+
+
+def opening_stock_fields(references: ReferenceData, opening_date: date, ref_no: str) -> List[Field]:
+    return [
+        Field('item_code', parse_integer(), required=True, aliases=('item', 'code')),
+        Field('warehouse_id', references.warehouse_id, aliases=('warehouse',)),
+        Field('quantity', parse_decimal(positive=True), required=True),
+        Field('cost', _money(), aliases=('unit_cost', 'cost_price')),
+        Field('currency_id', references.currency_id, aliases=('currency',)),
+        Field('movement_date', parse_date, default=opening_date, aliases=('date',)),
+        Field('ref_no', parse_text(50), default=ref_no, aliases=('reference',)),
+    ]
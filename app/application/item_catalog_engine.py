@@ -0,0 +1,252 @@
+"""
+Labeeb ERP - Item Catalog Engine
+In-memory item lookup by barcode, code and name prefix for POS scanning, kept fresh by change notifications
+"""
+
+import threading
+from bisect import bisect_left
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from app.infrastructure.cache import LoadOnceCache
+from app.infrastructure.database import get_session
+from app.infrastructure.repositories import ItemRepository, TaxSettingRepository
+from app.infrastructure.notification_channel import get_item_catalog_channel
+
+ZERO = Decimal(0)
+
+
+def normalize_name(name: Optional[str]) -> str:
+    """Case-folded name with collapsed whitespace, the form names are indexed and searched in"""
+    return ' '.join(name.split()).casefold() if name else ''
+
+
+class CatalogItem:
+    """Flattened, immutable view of an active Item with what a scan needs"""
+
+    __slots__ = ('id', 'company_id', 'code', 'barcode', 'name_ar', 'name_en', 'unit_id', 'unit_name',
+                 'sale_price', 'min_sale_price', 'tax_rate')
+
+    def __init__(self, id: int, company_id: int, code: int, barcode: Optional[str], name_ar: str, name_en: Optional[str],
+                 unit_id: int, unit_name: Optional[str], sale_price: Decimal, min_sale_price: Decimal, tax_rate: Decimal):
+        self.id = id
+        self.company_id = company_id
+        self.code = code
+        self.barcode = barcode
+        self.name_ar = name_ar
+        self.name_en = name_en
+        self.unit_id = unit_id
+        self.unit_name = unit_name
+        self.sale_price = sale_price
+        self.min_sale_price = min_sale_price
+        self.tax_rate = tax_rate # Company's default tax setting, e.g. 0.15
+
+    @classmethod
+    def from_row(cls, row, tax_rate: Decimal) -> 'CatalogItem':
+        return cls(
+            id=row.id,
+            company_id=row.company_id,
+            code=row.code,
+            barcode=row.barcode.strip() if row.barcode else None,
+            name_ar=row.name_ar,
+            name_en=row.name_en,
+            unit_id=row.unit_id,
+            unit_name=row.unit_name,
+            sale_price=row.sale_price if row.sale_price is not None else ZERO,
+            min_sale_price=row.min_sale_price if row.min_sale_price is not None else ZERO,
+            tax_rate=tax_rate if tax_rate is not None else ZERO
+        )
+
+    def __repr__(self):
+        return f"<CatalogItem(id={self.id}, code={self.code}, barcode='{self.barcode}', name='{self.name_ar}')>"
+
+
+class CatalogIndex:
+    """Hash indexes by (company, barcode) and (company, code), and sorted (company, name, item id) keys for prefix search.
+
+    Only ItemCatalog changes an index, under its lock. Single dict operations
+    are atomic and the name keys list is replaced rather than modified, so
+    lookups need no lock.
+    """
+
+    def __init__(self, items: Iterable[CatalogItem] = ()):
+        self.by_id: Dict[int, CatalogItem] = {}
+        self.by_barcode: Dict[Tuple[int, str], CatalogItem] = {}
+        self.by_code: Dict[Tuple[int, int], CatalogItem] = {}
+        keys = []
+        for item in items:
+            self._add(item)
+            keys.extend(self._name_keys(item))
+        keys.sort()
+        self.name_keys: List[Tuple[int, str, int]] = keys
+
+    @staticmethod
+    def _name_keys(item: CatalogItem) -> List[Tuple[int, str, int]]:
+        names = {normalize_name(item.name_ar), normalize_name(item.name_en)} - {''}
+        return [(item.company_id, name, item.id) for name in names]
+
+    def _add(self, item: CatalogItem):
+        self.by_id[item.id] = item
+        if item.barcode:
+            self.by_barcode[(item.company_id, item.barcode)] = item
+        self.by_code[(item.company_id, item.code)] = item
+
+    def _remove(self, item: CatalogItem):
+        self.by_id.pop(item.id, None)
+        if item.barcode and self.by_barcode.get((item.company_id, item.barcode)) is item:
+            del self.by_barcode[(item.company_id, item.barcode)]
+        if self.by_code.get((item.company_id, item.code)) is item:
+            del self.by_code[(item.company_id, item.code)]
+
+    def apply(self, items: List[CatalogItem], removed_ids: Iterable[int]):
+        """Replace changed items and drop removed (deleted or deactivated) ones"""
+        stale = set(removed_ids) | {item.id for item in items}
+        for item_id in stale:
+            previous = self.by_id.get(item_id)
+            if previous is not None:
+                self._remove(previous)
+        for item in items:
+            self._add(item)
+        keys = [key for key in self.name_keys if key[2] not in stale]
+        for item in items:
+            keys.extend(self._name_keys(item))
+        keys.sort() # Nearly sorted already: linear for a few changed items
+        self.name_keys = keys
+
+    def company_item_ids(self, company_id: int) -> List[int]:
+        return [item.id for item in list(self.by_id.values()) if item.company_id == company_id]
+
+    def search(self, company_id: int, prefix: str, limit: int = 20) -> List[CatalogItem]:
+        """Items of a company whose Arabic or English name starts with prefix, in name order"""
+        prefix = normalize_name(prefix)
+        keys = self.name_keys
+        position = bisect_left(keys, (company_id, prefix))
+        results, seen = [], set()
+        while position < len(keys) and len(results) < limit:
+            key_company_id, name, item_id = keys[position]
+            if key_company_id != company_id or not name.startswith(prefix):
+                break
+            item = self.by_id.get(item_id)
+            if item is not None and item_id not in seen:
+                seen.add(item_id)
+                results.append(item)
+            position += 1
+        return results
+
+    def __len__(self):
+        return len(self.by_id)
+
+
+def load_catalog_items(company_id: int = None, item_ids: list = None) -> List[CatalogItem]:
+    """Default loader: active items (of one company, or only item_ids) with their company's default tax rate"""
+    with get_session() as db:
+        tax_rates = TaxSettingRepository(db).get_default_tax_rates()
+        return [CatalogItem.from_row(row, tax_rates.get(row.company_id))
+                for row in ItemRepository(db).get_catalog_rows(company_id, item_ids)]
+
+
+class ItemCatalog:
+    """This terminal's item catalog: barcode, code and name lookups without a database round trip.
+
+    start() loads the index on a background thread and subscribes to the item
+    catalog channel: item writes send the changed ids (a company id alone
+    after bulk imports and tax changes), and only those rows are reloaded and
+    swapped into the index. Until the first load finishes, a lookup waits for
+    it rather than querying item by item.
+    """
+
+    def __init__(self, loader=load_catalog_items, channel=None):
+        self.loader = loader
+        self.channel = channel
+        self._index: LoadOnceCache[CatalogIndex] = LoadOnceCache(lambda: CatalogIndex(self.loader()))
+        self._refresh_lock = threading.Lock()
+        self._warmer: Optional[threading.Thread] = None
+
+    def index(self) -> CatalogIndex:
+        return self._index.get()
+
+    def _warm(self):
+        try:
+            self.index()
+        except Exception as e:
+            print(f"Error warming item catalog: {e}")
+
+    def warm(self):
+        """Load the index on a background thread, if it is not loaded or loading already"""
+        if self._index.peek() is not None or (self._warmer is not None and self._warmer.is_alive()):
+            return
+        self._warmer = threading.Thread(target=self._warm, name='item-catalog-warmer', daemon=True)
+        self._warmer.start()
+
+    def start(self):
+        channel = self.channel or get_item_catalog_channel()
+        channel.subscribe(None, self.on_change)
+        channel.start()
+        self.warm()
+
+    def stop(self):
+        channel = self.channel or get_item_catalog_channel()
+        channel.unsubscribe(None, self.on_change)
+
+    def invalidate(self):
+        self._index.invalidate()
+
+    def on_change(self, message: dict):
+        """Channel callback: {'company_id', 'item_ids'}, item_ids None for the whole company"""
+        try:
+            self.refresh(message.get('company_id'), message.get('item_ids'))
+        except Exception as e:
+            print(f"Error refreshing item catalog: {e}")
+            self.invalidate()
+
+    def refresh(self, company_id: int = None, item_ids: list = None):
+        """Reload the given items (or a whole company, or everything) into the loaded index"""
+        if self._index.peek() is None:
+            self.invalidate() # A load in flight may predate the change: do not publish it
+            return
+        if company_id is None and item_ids is None:
+            self.invalidate()
+            self.warm()
+            return
+        with self._refresh_lock: # Applied one at a time, in arrival order
+            version = self._index.version
+            items = self.loader(company_id=company_id if item_ids is None else None, item_ids=item_ids)
+
+            def apply(index: CatalogIndex):
+                removed = item_ids if item_ids is not None else index.company_item_ids(company_id)
+                index.apply(items, removed)
+
+            # Skipped when the index was dropped meanwhile: its reload reads these rows anyway
+            self._index.update(version, apply)
+
+    # ---- Lookups ----
+
+    def get(self, item_id: int) -> Optional[CatalogItem]:
+        return self.index().by_id.get(item_id)
+
+    def find_barcode(self, company_id: int, barcode: str) -> Optional[CatalogItem]:
+        return self.index().by_barcode.get((company_id, barcode.strip())) if barcode else None
+
+    def find_code(self, company_id: int, code) -> Optional[CatalogItem]:
+        try:
+            return self.index().by_code.get((company_id, int(code)))
+        except (TypeError, ValueError):
+            return None
+
+    def scan(self, company_id: int, scanned: str) -> Optional[CatalogItem]:
+        """Resolve scanner or keyboard input: barcode first, then item code"""
+        return self.find_barcode(company_id, scanned) or self.find_code(company_id, scanned)
+
+    def search(self, company_id: int, prefix: str, limit: int = 20) -> List[CatalogItem]:
+        return self.index().search(company_id, prefix, limit)
+
+
+# Global item catalog instance
+_item_catalog = None
+
+def get_item_catalog() -> ItemCatalog:
+    """Get the global item catalog instance"""
+    global _item_catalog
+    if _item_catalog is None:
+        _item_catalog = ItemCatalog()
+    return _item_catalog
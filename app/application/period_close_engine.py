@@ -0,0 +1,118 @@
+"""
+Labeeb ERP - Period Close Engine
+Cached closed-period lookup for posting checks and year-end closing lines
+"""
+
+from bisect import bisect_right
+from datetime import date
+from decimal import Decimal
+from typing import Dict, List, Optional, Tuple
+
+from app.infrastructure.cache import LoadOnceCache
+from app.infrastructure.database import get_session
+from app.infrastructure.repositories import PeriodCloseRepository
+from app.infrastructure.notification_channel import get_fiscal_period_channel
+
+ZERO = Decimal(0)
+CLOSING_REF_PREFIX = "YEC-" # ref_no of year-end closing entries: YEC-<year>-<period id>
+
+
+def load_closed_periods() -> Dict[int, Tuple[List[date], List[date]]]:
+    """Closed date ranges per company, merged and sorted by start date"""
+    ranges: Dict[int, Tuple[List[date], List[date]]] = {}
+    with get_session() as db:
+        for company_id, start_date, end_date in PeriodCloseRepository(db).get_closed_periods():
+            starts, ends = ranges.setdefault(company_id, ([], []))
+            if ends and start_date <= ends[-1]:
+                ends[-1] = max(ends[-1], end_date) # Overlapping or nested periods
+            else:
+                starts.append(start_date)
+                ends.append(end_date)
+    return ranges
+
+
+class ClosedPeriodMap:
+    """Answers "is this date in a closed fiscal period" by bisection, without a query per posting.
+
+    Loaded on first use and dropped by invalidate(), which the fiscal period
+    service calls after every change to a period. start() subscribes to the
+    fiscal period channel, so a period closed on another terminal drops this
+    terminal's map as soon as that change commits.
+    """
+
+    def __init__(self, loader=load_closed_periods, channel=None):
+        self.channel = channel
+        self._ranges: LoadOnceCache[Dict[int, Tuple[List[date], List[date]]]] = LoadOnceCache(loader)
+
+    def _get_ranges(self):
+        return self._ranges.get()
+
+    def invalidate(self):
+        self._ranges.invalidate()
+
+    def start(self):
+        channel = self.channel or get_fiscal_period_channel()
+        channel.subscribe(None, self.on_change)
+        channel.start()
+
+    def stop(self):
+        channel = self.channel or get_fiscal_period_channel()
+        channel.unsubscribe(None, self.on_change)
+
+    def on_change(self, message: dict):
+        """Channel callback: {'company_id'} of the periods that changed"""
+        self.invalidate()
+
+    def is_closed(self, company_id: int, on: date) -> bool:
+        company_ranges = self._get_ranges().get(company_id)
+        if not company_ranges or on is None:
+            return False
+        starts, ends = company_ranges
+        position = bisect_right(starts, on)
+        return position > 0 and on <= ends[position - 1]
+
+    def check_open(self, company_id: int, on: date):
+        """Raise when a posting dated on falls in a closed period of the company"""
+        if self.is_closed(company_id, on):
+            raise ValueError(f"لا يمكن الترحيل بتاريخ {on} لأنه ضمن فترة مالية مغلقة.")
+
+
+def is_closing_entry(entry) -> bool:
+    """Year-end closing entries zero the income accounts; period P&L figures leave them out"""
+    return bool(entry.ref_no) and entry.ref_no.startswith(CLOSING_REF_PREFIX)
+
+
+def closing_lines(balances, retained_earnings_account_id: int, currency: str) -> Dict[Optional[int], list]:
+    """Year-end closing lines per branch from (branch_id, account_id, balance) rows.
+
+    Every revenue and expense balance is reversed and the net result goes to
+    retained earnings, so each branch's entry balances on its own.
+    """
+    entries: Dict[Optional[int], list] = {}
+    net: Dict[Optional[int], Decimal] = {}
+    for branch_id, account_id, balance in balances:
+        if not balance:
+            continue
+        entries.setdefault(branch_id, []).append({
+            'account_id': account_id, 'debit': -balance if balance < 0 else ZERO, 'credit': balance if balance > 0 else ZERO,
+            'currency': currency, 'fx_rate': 1, 'memo': "Year-end closing"
+        })
+        net[branch_id] = net.get(branch_id, ZERO) + balance
+    for branch_id, result in net.items():
+        if result:
+            entries[branch_id].append({
+                'account_id': retained_earnings_account_id, 'debit': result if result > 0 else ZERO, 'credit': -result if result < 0 else ZERO,
+                'currency': currency, 'fx_rate': 1, 'memo': "Year-end closing: net result"
+            })
+    return entries
+
+
+# Global closed period map instance
+_closed_period_map = None
+
+def get_closed_period_map() -> ClosedPeriodMap:
+    """Get the global closed period map instance"""
+    global _closed_period_map
+    if _closed_period_map is None:
+        _closed_period_map = ClosedPeriodMap()
+    return _closed_period_map
@@ -0,0 +1,266 @@
+"""
+Labeeb ERP - Promotion Engine
+Compiled in-memory evaluation of coupons and loyalty programs for POS baskets
+"""
+
+import threading
+from bisect import bisect_right
+from datetime import datetime
+from decimal import Decimal, ROUND_HALF_UP, ROUND_DOWN
+from typing import Dict, List, Iterable
+
+from app.infrastructure.cache import LoadOnceCache
+from app.infrastructure.database import get_session
+from app.infrastructure.repositories import CouponRepository, LoyaltyProgramRepository
+
+MONEY_QUANT = Decimal('0.001') # Matches Numeric(18,3) used for amounts
+HUNDRED = Decimal(100)
+ZERO = Decimal(0)
+
+
+def to_decimal(value) -> Decimal:
+    """Convert floats/ints/strings coming from the UI or Float columns to Decimal"""
+    if value is None:
+        return ZERO
+    if isinstance(value, Decimal):
+        return value
+    return Decimal(str(value))
+
+
+class PromotionRule:
+    """Flattened, immutable view of a Coupon or LoyaltyProgram row"""
+
+    __slots__ = ('id', 'source', 'code', 'kind', 'value', 'min_purchase',
+                 'valid_from', 'valid_until', 'priority', 'is_stackable', 'validity_days')
+
+    def __init__(self, id: int, source: str, kind: str, value: Decimal, min_purchase: Decimal = ZERO,
+                 code: str = None, valid_from: datetime = None, valid_until: datetime = None,
+                 priority: int = 0, is_stackable: bool = True, validity_days: int = None):
+        self.id = id
+        self.source = source # 'coupon' or 'loyalty'
+        self.code = code
+        self.kind = kind # coupon: 'percentage'/'fixed_amount', loyalty: 'points'/'cashback'
+        self.value = value
+        self.min_purchase = min_purchase
+        self.valid_from = valid_from
+        self.valid_until = valid_until
+        self.priority = priority
+        self.is_stackable = is_stackable
+        self.validity_days = validity_days # Loyalty points expiry, None: never
+
+    @classmethod
+    def from_coupon(cls, coupon) -> 'PromotionRule':
+        return cls(
+            id=coupon.id,
+            source='coupon',
+            code=coupon.code,
+            kind=coupon.discount_type,
+            value=to_decimal(coupon.discount_value),
+            min_purchase=to_decimal(coupon.min_purchase_amount),
+            valid_from=coupon.valid_from,
+            valid_until=coupon.valid_until,
+            priority=coupon.priority or 0,
+            is_stackable=coupon.is_stackable if coupon.is_stackable is not None else True
+        )
+
+    @classmethod
+    def from_loyalty_program(cls, program) -> 'PromotionRule':
+        if program.type == 'cashback':
+            value = to_decimal(program.cashback_percentage)
+            min_purchase = to_decimal(program.min_purchase_amount_for_cashback)
+        else:
+            value = to_decimal(program.points_per_amount)
+            min_purchase = ZERO
+        return cls(id=program.id, source='loyalty', kind=program.type, value=value, min_purchase=min_purchase,
+                   validity_days=program.points_validity_days)
+
+    def __repr__(self):
+        return f"<PromotionRule(source='{self.source}', id={self.id}, kind='{self.kind}', value={self.value})>"
+
+
+class CompiledRuleSet:
+    """Per-company rule set indexed for constant/logarithmic time evaluation.
+
+    Coupons are hashed by code. Loyalty programs are sorted by their minimum
+    purchase threshold with prefix sums of their rates, so the earned points and
+    cashback for any net amount come from a single bisect.
+    """
+
+    def __init__(self, company_id: int, rules: Iterable[PromotionRule], version: int = 0):
+        self.company_id = company_id
+        self.version = version
+        self.loaded_at = datetime.now()
+        self.coupons_by_code: Dict[str, PromotionRule] = {}
+
+        points_rules = []
+        cashback_rules = []
+        for rule in rules:
+            if rule.source == 'coupon':
+                self.coupons_by_code[rule.code] = rule
+            elif rule.kind == 'points':
+                points_rules.append(rule)
+            elif rule.kind == 'cashback':
+                cashback_rules.append(rule)
+
+        self.points_thresholds, self.points_rates = self._build_prefix_index(points_rules)
+        validities = [r.validity_days for r in points_rules if r.validity_days]
+        self.points_validity_days = min(validities) if validities else None
+        self.cashback_thresholds, self.cashback_rates = self._build_prefix_index(cashback_rules)
+
+    @staticmethod
+    def _build_prefix_index(rules: List[PromotionRule]):
+        rules = sorted(rules, key=lambda r: r.min_purchase)
+        thresholds = []
+        rates = []
+        running = ZERO
+        for rule in rules:
+            running += rule.value
+            thresholds.append(rule.min_purchase)
+            rates.append(running)
+        return thresholds, rates
+
+    @staticmethod
+    def _rate_for(amount: Decimal, thresholds: List[Decimal], rates: List[Decimal]) -> Decimal:
+        idx = bisect_right(thresholds, amount)
+        return rates[idx - 1] if idx else ZERO
+
+    def points_rate(self, amount: Decimal) -> Decimal:
+        return self._rate_for(amount, self.points_thresholds, self.points_rates)
+
+    def cashback_rate(self, amount: Decimal) -> Decimal:
+        return self._rate_for(amount, self.cashback_thresholds, self.cashback_rates)
+
+    def __len__(self):
+        return len(self.coupons_by_code) + len(self.points_thresholds) + len(self.cashback_thresholds)
+
+
+def load_company_rules(company_id: int) -> List[PromotionRule]:
+    """Default loader: read the active coupons and loyalty programs of a company"""
+    with get_session() as db:
+        coupons = CouponRepository(db).get_all_coupons(company_id)
+        programs = LoyaltyProgramRepository(db).get_all_loyalty_programs(company_id)
+        rules = [PromotionRule.from_coupon(c) for c in coupons]
+        rules.extend(PromotionRule.from_loyalty_program(p) for p in programs)
+        return rules
+
+
+class PromotionEngine:
+    """Caches a CompiledRuleSet per company and evaluates baskets against it.
+
+    Rule sets are loaded lazily on first use and dropped by invalidate(), which
+    the coupon and loyalty program services call after every change.
+    """
+
+    def __init__(self, loader=load_company_rules):
+        self.loader = loader
+        self._rule_sets: Dict[int, LoadOnceCache[CompiledRuleSet]] = {}
+        self._lock = threading.Lock()
+
+    def _cache(self, company_id: int) -> LoadOnceCache[CompiledRuleSet]:
+        cache = self._rule_sets.get(company_id)
+        if cache is None:
+            with self._lock:
+                cache = self._rule_sets.get(company_id)
+                if cache is None:
+                    cache = LoadOnceCache(lambda: CompiledRuleSet(company_id, self.loader(company_id), cache.version))
+                    self._rule_sets[company_id] = cache
+        return cache
+
+    def get_rule_set(self, company_id: int) -> CompiledRuleSet:
+        return self._cache(company_id).get()
+
+    def invalidate(self, company_id: int = None):
+        """Drop the cached rules of a company (or all companies) after a change"""
+        with self._lock:
+            caches = list(self._rule_sets.values()) if company_id is None else [self._rule_sets.get(company_id)]
+        for cache in caches:
+            if cache is not None:
+                cache.invalidate()
+
+    @staticmethod
+    def basket_subtotal(lines: Iterable[dict]) -> Decimal:
+        subtotal = ZERO
+        for line in lines:
+            amount = to_decimal(line.get('quantity', 0)) * to_decimal(line.get('price', 0))
+            line_discount = line.get('discount')
+            if line_discount:
+                amount -= amount * to_decimal(line_discount) / HUNDRED
+            subtotal += amount
+        return subtotal.quantize(MONEY_QUANT, rounding=ROUND_HALF_UP)
+
+    def evaluate(self, company_id: int, lines: Iterable[dict] = None, coupon_codes: Iterable[str] = (),
+                 at: datetime = None, subtotal: Decimal = None) -> dict:
+        """Evaluate a basket and return its discounts and loyalty rewards.
+
+        lines are dicts with 'quantity', 'price' and an optional line 'discount'
+        percentage, as used by the invoice screens. Coupons are applied in
+        descending priority, percentages on the running total; a non-stackable
+        coupon is only applied when it is the first one, and stops the chain.
+        """
+        rule_set = self.get_rule_set(company_id)
+        if subtotal is None:
+            subtotal = self.basket_subtotal(lines or ())
+        else:
+            subtotal = to_decimal(subtotal)
+        at = at or datetime.now()
+
+        candidates = []
+        rejected = []
+        for position, code in enumerate(coupon_codes):
+            rule = rule_set.coupons_by_code.get(code)
+            if rule is None:
+                rejected.append({'code': code, 'reason': 'invalid'})
+            elif rule.valid_from and rule.valid_from > at:
+                rejected.append({'code': code, 'reason': 'not_started'})
+            elif rule.valid_until and rule.valid_until < at:
+                rejected.append({'code': code, 'reason': 'expired'})
+            elif subtotal < rule.min_purchase:
+                rejected.append({'code': code, 'reason': 'min_purchase', 'min_purchase': rule.min_purchase})
+            elif rule.kind not in ('percentage', 'fixed_amount'):
+                rejected.append({'code': code, 'reason': 'unsupported_type'})
+            else:
+                candidates.append((-rule.priority, position, rule))
+        candidates.sort()
+
+        discounts = []
+        running = subtotal
+        for _, _, rule in candidates:
+            if discounts and not rule.is_stackable:
+                rejected.append({'code': rule.code, 'reason': 'not_stackable'})
+                continue
+            if rule.kind == 'percentage':
+                amount = (running * rule.value / HUNDRED).quantize(MONEY_QUANT, rounding=ROUND_HALF_UP)
+            else:
+                amount = rule.value
+            amount = min(amount, running)
+            running -= amount
+            discounts.append({'source': rule.source, 'rule_id': rule.id, 'code': rule.code, 'amount': amount})
+            if not rule.is_stackable:
+                rejected.extend({'code': r.code, 'reason': 'not_stackable'} for _, _, r in candidates if r is not rule)
+                break
+
+        points_earned = (running * rule_set.points_rate(running)).quantize(Decimal(1), rounding=ROUND_DOWN)
+        cashback = (running * rule_set.cashback_rate(running) / HUNDRED).quantize(MONEY_QUANT, rounding=ROUND_HALF_UP)
+
+        return {
+            'company_id': company_id,
+            'subtotal': subtotal,
+            'discounts': discounts,
+            'total_discount': subtotal - running,
+            'total': running,
+            'points_earned': int(points_earned),
+            'cashback': cashback,
+            'rejected': rejected,
+            'rule_set_version': rule_set.version
+        }
+
+
+# Global promotion engine instance
+_promotion_engine = None
+
+def get_promotion_engine() -> PromotionEngine:
+    """Get the global promotion engine instance"""
+    global _promotion_engine
+    if _promotion_engine is None:
+        _promotion_engine = PromotionEngine()
+    return _promotion_engine
@@ -0,0 +1,144 @@
+"""
+Labeeb ERP - Replenishment Engine
+Vectorized demand forecast, safety stock and reorder points per (item, warehouse) from weekly sales history
+"""
+
+import math
+from datetime import date, timedelta
+from statistics import NormalDist
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+
+DAYS_PER_WEEK = 7
+SEASON_WEEKS = 52
+SEASON_FACTOR_LIMITS = (0.25, 4.0) # A year-ago spike or gap should not swing the forecast beyond this
+
+
+class PlanParameters:
+    """Tuning of one planning run"""
+
+    def __init__(self, history_weeks: int = 156, level_weeks: int = 13, volatility_weeks: int = 26, service_level: float = 0.95,
+                 lead_time_days: int = 14, review_days: int = 7, seasonal: bool = True):
+        self.history_weeks = history_weeks # Three years of weekly buckets
+        self.level_weeks = level_weeks # Moving average window of the demand level
+        self.volatility_weeks = volatility_weeks # Window of the demand standard deviation
+        self.service_level = service_level # Probability of not stocking out during the lead time
+        self.lead_time_days = lead_time_days
+        self.review_days = review_days # Cover ordered beyond the reorder point, until the next planning run
+        self.seasonal = seasonal
+
+    @property
+    def lead_weeks(self) -> float:
+        return self.lead_time_days / DAYS_PER_WEEK
+
+    @property
+    def review_weeks(self) -> float:
+        return self.review_days / DAYS_PER_WEEK
+
+    def history_start(self, as_of: date) -> date:
+        """First day of the oldest weekly bucket; the last bucket ends on as_of"""
+        return as_of - timedelta(days=self.history_weeks * DAYS_PER_WEEK - 1)
+
+
+def demand_matrix(partitions: Iterable[List[Tuple]], weeks: int, extra_pairs: np.ndarray = None):
+    """Dense weekly demand per (item, warehouse) from (item_id, warehouse_id, week, quantity) row batches.
+
+    extra_pairs ((n, 2) item/warehouse ids) adds pairs without history, e.g.
+    items whose static reorder level should still be checked. Returns the pair
+    item ids, warehouse ids and a (pairs, weeks) float64 matrix.
+    """
+    items, warehouses, week_numbers, quantities = [], [], [], []
+    for rows in partitions:
+        if not rows:
+            continue
+        batch = np.asarray(rows, dtype=np.float64)
+        items.append(batch[:, 0].astype(np.int64))
+        warehouses.append(batch[:, 1].astype(np.int64))
+        week_numbers.append(batch[:, 2].astype(np.int64))
+        quantities.append(batch[:, 3])
+    item_ids = np.concatenate(items) if items else np.empty(0, np.int64)
+    warehouse_ids = np.concatenate(warehouses) if warehouses else np.empty(0, np.int64)
+    week_index = np.concatenate(week_numbers) if week_numbers else np.empty(0, np.int64)
+    quantity = np.concatenate(quantities) if quantities else np.empty(0, np.float64)
+
+    all_items, all_warehouses = item_ids, warehouse_ids
+    if extra_pairs is not None and len(extra_pairs):
+        all_items = np.concatenate([item_ids, extra_pairs[:, 0].astype(np.int64)])
+        all_warehouses = np.concatenate([warehouse_ids, extra_pairs[:, 1].astype(np.int64)])
+    if not len(all_items):
+        return np.empty(0, np.int64), np.empty(0, np.int64), np.zeros((0, weeks))
+
+    warehouse_span = int(all_warehouses.max()) + 1
+    pair_keys, inverse = np.unique(all_items * warehouse_span + all_warehouses, return_inverse=True)
+    pairs = len(pair_keys)
+    row_pairs = inverse[:len(item_ids)]
+    valid = (week_index >= 0) & (week_index < weeks)
+    demand = np.bincount(row_pairs[valid] * weeks + week_index[valid], weights=quantity[valid],
+                         minlength=pairs * weeks).reshape(pairs, weeks)
+    return pair_keys // warehouse_span, pair_keys % warehouse_span, demand
+
+
+def plan_pairs(demand: np.ndarray, on_hand: np.ndarray, on_order: np.ndarray, static_reorder: np.ndarray,
+               parameters: PlanParameters) -> Dict[str, np.ndarray]:
+    """Forecast, safety stock, reorder point and suggested quantity for every row of demand at once.
+
+    The weekly level is the moving average of the last level_weeks. With more
+    than a year of history it is scaled by a seasonal factor: last year's
+    demand over the coming lead time relative to last year's level. Safety
+    stock is z * sigma * sqrt(lead time); the reorder point never falls below
+    the item's static reorder level. When the stock position (on hand plus
+    open purchase orders) is at or below the reorder point, the suggestion
+    orders up to the reorder point plus the review period's demand.
+    """
+    pairs, weeks = demand.shape
+    level_weeks = min(parameters.level_weeks, weeks)
+    volatility_weeks = min(parameters.volatility_weeks, weeks)
+    lead_weeks = parameters.lead_weeks
+    lead_buckets = max(1, math.ceil(lead_weeks))
+
+    cumulative = np.zeros((pairs, weeks + 1))
+    np.cumsum(demand, axis=1, out=cumulative[:, 1:])
+
+    def window_mean(start: int, end: int) -> np.ndarray:
+        start, end = max(start, 0), min(end, weeks)
+        if end <= start:
+            return np.zeros(pairs)
+        return (cumulative[:, end] - cumulative[:, start]) / (end - start)
+
+    level = window_mean(weeks - level_weeks, weeks)
+    factor = np.ones(pairs)
+    if parameters.seasonal and weeks >= SEASON_WEEKS + level_weeks:
+        year_ago = weeks - SEASON_WEEKS
+        year_ago_level = window_mean(year_ago - level_weeks, year_ago)
+        year_ago_ahead = window_mean(year_ago, year_ago + lead_buckets)
+        # Only pairs that were already selling a year before the level window
+        first_sale = np.where(demand.any(axis=1), np.argmax(demand > 0, axis=1), weeks)
+        seasonal = (first_sale < year_ago - level_weeks) & (year_ago_level > 0)
+        factor[seasonal] = np.clip(year_ago_ahead[seasonal] / year_ago_level[seasonal], *SEASON_FACTOR_LIMITS)
+    forecast = level * factor
+
+    sigma = demand[:, weeks - volatility_weeks:].std(axis=1, ddof=1) if volatility_weeks > 1 else np.zeros(pairs)
+    z = NormalDist().inv_cdf(parameters.service_level)
+    safety_stock = z * sigma * math.sqrt(lead_weeks)
+    reorder_point = np.maximum(forecast * lead_weeks + safety_stock, static_reorder)
+    order_up_to = reorder_point + forecast * parameters.review_weeks
+    position = on_hand + on_order
+    needed = (reorder_point > 0) & (position <= reorder_point)
+    suggested = np.where(needed, np.ceil(np.maximum(order_up_to - position, 0)), 0)
+    return {
+        'level': level,
+        'seasonal_factor': factor,
+        'forecast': forecast,
+        'sigma': sigma,
+        'safety_stock': safety_stock,
+        'reorder_point': reorder_point,
+        'position': position,
+        'suggested': suggested
+    }
+
+
+def lookup(item_ids: np.ndarray, warehouse_ids: np.ndarray, values: Dict[Tuple[int, int], float]) -> np.ndarray:
+    """Per-pair values from a {(item_id, warehouse_id): value} map, 0 where missing"""
+    return np.fromiter((values.get(pair, 0.0) for pair in zip(item_ids.tolist(), warehouse_ids.tolist())),
+                       dtype=np.float64, count=len(item_ids))
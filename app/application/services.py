@@ -1,10 +1,29 @@
 from sqlalchemy.orm import Session
-from app.infrastructure.repositories import AccountRepository, JournalEntryRepository, JournalLineRepository, CustomerRepository, SupplierRepository, InvoiceRepository, PaymentRepository, ItemRepository, StockMovementRepository, SalesOrderRepository, PurchaseOrderRepository, BankTransactionRepository, BankReconciliationRepository, FixedAssetRepository, DepreciationRepository, TaxSettingRepository, TaxReportRepository, UserRepository, RoleRepository, PermissionRepository, CompanyRepository, BranchRepository, FiscalPeriodRepository, CostCenterRepository, ProjectRepository, EmployeeRepository, PayrunRepository, NotificationRepository, WorkflowRepository, UnitRepository, CurrencyRepository, PaymentMethodRepository, WarehouseRepository, CouponRepository, ShiftRepository, ShiftMovementRepository, GiftCardRepository, LoyaltyProgramRepository # Added new repositories and GiftCardRepository, LoyaltyProgramRepository
+from app.infrastructure.repositories import AccountRepository, JournalEntryRepository, JournalLineRepository, CustomerRepository, SupplierRepository, InvoiceRepository, PaymentRepository, ItemRepository, StockMovementRepository, SalesOrderRepository, PurchaseOrderRepository, BankTransactionRepository, BankReconciliationRepository, FixedAssetRepository, DepreciationRepository, TaxSettingRepository, TaxReportRepository, UserRepository, RoleRepository, PermissionRepository, CompanyRepository, BranchRepository, FiscalPeriodRepository, CostCenterRepository, ProjectRepository, EmployeeRepository, PayrunRepository, NotificationRepository, WorkflowRepository, UnitRepository, CurrencyRepository, PaymentMethodRepository, WarehouseRepository, CouponRepository, ShiftRepository, ShiftMovementRepository, GiftCardRepository, LoyaltyProgramRepository, LoyaltyLedgerRepository, BankStatementLineRepository, ItemCostRepository, CustomerExposureRepository, MasterDataImportRepository, ExchangeRateRepository, PeriodCloseRepository, EliminationRuleRepository, OrderConversionRepository, ReplenishmentRepository, AccountClosureRepository # Added new repositories and GiftCardRepository, LoyaltyProgramRepository
 from app.domain import models # Import models module as a whole
 from app.domain.settings_models import Unit, Currency, PaymentMethod, GiftCard, LoyaltyProgram # Import new settings models and GiftCard and LoyaltyProgram
-from datetime import date, datetime
+import csv
+import json
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
 from decimal import Decimal
-from app.infrastructure.database import get_session
+from app.infrastructure.database import get_session, read_only
+from app.application.promotion_engine import get_promotion_engine
+from app.application.bank_reconciliation_engine import parse_statement, with_line_hashes, signed_book_amount, MatchEntry, ReconciliationMatcher
+from app.application.tax_engine import get_tax_engine, period_bounds
+from app.application.fx_engine import get_exchange_rates
+from app.application.item_catalog_engine import get_item_catalog
+from app.application.account_tree_engine import get_account_tree
+from app.application.period_close_engine import get_closed_period_map, closing_lines, CLOSING_REF_PREFIX
+from app.application.consolidation_engine import parallel_balances, consolidate
+from app.application.fulfilment_engine import ConversionReport, SALES_ORDER, PURCHASE_ORDER, SALES_CONVERSION, PURCHASE_CONVERSION, CHUNK_SIZE, CONVERTED, SKIPPED, FAILED, chunked, net_unit_price, to_base, posting_lines
+from app.application.export_engine import export_rows
+from app.application.import_engine import ImportResult, ReferenceData, RowValidator, read_chunks, item_fields, customer_fields, supplier_fields, opening_stock_fields
+from app.application.costing_engine import CostState, CostLayer, FIFO, INBOUND_MOVEMENT_TYPES, CHECKPOINT_INTERVAL_DAYS
+from app.application.workflow_engine import get_workflow_runtime, parse_actions
+from app.infrastructure.notification_channel import get_notification_channel
+from app.infrastructure.event_bus import publish_event, invoice_event_data, payment_event_data, stock_movement_event_data, INVOICE_CREATED, PAYMENT_RECEIVED, STOCK_MOVED, JOURNAL_POSTED, MASTER_DATA_IMPORTED
+from app.infrastructure.audit import audit_bulk_write
 from sqlalchemy.exc import IntegrityError # Import IntegrityError
 from sqlalchemy import func # Import func for max()
 
@@ -25,6 +44,8 @@ class AccountService:
 
     def create_account(self, code: str, name_ar: str, name_en: str, type: int, level: int, parent_id: int, currency: str, is_postable: bool, is_active: bool):
         with get_session() as db:
+            if parent_id is not None and AccountRepository(db).get_account_by_id(parent_id) is None:
+                raise ValueError("الحساب الأب غير موجود.")
             account = models.Account(
                 code=code,
                 name_ar=name_ar,
@@ -36,20 +57,58 @@ class AccountService:
                 is_postable=is_postable,
                 is_active=is_active
             )
-            return AccountRepository(db).create_account(account)
+            db.add(account)
+            db.flush()
+            AccountClosureRepository(db).insert_account(account.id, parent_id) # Same transaction as the account
+            db.commit()
+            db.refresh(account)
+            get_account_tree().invalidate()
+            return account
 
     def update_account(self, account_id: int, **kwargs):
         with get_session() as db:
-            return AccountRepository(db).update_account(account_id, kwargs)
+            account_repo = AccountRepository(db)
+            account = account_repo.get_account_by_id(account_id)
+            if account and 'parent_id' in kwargs and kwargs['parent_id'] != account.parent_id:
+                new_parent_id = kwargs['parent_id']
+                closure_repo = AccountClosureRepository(db)
+                if new_parent_id is not None:
+                    if account_repo.get_account_by_id(new_parent_id) is None:
+                        raise ValueError("الحساب الأب غير موجود.")
+                    if closure_repo.is_descendant(account_id, new_parent_id):
+                        raise ValueError("لا يمكن نقل الحساب تحت نفسه أو تحت أحد الحسابات التابعة له.")
+                closure_repo.move_subtree(account_id, new_parent_id) # Committed with the account below
+            account = account_repo.update_account(account_id, kwargs)
+            get_account_tree().invalidate()
+            return account
 
     def delete_account(self, account_id: int):
         with get_session() as db:
-            return AccountRepository(db).delete_account(account_id)
+            account = AccountRepository(db).delete_account(account_id) # Closure links go with it (ON DELETE CASCADE)
+            get_account_tree().invalidate()
+            return account
+
+    def ensure_account_closure(self):
+        """ Rebuild the account closure from parent_id when accounts are missing from it, e.g. charts created before it existed """
+        with get_session() as db:
+            closure_repo = AccountClosureRepository(db)
+            if not closure_repo.is_complete():
+                closure_repo.rebuild()
+                db.commit()
+                get_account_tree().invalidate()
+
+    def get_subtree_account_ids(self, account_id: int) -> frozenset:
+        """ The account and every account below it, from the cached tree """
+        return get_account_tree().subtree(account_id)
+
+    def is_in_subtree(self, ancestor_id: int, account_id: int) -> bool:
+        return get_account_tree().is_in_subtree(ancestor_id, account_id)
 
 class JournalService:
     def __init__(self):
         pass
 
+    @read_only
     def get_all_journal_entries(self):
         with get_session() as db:
             return JournalEntryRepository(db).get_all_journal_entries()
@@ -60,78 +119,172 @@ class JournalService:
             journal_line_repo = JournalLineRepository(db)
             journal_entry = journal_entry_repo.get_journal_entry_by_id(entry_id)
             if journal_entry:
-                journal_entry.lines = journal_line_repo.get_lines_by_entry_id(entry_id)
+                journal_entry.lines = journal_line_repo.get_lines_by_entry_id(entry_id, journal_entry.date)
             return journal_entry
 
-    def create_journal_entry(self, company_id: int, branch_id: int, entry_date: date, period: str, ref_no: str, created_by: int, lines_data: list):
+    @read_only
+    def get_account_balances(self, company_id: int, as_of: date, branch_id: int = None) -> dict:
+        """ Posted balance (debit - credit) per account up to a date, from the nearest closing snapshot """
         with get_session() as db:
-            journal_entry_repo = JournalEntryRepository(db)
-            journal_line_repo = JournalLineRepository(db)
-            account_repo = AccountRepository(db)
-
-            total_debit = Decimal(0)
-            total_credit = Decimal(0)
+            rows = PeriodCloseRepository(db).get_account_balances(company_id, as_of, branch_id)
+            return {row.account_id: (row.debit or Decimal(0)) - (row.credit or Decimal(0)) for row in rows}
 
-            for line in lines_data:
-                total_debit += Decimal(line.get('debit', 0))
-                total_credit += Decimal(line.get('credit', 0))
+    @read_only
+    def get_rollup_balances(self, company_id: int, as_of: date, branch_id: int = None) -> dict:
+        """ Posted balance (debit - credit) of every account including everything below it, so group accounts carry their subtotals """
+        with get_session() as db:
+            rows = PeriodCloseRepository(db).get_rollup_balances(company_id, as_of, branch_id)
+            return {row.account_id: (row.debit or Decimal(0)) - (row.credit or Decimal(0)) for row in rows}
 
-            if total_debit != total_credit:
-                raise ValueError("Debit and Credit totals must be equal.")
+    @read_only
+    def get_account_statement(self, company_id: int, account_id: int, date_from: date, date_to: date = None, branch_id: int = None,
+                              after: tuple = None, balance_forward: Decimal = None, limit: int = 200) -> dict:
+        """ One page of an account's posted lines between two dates, oldest first, with the opening balance and a
+        running balance computed by the database. For the next page pass the returned 'next' as after and
+        'balance_forward' as balance_forward; without it the balance up to the cursor is aggregated again. """
+        date_to = date_to or date.today()
+        with get_session() as db:
+            if AccountRepository(db).get_account_by_id(account_id) is None:
+                raise ValueError("الحساب غير موجود.")
+            journal_line_repo = JournalLineRepository(db)
+            opening_balance = None
+            if after is None or balance_forward is None:
+                opening = PeriodCloseRepository(db).get_account_balance(company_id, account_id, date_from - timedelta(days=1), branch_id)
+                opening_balance = opening.debit - opening.credit
+                balance_forward = opening_balance
+                if after is not None:
+                    through = journal_line_repo.get_account_total(company_id, account_id, date_from, after, branch_id)
+                    balance_forward += through[0] - through[1]
+            rows = journal_line_repo.get_account_statement(company_id, account_id, date_from, date_to, balance_forward, after, limit, branch_id)
+            lines = [{
+                "id": row.id,
+                "date": row.entry_date,
+                "entry_id": row.entry_id,
+                "ref_no": row.ref_no,
+                "period": row.period,
+                "branch_id": row.branch_id,
+                "memo": row.memo,
+                "debit": row.debit,
+                "credit": row.credit,
+                "currency": row.currency,
+                "fx_rate": row.fx_rate,
+                "cost_center_id": row.cost_center_id,
+                "project_id": row.project_id,
+                "running_balance": row.running_balance,
+                "cursor": (row.entry_date, row.id)
+            } for row in rows]
+            return {
+                "account_id": account_id,
+                "date_from": date_from,
+                "date_to": date_to,
+                "opening_balance": opening_balance, # Only on pages that had to compute it
+                "lines": lines,
+                "next": lines[-1]["cursor"] if len(lines) == limit else None,
+                "balance_forward": lines[-1]["running_balance"] if lines else balance_forward
+            }
 
-            journal_entry = models.JournalEntry(
-                company_id=company_id,
-                branch_id=branch_id,
-                date=entry_date,
-                period=period,
-                ref_no=ref_no,
-                created_by=created_by,
-                status=0 # Draft
-            )
-            created_entry = journal_entry_repo.create_journal_entry(journal_entry)
-
-            for line_data in lines_data:
-                account = account_repo.get_account_by_id(line_data['account_id'])
-                if not account:
-                    raise ValueError(f"Account with ID {line_data['account_id']} not found.")
-
-                journal_line = models.JournalLine(
-                    entry_id=created_entry.id,
-                    account_id=line_data['account_id'],
-                    debit=Decimal(line_data.get('debit', 0)),
-                    credit=Decimal(line_data.get('credit', 0)),
-                    currency=line_data.get('currency', 'USD'), # Default currency for now
-                    fx_rate=Decimal(line_data.get('fx_rate', 1)),
-                    cost_center_id=line_data.get('cost_center_id'),
-                    project_id=line_data.get('project_id'),
-                    memo=line_data.get('memo')
-                )
-                journal_line_repo.create_journal_line(journal_line)
+    @staticmethod
+    def _check_period_open(journal_entry_repo, entry_id: int, new_date: date = None):
+        """ Entries dated in a closed period, or moved into one, cannot change """
+        entry = journal_entry_repo.get_journal_entry_by_id(entry_id)
+        if entry:
+            closed_periods = get_closed_period_map()
+            closed_periods.check_open(entry.company_id, entry.date)
+            if new_date is not None:
+                closed_periods.check_open(entry.company_id, new_date)
 
+    def create_journal_entry(self, company_id: int, branch_id: int, entry_date: date, period: str, ref_no: str, created_by: int, lines_data: list):
+        with get_session() as db:
+            created_entry = self.add_journal_entry(db, company_id, branch_id, entry_date, period, ref_no, created_by, lines_data)
+            db.commit()
+            db.refresh(created_entry)
             return created_entry
 
+    @staticmethod
+    def add_journal_entry(db, company_id: int, branch_id: int, entry_date: date, period: str, ref_no: str, created_by: int, lines_data: list):
+        """ Validate and add a draft entry with its lines to the caller's session. Does not commit. """
+        get_closed_period_map().check_open(company_id, entry_date)
+        account_repo = AccountRepository(db)
+
+        total_debit = Decimal(0)
+        total_credit = Decimal(0)
+
+        for line in lines_data:
+            total_debit += Decimal(line.get('debit', 0))
+            total_credit += Decimal(line.get('credit', 0))
+
+        if total_debit != total_credit:
+            raise ValueError("Debit and Credit totals must be equal.")
+
+        journal_entry = models.JournalEntry(
+            company_id=company_id,
+            branch_id=branch_id,
+            date=entry_date,
+            period=period,
+            ref_no=ref_no,
+            created_by=created_by,
+            status=0 # Draft
+        )
+        exchange_rates = get_exchange_rates()
+
+        journal_lines = []
+        for line_data in lines_data:
+            account = account_repo.get_account_by_id(line_data['account_id'])
+            if not account:
+                raise ValueError(f"Account with ID {line_data['account_id']} not found.")
+            currency = line_data.get('currency') or exchange_rates.base_currency(company_id) or 'USD'
+            fx_rate = line_data.get('fx_rate')
+            if fx_rate is None: # Rate in effect on the entry date
+                fx_rate = exchange_rates.base_rate(company_id, currency, entry_date)
+
+            journal_lines.append(models.JournalLine(
+                account_id=line_data['account_id'],
+                debit=Decimal(line_data.get('debit', 0)),
+                credit=Decimal(line_data.get('credit', 0)),
+                currency=currency,
+                fx_rate=Decimal(fx_rate),
+                cost_center_id=line_data.get('cost_center_id'),
+                project_id=line_data.get('project_id'),
+                memo=line_data.get('memo')
+            ))
+
+        return JournalEntryRepository(db).add_journal_entry(journal_entry, journal_lines)
+
     def update_journal_entry(self, entry_id: int, **kwargs):
         with get_session() as db:
-            return JournalEntryRepository(db).update_journal_entry(entry_id, kwargs)
+            journal_entry_repo = JournalEntryRepository(db)
+            self._check_period_open(journal_entry_repo, entry_id, kwargs.get('date'))
+            return journal_entry_repo.update_journal_entry(entry_id, kwargs)
 
     def approve_journal_entry(self, entry_id: int, approved_by: int):
         with get_session() as db:
-            return JournalEntryRepository(db).update_journal_entry(entry_id, {'status': 1, 'posted_by': approved_by}) # 1: Approved
+            journal_entry_repo = JournalEntryRepository(db)
+            self._check_period_open(journal_entry_repo, entry_id)
+            return journal_entry_repo.update_journal_entry(entry_id, {'status': 1, 'posted_by': approved_by}) # 1: Approved
 
     def post_journal_entry(self, entry_id: int, posted_by: int):
         with get_session() as db:
             from datetime import datetime
-            return JournalEntryRepository(db).update_journal_entry(entry_id, {'status': 2, 'posted_by': posted_by, 'posted_at': datetime.now()}) # 2: Posted
+            journal_entry_repo = JournalEntryRepository(db)
+            self._check_period_open(journal_entry_repo, entry_id)
+            entry = journal_entry_repo.update_journal_entry(entry_id, {'status': 2, 'posted_by': posted_by, 'posted_at': datetime.now()}) # 2: Posted
+            if entry:
+                publish_event(JOURNAL_POSTED, {'entry_id': entry.id, 'company_id': entry.company_id, 'branch_id': entry.branch_id,
+                                               'date': entry.date, 'ref_no': entry.ref_no, 'posted_by': posted_by})
+            return entry
 
     def void_journal_entry(self, entry_id: int):
         with get_session() as db:
-            return JournalEntryRepository(db).update_journal_entry(entry_id, {'status': 3}) # 3: Voided
+            journal_entry_repo = JournalEntryRepository(db)
+            self._check_period_open(journal_entry_repo, entry_id)
+            return journal_entry_repo.update_journal_entry(entry_id, {'status': 3}) # 3: Voided
 
 class ARAPService:
     def __init__(self):
         pass
 
     # Customer Operations
+    @read_only
     def get_all_customers(self):
         with get_session() as db:
             return CustomerRepository(db).get_all_customers()
@@ -184,6 +337,7 @@ class ARAPService:
             return next_code
 
     # Supplier Operations
+    @read_only
     def get_all_suppliers(self):
         with get_session() as db:
             return SupplierRepository(db).get_all_suppliers()
@@ -267,10 +421,13 @@ class ARAPService:
                 total_amount=total_amount,
                 total_tax=total_tax,
                 currency=currency,
+                fx_rate=get_exchange_rates().base_rate(company_id, currency, invoice_date),
                 status=0, # Draft
                 created_by=created_by
             )
-            return InvoiceRepository(db).create_invoice(invoice)
+            created_invoice = InvoiceRepository(db).create_invoice(invoice)
+            publish_event(INVOICE_CREATED, invoice_event_data(created_invoice))
+            return created_invoice
 
     def update_invoice(self, invoice_id: int, **kwargs):
         with get_session() as db:
@@ -292,7 +449,6 @@ class ARAPService:
     def record_payment(self, company_id: int, branch_id: int, invoice_id: int, payment_date: date, amount: Decimal, currency: str, payment_method: str, ref_no: str = None, created_by: int = 1):
         with get_session() as db:
             payment_repo = PaymentRepository(db)
-            invoice_repo = InvoiceRepository(db)
 
             payment = models.Payment(
                 company_id=company_id,
@@ -301,20 +457,15 @@ class ARAPService:
                 payment_date=payment_date,
                 amount=amount,
                 currency=currency,
+                fx_rate=get_exchange_rates().base_rate(company_id, currency, payment_date),
                 payment_method=payment_method,
                 ref_no=ref_no,
                 created_by=created_by
             )
-            recorded_payment = payment_repo.create_payment(payment)
-
-            # Update invoice status to 'Paid' if the total amount is covered
-            invoice = invoice_repo.get_invoice_by_id(invoice_id)
-            if invoice:
-                total_paid = sum([p.amount for p in invoice.payments]) if invoice.payments else Decimal(0)
-                if total_paid >= invoice.total_amount: # Simple check, can be more complex with partial payments
-                    invoice_repo.update_invoice(invoice_id, {'status': 2}) # 2: Paid
-
-            return recorded_payment
+            # The repository updates the invoice's amount_paid / balance_due and marks it Paid once covered
+            created_payment = payment_repo.create_payment(payment)
+            publish_event(PAYMENT_RECEIVED, payment_event_data(created_payment))
+            return created_payment
 
     def update_payment(self, payment_id: int, **kwargs):
         with get_session() as db:
@@ -324,11 +475,175 @@ class ARAPService:
         with get_session() as db:
             return PaymentRepository(db).delete_payment(payment_id)
 
+    # Credit Control
+    @staticmethod
+    def _credit_result(position, amount: Decimal) -> dict:
+        exposure = position.open_ar + position.open_orders
+        credit_limit = position.credit_limit or Decimal(0)
+        # A credit limit of 0 means no limit has been set for the customer
+        allowed = not credit_limit or exposure + amount <= credit_limit
+        return {
+            'allowed': allowed,
+            'credit_limit': credit_limit,
+            'open_ar': position.open_ar,
+            'open_orders': position.open_orders,
+            'exposure': exposure,
+            'available': (credit_limit - exposure) if credit_limit else None
+        }
+
+    def check_credit(self, customer_id: int, amount: Decimal) -> dict:
+        """ Whether a sale of amount on credit fits the customer's limit. One primary key read, no locking. """
+        with get_session() as db:
+            position = CustomerExposureRepository(db).get_credit_position(customer_id)
+            if position is None:
+                raise ValueError("العميل غير موجود.")
+            return self._credit_result(position, Decimal(amount))
+
+    def reserve_credit_in_transaction(self, db: Session, customer_id: int, amount: Decimal) -> dict:
+        """ Credit check at checkout. Takes a per-customer advisory lock held until the caller's transaction
+        ends, so concurrent terminals selling to the same customer cannot both pass on the same headroom. """
+        exposure_repo = CustomerExposureRepository(db)
+        exposure_repo.lock_customer(customer_id)
+        position = exposure_repo.get_credit_position(customer_id)
+        if position is None:
+            raise ValueError("العميل غير موجود.")
+        result = self._credit_result(position, Decimal(amount))
+        if not result['allowed']:
+            raise ValueError(f"تجاوز الحد الائتماني للعميل. المتاح: {result['available']}")
+        return result
+
+    def rebuild_customer_exposure(self):
+        """ Recompute the stored exposure the credit check reads, e.g. for customers with open items from before it existed """
+        with get_session() as db:
+            CustomerExposureRepository(db).rebuild()
+            db.commit()
+
+    # Open Items & Aging
+    @read_only
+    def get_aging(self, company_id: int, ledger: str = 'AR', as_of: date = None, buckets: tuple = (30, 60, 90), party_id: int = None):
+        """ Aging per customer (ledger 'AR') or supplier ('AP') as of a date, from the precomputed invoice balances """
+        return self._aging(company_id, ledger, as_of, buckets, party_id)
+
+    def _aging(self, company_id: int, ledger: str, as_of: date, buckets: tuple, party_id: int):
+        if ledger not in ('AR', 'AP'):
+            raise ValueError(f"Invalid ledger: {ledger}")
+        as_of_today = as_of is None or as_of >= date.today()
+        as_of = as_of or date.today()
+        with get_session() as db:
+            rows = InvoiceRepository(db).get_aging_summary(company_id, ledger, as_of, tuple(buckets), party_id, as_of_today)
+            return [dict(row._mapping) for row in rows]
+
+    def get_open_balance(self, company_id: int, ledger: str, party_id: int, as_of: date = None) -> Decimal:
+        """ Open balance of one customer or supplier; read on the primary, as credit checks depend on it """
+        rows = self._aging(company_id, ledger, as_of, (30, 60, 90), party_id)
+        return rows[0]['total'] if rows else Decimal(0)
+
+    @read_only
+    def export_aging(self, company_id: int, file_path: str, ledger: str = 'AR', as_of: date = None, buckets: tuple = (30, 60, 90)) -> int:
+        """ Write every open item of a ledger with its aging bucket to a CSV file, streaming from the database """
+        if ledger not in ('AR', 'AP'):
+            raise ValueError(f"Invalid ledger: {ledger}")
+        as_of_today = as_of is None or as_of >= date.today()
+        as_of = as_of or date.today()
+        count = 0
+        with get_session() as db, open(file_path, 'w', newline='', encoding='utf-8') as output:
+            writer = csv.writer(output)
+            writer.writerow(['party_id', 'invoice_id', 'invoice_no', 'invoice_type', 'invoice_date', 'due_date',
+                             'total_amount', 'balance', 'days_overdue', 'bucket'])
+            result = InvoiceRepository(db).stream_open_items(company_id, ledger, as_of, tuple(buckets), None, as_of_today)
+            for rows in result.partitions():
+                writer.writerows((r.party_id, r.id, r.invoice_no, r.invoice_type, r.invoice_date, r.due_date,
+                                  r.total_amount, r.balance, r.days_overdue, r.bucket) for r in rows)
+                count += len(rows)
+        return count
+
+    def revalue_foreign_balances(self, company_id: int, branch_id: int, as_of: date, receivable_account_id: int, payable_account_id: int,
+                                 gain_account_id: int, loss_account_id: int, created_by: int = 1, reverse: bool = True) -> dict:
+        """ Period-end unrealized FX revaluation of all foreign-currency open AR/AP items.
+
+        The differences come from one grouped query per ledger and are posted as a single
+        journal: one receivable / payable line per currency and the net gain or loss. With
+        reverse, the entry is reversed on the next day, so each period revalues from the
+        booked invoice rates again. A date that already has an FXR entry is rejected.
+        """
+        as_of_today = as_of >= date.today()
+        exchange_rates = get_exchange_rates()
+        base_currency = exchange_rates.base_currency(company_id)
+        ref_no = f"FXR-{as_of.isoformat()}"
+        with get_session() as db:
+            if JournalEntryRepository(db).ref_exists(company_id, ref_no):
+                raise ValueError(f"تم تقييم الأرصدة بالعملات الأجنبية بتاريخ {as_of.isoformat()} مسبقاً.")
+            invoice_repo = InvoiceRepository(db)
+            ledgers = {ledger: invoice_repo.get_fx_revaluation(company_id, ledger, as_of, as_of_today) for ledger in ('AR', 'AP')}
+
+            lines = []
+            net_gain = Decimal(0)
+            for ledger, account_id in (('AR', receivable_account_id), ('AP', payable_account_id)):
+                for row in ledgers[ledger]:
+                    difference = row.difference or Decimal(0)
+                    if not difference:
+                        continue
+                    # A higher receivable is a gain, a higher payable a loss
+                    gain = difference if ledger == 'AR' else -difference
+                    net_gain += gain
+                    lines.append({'account_id': account_id, 'debit': gain if gain > 0 else 0, 'credit': -gain if gain < 0 else 0,
+                                  'currency': base_currency, 'fx_rate': 1,
+                                  'memo': f"FX revaluation {ledger} {row.currency} {row.balance} @ {row.rate}"})
+            if not lines:
+                return {'entry_id': None, 'reversal_id': None, 'net_gain': net_gain, 'ledgers': ledgers}
+            if net_gain:
+                lines.append({'account_id': gain_account_id if net_gain > 0 else loss_account_id,
+                              'debit': -net_gain if net_gain < 0 else 0, 'credit': net_gain if net_gain > 0 else 0,
+                              'currency': base_currency, 'fx_rate': 1, 'memo': "Unrealized FX gain / loss"})
+
+            # The entry and its reversal commit together, so a failed reversal leaves no half-posted revaluation
+            period = as_of.strftime('%Y-%m')
+            entry = JournalService.add_journal_entry(db, company_id, branch_id, as_of, period, ref_no, created_by, lines)
+            reversal = None
+            if reverse:
+                reverse_date = as_of + timedelta(days=1)
+                reversed_lines = [dict(line, debit=line['credit'], credit=line['debit']) for line in lines]
+                reversal = JournalService.add_journal_entry(db, company_id, branch_id, reverse_date, reverse_date.strftime('%Y-%m'),
+                                                            f"{ref_no}-REV", created_by, reversed_lines)
+            db.commit()
+            return {'entry_id': entry.id, 'reversal_id': reversal.id if reversal else None, 'net_gain': net_gain, 'ledgers': ledgers}
+
+    INVOICE_EXPORT_HEADERS = ['Invoice No', 'Type', 'Date', 'Due Date', 'Party', 'Total', 'Tax', 'Balance Due', 'Currency', 'Status']
+
+    @read_only
+    def export_invoices(self, company_id: int, file_path: str, date_from: date = None, date_to: date = None, invoice_type: int = None,
+                        headers: list = None, progress=None, cancelled=None, **options) -> int:
+        """ Stream the invoice register to CSV / XLSX / PDF (by file extension); memory does not grow with the row count """
+        with get_session() as db:
+            invoice_repo = InvoiceRepository(db)
+            total = invoice_repo.count_invoices(company_id, date_from, date_to, invoice_type)
+            rows = invoice_repo.stream_invoices(company_id, date_from, date_to, invoice_type)
+            return export_rows(file_path, headers or self.INVOICE_EXPORT_HEADERS, rows, total, progress, cancelled, **options)
+
+    def ensure_invoice_types(self) -> int:
+        """ Move purchase invoices saved as type 2 by earlier versions to type 1, so tax and aging do not read them as sales returns """
+        with get_session() as db:
+            return InvoiceRepository(db).retype_legacy_purchases()
+
+    def ensure_invoice_balances(self) -> int:
+        """ Backfill amount_paid / balance_due once, when invoices saved before those columns were stored are found """
+        with get_session() as db:
+            invoice_repo = InvoiceRepository(db)
+            if not invoice_repo.has_unset_balances():
+                return 0
+            return invoice_repo.recalculate_balances()
+
+    def recalculate_invoice_balances(self, company_id: int = None) -> int:
+        """ Rebuild amount_paid / balance_due of existing invoices from their payments """
+        with get_session() as db:
+            return InvoiceRepository(db).recalculate_balances(company_id)
+
 class InventoryService:
     def __init__(self):
         pass
 
     # Item Operations
+    @read_only
     def get_all_items(self):
         with get_session() as db:
             return ItemRepository(db).get_all_items()
@@ -337,6 +652,18 @@ class InventoryService:
         with get_session() as db:
             return ItemRepository(db).get_item_by_id(item_id)
 
+    # Item Catalog (in memory, for scanning)
+    def scan_item(self, company_id: int, scanned: str):
+        """ Active item by barcode or item code from this terminal's catalog, None if unknown """
+        return get_item_catalog().scan(company_id, scanned)
+
+    def search_catalog_items(self, company_id: int, prefix: str, limit: int = 20):
+        return get_item_catalog().search(company_id, prefix, limit)
+
+    def get_catalog_item(self, item_id: int):
+        """ Price, unit and tax of an active item without a database round trip """
+        return get_item_catalog().get(item_id)
+
     def create_item(self, company_id: int, warehouse_id: int, name_ar: str, name_en: str = None, unit_id: int = None, barcode: str = None, sale_price: Decimal = Decimal(0), min_sale_price: Decimal = Decimal(0), cost_price: Decimal = Decimal(0), reorder_level: Decimal = Decimal(0), free_quantity_level: Decimal = Decimal(0), costing_method: int = 0, is_active: bool = True):
         with get_session() as db:
             item = models.Item(
@@ -373,11 +700,12 @@ class InventoryService:
     # Removed Warehouse Operations from InventoryService
 
     # Stock Movement Operations
+    @read_only
     def get_all_stock_movements(self):
         with get_session() as db:
             return StockMovementRepository(db).get_all_stock_movements()
 
-    def record_stock_movement(self, company_id: int, branch_id: int, item_id: int, movement_type: int, quantity: Decimal, cost: Decimal = Decimal(0), movement_date: date = None, ref_no: str = None, created_by: int = 1):
+    def record_stock_movement(self, company_id: int, branch_id: int, item_id: int, movement_type: int, quantity: Decimal, cost: Decimal = Decimal(0), movement_date: date = None, ref_no: str = None, created_by: int = 1, warehouse_id: int = None):
         with get_session() as db:
             if not movement_date:
                 movement_date = date.today()
@@ -386,6 +714,7 @@ class InventoryService:
                 company_id=company_id,
                 branch_id=branch_id,
                 item_id=item_id,
+                warehouse_id=warehouse_id,
                 movement_type=movement_type,
                 quantity=quantity,
                 cost=cost,
@@ -393,7 +722,13 @@ class InventoryService:
                 ref_no=ref_no,
                 created_by=created_by
             )
-            return StockMovementRepository(db).create_stock_movement(stock_movement)
+            db.add(stock_movement)
+            db.flush()
+            InventoryCostingService().apply_movement_in_transaction(db, stock_movement)
+            db.commit()
+            db.refresh(stock_movement)
+            publish_event(STOCK_MOVED, stock_movement_event_data(stock_movement))
+            return stock_movement
 
     def get_stock_movements_by_item(self, item_id: int):
         with get_session() as db:
@@ -401,6 +736,11 @@ class InventoryService:
 
     def get_item_stock_level(self, item_id: int, warehouse_id: int) -> float:
         with get_session() as db:
+            # Maintained incrementally by the costing engine
+            state = ItemCostRepository(db).get_state(item_id, warehouse_id or 0)
+            if state is not None:
+                return float(state.quantity_on_hand)
+
             # Calculate total 'in' movements (received items)
             total_in = db.query(func.sum(models.StockMovement.quantity)).filter(
                 models.StockMovement.item_id == item_id,
@@ -426,6 +766,397 @@ class InventoryService:
         with get_session() as db:
             return StockMovementRepository(db).delete_stock_movement(movement_id)
 
+    MOVEMENT_EXPORT_HEADERS = ['Date', 'Item Code', 'Item', 'Warehouse', 'Type', 'Quantity', 'Unit Cost', 'Reference']
+    MOVEMENT_TYPE_NAMES = {0: "In", 1: "Out", 2: "Transfer In", 3: "Transfer Out/Adjustment", 4: "Waste"}
+
+    @read_only
+    def export_stock_movements(self, file_path: str, date_from: date = None, date_to: date = None, company_id: int = None,
+                               headers: list = None, type_names: dict = None, progress=None, cancelled=None, **options) -> int:
+        """ Stream stock movements to CSV / XLSX / PDF (by file extension) from a server-side cursor """
+        type_names = type_names or self.MOVEMENT_TYPE_NAMES
+        with get_session() as db:
+            movement_repo = StockMovementRepository(db)
+            total = movement_repo.count_movements(date_from, date_to, company_id)
+            rows = ((r[0], r[1], r[2], r[3], type_names.get(r[4], r[4]), r[5], r[6], r[7])
+                    for r in movement_repo.stream_movements(date_from, date_to, company_id))
+            return export_rows(file_path, headers or self.MOVEMENT_EXPORT_HEADERS, rows, total, progress, cancelled, **options)
+
+class InventoryCostingService:
+    """ FIFO layers and moving average cost per (item, warehouse), updated on every stock movement """
+
+    def __init__(self):
+        pass
+
+    def apply_movement_in_transaction(self, db: Session, movement: models.StockMovement) -> Decimal:
+        """ Cost a flushed stock movement and update the item's costing state in the caller's transaction.
+        Sets movement.cost to the unit cost and returns the total cost (the COGS of an issue). """
+        repo = ItemCostRepository(db)
+        item = db.get(models.Item, movement.item_id)
+        warehouse_id = movement.warehouse_id or 0
+        state_row = repo.lock_state(movement.item_id, warehouse_id, movement.company_id)
+
+        if state_row.last_movement_date is None or movement.movement_date < state_row.last_movement_date:
+            # Backdated entry, or the pair's first costed movement (its history may predate the costing state):
+            # replay this pair from the last checkpoint before it
+            costs = dict(self._rebuild_pair(db, repo, item, warehouse_id, movement.movement_date, state_row))
+            unit_cost = costs.get(movement.id, movement.cost or Decimal(0))
+            movement.cost = unit_cost
+            return (unit_cost * movement.quantity).quantize(Decimal('0.001'))
+
+        state = self._load_state(repo, item, warehouse_id, state_row)
+        if state_row.last_movement_date and movement.movement_date > state_row.last_movement_date:
+            # First movement of a new day: the current state closes the previous one
+            self._maybe_checkpoint(repo, item.id, warehouse_id, state_row.last_movement_date, state)
+
+        unit_cost, total_cost = state.apply(movement.id, movement.movement_type, movement.movement_date,
+                                            movement.quantity, movement.cost)
+        movement.cost = unit_cost
+        repo.save_layers(item.id, warehouse_id, state.touched.values())
+        self._save_state(state_row, state, movement.movement_date)
+        return total_cost
+
+    def _load_state(self, repo: ItemCostRepository, item: models.Item, warehouse_id: int, state_row) -> CostState:
+        method = item.costing_method or FIFO
+        layers = []
+        if method != 1:
+            layers = [CostLayer(l.movement_id, l.layer_date, l.remaining_quantity, l.unit_cost, l.original_quantity)
+                      for l in repo.get_open_layers(item.id, warehouse_id)]
+        # Until the first receipt is costed, fall back to the item's standard cost
+        average_cost = state_row.average_cost or item.cost_price or Decimal(0)
+        return CostState(method, state_row.quantity_on_hand, state_row.total_value, average_cost, layers)
+
+    @staticmethod
+    def _save_state(state_row, state: CostState, movement_date: date):
+        state_row.quantity_on_hand = state.quantity
+        state_row.total_value = state.value
+        state_row.average_cost = state.average_cost
+        if state_row.last_movement_date is None or movement_date > state_row.last_movement_date:
+            state_row.last_movement_date = movement_date
+
+    @staticmethod
+    def _maybe_checkpoint(repo: ItemCostRepository, item_id: int, warehouse_id: int, checkpoint_date: date, state: CostState, latest_date: date = None):
+        if latest_date is None:
+            latest = repo.get_latest_checkpoint(item_id, warehouse_id)
+            latest_date = latest.checkpoint_date if latest else None
+        if latest_date is not None and (checkpoint_date - latest_date).days < CHECKPOINT_INTERVAL_DAYS:
+            return latest_date
+        repo.add_checkpoint(item_id, warehouse_id, checkpoint_date, state.quantity, state.value,
+                            state.average_cost, state.layers_to_json())
+        return checkpoint_date
+
+    def _rebuild_pair(self, db: Session, repo: ItemCostRepository, item: models.Item, warehouse_id: int, from_date: date, state_row) -> list:
+        """ Recompute an (item, warehouse) from the last checkpoint before from_date.
+        Only the movements after that checkpoint are read, so the work is bounded by the checkpoint interval. """
+        repo.delete_checkpoints_from(item.id, warehouse_id, from_date)
+        checkpoint = repo.get_latest_checkpoint(item.id, warehouse_id)
+        method = item.costing_method or FIFO
+        if checkpoint:
+            state = CostState(method, checkpoint.quantity_on_hand, checkpoint.total_value, checkpoint.average_cost,
+                              CostState.layers_from_json(checkpoint.open_layers) if method != 1 else ())
+            start_date = checkpoint.checkpoint_date
+        else:
+            state = CostState(method, average_cost=item.cost_price or Decimal(0))
+            start_date = None
+        repo.reset_layers_after(item.id, warehouse_id, start_date)
+        db.flush()
+
+        costs = []
+        last_date = None
+        checkpoint_date = start_date
+        for movement in repo.get_movements_after(item.id, warehouse_id, start_date):
+            if last_date is not None and movement.movement_date > last_date:
+                checkpoint_date = self._maybe_checkpoint(repo, item.id, warehouse_id, last_date, state, checkpoint_date)
+            unit_cost, _ = state.apply(movement.id, movement.movement_type, movement.movement_date,
+                                       movement.quantity, movement.cost)
+            if movement.movement_type not in INBOUND_MOVEMENT_TYPES or movement.cost != unit_cost:
+                costs.append((movement.id, unit_cost))
+            last_date = movement.movement_date
+
+        final_layers = dict(state.touched)
+        final_layers.update((layer.movement_id, layer) for layer in state.layers)
+        repo.save_layers(item.id, warehouse_id, final_layers.values())
+        repo.update_movement_costs(costs)
+        state_row.quantity_on_hand = state.quantity
+        state_row.total_value = state.value
+        state_row.average_cost = state.average_cost
+        state_row.last_movement_date = last_date or start_date
+        return costs
+
+    def rebuild_costs(self, company_id: int = None, item_ids: list = None, from_date: date = None, warehouse_id: int = None) -> int:
+        """ Bulk revaluation / backdated-entry repair: recompute every matching (item, warehouse)
+        from the last checkpoint before from_date (from the first movement when no date is given). """
+        with get_session() as db:
+            pairs = ItemCostRepository(db).get_movement_pairs(company_id, item_ids, warehouse_id)
+        return self._rebuild_pairs(pairs, from_date or date.min)
+
+    def ensure_cost_state(self) -> int:
+        """ Build the costing state of (item, warehouse) pairs moved before costing existed, so stock levels read from it are right """
+        with get_session() as db:
+            pairs = ItemCostRepository(db).get_uncosted_pairs()
+        return self._rebuild_pairs(pairs, date.min)
+
+    def _rebuild_pairs(self, pairs: list, from_date: date) -> int:
+        rebuilt = 0
+        for item_id, pair_warehouse_id in pairs:
+            # One transaction per pair keeps row locks short
+            with get_session() as db:
+                try:
+                    repo = ItemCostRepository(db)
+                    item = db.get(models.Item, item_id)
+                    state_row = repo.lock_state(item_id, pair_warehouse_id, item.company_id)
+                    self._rebuild_pair(db, repo, item, pair_warehouse_id, from_date, state_row)
+                    db.commit()
+                    rebuilt += 1
+                except Exception as e:
+                    db.rollback()
+                    print(f"Error rebuilding costs for item {item_id} in warehouse {pair_warehouse_id}: {e}")
+        return rebuilt
+
+    def get_issue_cost(self, item_id: int, warehouse_id: int, quantity: Decimal) -> Decimal:
+        """ COGS an issue of quantity would get now, from the costing state alone (no history scan) """
+        with get_session() as db:
+            repo = ItemCostRepository(db)
+            item = db.get(models.Item, item_id)
+            if item is None:
+                return Decimal(0)
+            state_row = repo.get_state(item_id, warehouse_id or 0)
+            if state_row is None:
+                return (Decimal(quantity) * (item.cost_price or Decimal(0))).quantize(Decimal('0.001'))
+            return self._load_state(repo, item, warehouse_id or 0, state_row).peek_issue_cost(Decimal(quantity))
+
+    def get_stock_position(self, item_id: int, warehouse_id: int) -> dict:
+        with get_session() as db:
+            state_row = ItemCostRepository(db).get_state(item_id, warehouse_id or 0)
+            if state_row is None:
+                return {'quantity_on_hand': Decimal(0), 'total_value': Decimal(0), 'average_cost': Decimal(0)}
+            return {
+                'quantity_on_hand': state_row.quantity_on_hand,
+                'total_value': state_row.total_value,
+                'average_cost': state_row.average_cost
+            }
+
+class MasterDataImportService:
+    """ Bulk import of items, customers, suppliers and opening stock from CSV / XLSX files.
+    Rows are validated and written in chunks, one transaction per chunk; invalid rows are reported, not fatal.
+    Writes are set-based, so each committed chunk is audited and published as one batch instead of per statement. """
+
+    def __init__(self):
+        pass
+
+    def _reference_data(self, company_id: int = None) -> ReferenceData:
+        with get_session() as db:
+            warehouses = db.query(models.Warehouse)
+            if company_id is not None:
+                warehouses = warehouses.filter(models.Warehouse.company_id == company_id)
+            return ReferenceData(UnitRepository(db).get_all_units(), warehouses.all(), CurrencyRepository(db).get_all_currencies())
+
+    @staticmethod
+    def _database_error(e: Exception) -> str:
+        return str(getattr(e, 'orig', None) or e).strip().splitlines()[0]
+
+    def _write_chunk(self, rows: list, write, result: ImportResult, company_id: int = None):
+        """ Write a validated chunk in one transaction. A chunk the database rejects is retried
+        row by row, so one bad row is reported instead of sinking the rest. """
+        with get_session() as db:
+            db.info['audit_statements'] = False # The chunk's batch entry below covers its statements
+            try:
+                inserted, updated, skipped, errors = write(db, rows)
+                batch = {'entity': result.entity, 'company_id': company_id, 'rows': len(rows), 'first_line': rows[0][0],
+                         'last_line': rows[-1][0], 'inserted': inserted, 'updated': updated, 'skipped': skipped}
+                audit_bulk_write(db, result.entity, 'import', batch)
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                if len(rows) == 1:
+                    result.add_error(rows[0][0], None, self._database_error(e))
+                    return
+                for row in rows:
+                    self._write_chunk([row], write, result, company_id)
+                return
+        publish_event(MASTER_DATA_IMPORTED, batch)
+        result.inserted += inserted
+        result.updated += updated
+        result.skipped += skipped
+        for line, field, message in errors:
+            result.add_error(line, field, message)
+
+    def _run(self, entity: str, file_path: str, validator: RowValidator, write, progress=None, cancelled=None, company_id: int = None) -> ImportResult:
+        result = ImportResult(entity)
+        for chunk in read_chunks(file_path):
+            if cancelled is not None and cancelled():
+                result.cancelled = True
+                break
+            if not validator.columns:
+                validator.bind(chunk[0][1].keys())
+            valid = []
+            for line, raw in chunk:
+                values, errors = validator.validate(raw)
+                for field, message in errors:
+                    result.add_error(line, field, message)
+                if not errors:
+                    valid.append((line, values))
+            result.processed += len(chunk)
+            if valid:
+                self._write_chunk(valid, write, result, company_id)
+            if progress is not None:
+                progress(result.processed, None)
+        return result
+
+    @staticmethod
+    def _upsert_master(db: Session, model, rows: list, extra: dict = None):
+        """ Rows with a code are upserted on it (a later row with the same code wins); rows without one get the next code """
+        repo = MasterDataImportRepository(db)
+        defaults = {c.key: c.default.arg for c in model.__table__.columns if c.default is not None and c.default.is_scalar}
+        by_code = {}
+        new_rows = []
+        skipped = 0
+        for line, values in rows:
+            values = dict(values, **(extra or {}))
+            for key, value in values.items():
+                if value is None and key in defaults:
+                    values[key] = defaults[key]
+            code = values.pop('code', None)
+            if code is None:
+                new_rows.append(values)
+                continue
+            if code in by_code:
+                skipped += 1
+            by_code[code] = (line, values)
+
+        upserted = repo.upsert_by_code(model, [dict(values, code=code) for code, (line, values) in by_code.items()])
+        errors = [(line, 'code', "هذا الرمز مستخدم في شركة أخرى.") for code, (line, values) in by_code.items() if code not in upserted]
+        inserted = repo.insert_rows(model, new_rows) + sum(1 for was_inserted in upserted.values() if was_inserted)
+        updated = sum(1 for was_inserted in upserted.values() if not was_inserted)
+        return inserted, updated, skipped, errors
+
+    def _sync_code_sequence(self, model, sequence_name: str):
+        with get_session() as db:
+            MasterDataImportRepository(db).sync_code_sequence(model, sequence_name)
+            db.commit()
+
+    def import_items(self, company_id: int, file_path: str, default_warehouse_id: int = None, progress=None, cancelled=None) -> ImportResult:
+        validator = RowValidator(item_fields(self._reference_data(company_id), default_warehouse_id))
+        result = self._run('item', file_path, validator,
+                           lambda db, rows: self._upsert_master(db, models.Item, rows, {'company_id': company_id}),
+                           progress, cancelled, company_id)
+        self._sync_code_sequence(models.Item, 'item_code_seq')
+        with get_session() as db:
+            ItemRepository(db).announce_reload(company_id)
+        return result
+
+    def import_customers(self, file_path: str, progress=None, cancelled=None) -> ImportResult:
+        result = self._run('customer', file_path, RowValidator(customer_fields()),
+                           lambda db, rows: self._upsert_master(db, models.Customer, rows), progress, cancelled)
+        self._sync_code_sequence(models.Customer, 'customer_code_seq')
+        return result
+
+    def import_suppliers(self, file_path: str, progress=None, cancelled=None) -> ImportResult:
+        result = self._run('supplier', file_path, RowValidator(supplier_fields()),
+                           lambda db, rows: self._upsert_master(db, models.Supplier, rows), progress, cancelled)
+        self._sync_code_sequence(models.Supplier, 'supplier_code_seq')
+        return result
+
+    def import_opening_stock(self, company_id: int, file_path: str, opening_date: date = None, ref_no: str = 'OPENING',
+                             created_by: int = 1, progress=None, cancelled=None) -> ImportResult:
+        """ Opening quantities as inbound stock movements (items referenced by code). Costs given in another
+        currency are converted to the warehouse's base currency. (item, warehouse) pairs without stock are
+        costed in bulk; pairs that already had movements are re-costed afterwards by the costing engine. """
+        opening_date = opening_date or date.today()
+        references = self._reference_data(company_id)
+        validator = RowValidator(opening_stock_fields(references, opening_date, ref_no))
+        recost = {}
+
+        def write(db, rows):
+            repo = MasterDataImportRepository(db)
+            items = repo.get_items_by_code(company_id, list({values['item_code'] for line, values in rows}))
+            movements = []
+            errors = []
+            for line, values in rows:
+                item = items.get(values['item_code'])
+                if item is None:
+                    errors.append((line, 'item_code', "الصنف غير موجود في هذه الشركة."))
+                    continue
+                item_id, item_warehouse_id, method, cost_price = item
+                warehouse = references.warehouses.get(values.get('warehouse_id') or item_warehouse_id)
+                if warehouse is None:
+                    errors.append((line, 'warehouse_id', "المستودع غير موجود في هذه الشركة"))
+                    continue
+                cost = values.get('cost')
+                if cost is None:
+                    cost = cost_price or Decimal(0)
+                elif values.get('currency_id'):
+                    cost = references.convert(cost, values['currency_id'], warehouse.base_currency_id)
+                movements.append({
+                    'company_id': company_id,
+                    'branch_id': warehouse.branch_id,
+                    'item_id': item_id,
+                    'warehouse_id': warehouse.id,
+                    'movement_type': 0,
+                    'quantity': values['quantity'],
+                    'cost': cost,
+                    'movement_date': values['movement_date'],
+                    'ref_no': values['ref_no'],
+                    'created_by': created_by
+                })
+            inserted = repo.insert_stock_movements(movements)
+            methods = {item_id: (method, cost_price) for item_id, warehouse_id, method, cost_price in items.values()}
+            for item_id, movement_date in self._cost_opening_movements(db, repo, company_id, methods, inserted):
+                recost[item_id] = min(movement_date, recost.get(item_id, movement_date))
+            return len(inserted), 0, 0, errors
+
+        result = self._run('opening_stock', file_path, validator, write, progress, cancelled, company_id)
+        if recost:
+            InventoryCostingService().rebuild_costs(company_id, sorted(recost), min(recost.values()))
+        return result
+
+    @staticmethod
+    def _cost_opening_movements(db: Session, repo: MasterDataImportRepository, company_id: int, methods: dict, movements: list) -> list:
+        """ Cost receipts into (item, warehouse) pairs that have no costing state yet with the costing engine
+        in memory, and write the states and layers in bulk. Returns (item_id, date) of the pairs that already
+        had a state and need a replay instead. """
+        existing = repo.get_existing_cost_pairs(list({(m.item_id, m.warehouse_id) for m in movements}))
+        states = {}
+        costs = []
+        recost = []
+        for movement in sorted(movements, key=lambda m: (m.movement_date, m.id)):
+            key = (movement.item_id, movement.warehouse_id)
+            if key in existing:
+                recost.append((movement.item_id, movement.movement_date))
+                continue
+            if key not in states:
+                method, cost_price = methods[movement.item_id]
+                states[key] = [CostState(method or FIFO, average_cost=cost_price or Decimal(0)), movement.movement_date]
+            state = states[key][0]
+            states[key][1] = movement.movement_date
+            unit_cost, _ = state.apply(movement.id, 0, movement.movement_date, movement.quantity, movement.cost)
+            if unit_cost != movement.cost:
+                costs.append((movement.id, unit_cost))
+
+        state_rows = []
+        layer_rows = []
+        for (item_id, warehouse_id), (state, last_date) in states.items():
+            state_rows.append({
+                'item_id': item_id,
+                'warehouse_id': warehouse_id,
+                'company_id': company_id,
+                'quantity_on_hand': state.quantity,
+                'total_value': state.value,
+                'average_cost': state.average_cost,
+                'last_movement_date': last_date
+            })
+            layer_rows.extend({
+                'movement_id': layer.movement_id,
+                'item_id': item_id,
+                'warehouse_id': warehouse_id,
+                'layer_date': layer.layer_date,
+                'original_quantity': layer.original,
+                'remaining_quantity': layer.remaining,
+                'unit_cost': layer.unit_cost
+            } for layer in state.layers)
+        repo.insert_cost_states(state_rows, layer_rows)
+        ItemCostRepository(db).update_movement_costs(costs)
+        return recost
+
 class SalesPurchaseService:
     def __init__(self):
         pass
@@ -439,7 +1170,24 @@ class SalesPurchaseService:
         with get_session() as db:
             return SalesOrderRepository(db).get_sales_order_by_id(order_id)
 
-    def create_sales_order(self, company_id: int, branch_id: int, customer_id: int, order_no: str, order_date: date, total_amount: Decimal, total_tax: Decimal, currency: str, created_by: int = 1):
+    @staticmethod
+    def _order_lines(line_model, lines_data: list) -> list:
+        """ Order lines from dicts with item_id, quantity, unit_price and optional discount_percentage, warehouse_id, memo """
+        lines = []
+        for line_data in lines_data or ():
+            line = line_model(
+                item_id=line_data['item_id'],
+                warehouse_id=line_data.get('warehouse_id'),
+                quantity=Decimal(line_data['quantity']),
+                unit_price=Decimal(line_data['unit_price']),
+                discount_percentage=Decimal(line_data.get('discount_percentage') or 0),
+                memo=line_data.get('memo')
+            )
+            line.total_line_amount = (net_unit_price(line) * line.quantity).quantize(Decimal('0.001'))
+            lines.append(line)
+        return lines
+
+    def create_sales_order(self, company_id: int, branch_id: int, customer_id: int, order_no: str, order_date: date, total_amount: Decimal, total_tax: Decimal, currency: str, created_by: int = 1, lines: list = None):
         with get_session() as db:
             sales_order = models.SalesOrder(
                 company_id=company_id,
@@ -451,7 +1199,8 @@ class SalesPurchaseService:
                 total_tax=total_tax,
                 currency=currency,
                 status=0, # Draft
-                created_by=created_by
+                created_by=created_by,
+                lines=self._order_lines(models.SalesOrderLine, lines)
             )
             return SalesOrderRepository(db).create_sales_order(sales_order)
 
@@ -472,7 +1221,7 @@ class SalesPurchaseService:
         with get_session() as db:
             return PurchaseOrderRepository(db).get_purchase_order_by_id(order_id)
 
-    def create_purchase_order(self, company_id: int, branch_id: int, supplier_id: int, order_no: str, order_date: date, total_amount: Decimal, total_tax: Decimal, currency: str, created_by: int = 1):
+    def create_purchase_order(self, company_id: int, branch_id: int, supplier_id: int, order_no: str, order_date: date, total_amount: Decimal, total_tax: Decimal, currency: str, created_by: int = 1, lines: list = None):
         with get_session() as db:
             purchase_order = models.PurchaseOrder(
                 company_id=company_id,
@@ -484,7 +1233,8 @@ class SalesPurchaseService:
                 total_tax=total_tax,
                 currency=currency,
                 status=0, # Draft
-                created_by=created_by
+                created_by=created_by,
+                lines=self._order_lines(models.PurchaseOrderLine, lines)
             )
             return PurchaseOrderRepository(db).create_purchase_order(purchase_order)
 
@@ -496,6 +1246,268 @@ class SalesPurchaseService:
         with get_session() as db:
             return PurchaseOrderRepository(db).delete_purchase_order(order_id)
 
+class OrderFulfilmentService:
+    """ Batch conversion of confirmed sales orders into sales invoices and purchase orders into
+    purchase invoices (goods receipts), with their stock movements and journal entries """
+
+    def __init__(self):
+        pass
+
+    def convert_sales_orders(self, order_ids: list = None, company_id: int = None, invoice_date: date = None, accounts: dict = None,
+                             created_by: int = 1, workers: int = 4, chunk_size: int = CHUNK_SIZE, progress=None, cancelled=None) -> ConversionReport:
+        """ Invoice and issue the given sales orders (all pending confirmed ones of the company by default).
+        accounts ('receivable', 'revenue', 'output_tax', optionally 'cogs' and 'inventory') enables posting. """
+        return self._convert(SALES_ORDER, order_ids, company_id, invoice_date, accounts, created_by, workers, chunk_size, progress, cancelled)
+
+    def convert_purchase_orders(self, order_ids: list = None, company_id: int = None, invoice_date: date = None, accounts: dict = None,
+                                created_by: int = 1, workers: int = 4, chunk_size: int = CHUNK_SIZE, progress=None, cancelled=None) -> ConversionReport:
+        """ Invoice and receive the given purchase orders (all pending confirmed ones of the company by default).
+        accounts ('inventory', 'input_tax', 'payable') enables posting. """
+        return self._convert(PURCHASE_ORDER, order_ids, company_id, invoice_date, accounts, created_by, workers, chunk_size, progress, cancelled)
+
+    def _convert(self, order_type: int, order_ids, company_id, invoice_date, accounts, created_by, workers, chunk_size, progress, cancelled) -> ConversionReport:
+        """ Orders are converted in chunks, one transaction each, on parallel workers. An order's
+        conversion record commits with its invoice, so rerunning after an interruption skips the
+        orders already done and picks up the rest. """
+        report = ConversionReport(order_type)
+        invoice_date = invoice_date or date.today()
+        if order_ids is None:
+            with get_session() as db:
+                order_ids = OrderConversionRepository(db).get_pending_order_ids(order_type, company_id)
+        chunks = list(chunked(list(dict.fromkeys(order_ids)), chunk_size))
+        if not chunks:
+            return report
+
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(chunks))), thread_name_prefix="fulfilment") as executor:
+            futures = [executor.submit(self._convert_chunk, order_type, chunk, invoice_date, accounts, created_by) for chunk in chunks]
+            for future in futures:
+                if report.cancelled and future.cancel():
+                    continue
+                for outcome in future.result():
+                    report.add(*outcome)
+                if progress is not None:
+                    progress(len(report.outcomes), len(order_ids))
+                if not report.cancelled and cancelled is not None and cancelled():
+                    report.cancelled = True # Chunks already running still finish and are reported
+        return report
+
+    def _convert_chunk(self, order_type: int, order_ids: list, invoice_date: date, accounts: dict, created_by: int) -> list:
+        """ Convert a chunk in one transaction. A chunk the database rejects is retried order by
+        order, so one bad order is reported instead of sinking the rest. """
+        with get_session() as db:
+            try:
+                outcomes = self._write_orders(db, order_type, order_ids, invoice_date, accounts, created_by)
+                db.commit()
+                return outcomes
+            except Exception as e:
+                db.rollback()
+                if len(order_ids) == 1:
+                    return [(order_ids[0], None, FAILED, None, MasterDataImportService._database_error(e))]
+        return [outcome for order_id in order_ids for outcome in self._convert_chunk(order_type, [order_id], invoice_date, accounts, created_by)]
+
+    def _write_orders(self, db: Session, order_type: int, order_ids: list, invoice_date: date, accounts: dict, created_by: int) -> list:
+        conversion = SALES_CONVERSION if order_type == SALES_ORDER else PURCHASE_CONVERSION
+        party_column = 'customer_id' if order_type == SALES_ORDER else 'supplier_id'
+        repo = OrderConversionRepository(db)
+        orders = {order.id: order for order in repo.get_orders(order_type, order_ids)} # Locks the orders first
+        converted = repo.get_converted(order_type, order_ids)
+        closed_periods = get_closed_period_map()
+        exchange_rates = get_exchange_rates()
+
+        outcomes = []
+        valid = []
+        for order_id in order_ids:
+            order = orders.get(order_id)
+            if order is None:
+                outcomes.append((order_id, None, FAILED, None, "الطلب غير موجود."))
+            elif order_id in converted:
+                outcomes.append((order_id, order.order_no, SKIPPED, converted[order_id], None))
+            elif order.status != 1:
+                outcomes.append((order_id, order.order_no, FAILED, None, "الطلب غير مؤكد."))
+            elif not order.lines:
+                outcomes.append((order_id, order.order_no, FAILED, None, "الطلب لا يحتوي على أصناف."))
+            elif not order.company_id or not order.branch_id:
+                outcomes.append((order_id, order.order_no, FAILED, None, "الشركة والفرع مطلوبان للفاتورة."))
+            elif closed_periods.is_closed(order.company_id, invoice_date):
+                outcomes.append((order_id, order.order_no, FAILED, None, "تاريخ الفاتورة ضمن فترة مالية مغلقة."))
+            else:
+                valid.append(order)
+        if not valid:
+            return outcomes
+
+        invoice_nos = {order.id: f"{conversion['prefix']}-{order.order_no}" for order in valid}
+        fx_rates = {order.id: exchange_rates.base_rate(order.company_id, order.currency, invoice_date) for order in valid}
+        invoice_ids = repo.insert_invoices([{
+            'company_id': order.company_id, 'branch_id': order.branch_id, party_column: getattr(order, party_column),
+            'invoice_type': conversion['invoice_type'], 'invoice_no': invoice_nos[order.id], 'invoice_date': invoice_date,
+            'total_amount': order.total_amount or 0, 'total_tax': order.total_tax or 0, 'amount_paid': 0,
+            'balance_due': order.total_amount or 0, 'currency': order.currency, 'fx_rate': fx_rates[order.id],
+            'status': 1, 'created_by': created_by # 1: Issued
+        } for order in valid])
+
+        invoice_lines = []
+        movements = []
+        for order in valid:
+            invoice_no = invoice_nos[order.id]
+            for line in order.lines:
+                invoice_lines.append({'invoice_id': invoice_ids[invoice_no], 'item_id': line.item_id, 'quantity': line.quantity,
+                                      'unit_price': line.unit_price, 'discount_percentage': line.discount_percentage or 0,
+                                      'total_line_amount': line.total_line_amount, 'memo': line.memo})
+                # Receipts carry their cost; issues are costed by the costing engine
+                unit_cost = to_base(net_unit_price(line), fx_rates[order.id]) if order_type == PURCHASE_ORDER else Decimal(0)
+                movements.append({'company_id': order.company_id, 'branch_id': order.branch_id, 'item_id': line.item_id,
+                                  'warehouse_id': line.warehouse_id, 'movement_type': conversion['movement_type'],
+                                  'quantity': line.quantity, 'cost': unit_cost, 'movement_date': invoice_date,
+                                  'ref_no': invoice_no, 'created_by': created_by})
+        repo.insert_many(models.InvoiceLine, invoice_lines)
+
+        # Costing state rows are locked in (item, warehouse) order, so parallel chunks cannot deadlock
+        inserted = MasterDataImportRepository(db).insert_stock_movements(movements)
+        costing = InventoryCostingService()
+        cost_by_invoice = {}
+        for movement in repo.get_movements([row.id for row in inserted]):
+            total_cost = costing.apply_movement_in_transaction(db, movement)
+            cost_by_invoice[movement.ref_no] = cost_by_invoice.get(movement.ref_no, Decimal(0)) + (total_cost or Decimal(0))
+        db.flush()
+
+        entry_ids = {}
+        if accounts:
+            entry_ids = repo.insert_journal_entries([{
+                'company_id': order.company_id, 'branch_id': order.branch_id, 'date': invoice_date,
+                'period': invoice_date.strftime('%Y-%m'), 'ref_no': invoice_nos[order.id], 'created_by': created_by,
+                'status': 2, 'posted_by': created_by, 'posted_at': datetime.now() # 2: Posted
+            } for order in valid])
+            journal_lines = []
+            for order in valid:
+                invoice_no = invoice_nos[order.id]
+                currency = exchange_rates.base_currency(order.company_id) or order.currency
+                lines = posting_lines(order_type, accounts, to_base(order.total_amount, fx_rates[order.id]),
+                                      to_base(order.total_tax, fx_rates[order.id]), cost_by_invoice.get(invoice_no, Decimal(0)),
+                                      currency, f"{invoice_no} / {order.order_no}")
+                journal_lines.extend(dict(line, entry_id=entry_ids[invoice_no], entry_date=invoice_date) for line in lines)
+            repo.insert_many(models.JournalLine, journal_lines)
+
+        # Draft tax reports of the invoice date's period, one update per branch
+        tax_deltas = {}
+        for order in valid:
+            output_delta, input_delta = get_tax_engine().tax_delta(conversion['invoice_type'], order.total_tax)
+            output_total, input_total = tax_deltas.get((order.company_id, order.branch_id), (Decimal(0), Decimal(0)))
+            tax_deltas[(order.company_id, order.branch_id)] = (output_total + output_delta, input_total + input_delta)
+        tax_service = TaxService()
+        for (company_id, branch_id), (output_delta, input_delta) in sorted(tax_deltas.items()):
+            tax_service.apply_tax_delta_in_transaction(db, company_id, branch_id, invoice_date, output_delta, input_delta)
+
+        if order_type == SALES_ORDER:
+            # Open orders become open receivables; customers in a fixed order, like the costing locks
+            deltas = {}
+            for order in valid:
+                open_ar, open_orders = deltas.get(order.customer_id, (Decimal(0), Decimal(0)))
+                deltas[order.customer_id] = (open_ar + (order.total_amount or 0), open_orders - (order.total_amount or 0))
+            exposure_repo = CustomerExposureRepository(db)
+            for customer_id in sorted(deltas):
+                exposure_repo.adjust(customer_id, open_ar=deltas[customer_id][0], open_orders=deltas[customer_id][1])
+
+        repo.set_order_status(order_type, [order.id for order in valid], conversion['status'])
+        repo.insert_many(models.OrderConversion, [{
+            'order_type': order_type, 'order_id': order.id, 'invoice_id': invoice_ids[invoice_nos[order.id]],
+            'journal_entry_id': entry_ids.get(invoice_nos[order.id]), 'converted_by': created_by
+        } for order in valid])
+        outcomes.extend((order.id, order.order_no, CONVERTED, invoice_ids[invoice_nos[order.id]], None) for order in valid)
+        return outcomes
+
+class ReplenishmentService:
+    """ Demand-driven purchase suggestions per (item, warehouse) from the outbound stock history """
+
+    def __init__(self):
+        pass
+
+    @read_only
+    def plan(self, company_id: int = None, as_of: date = None, history_weeks: int = 156, service_level: float = 0.95,
+             lead_time_days: int = 14, review_days: int = 7, seasonal: bool = True) -> dict:
+        """ Forecast weekly demand, safety stock and reorder point of every (item, warehouse) in one
+        vectorized pass and suggest order quantities where the stock position (on hand plus open
+        purchase orders) has reached the reorder point. Suggestions are grouped into purchase order
+        drafts per (supplier, company, branch); the supplier is the one of the item's last purchase
+        invoice, items never purchased are returned under 'unassigned'. """
+        # NumPy is only needed by the planner, the rest of the application runs without it
+        import numpy as np
+        from app.application.replenishment_engine import PlanParameters, demand_matrix, plan_pairs, lookup
+
+        as_of = as_of or date.today()
+        parameters = PlanParameters(history_weeks=history_weeks, service_level=service_level, lead_time_days=lead_time_days,
+                                    review_days=review_days, seasonal=seasonal)
+        with get_session() as db:
+            repository = ReplenishmentRepository(db)
+            items = {row.id: row for row in repository.get_items(company_id)}
+            # Items with a static reorder level are checked even without sales history
+            static_pairs = np.array([(item.id, item.warehouse_id or 0) for item in items.values() if item.reorder_level],
+                                    dtype=np.int64).reshape(-1, 2)
+            item_ids, warehouse_ids, demand = demand_matrix(
+                repository.stream_weekly_demand(parameters.history_start(as_of), as_of, company_id), history_weeks, static_pairs)
+            on_hand = lookup(item_ids, warehouse_ids, repository.get_on_hand(company_id))
+            on_order = lookup(item_ids, warehouse_ids, repository.get_on_order(company_id))
+            suppliers = repository.get_last_suppliers(company_id)
+            branches = repository.get_warehouse_branches()
+
+        active = np.fromiter((item_id in items for item_id in item_ids.tolist()), dtype=bool, count=len(item_ids))
+        static_reorder = np.fromiter((float(items[item_id].reorder_level or 0) if item_id in items else 0.0 for item_id in item_ids.tolist()),
+                                     dtype=np.float64, count=len(item_ids))
+        result = plan_pairs(demand, on_hand, on_order, static_reorder, parameters)
+
+        suggestions, unassigned, drafts = [], [], {}
+        for index in np.flatnonzero((result['suggested'] > 0) & active).tolist():
+            item = items[int(item_ids[index])]
+            warehouse_id = int(warehouse_ids[index]) or None # 0: movements without a warehouse
+            supplier_id = suppliers.get(item.id)
+            quantity = Decimal(int(result['suggested'][index]))
+            unit_price = Decimal(item.cost_price or 0)
+            suggestion = {
+                'item_id': item.id,
+                'warehouse_id': warehouse_id,
+                'supplier_id': supplier_id,
+                'weekly_forecast': round(float(result['forecast'][index]), 3),
+                'seasonal_factor': round(float(result['seasonal_factor'][index]), 3),
+                'safety_stock': round(float(result['safety_stock'][index]), 3),
+                'reorder_point': round(float(result['reorder_point'][index]), 3),
+                'on_hand': float(on_hand[index]),
+                'on_order': float(on_order[index]),
+                'quantity': quantity,
+                'unit_price': unit_price
+            }
+            suggestions.append(suggestion)
+            if supplier_id is None:
+                unassigned.append(suggestion)
+                continue
+            key = (supplier_id, item.company_id, branches.get(warehouse_id or item.warehouse_id))
+            draft = drafts.setdefault(key, {'supplier_id': key[0], 'company_id': key[1], 'branch_id': key[2], 'lines': [], 'total_amount': Decimal(0)})
+            draft['lines'].append({'item_id': item.id, 'warehouse_id': warehouse_id, 'quantity': quantity, 'unit_price': unit_price,
+                                   'memo': "Replenishment suggestion"})
+            draft['total_amount'] += (quantity * unit_price).quantize(Decimal('0.001'))
+        return {'as_of': as_of, 'pairs': len(item_ids), 'suggestions': suggestions, 'drafts': list(drafts.values()), 'unassigned': unassigned}
+
+    def create_purchase_order_drafts(self, plan: dict, order_date: date = None, created_by: int = 1) -> list:
+        """ Save the drafts of a plan as draft purchase orders in the company base currency. Drafts count
+        as open orders in the next plan, so rerunning the planner does not order the same shortfall twice. """
+        order_date = order_date or date.today()
+        stamp = datetime.now().strftime('%Y%m%d%H%M%S')
+        exchange_rates = get_exchange_rates()
+        sales_purchase_service = SalesPurchaseService()
+        orders = []
+        for draft in plan['drafts']:
+            orders.append(sales_purchase_service.create_purchase_order(
+                company_id=draft['company_id'],
+                branch_id=draft['branch_id'],
+                supplier_id=draft['supplier_id'],
+                order_no=f"RP-{stamp}-{draft['company_id']}-{draft['branch_id']}-{draft['supplier_id']}",
+                order_date=order_date,
+                total_amount=draft['total_amount'],
+                total_tax=Decimal(0),
+                currency=exchange_rates.base_currency(draft['company_id']) or 'USD',
+                created_by=created_by,
+                lines=draft['lines']
+            ))
+        return orders
+
 class CashBankService:
     def __init__(self):
         pass
@@ -566,39 +1578,132 @@ class CashBankService:
         with get_session() as db:
             return BankReconciliationRepository(db).delete_reconciliation(reconciliation_id)
 
-    def get_all_cash_bank_entries(self):
-        with get_session() as db:
-            transactions = BankTransactionRepository(db).get_all_bank_transactions()
-            reconciliations = BankReconciliationRepository(db).get_all_bank_reconciliations()
-
-            combined_entries = []
-            for t in transactions:
-                combined_entries.append({
-                    "id": t.id,
-                    "company_id": t.company_id,
-                    "branch_id": t.branch_id,
-                    "account_id": t.bank_account_id,
-                    "type": "Transaction",
-                    "amount": t.amount,
-                    "date": t.transaction_date,
-                    "description": t.description,
-                    "ref_no": t.ref_no
-                })
-            for r in reconciliations:
-                combined_entries.append({
-                    "id": r.id,
-                    "company_id": r.company_id,
-                    "branch_id": r.branch_id,
-                    "account_id": r.bank_account_id,
-                    "type": "Reconciliation",
-                    "amount": r.statement_balance, # Or difference, depending on what's desired
-                    "date": r.reconciliation_date,
-                    "description": "Bank Reconciliation",
-                    "ref_no": None
-                })
-            # Sort by date, most recent first
-            combined_entries.sort(key=lambda x: x['date'], reverse=True)
-            return combined_entries
+    def import_bank_statement(self, company_id: int, bank_account_id: int, file_path: str, file_format: str = None, batch_size: int = 5000, **parser_options) -> int:
+        """ Streams a CSV/MT940/CAMT.053 statement into bank_statement_line in batches. Returns the number of new lines;
+        lines already imported for the account (e.g. from an overlapping statement) are skipped. """
+        with get_session() as db:
+            line_repo = BankStatementLineRepository(db)
+            batch = []
+            imported = 0
+            try:
+                for line in with_line_hashes(parse_statement(file_path, file_format, **parser_options)):
+                    line.update(company_id=company_id, bank_account_id=bank_account_id, source_file=file_path, is_matched=False)
+                    batch.append(line)
+                    if len(batch) >= batch_size:
+                        imported += line_repo.bulk_create_lines(batch)
+                        batch = []
+                imported += line_repo.bulk_create_lines(batch)
+                db.commit()
+                return imported
+            except Exception as e:
+                db.rollback()
+                raise ValueError(f"فشل استيراد كشف الحساب البنكي: {e}")
+
+    def auto_reconcile(self, company_id: int, bank_account_id: int, reconciliation_date: date, branch_id: int = None, statement_balance: Decimal = None, date_window_days: int = 3, created_by: int = 1):
+        """ Matches imported statement lines against unreconciled book transactions and records the reconciliation. """
+        with get_session() as db:
+            line_repo = BankStatementLineRepository(db)
+            transaction_repo = BankTransactionRepository(db)
+            reconciliation_repo = BankReconciliationRepository(db)
+
+            statement_lines = [MatchEntry(r.id, r.amount, r.statement_date, r.ref_no)
+                               for r in line_repo.get_unmatched_lines(bank_account_id, reconciliation_date)]
+            book_entries = [MatchEntry(r.id, signed_book_amount(r.transaction_type, r.amount), r.transaction_date, r.ref_no)
+                            for r in transaction_repo.get_unreconciled_transactions(bank_account_id, reconciliation_date)]
+
+            matches = ReconciliationMatcher(date_window_days).match(statement_lines, book_entries)
+
+            # Without a balance from the bank, the imported lines are taken as the full statement history
+            if statement_balance is None:
+                statement_balance = line_repo.get_statement_total(bank_account_id, reconciliation_date)
+            book_balance = transaction_repo.get_book_balance(bank_account_id, reconciliation_date)
+            difference = statement_balance - book_balance
+            matched_line_ids = [line_id for _, line_ids, _ in matches for line_id in line_ids]
+            matched_transaction_ids = [txn_id for _, _, txn_ids in matches for txn_id in txn_ids]
+
+            try:
+                reconciliation = models.BankReconciliation(
+                    company_id=company_id,
+                    branch_id=branch_id,
+                    bank_account_id=bank_account_id,
+                    reconciliation_date=reconciliation_date,
+                    statement_balance=statement_balance,
+                    book_balance=book_balance,
+                    difference=difference,
+                    is_reconciled=(difference == 0 and len(matched_line_ids) == len(statement_lines)),
+                    created_by=created_by
+                )
+                db.add(reconciliation)
+                db.flush()
+
+                match_rows = []
+                for group, (rule, line_ids, txn_ids) in enumerate(matches, start=1):
+                    for line_id in line_ids:
+                        match_rows.append({"reconciliation_id": reconciliation.id, "match_group": group, "statement_line_id": line_id, "bank_transaction_id": None, "match_rule": rule})
+                    for txn_id in txn_ids:
+                        match_rows.append({"reconciliation_id": reconciliation.id, "match_group": group, "statement_line_id": None, "bank_transaction_id": txn_id, "match_rule": rule})
+                reconciliation_repo.bulk_create_matches(match_rows)
+                transaction_repo.mark_reconciled(matched_transaction_ids, reconciliation.id)
+                line_repo.mark_matched(matched_line_ids, reconciliation.id)
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                raise ValueError(f"فشلت المطابقة البنكية: {e}")
+
+            rules = {}
+            for rule, _, _ in matches:
+                rules[rule] = rules.get(rule, 0) + 1
+            return {
+                "reconciliation_id": reconciliation.id,
+                "statement_lines": len(statement_lines),
+                "book_transactions": len(book_entries),
+                "matched_lines": len(matched_line_ids),
+                "matched_transactions": len(matched_transaction_ids),
+                "unmatched_lines": len(statement_lines) - len(matched_line_ids),
+                "unmatched_transactions": len(book_entries) - len(matched_transaction_ids),
+                "matches_by_rule": rules,
+                "statement_balance": statement_balance,
+                "book_balance": book_balance,
+                "difference": difference
+            }
+
+    def get_all_cash_bank_entries(self, company_id: int = None, bank_account_id: int = None, date_from: date = None, date_to: date = None,
+                                  after: tuple = None, limit: int = 100) -> dict:
+        """ One page of transactions and reconciliations, most recent first, with a running balance per account.
+        Pass the previous page's 'next' as after for the next page. """
+        with get_session() as db:
+            rows = BankTransactionRepository(db).get_activity_feed(company_id, bank_account_id, date_from, date_to, after, limit)
+        entries = []
+        for row in rows:
+            entries.append({
+                "id": row.id,
+                "company_id": row.company_id,
+                "branch_id": row.branch_id,
+                "company_name": row.company_name,
+                "branch_name": row.branch_name,
+                "account_id": row.account_id,
+                "type": row.entry_type,
+                "amount": row.amount,
+                "date": row.entry_date,
+                "description": row.description,
+                "ref_no": row.ref_no,
+                "running_balance": row.running_balance,
+                "cursor": (row.entry_date, row.entry_type, row.id)
+            })
+        return {
+            "entries": entries,
+            "next": entries[-1]["cursor"] if len(entries) == limit else None
+        }
+
+    def ensure_balance_snapshots(self) -> int:
+        """ Write the month snapshots of bank accounts that have transactions but none yet, which the activity feed's balances start from """
+        with get_session() as db:
+            repo = BankTransactionRepository(db)
+            accounts = repo.get_unsnapshotted_accounts()
+            for bank_account_id in accounts:
+                repo.write_balance_snapshots(bank_account_id)
+            db.commit()
+            return len(accounts)
 
 class FixedAssetService:
     def __init__(self):
@@ -684,15 +1789,23 @@ class TaxService:
                 is_active=is_active,
                 created_by=created_by
             )
-            return TaxSettingRepository(db).create_tax_setting(tax_setting)
+            tax_setting = TaxSettingRepository(db).create_tax_setting(tax_setting)
+            ItemRepository(db).announce_reload(tax_setting.company_id) # Item catalogs carry the default tax rate
+            return tax_setting
 
     def update_tax_setting(self, setting_id: int, **kwargs):
         with get_session() as db:
-            return TaxSettingRepository(db).update_tax_setting(setting_id, kwargs)
+            tax_setting = TaxSettingRepository(db).update_tax_setting(setting_id, kwargs)
+            if tax_setting:
+                ItemRepository(db).announce_reload(tax_setting.company_id)
+            return tax_setting
 
     def delete_tax_setting(self, setting_id: int):
         with get_session() as db:
-            return TaxSettingRepository(db).delete_tax_setting(setting_id)
+            tax_setting = TaxSettingRepository(db).delete_tax_setting(setting_id)
+            if tax_setting:
+                ItemRepository(db).announce_reload(tax_setting.company_id)
+            return tax_setting
 
     # Tax Report Operations (simplified for now)
     def get_all_tax_reports(self):
@@ -703,8 +1816,14 @@ class TaxService:
         with get_session() as db:
             return TaxReportRepository(db).get_tax_report_by_id(report_id)
 
-    def create_tax_report(self, company_id: int, branch_id: int, tax_setting_id: int, report_period: str, start_date: date, end_date: date, total_sales_tax: Decimal, total_purchase_tax: Decimal, created_by: int = 1):
+    def create_tax_report(self, company_id: int, branch_id: int, tax_setting_id: int, report_period: str, start_date: date, end_date: date, total_sales_tax: Decimal = None, total_purchase_tax: Decimal = None, created_by: int = 1):
         with get_session() as db:
+            if total_sales_tax is None or total_purchase_tax is None:
+                totals = get_tax_engine().aggregate(db, company_id, start_date, end_date, branch_id).get(tax_setting_id)
+                if total_sales_tax is None:
+                    total_sales_tax = totals.output_tax if totals else Decimal(0)
+                if total_purchase_tax is None:
+                    total_purchase_tax = totals.input_tax if totals else Decimal(0)
             net_tax_payable = total_sales_tax - total_purchase_tax
             tax_report = models.TaxReport(
                 company_id=company_id,
@@ -721,6 +1840,66 @@ class TaxService:
             )
             return TaxReportRepository(db).create_tax_report(tax_report)
 
+    def compute_tax_totals(self, company_id: int, start_date: date, end_date: date, branch_id: int = None):
+        """ Output and input tax per tax setting over a date range """
+        with get_session() as db:
+            totals = get_tax_engine().aggregate(db, company_id, start_date, end_date, branch_id)
+            return [t.as_dict() for t in totals.values()]
+
+    def generate_tax_reports(self, company_id: int, report_period: str, branch_id: int = None, created_by: int = 1):
+        """ Create or refresh the draft tax reports of a period from the invoices. Submitted reports are left as they are. """
+        start_date, end_date = period_bounds(report_period)
+        with get_session() as db:
+            tax_report_repo = TaxReportRepository(db)
+            totals = get_tax_engine().aggregate(db, company_id, start_date, end_date, branch_id)
+            existing = {r.tax_setting_id: r for r in tax_report_repo.get_reports_for_period(company_id, report_period, branch_id)}
+            reports = []
+            for tax_setting_id, total in totals.items():
+                report = existing.get(tax_setting_id)
+                if report is None:
+                    report = models.TaxReport(
+                        company_id=company_id,
+                        branch_id=branch_id,
+                        tax_setting_id=tax_setting_id,
+                        report_period=report_period,
+                        start_date=start_date,
+                        end_date=end_date,
+                        status=0, # Draft
+                        created_by=created_by
+                    )
+                    db.add(report)
+                elif report.status != 0:
+                    reports.append(report)
+                    continue
+                report.total_sales_tax = total.output_tax
+                report.total_purchase_tax = total.input_tax
+                report.net_tax_payable = total.net_tax_payable
+                reports.append(report)
+            db.commit()
+            for report in reports:
+                db.refresh(report)
+            return reports
+
+    def apply_invoice_in_transaction(self, db: Session, invoice: models.Invoice):
+        """ Add a new invoice's tax to the draft reports of its period (e.g. a late invoice). Runs in the caller's transaction. """
+        output_delta, input_delta = get_tax_engine().invoice_tax_delta(invoice)
+        return self.apply_tax_delta_in_transaction(db, invoice.company_id, invoice.branch_id, invoice.invoice_date,
+                                                   output_delta, input_delta, invoice.tax_setting_id)
+
+    def apply_tax_delta_in_transaction(self, db: Session, company_id: int, branch_id: int, invoice_date: date,
+                                       output_delta: Decimal, input_delta: Decimal, tax_setting_id: int = None):
+        """ Add (output, input) tax of invoices dated invoice_date to the draft reports of its period, e.g. the
+        summed tax of a batch of invoices of one branch. Runs in the caller's transaction. """
+        get_tax_engine().invalidate(company_id, invoice_date)
+        if not output_delta and not input_delta:
+            return 0
+        tax_setting_id = tax_setting_id or TaxSettingRepository(db).get_default_tax_setting_id(company_id)
+        if tax_setting_id is None:
+            return 0
+        return TaxReportRepository(db).apply_invoice_tax_delta(
+            company_id, branch_id, tax_setting_id, invoice_date, output_delta, input_delta
+        )
+
     def update_tax_report(self, report_id: int, **kwargs):
         with get_session() as db:
             return TaxReportRepository(db).update_tax_report(report_id, kwargs)
@@ -889,6 +2068,7 @@ class CompanyService:
                     created_by=created_by
                 )
                 new_company = CompanyRepository(db).create_company(company)
+                get_exchange_rates().invalidate() # Base currency of the new company
 
                 # Removed default branch creation here. It will be handled in SetupWizard.
 
@@ -911,7 +2091,10 @@ class CompanyService:
                 kwargs['base_currency_id'] = kwargs.pop('base_currency')
             if 'secondary_currency' in kwargs:
                 kwargs['secondary_currency_id'] = kwargs.pop('secondary_currency')
-            return CompanyRepository(db).update_company(company_id, kwargs)
+            company = CompanyRepository(db).update_company(company_id, kwargs)
+            if 'base_currency_id' in kwargs:
+                get_exchange_rates().invalidate()
+            return company
 
     def update_company_loyalty_status(self, company_id: int, is_enabled: bool):
         """ Updates the loyalty program enabled status for a company. """
@@ -1009,19 +2192,89 @@ class FiscalPeriodService:
                 is_open=is_open,
                 created_by=created_by
             )
-            return FiscalPeriodRepository(db).create_fiscal_period(fiscal_period)
+            fiscal_period = FiscalPeriodRepository(db).create_fiscal_period(fiscal_period)
+            get_closed_period_map().invalidate()
+            return fiscal_period
 
     def update_fiscal_period(self, period_id: int, **kwargs):
-        with get_session() as db:
-            return FiscalPeriodRepository(db).update_fiscal_period(period_id, kwargs)
+        if 'is_open' in kwargs:
+            raise ValueError("استخدم إقفال الفترة أو إعادة فتحها لتغيير حالتها.")
+        with get_session() as db:
+            fiscal_period = FiscalPeriodRepository(db).update_fiscal_period(period_id, kwargs)
+            get_closed_period_map().invalidate()
+            return fiscal_period
+
+    def close_fiscal_period(self, period_id: int, retained_earnings_account_id: int = None, closed_by: int = 1) -> dict:
+        """ Close a fiscal period: validate its entries, post the year-end closing entries when
+        retained_earnings_account_id is given, and snapshot closing balances per account and branch.
+        Periods close in date order, so each snapshot builds on the previous one. """
+        with get_session() as db:
+            period_repo = FiscalPeriodRepository(db)
+            close_repo = PeriodCloseRepository(db)
+            period = period_repo.get_fiscal_period_by_id(period_id)
+            if not period:
+                raise ValueError("الفترة المالية غير موجودة.")
+            if not period.is_open:
+                raise ValueError("الفترة المالية مغلقة بالفعل.")
+            if close_repo.has_open_period_before(period.company_id, period.start_date):
+                raise ValueError("يجب إقفال الفترات المالية السابقة أولاً.")
+            unposted = close_repo.count_unposted_entries(period.company_id, period.start_date, period.end_date)
+            if unposted:
+                raise ValueError(f"يوجد {unposted} قيد غير مرحل في هذه الفترة.")
+            unbalanced = close_repo.get_unbalanced_entries(period.company_id, period.start_date, period.end_date)
+            if unbalanced:
+                raise ValueError(f"القيود التالية غير متوازنة: {', '.join(str(row.ref_no or row.id) for row in unbalanced)}")
 
-    def close_fiscal_period(self, period_id: int):
-        with get_session() as db:
-            return FiscalPeriodRepository(db).update_fiscal_period(period_id, {'is_open': False})
+            try:
+                closing_entries = 0
+                if retained_earnings_account_id:
+                    currency = get_exchange_rates().base_currency(period.company_id) or 'USD'
+                    balances = close_repo.get_income_balances(period.company_id, period.start_date, period.end_date)
+                    entries = closing_lines(balances, retained_earnings_account_id, currency)
+                    closing_entries = close_repo.insert_closing_entries(period.company_id, period.end_date, self._closing_ref(period),
+                                                                        closed_by, entries)
+                previous = close_repo.get_latest_snapshot_date(period.company_id, period.start_date - timedelta(days=1))
+                snapshot_rows = close_repo.write_snapshot(period.company_id, period.id, period.end_date, previous)
+                period.is_open = False
+                message = period_repo.queue_change(period.company_id)
+                db.commit()
+            except Exception:
+                db.rollback()
+                raise
+            get_closed_period_map().invalidate()
+            period_repo.announce(message)
+            return {'period_id': period.id, 'closing_entries': closing_entries, 'snapshot_rows': snapshot_rows}
+
+    def reopen_fiscal_period(self, period_id: int):
+        """ Reopen the latest closed period: drop its snapshot and year-end closing entries """
+        with get_session() as db:
+            period_repo = FiscalPeriodRepository(db)
+            close_repo = PeriodCloseRepository(db)
+            period = period_repo.get_fiscal_period_by_id(period_id)
+            if not period:
+                raise ValueError("الفترة المالية غير موجودة.")
+            if period.is_open:
+                return period
+            if close_repo.has_closed_period_after(period.company_id, period.end_date):
+                raise ValueError("يجب إعادة فتح الفترات المالية اللاحقة أولاً.")
+            close_repo.delete_snapshots(period.company_id, period.end_date)
+            close_repo.delete_entries_by_ref(period.company_id, self._closing_ref(period))
+            period.is_open = True
+            message = period_repo.queue_change(period.company_id)
+            db.commit()
+            get_closed_period_map().invalidate()
+            period_repo.announce(message)
+            return period
+
+    @staticmethod
+    def _closing_ref(period) -> str:
+        return f"{CLOSING_REF_PREFIX}{period.year}-{period.id}"
 
     def delete_fiscal_period(self, period_id: int):
         with get_session() as db:
-            return FiscalPeriodRepository(db).delete_fiscal_period(period_id)
+            fiscal_period = FiscalPeriodRepository(db).delete_fiscal_period(period_id)
+            get_closed_period_map().invalidate()
+            return fiscal_period
 
 class CostCenterProjectService:
     def __init__(self):
@@ -1214,6 +2467,41 @@ class NotificationsWorkflowsService:
         with get_session() as db:
             return NotificationRepository(db).update_notification(notification_id, kwargs)
 
+    def get_user_notifications(self, user_id: int = None, is_read: bool = None, after: tuple = None, limit: int = 50):
+        """One page of a user's notifications (all users when user_id is None), newest first"""
+        with get_session() as db:
+            return NotificationRepository(db).get_user_notifications(user_id, is_read, after, limit)
+
+    def get_unread_count(self, user_id: int) -> int:
+        with get_session() as db:
+            return NotificationRepository(db).get_unread_count(user_id)
+
+    def mark_notification_as_read(self, notification_id: int):
+        with get_session() as db:
+            notification_repo = NotificationRepository(db)
+            notification = notification_repo.get_notification_by_id(notification_id)
+            if not notification:
+                return 0
+            return notification_repo.mark_read(notification.user_id, [notification_id])
+
+    def mark_all_notifications_as_read(self, user_id: int):
+        with get_session() as db:
+            return NotificationRepository(db).mark_read(user_id)
+
+    def rebuild_notification_counters(self):
+        """ Recompute the unread counters from the notification table """
+        with get_session() as db:
+            NotificationRepository(db).rebuild_counters()
+
+    def subscribe_notifications(self, user_id: int, callback):
+        """Call callback({'user_id', 'unread_count', 'notification_id'}) whenever a user's unread count changes;
+        marking read adds 'read_ids' and deleting adds 'deleted_id'. user_id None receives every user's updates.
+        Runs on the listener thread."""
+        get_notification_channel().subscribe(user_id, callback)
+
+    def unsubscribe_notifications(self, user_id: int, callback):
+        get_notification_channel().unsubscribe(user_id, callback)
+
     def delete_notification(self, notification_id: int):
         with get_session() as db:
             return NotificationRepository(db).delete_notification(notification_id)
@@ -1227,7 +2515,23 @@ class NotificationsWorkflowsService:
         with get_session() as db:
             return WorkflowRepository(db).get_workflow_by_id(workflow_id)
 
+    # Fields that change what the workflow runtime executes
+    WORKFLOW_RUNTIME_FIELDS = ('company_id', 'trigger_event', 'actions', 'is_active')
+
+    @staticmethod
+    def _workflow_actions_text(actions):
+        if actions is None or isinstance(actions, str):
+            text_actions = actions
+        else:
+            text_actions = json.dumps(actions, ensure_ascii=False)
+        try:
+            parse_actions(text_actions)
+        except ValueError:
+            raise ValueError("صيغة إجراءات سير العمل غير صالحة.")
+        return text_actions
+
     def create_workflow(self, company_id: int, name: str, description: str, trigger_event: str, actions: dict, is_active: bool = True, created_by: int = 1):
+        actions = self._workflow_actions_text(actions)
         with get_session() as db:
             workflow = models.Workflow(
                 company_id=company_id,
@@ -1238,15 +2542,31 @@ class NotificationsWorkflowsService:
                 is_active=is_active,
                 created_by=created_by
             )
-            return WorkflowRepository(db).create_workflow(workflow)
+            created_workflow = WorkflowRepository(db).create_workflow(workflow)
+            if created_workflow.is_active:
+                get_workflow_runtime().invalidate()
+            return created_workflow
 
     def update_workflow(self, workflow_id: int, **kwargs):
+        if 'actions' in kwargs:
+            kwargs['actions'] = self._workflow_actions_text(kwargs['actions'])
         with get_session() as db:
-            return WorkflowRepository(db).update_workflow(workflow_id, kwargs)
+            workflow_repo = WorkflowRepository(db)
+            workflow = workflow_repo.get_workflow_by_id(workflow_id)
+            runtime_changed = workflow is not None and any(
+                key in kwargs and getattr(workflow, key) != kwargs[key] for key in self.WORKFLOW_RUNTIME_FIELDS
+            )
+            updated_workflow = workflow_repo.update_workflow(workflow_id, kwargs)
+            if runtime_changed:
+                get_workflow_runtime().invalidate()
+            return updated_workflow
 
     def delete_workflow(self, workflow_id: int):
         with get_session() as db:
-            return WorkflowRepository(db).delete_workflow(workflow_id)
+            deleted_workflow = WorkflowRepository(db).delete_workflow(workflow_id)
+            if deleted_workflow is not None:
+                get_workflow_runtime().invalidate()
+            return deleted_workflow
 
 class ReportingService:
     def __init__(self, account_service, journal_service, arap_service):
@@ -1254,18 +2574,100 @@ class ReportingService:
         self.journal_service = journal_service
         self.arap_service = arap_service
 
-    def get_trial_balance(self, company_id: int, branch_id: int = None, period: str = None, as_of_date: date = None):
-        # Simplified for now
+    @read_only
+    def get_trial_balance(self, company_id: int, branch_id: int = None, period: str = None, as_of_date: date = None, rollup: bool = False):
+        """ Posted debit / credit totals per account up to as_of_date (or the end of period), starting from the nearest closing snapshot.
+        With rollup, every account (group accounts included) carries the totals of its whole subtree, ordered by code. """
+        if as_of_date is None:
+            as_of_date = period_bounds(period)[1] if period else date.today()
         with get_session() as db:
-            # Example: Fetch all accounts
             accounts = AccountRepository(db).get_all_accounts()
+            period_close_repo = PeriodCloseRepository(db)
+            if rollup:
+                accounts = sorted(accounts, key=lambda a: a.code)
+                rows = period_close_repo.get_rollup_balances(company_id, as_of_date, branch_id)
+            else:
+                rows = period_close_repo.get_account_balances(company_id, as_of_date, branch_id)
+            totals = {row.account_id: row for row in rows}
             return [{
+                "account_id": a.id,
                 "account_code": a.code,
                 "account_name": a.name_ar,
-                "debit": 0.0, # Placeholder
-                "credit": 0.0 # Placeholder
+                "parent_id": a.parent_id,
+                "level": a.level,
+                "is_postable": a.is_postable,
+                "debit": totals[a.id].debit if a.id in totals else Decimal(0),
+                "credit": totals[a.id].credit if a.id in totals else Decimal(0)
             } for a in accounts]
 
+class ConsolidationService:
+    def __init__(self):
+        pass
+
+    @read_only
+    def get_consolidated_balances(self, as_of: date = None, company_ids: list = None, presentation_currency: str = None, workers: int = None) -> dict:
+        """ Group balances per account for several companies (all active ones by default).
+
+        Each company's ledger is aggregated concurrently from its nearest closing snapshot,
+        translated at the as-of rate from its base currency into presentation_currency
+        (the first company's base currency by default), merged and reduced by the active
+        intercompany elimination rules.
+        """
+        as_of = as_of or date.today()
+        with get_session() as db:
+            if company_ids is None:
+                company_ids = [c.id for c in CompanyRepository(db).get_all_companies() if c.is_active]
+            accounts = {a.id: a for a in AccountRepository(db).get_all_accounts()}
+            rules = EliminationRuleRepository(db).get_active_rules()
+        if not company_ids:
+            raise ValueError("لا توجد شركات للتجميع.")
+
+        exchange_rates = get_exchange_rates()
+        presentation_currency = presentation_currency or exchange_rates.base_currency(company_ids[0])
+        rates = {company_id: exchange_rates.rate(exchange_rates.base_currency(company_id), presentation_currency, as_of)
+                 for company_id in company_ids}
+        result = consolidate(parallel_balances(company_ids, as_of, workers), rates, rules)
+
+        totals = result['totals']
+        lines = []
+        for account_id in sorted(totals, key=lambda account_id: accounts[account_id].code if account_id in accounts else ''):
+            account = accounts.get(account_id)
+            lines.append({
+                'account_id': account_id,
+                'account_code': account.code if account else None,
+                'account_name': account.name_ar if account else None,
+                'type': account.type if account else None,
+                'by_company': {company_id: balances.get(account_id, Decimal(0)) for company_id, balances in result['by_company'].items()},
+                'balance': totals[account_id]
+            })
+        type_totals = {}
+        for line in lines:
+            type_totals[line['type']] = type_totals.get(line['type'], Decimal(0)) + line['balance']
+        return {'as_of': as_of, 'currency': presentation_currency, 'company_ids': company_ids, 'rates': rates,
+                'lines': lines, 'eliminations': result['eliminations'], 'type_totals': type_totals}
+
+    # Elimination Rules
+    def get_all_elimination_rules(self):
+        with get_session() as db:
+            return EliminationRuleRepository(db).get_all_rules()
+
+    def create_elimination_rule(self, name: str, account_id: int, counterpart_account_id: int, difference_account_id: int = None,
+                                is_active: bool = True, created_by: int = 1):
+        if account_id == counterpart_account_id:
+            raise ValueError("يجب أن يختلف الحساب عن الحساب المقابل.")
+        with get_session() as db:
+            rule = models.EliminationRule(name=name, account_id=account_id, counterpart_account_id=counterpart_account_id,
+                                          difference_account_id=difference_account_id, is_active=is_active, created_by=created_by)
+            return EliminationRuleRepository(db).create_rule(rule)
+
+    def update_elimination_rule(self, rule_id: int, **kwargs):
+        with get_session() as db:
+            return EliminationRuleRepository(db).update_rule(rule_id, kwargs)
+
+    def delete_elimination_rule(self, rule_id: int):
+        with get_session() as db:
+            return EliminationRuleRepository(db).delete_rule(rule_id)
+
 class GeneralConfigurationService:
     def __init__(self):
         pass
@@ -1372,7 +2774,9 @@ class CurrencyService:
                     exchange_rate=exchange_rate,
                     is_active=is_active
                 )
-                return CurrencyRepository(db).create_currency(currency)
+                currency = CurrencyRepository(db).create_currency(currency)
+                get_exchange_rates().invalidate()
+                return currency
             except IntegrityError as e:
                 db.rollback()
                 if "currencies_code_key" in str(e): # Assuming unique constraint on currency code
@@ -1394,7 +2798,12 @@ class CurrencyService:
                 if exchange_rate is not None: update_data['exchange_rate'] = exchange_rate
                 if is_active is not None: update_data['is_active'] = is_active
                 
-                return CurrencyRepository(db).update_currency(currency_id, update_data)
+                currency = CurrencyRepository(db).update_currency(currency_id, update_data)
+                if currency and exchange_rate is not None:
+                    # Keep the change as history from today; earlier documents keep their rates
+                    ExchangeRateRepository(db).set_rate(currency_id, date.today(), exchange_rate)
+                get_exchange_rates().invalidate()
+                return currency
             except IntegrityError as e:
                 db.rollback()
                 if "currencies_code_key" in str(e):
@@ -1410,7 +2819,37 @@ class CurrencyService:
 
     def delete_currency(self, currency_id: int):
         with get_session() as db:
-            return CurrencyRepository(db).delete_currency(currency_id)
+            currency = CurrencyRepository(db).delete_currency(currency_id)
+            get_exchange_rates().invalidate()
+            return currency
+
+    # Exchange Rate History
+    def get_exchange_rate_history(self, currency_id: int):
+        with get_session() as db:
+            return ExchangeRateRepository(db).get_rates_by_currency(currency_id)
+
+    def set_exchange_rate(self, currency_id: int, rate_date: date, rate: Decimal, created_by: int = 1):
+        """ Record the rate of a currency effective from rate_date; the latest entry is also its current rate """
+        if Decimal(rate) <= 0:
+            raise ValueError("سعر الصرف يجب أن يكون أكبر من صفر.")
+        with get_session() as db:
+            rate_repo = ExchangeRateRepository(db)
+            if not CurrencyRepository(db).get_currency_by_id(currency_id):
+                raise ValueError("العملة غير موجودة.")
+            rate_repo.set_rate(currency_id, rate_date, rate, created_by)
+            if rate_repo.get_latest_rate_date(currency_id) == rate_date:
+                CurrencyRepository(db).update_currency(currency_id, {'exchange_rate': rate})
+        get_exchange_rates().invalidate()
+
+    def delete_exchange_rate(self, currency_id: int, rate_date: date):
+        with get_session() as db:
+            deleted = ExchangeRateRepository(db).delete_rate(currency_id, rate_date)
+        get_exchange_rates().invalidate()
+        return deleted
+
+    def get_exchange_rate(self, from_currency: str, to_currency: str, on: date = None) -> Decimal:
+        """ Value of one unit of from_currency in to_currency on a date, from the cached rate history """
+        return get_exchange_rates().rate(from_currency, to_currency, on)
 
 class PaymentMethodService:
     def __init__(self):
@@ -1479,7 +2918,7 @@ class CouponService:
         with get_session() as db:
             return CouponRepository(db).get_coupon_by_code(company_id, code)
 
-    def create_coupon(self, company_id: int, code: str, name_ar: str, name_en: str = None, discount_type: str = "percentage", discount_value: float = 0.0, min_purchase_amount: float = 0.0, valid_from: datetime = None, valid_until: datetime = None, is_active: bool = True):
+    def create_coupon(self, company_id: int, code: str, name_ar: str, name_en: str = None, discount_type: str = "percentage", discount_value: float = 0.0, min_purchase_amount: float = 0.0, valid_from: datetime = None, valid_until: datetime = None, is_active: bool = True, priority: int = 0, is_stackable: bool = True):
         with get_session() as db:
             try:
                 if valid_from is None: valid_from = datetime.now()
@@ -1494,9 +2933,13 @@ class CouponService:
                     min_purchase_amount=min_purchase_amount,
                     valid_from=valid_from,
                     valid_until=valid_until,
+                    priority=priority,
+                    is_stackable=is_stackable,
                     is_active=is_active
                 )
-                return CouponRepository(db).create_coupon(coupon)
+                created_coupon = CouponRepository(db).create_coupon(coupon)
+                get_promotion_engine().invalidate(company_id)
+                return created_coupon
             except IntegrityError as e:
                 db.rollback()
                 if "coupons_code_key" in str(e): # Assuming unique constraint on coupon code
@@ -1510,7 +2953,9 @@ class CouponService:
     def update_coupon(self, coupon_id: int, **kwargs):
         with get_session() as db:
             try:
-                return CouponRepository(db).update_coupon(coupon_id, kwargs)
+                updated_coupon = CouponRepository(db).update_coupon(coupon_id, kwargs)
+                get_promotion_engine().invalidate(updated_coupon.company_id if updated_coupon else None)
+                return updated_coupon
             except IntegrityError as e:
                 db.rollback()
                 if "coupons_code_key" in str(e):
@@ -1523,29 +2968,26 @@ class CouponService:
 
     def delete_coupon(self, coupon_id: int):
         with get_session() as db:
-            return CouponRepository(db).delete_coupon(coupon_id)
-
-    def apply_coupon(self, company_id: int, coupon_code: str, total_amount: float) -> float:
-        with get_session() as db:
-            coupon = self.get_coupon_by_code(company_id, coupon_code)
-            if not coupon or not coupon.is_active:
-                raise ValueError("الكوبون غير صالح أو غير نشط.")
+            deleted_coupon = CouponRepository(db).delete_coupon(coupon_id)
+            get_promotion_engine().invalidate()
+            return deleted_coupon
 
-            if coupon.valid_until and coupon.valid_until < datetime.now():
+    def apply_coupon(self, company_id: int, coupon_code: str, total_amount: Decimal) -> Decimal:
+        result = get_promotion_engine().evaluate(company_id, coupon_codes=[coupon_code], subtotal=total_amount)
+        for rejection in result['rejected']:
+            if rejection['reason'] == 'expired':
                 raise ValueError("الكوبون منتهي الصلاحية.")
-
-            if total_amount < coupon.min_purchase_amount:
-                raise ValueError(f"الحد الأدنى للشراء لتطبيق هذا الكوبون هو {coupon.min_purchase_amount:.2f}.")
-
-            discount_amount = 0.0
-            if coupon.discount_type == "percentage":
-                discount_amount = total_amount * (coupon.discount_value / 100)
-            elif coupon.discount_type == "fixed_amount":
-                discount_amount = coupon.discount_value
-            else:
+            elif rejection['reason'] == 'min_purchase':
+                raise ValueError(f"الحد الأدنى للشراء لتطبيق هذا الكوبون هو {rejection['min_purchase']:.2f}.")
+            elif rejection['reason'] == 'unsupported_type':
                 raise ValueError("نوع الخصم غير مدعوم.")
+            else:
+                raise ValueError("الكوبون غير صالح أو غير نشط.")
+        return result['total']
 
-            return max(0.0, total_amount - discount_amount)
+    def evaluate_basket(self, company_id: int, lines: list, coupon_codes: list = None):
+        """ Evaluates all active promotions of the company against a basket of invoice lines. """
+        return get_promotion_engine().evaluate(company_id, lines, coupon_codes or [])
 
 class ShiftService:
     def __init__(self):
@@ -1633,6 +3075,7 @@ class ShiftService:
             )
             return ShiftMovementRepository(db).create_shift_movement(movement)
 
+    @read_only
     def get_shift_closeout_report(self, shift_id: int):
         with get_session() as db:
             shift_repo = ShiftRepository(db)
@@ -1755,7 +3198,7 @@ class LoyaltyProgramService:
         with get_session() as db:
             return LoyaltyProgramRepository(db).get_loyalty_program_by_id(program_id)
 
-    def create_loyalty_program(self, company_id: int, name_ar: str, name_en: str = None, type: str = "points", points_per_amount: float = 0.0, point_value: float = 0.0, min_redemption_points: int = 0, cashback_percentage: float = 0.0, min_purchase_amount_for_cashback: float = 0.0, is_active: bool = True):
+    def create_loyalty_program(self, company_id: int, name_ar: str, name_en: str = None, type: str = "points", points_per_amount: float = 0.0, point_value: float = 0.0, min_redemption_points: int = 0, cashback_percentage: float = 0.0, min_purchase_amount_for_cashback: float = 0.0, is_active: bool = True, points_validity_days: int = None):
         with get_session() as db:
             try:
                 if type == "points":
@@ -1778,9 +3221,12 @@ class LoyaltyProgramService:
                     min_redemption_points=min_redemption_points,
                     cashback_percentage=cashback_percentage,
                     min_purchase_amount_for_cashback=min_purchase_amount_for_cashback,
+                    points_validity_days=points_validity_days,
                     is_active=is_active
                 )
-                return LoyaltyProgramRepository(db).create_loyalty_program(loyalty_program)
+                created_program = LoyaltyProgramRepository(db).create_loyalty_program(loyalty_program)
+                get_promotion_engine().invalidate(company_id)
+                return created_program
             except IntegrityError as e:
                 db.rollback()
                 if "loyalty_programs_name_ar_key" in str(e) or "loyalty_programs_name_en_key" in str(e): # Assuming unique constraints
@@ -1816,7 +3262,9 @@ class LoyaltyProgramService:
                 elif updated_type not in ["points", "cashback"]:
                     raise ValueError("نوع برنامج الولاء غير مدعوم.")
 
-                return LoyaltyProgramRepository(db).update_loyalty_program(program_id, kwargs)
+                updated_program = LoyaltyProgramRepository(db).update_loyalty_program(program_id, kwargs)
+                get_promotion_engine().invalidate(existing_program.company_id)
+                return updated_program
             except IntegrityError as e:
                 db.rollback()
                 if "loyalty_programs_name_ar_key" in str(e) or "loyalty_programs_name_en_key" in str(e):
@@ -1829,7 +3277,89 @@ class LoyaltyProgramService:
 
     def deactivate_loyalty_program(self, program_id: int):
         with get_session() as db:
-            return LoyaltyProgramRepository(db).deactivate_loyalty_program(program_id)
+            program = LoyaltyProgramRepository(db).deactivate_loyalty_program(program_id)
+            get_promotion_engine().invalidate(program.company_id if program else None)
+            return program
+
+class LoyaltyLedgerService:
+    # Points accrued over the rolling window required for each tier
+    TIER_WINDOW_DAYS = 365
+    SILVER_TIER_POINTS = 1000
+    GOLD_TIER_POINTS = 5000
+
+    def __init__(self):
+        pass
+
+    def accrue_in_transaction(self, db, company_id: int, customer_id: int, net_amount: Decimal, invoice_id: int = None):
+        """ Accrues points/cashback for a sale using the caller's session; committed with the checkout. """
+        if not customer_id:
+            return None
+        is_enabled = db.query(models.Company.is_loyalty_enabled).filter(models.Company.id == company_id).scalar()
+        if not is_enabled:
+            return None
+
+        engine = get_promotion_engine()
+        result = engine.evaluate(company_id, subtotal=net_amount)
+        if result['points_earned'] <= 0 and result['cashback'] <= 0:
+            return None
+
+        validity_days = engine.get_rule_set(company_id).points_validity_days
+        entry = models.LoyaltyLedger(
+            company_id=company_id,
+            customer_id=customer_id,
+            invoice_id=invoice_id,
+            entry_type=0, # Accrual
+            points=result['points_earned'],
+            cashback_amount=result['cashback'],
+            remaining_points=result['points_earned'],
+            expires_at=date.today() + timedelta(days=validity_days) if validity_days else None
+        )
+        return LoyaltyLedgerRepository(db).add_accrual(entry)
+
+    def get_balance(self, company_id: int, customer_id: int):
+        with get_session() as db:
+            account = LoyaltyLedgerRepository(db).get_account(company_id, customer_id)
+            if not account:
+                return {"points_balance": 0, "cashback_balance": Decimal(0), "lifetime_points": 0, "tier": 0}
+            return {
+                "points_balance": account.points_balance,
+                "cashback_balance": account.cashback_balance,
+                "lifetime_points": account.lifetime_points,
+                "tier": account.tier
+            }
+
+    def get_ledger_entries(self, company_id: int, customer_id: int, limit: int = 100):
+        with get_session() as db:
+            return LoyaltyLedgerRepository(db).get_entries_by_customer(company_id, customer_id, limit)
+
+    def redeem_points(self, company_id: int, customer_id: int, points: int, invoice_id: int = None):
+        if points <= 0:
+            raise ValueError("عدد النقاط المراد استبدالها يجب أن يكون أكبر من صفر.")
+        with get_session() as db:
+            entry = LoyaltyLedgerRepository(db).redeem_points(company_id, customer_id, points, date.today(), invoice_id)
+            if entry is None:
+                raise ValueError("رصيد نقاط الولاء غير كافٍ.")
+            return entry
+
+    def expire_points(self, as_of: date = None) -> int:
+        with get_session() as db:
+            return LoyaltyLedgerRepository(db).expire_due_points(as_of or date.today())
+
+    def recalculate_tiers(self, as_of: date = None) -> int:
+        as_of = as_of or date.today()
+        with get_session() as db:
+            return LoyaltyLedgerRepository(db).recalculate_tiers(
+                as_of - timedelta(days=self.TIER_WINDOW_DAYS), self.SILVER_TIER_POINTS, self.GOLD_TIER_POINTS
+            )
+
+    def run_scheduled_jobs(self):
+        """ Periodic maintenance: expire due points, then refresh tiers. """
+        try:
+            expired = self.expire_points()
+            retiered = self.recalculate_tiers()
+            print(f"[LoyaltyLedgerService] Expired points for {expired} accounts, updated {retiered} tiers")
+        except Exception as e:
+            print(f"[LoyaltyLedgerService] Error running scheduled jobs: {e}")
 
 class WarehouseService:
     def __init__(self):
@@ -1876,11 +3406,12 @@ class WarehouseService:
             return WarehouseRepository(db).delete_warehouse(warehouse_id)
 
     # Stock Movement Operations
+    @read_only
     def get_all_stock_movements(self):
         with get_session() as db:
             return StockMovementRepository(db).get_all_stock_movements()
 
-    def record_stock_movement(self, company_id: int, branch_id: int, item_id: int, movement_type: int, quantity: Decimal, cost: Decimal = Decimal(0), movement_date: date = None, ref_no: str = None, created_by: int = 1):
+    def record_stock_movement(self, company_id: int, branch_id: int, item_id: int, movement_type: int, quantity: Decimal, cost: Decimal = Decimal(0), movement_date: date = None, ref_no: str = None, created_by: int = 1, warehouse_id: int = None):
         with get_session() as db:
             if not movement_date:
                 movement_date = date.today()
@@ -1889,6 +3420,7 @@ class WarehouseService:
                 company_id=company_id,
                 branch_id=branch_id,
                 item_id=item_id,
+                warehouse_id=warehouse_id,
                 movement_type=movement_type,
                 quantity=quantity,
                 cost=cost,
@@ -1896,7 +3428,13 @@ class WarehouseService:
                 ref_no=ref_no,
                 created_by=created_by
             )
-            return StockMovementRepository(db).create_stock_movement(stock_movement)
+            db.add(stock_movement)
+            db.flush()
+            InventoryCostingService().apply_movement_in_transaction(db, stock_movement)
+            db.commit()
+            db.refresh(stock_movement)
+            publish_event(STOCK_MOVED, stock_movement_event_data(stock_movement))
+            return stock_movement
 
     def get_stock_movements_by_item(self, item_id: int):
         with get_session() as db:
@@ -1904,6 +3442,11 @@ class WarehouseService:
 
     def get_item_stock_level(self, item_id: int, warehouse_id: int) -> float:
         with get_session() as db:
+            # Maintained incrementally by the costing engine
+            state = ItemCostRepository(db).get_state(item_id, warehouse_id or 0)
+            if state is not None:
+                return float(state.quantity_on_hand)
+
             # Calculate total 'in' movements (received items)
             total_in = db.query(func.sum(models.StockMovement.quantity)).filter(
                 models.StockMovement.item_id == item_id,
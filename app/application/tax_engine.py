@@ -0,0 +1,143 @@
+"""
+Labeeb ERP - Tax Aggregation Engine
+Output and input VAT per tax setting and period, computed from invoices in one grouped query
+"""
+
+import calendar
+import re
+import threading
+from datetime import date
+from decimal import Decimal
+from typing import Dict, Optional, Tuple
+
+from app.infrastructure.repositories import TaxReportRepository, FiscalPeriodRepository
+
+ZERO = Decimal(0)
+
+# Invoice.invoice_type: 0 Sales, 1 Purchase, 2 Sales Return, 3 Purchase Return
+OUTPUT_TAX_SIGN = {0: 1, 2: -1}
+INPUT_TAX_SIGN = {1: 1, 3: -1}
+CANCELLED_INVOICE_STATUS = 3
+
+
+def period_bounds(report_period: str) -> Tuple[date, date]:
+    """Start and end dates of a report period: YYYY-MM, YYYY-Qn or YYYY"""
+    match = re.fullmatch(r'(\d{4})(?:-(\d{2})|-Q([1-4]))?', report_period.strip().upper())
+    if not match:
+        raise ValueError(f"Invalid report period: {report_period}")
+    year, month, quarter = match.groups()
+    year = int(year)
+    if month:
+        first_month = last_month = int(month)
+        if not 1 <= first_month <= 12:
+            raise ValueError(f"Invalid report period: {report_period}")
+    elif quarter:
+        first_month = (int(quarter) - 1) * 3 + 1
+        last_month = first_month + 2
+    else:
+        first_month, last_month = 1, 12
+    return date(year, first_month, 1), date(year, last_month, calendar.monthrange(year, last_month)[1])
+
+
+class TaxTotals:
+    """Output and input tax of one tax setting over a period"""
+
+    __slots__ = ('tax_setting_id', 'output_tax', 'input_tax', 'taxable_sales', 'invoice_count')
+
+    def __init__(self, tax_setting_id: int, output_tax: Decimal = ZERO, input_tax: Decimal = ZERO,
+                 taxable_sales: Decimal = ZERO, invoice_count: int = 0):
+        self.tax_setting_id = tax_setting_id
+        self.output_tax = output_tax
+        self.input_tax = input_tax
+        self.taxable_sales = taxable_sales # Net of sales returns
+        self.invoice_count = invoice_count
+
+    @property
+    def net_tax_payable(self) -> Decimal:
+        return self.output_tax - self.input_tax
+
+    def as_dict(self) -> dict:
+        return {
+            'tax_setting_id': self.tax_setting_id,
+            'total_sales_tax': self.output_tax,
+            'total_purchase_tax': self.input_tax,
+            'net_tax_payable': self.net_tax_payable,
+            'taxable_sales': self.taxable_sales,
+            'invoice_count': self.invoice_count
+        }
+
+    def __repr__(self):
+        return f"<TaxTotals(tax_setting_id={self.tax_setting_id}, output={self.output_tax}, input={self.input_tax})>"
+
+
+class TaxAggregationEngine:
+    """Aggregates invoice tax per tax setting and caches the results of closed periods.
+
+    Open periods are always recomputed by a single grouped query. A period is
+    cached once its fiscal period is closed or its tax report was submitted;
+    invalidate() drops cached periods when a late invoice lands in them.
+    """
+
+    def __init__(self):
+        self._closed: Dict[tuple, Dict[int, TaxTotals]] = {}
+        self._lock = threading.Lock()
+
+    def aggregate(self, db, company_id: int, start_date: date, end_date: date, branch_id: int = None) -> Dict[int, TaxTotals]:
+        key = (company_id, branch_id, start_date, end_date)
+        cached = self._closed.get(key)
+        if cached is not None:
+            return cached
+
+        totals = {}
+        for row in TaxReportRepository(db).aggregate_invoice_tax(company_id, start_date, end_date, branch_id):
+            if row.tax_setting_id is None:
+                print(f"Tax aggregation: {row.invoice_count} invoices of company {company_id} have no tax setting and no active default")
+                continue
+            totals[row.tax_setting_id] = TaxTotals(row.tax_setting_id, row.output_tax or ZERO, row.input_tax or ZERO,
+                                                  row.taxable_sales or ZERO, row.invoice_count)
+
+        if self._is_closed(db, company_id, start_date, end_date, branch_id):
+            with self._lock:
+                self._closed[key] = totals
+        return totals
+
+    @staticmethod
+    def _is_closed(db, company_id: int, start_date: date, end_date: date, branch_id: Optional[int]) -> bool:
+        if FiscalPeriodRepository(db).is_range_closed(company_id, start_date, end_date):
+            return True
+        return TaxReportRepository(db).has_submitted_report(company_id, start_date, end_date, branch_id)
+
+    def invalidate(self, company_id: int = None, on_date: date = None):
+        """Drop cached periods of a company (or all companies), optionally only those containing a date"""
+        with self._lock:
+            if company_id is None:
+                self._closed.clear()
+                return
+            for key in list(self._closed):
+                cached_company, _, start_date, end_date = key
+                if cached_company == company_id and (on_date is None or start_date <= on_date <= end_date):
+                    del self._closed[key]
+
+    @staticmethod
+    def invoice_tax_delta(invoice) -> Tuple[Decimal, Decimal]:
+        """Signed (output, input) tax contribution of a single invoice"""
+        if invoice.status == CANCELLED_INVOICE_STATUS:
+            return ZERO, ZERO
+        return TaxAggregationEngine.tax_delta(invoice.invoice_type, invoice.total_tax)
+
+    @staticmethod
+    def tax_delta(invoice_type: int, total_tax) -> Tuple[Decimal, Decimal]:
+        """Signed (output, input) tax contribution of an invoice type's tax amount"""
+        tax = total_tax or ZERO
+        return tax * OUTPUT_TAX_SIGN.get(invoice_type, 0), tax * INPUT_TAX_SIGN.get(invoice_type, 0)
+
+
+# Global tax aggregation engine instance
+_tax_engine = None
+
+def get_tax_engine() -> TaxAggregationEngine:
+    """Get the global tax aggregation engine instance"""
+    global _tax_engine
+    if _tax_engine is None:
+        _tax_engine = TaxAggregationEngine()
+    return _tax_engine
@@ -0,0 +1,274 @@
+"""
+Labeeb ERP - Workflow Engine
+Runs active workflows on domain events from a (company, trigger event) index of compiled actions
+"""
+
+import json
+import re
+import threading
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from app.infrastructure.database import get_session
+from app.infrastructure.event_bus import get_event_bus, BLOCK
+from app.infrastructure.repositories import WorkflowRepository, NotificationRepository, UserRepository
+
+WORKFLOW_SUBSCRIBER = 'workflows'
+
+
+def normalize_event_name(event_name: str) -> str:
+    """'InvoiceCreated', 'Invoice Created' and 'invoice_created' all name the same trigger"""
+    name = re.sub(r'(?<=[a-z0-9])(?=[A-Z])', '_', event_name.strip())
+    return re.sub(r'[\s\-]+', '_', name).lower()
+
+
+class _SafeFormat(dict):
+    """Leaves unknown {placeholders} in a message as they are"""
+
+    def __missing__(self, key):
+        return '{' + key + '}'
+
+
+class WorkflowContext:
+    """What the actions of one batch produce; written once per batch"""
+
+    __slots__ = ('notifications',)
+
+    def __init__(self):
+        self.notifications = []
+
+    def notify(self, user_id: int, company_id: int, message: str):
+        self.notifications.append({
+            'user_id': user_id,
+            'company_id': company_id,
+            'message': message,
+            'is_read': False,
+            'created_at': datetime.now()
+        })
+
+
+# ---- Conditions ----
+
+_OPERATORS = {
+    '==': lambda a, b: a == b,
+    '!=': lambda a, b: a != b,
+    '>': lambda a, b: a is not None and a > b,
+    '>=': lambda a, b: a is not None and a >= b,
+    '<': lambda a, b: a is not None and a < b,
+    '<=': lambda a, b: a is not None and a <= b,
+    'in': lambda a, b: a in b,
+}
+
+
+def compile_condition(conditions: Optional[dict]) -> Optional[Callable[[dict], bool]]:
+    """{"field": value} or {"field": {">": 1000}} -> predicate on the event data"""
+    if not conditions:
+        return None
+    checks = []
+    for field, expected in conditions.items():
+        if isinstance(expected, dict):
+            for op, value in expected.items():
+                if op not in _OPERATORS:
+                    raise ValueError(f"Unknown condition operator: {op}")
+                checks.append((field, _OPERATORS[op], value))
+        else:
+            checks.append((field, _OPERATORS['=='], expected))
+
+    def condition(data: dict) -> bool:
+        for field, op, value in checks:
+            actual = data.get(field)
+            if isinstance(value, (int, float)) and actual is not None and not isinstance(actual, (int, float)):
+                actual = float(actual) # Decimal amounts against JSON numbers
+            if not op(actual, value):
+                return False
+        return True
+    return condition
+
+
+# ---- Actions ----
+
+# action name -> compiler(spec, workflow, db) returning a callable(context, event_name, data)
+ACTION_COMPILERS: Dict[str, Callable] = {}
+
+def register_action(*names: str):
+    """Register a compiler for one or more action names"""
+    def decorator(compiler):
+        for name in names:
+            ACTION_COMPILERS[name] = compiler
+        return compiler
+    return decorator
+
+
+def _recipients(spec: dict, workflow, db) -> List[int]:
+    user_ids = spec.get('user_ids') or ([spec['user_id']] if spec.get('user_id') else [])
+    if not user_ids and spec.get('to'):
+        user = UserRepository(db).get_user_by_email(spec['to'])
+        if user:
+            user_ids = [user.id]
+    return user_ids or [workflow.created_by]
+
+
+@register_action('notify', 'create_notification', 'send_notification')
+def _compile_notify(spec: dict, workflow, db):
+    user_ids = _recipients(spec, workflow, db)
+    template = spec.get('message') or f"{workflow.name}: {{event}}"
+
+    def notify(context: WorkflowContext, event_name: str, data: dict):
+        message = template.format_map(_SafeFormat(data, event=event_name))
+        for user_id in user_ids:
+            context.notify(user_id, workflow.company_id, message)
+    return notify
+
+
+@register_action('send_email')
+def _compile_send_email(spec: dict, workflow, db):
+    # No mail transport is configured: deliver in-app to the user owning the address (or the workflow owner)
+    subject = spec.get('subject') or workflow.name
+    body = spec.get('message') or spec.get('body') or '{event}'
+    return _compile_notify({**spec, 'message': f"{subject}: {body}"}, workflow, db)
+
+
+@register_action('log')
+def _compile_log(spec: dict, workflow, db):
+    template = spec.get('message') or '{event}'
+
+    def log(context: WorkflowContext, event_name: str, data: dict):
+        print(f"Workflow {workflow.name}: {template.format_map(_SafeFormat(data, event=event_name))}")
+    return log
+
+
+def parse_actions(actions) -> Tuple[Optional[dict], List[dict]]:
+    """Workflow.actions text -> (workflow conditions, action specs).
+
+    Accepts one action object, a list of them, or
+    {"conditions": {...}, "actions": [...]}. Each action may carry its own
+    "conditions" as well.
+    """
+    if not actions:
+        return None, []
+    payload = json.loads(actions) if isinstance(actions, str) else actions
+    conditions = None
+    specs = payload
+    if isinstance(payload, dict):
+        if 'action' in payload:
+            specs = [payload]
+        else:
+            conditions = payload.get('conditions')
+            specs = payload.get('actions', [])
+    if not isinstance(specs, list) or not all(isinstance(spec, dict) for spec in specs):
+        raise ValueError("Workflow actions must be a JSON object or a list of objects")
+    return conditions, specs
+
+
+def _guarded(condition: Callable[[dict], bool], action: Callable):
+    def guarded(context: WorkflowContext, event_name: str, data: dict):
+        if condition(data):
+            action(context, event_name, data)
+    return guarded
+
+
+class CompiledWorkflow:
+    """A workflow with its condition and actions compiled once"""
+
+    __slots__ = ('id', 'company_id', 'name', 'trigger_event', 'condition', 'actions')
+
+    def __init__(self, workflow, db):
+        self.id = workflow.id
+        self.company_id = workflow.company_id
+        self.name = workflow.name
+        self.trigger_event = normalize_event_name(workflow.trigger_event)
+        conditions, specs = parse_actions(workflow.actions)
+        self.condition = compile_condition(conditions)
+        self.actions = []
+        for spec in specs:
+            compiler = ACTION_COMPILERS.get(spec.get('action'))
+            if compiler is None:
+                raise ValueError(f"Unknown workflow action: {spec.get('action')}")
+            action = compiler(spec, workflow, db)
+            condition = compile_condition(spec.get('conditions'))
+            self.actions.append(_guarded(condition, action) if condition else action)
+
+    def run(self, context: WorkflowContext, event_name: str, data: dict):
+        if self.condition is not None and not self.condition(data):
+            return False
+        for action in self.actions:
+            action(context, event_name, data)
+        return True
+
+
+class WorkflowRuntime:
+    """Executes workflows on the event bus worker, never on the posting path.
+
+    The index maps (company_id, trigger event) to compiled workflows and is
+    rebuilt lazily on the next event after invalidate(), which the service
+    calls only when a workflow's trigger, actions or activation changes.
+    """
+
+    def __init__(self):
+        self._index: Dict[Tuple[int, str], Tuple[CompiledWorkflow, ...]] = {}
+        self._dirty = True
+        self._lock = threading.Lock()
+        self.metrics = {'events': 0, 'matched': 0, 'errors': 0, 'notifications': 0, 'rebuilds': 0}
+
+    def invalidate(self):
+        self._dirty = True
+
+    def _ensure_index(self):
+        if not self._dirty:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            self._dirty = False # Set first: an invalidate() during the rebuild triggers another one
+            index = {}
+            with get_session() as db:
+                for workflow in WorkflowRepository(db).get_active_workflows():
+                    try:
+                        compiled = CompiledWorkflow(workflow, db)
+                    except (ValueError, TypeError) as e:
+                        print(f"Skipping workflow {workflow.name}: {e}")
+                        continue
+                    key = (compiled.company_id, compiled.trigger_event)
+                    index[key] = index.get(key, ()) + (compiled,)
+            self._index = index
+            self.metrics['rebuilds'] += 1
+
+    def get_workflows(self, company_id: int, event_name: str) -> Tuple[CompiledWorkflow, ...]:
+        self._ensure_index()
+        return self._index.get((company_id, normalize_event_name(event_name)), ())
+
+    def handle_events(self, events: List[Tuple[str, dict]]):
+        """Event bus batch handler: run every matched workflow and store their notifications together"""
+        self._ensure_index()
+        index = self._index
+        context = WorkflowContext()
+        for event_name, data in events:
+            self.metrics['events'] += 1
+            for workflow in index.get((data.get('company_id'), event_name), ()):
+                try:
+                    if workflow.run(context, event_name, data):
+                        self.metrics['matched'] += 1
+                except Exception as e:
+                    self.metrics['errors'] += 1
+                    print(f"Error running workflow {workflow.name} on {event_name}: {e}")
+        if context.notifications:
+            with get_session() as db:
+                self.metrics['notifications'] += NotificationRepository(db).create_notifications(context.notifications)
+
+    def start(self, event_bus=None):
+        """Subscribe to the event bus; events are matched and run on its worker thread"""
+        (event_bus or get_event_bus()).subscribe(
+            WORKFLOW_SUBSCRIBER, self.handle_events,
+            max_queue=10000, policy=BLOCK, timeout=10.0, batch_size=500, batch_window=0.1
+        )
+
+
+# Global workflow runtime instance
+_workflow_runtime = None
+
+def get_workflow_runtime() -> WorkflowRuntime:
+    """Get the global workflow runtime instance"""
+    global _workflow_runtime
+    if _workflow_runtime is None:
+        _workflow_runtime = WorkflowRuntime()
+    return _workflow_runtime
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, SmallInteger, Numeric, ForeignKey, Text, Date, TIMESTAMP, BigInteger
+from sqlalchemy import Column, Integer, String, Boolean, SmallInteger, Numeric, ForeignKey, Text, Date, TIMESTAMP, BigInteger, Index, text, event, DDL
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from sqlalchemy.dialects.postgresql import JSONB
@@ -27,6 +27,20 @@ class Account(Base):
     def __repr__(self):
         return f"<Account(code='{self.code}', name_ar='{self.name_ar}')>"
 
+class AccountClosure(Base):
+    __tablename__ = "account_closure"
+
+    ancestor_id = Column(Integer, ForeignKey("account.id", ondelete="CASCADE"), primary_key=True)
+    descendant_id = Column(Integer, ForeignKey("account.id", ondelete="CASCADE"), primary_key=True)
+    depth = Column(SmallInteger, nullable=False) # 0: the account itself, 1: direct child, ...
+
+    __table_args__ = (
+        Index("ix_account_closure_descendant", "descendant_id", "ancestor_id"),
+    )
+
+    def __repr__(self):
+        return f"<AccountClosure(ancestor_id={self.ancestor_id}, descendant_id={self.descendant_id}, depth={self.depth})>"
+
 class JournalEntry(Base):
     __tablename__ = "journal_entry"
 
@@ -51,7 +65,8 @@ class JournalEntry(Base):
 class JournalLine(Base):
     __tablename__ = "journal_line"
 
-    id = Column(BigInteger, primary_key=True)
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    entry_date = Column(Date, primary_key=True) # Copy of journal_entry.date; partition key
     entry_id = Column(BigInteger, ForeignKey("journal_entry.id", ondelete="CASCADE"))
     account_id = Column(Integer, ForeignKey("account.id"))
     debit = Column(Numeric(18,3), default=0)
@@ -65,6 +80,13 @@ class JournalLine(Base):
     journal_entry = relationship("JournalEntry", back_populates="lines")
     account = relationship("Account")
 
+    __table_args__ = (
+        Index("ix_journal_line_entry", "entry_id"),
+        Index("ix_journal_line_account_date", "account_id", "entry_date", "id"), # Account statements page on (entry_date, id)
+        {"postgresql_partition_by": "RANGE (entry_date)"},
+    )
+    __mapper_args__ = {"primary_key": [id]}
+
     def __repr__(self):
         return f"<JournalLine(id={self.id}, account_id={self.account_id}, debit={self.debit}, credit={self.credit})>"
 
@@ -101,9 +123,64 @@ class Customer(Base):
     email = Column(String(100)) # Added email column
     created_at = Column(TIMESTAMP, default=func.now()) # Added created_at column
 
+    __table_args__ = (
+        Index("customer_unique_code", "code", unique=True), # Upsert key of the bulk importer
+    )
+
     def __repr__(self):
         return f"<Customer(code='{self.code}', name_ar='{self.name_ar}')>"
 
+class CustomerExposure(Base):
+    __tablename__ = "customer_exposure"
+
+    # Kept in step with invoice, payment and sales order writes so credit checks read one row
+    customer_id = Column(Integer, ForeignKey("customer.id"), primary_key=True)
+    open_ar = Column(Numeric(18,3), nullable=False, default=0) # Open sales invoices less open returns
+    open_orders = Column(Numeric(18,3), nullable=False, default=0) # Confirmed, not yet fulfilled sales orders
+    updated_at = Column(TIMESTAMP, default=func.now(), onupdate=func.now())
+
+    def __repr__(self):
+        return f"<CustomerExposure(customer_id={self.customer_id}, open_ar={self.open_ar}, open_orders={self.open_orders})>"
+
+class LoyaltyAccount(Base):
+    __tablename__ = "loyalty_account"
+
+    # One row per customer per company so the till reads the balance by primary key
+    company_id = Column(Integer, ForeignKey("company.id"), primary_key=True)
+    customer_id = Column(Integer, ForeignKey("customer.id"), primary_key=True)
+    points_balance = Column(BigInteger, nullable=False, default=0)
+    cashback_balance = Column(Numeric(18,3), nullable=False, default=0)
+    lifetime_points = Column(BigInteger, nullable=False, default=0)
+    tier = Column(SmallInteger, nullable=False, default=0) # 0: Standard, 1: Silver, 2: Gold
+    updated_at = Column(TIMESTAMP, default=func.now(), onupdate=func.now())
+
+    customer = relationship("Customer")
+
+    def __repr__(self):
+        return f"<LoyaltyAccount(customer_id={self.customer_id}, points={self.points_balance}, tier={self.tier})>"
+
+class LoyaltyLedger(Base):
+    __tablename__ = "loyalty_ledger"
+
+    id = Column(BigInteger, primary_key=True)
+    company_id = Column(Integer, ForeignKey("company.id"), nullable=False)
+    customer_id = Column(Integer, ForeignKey("customer.id"), nullable=False)
+    invoice_id = Column(BigInteger, ForeignKey("invoice.id"), nullable=True)
+    entry_type = Column(SmallInteger, nullable=False) # 0: Accrual, 1: Redemption, 2: Expiry, 3: Adjustment
+    points = Column(BigInteger, nullable=False, default=0) # Signed: positive for accruals
+    cashback_amount = Column(Numeric(18,3), nullable=False, default=0)
+    remaining_points = Column(BigInteger, nullable=False, default=0) # Unredeemed points of an accrual, consumed oldest first
+    expires_at = Column(Date, nullable=True)
+    created_at = Column(TIMESTAMP, nullable=False, default=func.now())
+
+    __table_args__ = (
+        Index("ix_loyalty_ledger_customer", "company_id", "customer_id", "created_at"),
+        Index("ix_loyalty_ledger_expiry", "expires_at", postgresql_where=text("remaining_points > 0")),
+    )
+
+    def __repr__(self):
+        return f"<LoyaltyLedger(customer_id={self.customer_id}, type={self.entry_type}, points={self.points})>"
+
 class Supplier(Base): # Renamed from Vendor
     __tablename__ = "supplier" # Renamed from vendor
 
@@ -123,6 +200,10 @@ class Supplier(Base): # Renamed from Vendor
     tax_id = Column(String(50))
     supplier_group = Column(String(50))
 
+    __table_args__ = (
+        Index("supplier_unique_code", "code", unique=True), # Upsert key of the bulk importer
+    )
+
     def __repr__(self):
         return f"<Supplier(code='{self.code}', name_ar='{self.name_ar}')>"
 
@@ -140,11 +221,22 @@ class Invoice(Base):
     due_date = Column(Date)
     total_amount = Column(Numeric(18,3), default=0)
     total_tax = Column(Numeric(18,3), default=0)
+    amount_paid = Column(Numeric(18,3), nullable=False, default=0) # Maintained by payment writes
+    balance_due = Column(Numeric(18,3), nullable=False, default=0) # total_amount - amount_paid
+    tax_setting_id = Column(Integer, ForeignKey("tax_setting.id")) # Null: company's default active tax setting
     currency = Column(String(3), nullable=False)
+    fx_rate = Column(Numeric(18,6), nullable=False, default=1) # Invoice currency to company base currency on invoice_date
     status = Column(SmallInteger, default=0) # 0: Draft, 1: Issued, 2: Paid, 3: Cancelled
     created_by = Column(Integer, nullable=True) # Changed to nullable=True
     created_at = Column(TIMESTAMP, default=func.now())
 
+    __table_args__ = (
+        Index("ix_invoice_company_date", "company_id", "invoice_date"),
+        Index("ix_invoice_open_customer", "company_id", "customer_id", "due_date", postgresql_where=text("balance_due <> 0 AND customer_id IS NOT NULL")),
+        Index("ix_invoice_open_supplier", "company_id", "supplier_id", "due_date", postgresql_where=text("balance_due <> 0 AND supplier_id IS NOT NULL")),
+        Index("ix_invoice_balance_unset", "company_id", postgresql_where=text("balance_due IS NULL")), # Invoices awaiting the balance backfill
+    )
+
     customer = relationship("Customer")
     supplier = relationship("Supplier") # Changed from vendor
     branch = relationship("Branch", backref="invoices", lazy='joined') # New: Relationship to Branch model
@@ -165,6 +257,7 @@ class Payment(Base):
     payment_date = Column(Date, nullable=False)
     amount = Column(Numeric(18,3), nullable=False)
     currency = Column(String(3), nullable=False)
+    fx_rate = Column(Numeric(18,6), nullable=False, default=1) # Payment currency to company base currency on payment_date
     payment_method = Column(Text)
     ref_no = Column(String(50))
     created_by = Column(Integer, nullable=False)
@@ -172,6 +265,10 @@ class Payment(Base):
 
     invoice = relationship("Invoice")
 
+    __table_args__ = (
+        Index("ix_payment_date_invoice", "payment_date", "invoice_id"),
+    )
+
     def __repr__(self):
         return f"<Payment(id={self.id}, amount={self.amount}, date='{self.payment_date}')>"
 
@@ -188,6 +285,10 @@ class InvoicePayment(Base): # New InvoicePayment Model for split payments
     invoice = relationship("Invoice", back_populates="payments")
     payment_method = relationship("PaymentMethod")
 
+    __table_args__ = (
+        Index("ix_invoice_payment_created_invoice", "created_at", "invoice_id"),
+    )
+
     def __repr__(self):
         return f"<InvoicePayment(id={self.id}, invoice_id={self.invoice_id}, amount={self.amount})>"
 
@@ -214,6 +315,11 @@ class Item(Base):
     warehouse = relationship("Warehouse", backref="items", lazy='joined') # New: Relationship to Warehouse model
     company = relationship("Company", back_populates="items") # New: Relationship to Company model
 
+    __table_args__ = (
+        Index("item_unique_code", "code", unique=True), # Upsert key of the bulk importer
+        Index("ix_item_barcode", "barcode"), # Scans that miss the item catalog
+    )
+
     def __repr__(self):
         return f"<Item(code='{self.code}', name_ar='{self.name_ar}')>"
 
@@ -238,23 +344,77 @@ class InvoiceLine(Base):
 class StockMovement(Base):
     __tablename__ = "stock_movement"
 
-    id = Column(BigInteger, primary_key=True)
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
     company_id = Column(Integer, nullable=True) # Changed to nullable=True
     branch_id = Column(Integer)
     item_id = Column(Integer, ForeignKey("item.id"), nullable=False)
+    warehouse_id = Column(Integer, ForeignKey("warehouse.id"))
     movement_type = Column(SmallInteger, nullable=False) # 0: In, 1: Out, 2: Transfer, 3: Adjustment, 4: Waste
     quantity = Column(Numeric(18,3), nullable=False)
-    cost = Column(Numeric(18,3), default=0)
-    movement_date = Column(Date, nullable=False)
+    cost = Column(Numeric(18,3), default=0) # Unit cost; set by the costing engine for issues
+    movement_date = Column(Date, primary_key=True) # Partition key
     ref_no = Column(String(50))
     created_by = Column(Integer, nullable=True) # Changed to nullable=True
     created_at = Column(TIMESTAMP, default=func.now())
 
     item = relationship("Item")
 
+    __table_args__ = (
+        Index("ix_stock_movement_item_warehouse_date", "item_id", "warehouse_id", "movement_date", "id"),
+        {"postgresql_partition_by": "RANGE (movement_date)"},
+    )
+    __mapper_args__ = {"primary_key": [id]}
+
     def __repr__(self):
         return f"<StockMovement(item_id={self.item_id}, type={self.movement_type}, quantity={self.quantity})>"
 
+class ItemCostState(Base):
+    __tablename__ = "item_cost_state"
+
+    item_id = Column(Integer, ForeignKey("item.id"), primary_key=True)
+    warehouse_id = Column(Integer, primary_key=True, default=0) # 0: movements without a warehouse
+    company_id = Column(Integer)
+    quantity_on_hand = Column(Numeric(18,3), nullable=False, default=0)
+    total_value = Column(Numeric(18,3), nullable=False, default=0)
+    average_cost = Column(Numeric(18,6), nullable=False, default=0)
+    last_movement_date = Column(Date)
+    updated_at = Column(TIMESTAMP, default=func.now(), onupdate=func.now())
+
+    def __repr__(self):
+        return f"<ItemCostState(item_id={self.item_id}, warehouse_id={self.warehouse_id}, qty={self.quantity_on_hand}, avg={self.average_cost})>"
+
+class ItemCostLayer(Base):
+    __tablename__ = "item_cost_layer"
+
+    movement_id = Column(BigInteger, primary_key=True, autoincrement=False) # Receipt that opened the layer (no FK: stock_movement is partitioned)
+    item_id = Column(Integer, ForeignKey("item.id"), nullable=False)
+    warehouse_id = Column(Integer, nullable=False, default=0)
+    layer_date = Column(Date, nullable=False)
+    original_quantity = Column(Numeric(18,3), nullable=False)
+    remaining_quantity = Column(Numeric(18,3), nullable=False)
+    unit_cost = Column(Numeric(18,6), nullable=False)
+
+    __table_args__ = (
+        Index("ix_item_cost_layer_open", "item_id", "warehouse_id", "layer_date", "movement_id", postgresql_where=text("remaining_quantity > 0")),
+    )
+
+    def __repr__(self):
+        return f"<ItemCostLayer(movement_id={self.movement_id}, remaining={self.remaining_quantity}, unit_cost={self.unit_cost})>"
+
+class ItemCostCheckpoint(Base):
+    __tablename__ = "item_cost_checkpoint"
+
+    item_id = Column(Integer, ForeignKey("item.id"), primary_key=True)
+    warehouse_id = Column(Integer, primary_key=True, default=0)
+    checkpoint_date = Column(Date, primary_key=True) # State after every movement up to and including this date
+    quantity_on_hand = Column(Numeric(18,3), nullable=False)
+    total_value = Column(Numeric(18,3), nullable=False)
+    average_cost = Column(Numeric(18,6), nullable=False)
+    open_layers = Column(Text) # JSON [[movement_id, layer_date, remaining, unit_cost, original], ...]
+
+    def __repr__(self):
+        return f"<ItemCostCheckpoint(item_id={self.item_id}, warehouse_id={self.warehouse_id}, date='{self.checkpoint_date}')>"
+
 class SalesOrder(Base):
     __tablename__ = "sales_order"
 
@@ -272,10 +432,33 @@ class SalesOrder(Base):
     created_at = Column(TIMESTAMP, default=func.now())
 
     customer = relationship("Customer")
+    lines = relationship("SalesOrderLine", back_populates="order", cascade="all, delete-orphan")
 
     def __repr__(self):
         return f"<SalesOrder(order_no='{self.order_no}', total={self.total_amount})>"
 
+class SalesOrderLine(Base):
+    __tablename__ = "sales_order_line"
+
+    id = Column(BigInteger, primary_key=True)
+    order_id = Column(BigInteger, ForeignKey("sales_order.id", ondelete="CASCADE"), nullable=False)
+    item_id = Column(Integer, ForeignKey("item.id"), nullable=False)
+    warehouse_id = Column(Integer, ForeignKey("warehouse.id")) # Issued from on conversion
+    quantity = Column(Numeric(18,3), nullable=False)
+    unit_price = Column(Numeric(18,3), nullable=False)
+    discount_percentage = Column(Numeric(5,2), default=0)
+    total_line_amount = Column(Numeric(18,3), nullable=False)
+    memo = Column(Text)
+
+    order = relationship("SalesOrder", back_populates="lines")
+
+    __table_args__ = (
+        Index("ix_sales_order_line_order", "order_id"),
+    )
+
+    def __repr__(self):
+        return f"<SalesOrderLine(order_id={self.order_id}, item_id={self.item_id}, quantity={self.quantity})>"
+
 class PurchaseOrder(Base):
     __tablename__ = "purchase_order"
 
@@ -293,10 +476,47 @@ class PurchaseOrder(Base):
     created_at = Column(TIMESTAMP, default=func.now())
 
     supplier = relationship("Supplier") # Changed from vendor
+    lines = relationship("PurchaseOrderLine", back_populates="order", cascade="all, delete-orphan")
 
     def __repr__(self):
         return f"<PurchaseOrder(order_no='{self.order_no}', total={self.total_amount})>"
 
+class PurchaseOrderLine(Base):
+    __tablename__ = "purchase_order_line"
+
+    id = Column(BigInteger, primary_key=True)
+    order_id = Column(BigInteger, ForeignKey("purchase_order.id", ondelete="CASCADE"), nullable=False)
+    item_id = Column(Integer, ForeignKey("item.id"), nullable=False)
+    warehouse_id = Column(Integer, ForeignKey("warehouse.id")) # Received into on conversion
+    quantity = Column(Numeric(18,3), nullable=False)
+    unit_price = Column(Numeric(18,3), nullable=False)
+    discount_percentage = Column(Numeric(5,2), default=0)
+    total_line_amount = Column(Numeric(18,3), nullable=False)
+    memo = Column(Text)
+
+    order = relationship("PurchaseOrder", back_populates="lines")
+
+    __table_args__ = (
+        Index("ix_purchase_order_line_order", "order_id"),
+    )
+
+    def __repr__(self):
+        return f"<PurchaseOrderLine(order_id={self.order_id}, item_id={self.item_id}, quantity={self.quantity})>"
+
+class OrderConversion(Base):
+    __tablename__ = "order_conversion"
+
+    # Written in the same transaction as the invoice, so a rerun skips exactly the orders already converted
+    order_type = Column(SmallInteger, primary_key=True) # 0: Sales order, 1: Purchase order
+    order_id = Column(BigInteger, primary_key=True)
+    invoice_id = Column(BigInteger, ForeignKey("invoice.id", ondelete="CASCADE"), nullable=False)
+    journal_entry_id = Column(BigInteger) # Null when no posting accounts were given
+    converted_by = Column(Integer, nullable=False)
+    converted_at = Column(TIMESTAMP, default=func.now())
+
+    def __repr__(self):
+        return f"<OrderConversion(order_type={self.order_type}, order_id={self.order_id}, invoice_id={self.invoice_id})>"
+
 class BankTransaction(Base):
     __tablename__ = "bank_transaction"
 
@@ -310,12 +530,31 @@ class BankTransaction(Base):
     transaction_date = Column(Date, nullable=False)
     ref_no = Column(String(50))
     description = Column(Text)
+    is_reconciled = Column(Boolean, nullable=False, default=False) # Set by the reconciliation matching engine
+    reconciliation_id = Column(BigInteger, ForeignKey("bank_reconciliation.id"), nullable=True)
     created_by = Column(Integer, nullable=False)
     created_at = Column(TIMESTAMP, default=func.now())
 
+    __table_args__ = (
+        Index("ix_bank_transaction_account_date", "bank_account_id", "transaction_date", "id"),
+        Index("ix_bank_transaction_company_date", "company_id", "transaction_date"),
+        Index("ix_bank_transaction_unreconciled", "bank_account_id", "transaction_date", postgresql_where=text("NOT is_reconciled")),
+    )
+
     def __repr__(self):
         return f"<BankTransaction(id={self.id}, amount={self.amount}, type={self.transaction_type})>"
 
+class BankBalanceSnapshot(Base):
+    __tablename__ = "bank_balance_snapshot"
+
+    # Opening balance of each month per bank account, kept current as transactions are written
+    bank_account_id = Column(Integer, primary_key=True)
+    month_start = Column(Date, primary_key=True)
+    balance = Column(Numeric(18,3), nullable=False, default=0) # Signed total of the transactions dated before month_start
+
+    def __repr__(self):
+        return f"<BankBalanceSnapshot(bank_account_id={self.bank_account_id}, month_start={self.month_start}, balance={self.balance})>"
+
 class BankReconciliation(Base):
     __tablename__ = "bank_reconciliation"
 
@@ -331,9 +570,51 @@ class BankReconciliation(Base):
     created_by = Column(Integer, nullable=False)
     created_at = Column(TIMESTAMP, default=func.now())
 
+    __table_args__ = (
+        Index("ix_bank_reconciliation_account_date", "bank_account_id", "reconciliation_date", "id"),
+    )
+
     def __repr__(self):
         return f"<BankReconciliation(id={self.id}, date='{self.reconciliation_date}', reconciled={self.is_reconciled})>"
 
+class BankStatementLine(Base):
+    __tablename__ = "bank_statement_line"
+
+    id = Column(BigInteger, primary_key=True)
+    company_id = Column(Integer, nullable=False)
+    bank_account_id = Column(Integer, nullable=False)
+    statement_date = Column(Date, nullable=False)
+    amount = Column(Numeric(18,3), nullable=False) # Signed: positive for credits to the account
+    ref_no = Column(String(100))
+    description = Column(Text)
+    source_file = Column(Text)
+    line_hash = Column(String(64)) # Identifies the line within the account, so a re-imported statement adds nothing
+    is_matched = Column(Boolean, nullable=False, default=False)
+    reconciliation_id = Column(BigInteger, ForeignKey("bank_reconciliation.id"), nullable=True)
+    created_at = Column(TIMESTAMP, default=func.now())
+
+    __table_args__ = (
+        Index("ix_bank_statement_line_unmatched", "bank_account_id", "statement_date", postgresql_where=text("NOT is_matched")),
+        Index("ux_bank_statement_line_hash", "bank_account_id", "line_hash", unique=True),
+    )
+
+    def __repr__(self):
+        return f"<BankStatementLine(id={self.id}, date='{self.statement_date}', amount={self.amount})>"
+
+class BankReconciliationMatch(Base):
+    __tablename__ = "bank_reconciliation_match"
+
+    # A match group links one or more statement lines to one or more book transactions
+    id = Column(BigInteger, primary_key=True)
+    reconciliation_id = Column(BigInteger, ForeignKey("bank_reconciliation.id", ondelete="CASCADE"), nullable=False)
+    match_group = Column(Integer, nullable=False)
+    statement_line_id = Column(BigInteger, ForeignKey("bank_statement_line.id"), nullable=True)
+    bank_transaction_id = Column(BigInteger, ForeignKey("bank_transaction.id"), nullable=True)
+    match_rule = Column(String(20), nullable=False) # ref, amount_date, one_to_many, many_to_one
+
+    def __repr__(self):
+        return f"<BankReconciliationMatch(group={self.match_group}, line={self.statement_line_id}, transaction={self.bank_transaction_id})>"
+
 class FixedAsset(Base):
     __tablename__ = "fixed_asset"
 
@@ -568,6 +849,36 @@ class FiscalPeriod(Base):
     def __repr__(self):
         return f"<FiscalPeriod(year={self.year}, is_open={self.is_open})>"
 
+class AccountBalanceSnapshot(Base):
+    __tablename__ = "account_balance_snapshot"
+
+    company_id = Column(Integer, ForeignKey("company.id", ondelete="CASCADE"), primary_key=True)
+    as_of = Column(Date, primary_key=True) # end_date of the closed fiscal period
+    branch_id = Column(Integer, primary_key=True, default=0) # 0: entries without a branch
+    account_id = Column(Integer, ForeignKey("account.id"), primary_key=True)
+    fiscal_period_id = Column(Integer, ForeignKey("fiscal_period.id", ondelete="CASCADE"), nullable=False)
+    debit = Column(Numeric(18,3), nullable=False, default=0) # Posted totals from the first entry up to as_of
+    credit = Column(Numeric(18,3), nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<AccountBalanceSnapshot(account_id={self.account_id}, as_of='{self.as_of}', debit={self.debit}, credit={self.credit})>"
+
+class EliminationRule(Base):
+    __tablename__ = "elimination_rule"
+
+    # Intercompany balances removed from group consolidation
+    id = Column(Integer, primary_key=True)
+    name = Column(Text, nullable=False)
+    account_id = Column(Integer, ForeignKey("account.id"), nullable=False) # e.g. due from group companies
+    counterpart_account_id = Column(Integer, ForeignKey("account.id"), nullable=False) # e.g. due to group companies
+    difference_account_id = Column(Integer, ForeignKey("account.id")) # Unmatched remainder; null: left in place
+    is_active = Column(Boolean, default=True)
+    created_by = Column(Integer, default=1)
+    created_at = Column(TIMESTAMP, default=func.now())
+
+    def __repr__(self):
+        return f"<EliminationRule(name='{self.name}', account_id={self.account_id}, counterpart_account_id={self.counterpart_account_id})>"
+
 class CostCenter(Base):
     __tablename__ = "cost_center"
 
@@ -659,9 +970,24 @@ class Notification(Base):
     user = relationship("User", backref="notifications")
     company = relationship("Company", backref="notifications")
 
+    __table_args__ = (
+        Index("ix_notification_user_read_created", "user_id", "is_read", "created_at", "id"),
+    )
+
     def __repr__(self):
         return f"<Notification(id={self.id}, user_id={self.user_id}, message='{self.message[:20]}...')>"
 
+class NotificationCounter(Base):
+    __tablename__ = "notification_counter"
+
+    # Maintained on insert / mark-read / delete so the unread badge reads one row
+    user_id = Column(Integer, ForeignKey("user.id"), primary_key=True)
+    unread_count = Column(Integer, nullable=False, default=0)
+    updated_at = Column(TIMESTAMP, default=func.now(), onupdate=func.now())
+
+    def __repr__(self):
+        return f"<NotificationCounter(user_id={self.user_id}, unread_count={self.unread_count})>"
+
 class Workflow(Base):
     __tablename__ = "workflow"
 
@@ -707,12 +1033,12 @@ class Shift(Base):
 class ShiftMovement(Base):
     __tablename__ = "shift_movements"
 
-    id = Column(Integer, primary_key=True)
+    id = Column(Integer, primary_key=True, autoincrement=True)
     shift_id = Column(Integer, ForeignKey("shifts.id"), nullable=False)
     movement_type = Column(SmallInteger, nullable=False) # 0: Cash In, 1: Cash Out, 2: Sale, 3: Return
     amount = Column(Numeric(18, 3), nullable=False)
     notes = Column(Text)
-    transaction_time = Column(TIMESTAMP, nullable=False, default=func.now())
+    transaction_time = Column(TIMESTAMP, primary_key=True, default=func.now()) # Partition key
     sales_invoice_id = Column(BigInteger, ForeignKey("invoice.id"), nullable=True)
     return_invoice_id = Column(BigInteger, ForeignKey("invoice.id"), nullable=True)
 
@@ -720,5 +1046,32 @@ class ShiftMovement(Base):
     sales_invoice = relationship("Invoice", foreign_keys=[sales_invoice_id])
     return_invoice = relationship("Invoice", foreign_keys=[return_invoice_id])
 
+    __table_args__ = (
+        Index("ix_shift_movements_shift", "shift_id"),
+        {"postgresql_partition_by": "RANGE (transaction_time)"},
+    )
+    __mapper_args__ = {"primary_key": [id]}
+
     def __repr__(self):
         return f"<ShiftMovement(id={self.id}, shift_id={self.shift_id}, type={self.movement_type}, amount={self.amount})>"
+
+class ArchivedPartition(Base):
+    __tablename__ = "archived_partition"
+
+    # One row per closed year detached from a partitioned history table
+    table_name = Column(String(63), primary_key=True)
+    year = Column(SmallInteger, primary_key=True)
+    location = Column(SmallInteger, nullable=False, default=0) # 0: Table in the archive schema, 1: Compressed file only
+    archive_table = Column(String(63)) # Table name in the archive schema (location 0)
+    file_path = Column(Text) # gzip COPY file, kept after a restore
+    row_count = Column(BigInteger, nullable=False, default=0)
+    archived_at = Column(TIMESTAMP, default=func.now())
+
+    def __repr__(self):
+        return f"<ArchivedPartition(table='{self.table_name}', year={self.year}, location={self.location})>"
+
+# Rows of years without a yearly partition land in the default partition until app.infrastructure.partitioning adds one
+for _partitioned in (JournalLine, StockMovement, ShiftMovement):
+    event.listen(_partitioned.__table__, "after_create", DDL(
+        f"CREATE TABLE IF NOT EXISTS {_partitioned.__tablename__}_default PARTITION OF {_partitioned.__tablename__} DEFAULT"
+    ).execute_if(dialect="postgresql"))
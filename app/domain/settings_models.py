@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, ForeignKey, func, TIMESTAMP, Numeric, Text
+from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, ForeignKey, func, TIMESTAMP, Numeric, Text, Date
 from sqlalchemy.orm import relationship
 from app.infrastructure.database import Base
 import datetime
@@ -46,6 +46,21 @@ class Currency(Base):
     def __repr__(self):
         return f"<Currency(code='{self.code}', name_ar='{self.name_ar}')>"
 
+# --- ExchangeRate Model ---
+class ExchangeRate(Base):
+    __tablename__ = "exchange_rate_history"
+
+    currency_id = Column(Integer, ForeignKey("currencies.id", ondelete="CASCADE"), primary_key=True)
+    rate_date = Column(Date, primary_key=True) # Effective from this date until the next entry
+    rate = Column(Numeric(18,6), nullable=False) # Same basis as Currency.exchange_rate
+    created_by = Column(Integer, default=1)
+    created_at = Column(TIMESTAMP, default=func.now())
+
+    currency = relationship("Currency")
+
+    def __repr__(self):
+        return f"<ExchangeRate(currency_id={self.currency_id}, date='{self.rate_date}', rate={self.rate})>"
+
 # --- PaymentMethod Model ---
 class PaymentMethod(Base):
     __tablename__ = "payment_methods"
@@ -74,6 +89,8 @@ class Coupon(Base):
     min_purchase_amount = Column(Float, default=0.0)
     valid_from = Column(DateTime, default=datetime.datetime.now)
     valid_until = Column(DateTime)
+    priority = Column(Integer, default=0) # Higher priority coupons are applied first
+    is_stackable = Column(Boolean, default=True) # False: cannot be combined with other coupons
     is_active = Column(Boolean, default=True)
 
     company = relationship("Company") # Removed back_populates="coupons"
@@ -110,6 +127,7 @@ class LoyaltyProgram(Base):
     min_redemption_points = Column(Integer, default=100) # Minimum points required to redeem (for 'points' type)
     cashback_percentage = Column(Float, default=0.0) # New: Percentage of cashback (for 'cashback' type)
     min_purchase_amount_for_cashback = Column(Float, default=0.0) # New: Minimum purchase amount for cashback (for 'cashback' type)
+    points_validity_days = Column(Integer, nullable=True) # Days before accrued points expire, NULL: never expire
     is_active = Column(Boolean, default=True)
 
     company = relationship("Company")
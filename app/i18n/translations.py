@@ -4,20 +4,89 @@ Supports Arabic and English with RTL/LTR support
 """
 
 import json
+import marshal
 import os
+import sys
+from functools import lru_cache
+
+LANGUAGES = ('ar', 'en')
+
+# Compiled tables are cached next to this module's bytecode and rebuilt when the source changes
+CACHE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '__pycache__', 'translations.marshal')
+
+
+def compile_translations(tree: dict, languages=LANGUAGES) -> dict:
+    """Flatten the nested TRANSLATIONS tree into one {dotted key: text} dict per language.
+
+    A leaf is a dict of language -> text; a missing language falls back to
+    English, then to the key itself, exactly as the nested lookup did.
+    """
+    tables = {language: {} for language in languages}
+    stack = [('', tree)]
+    while stack:
+        prefix, node = stack.pop()
+        for name, value in node.items():
+            key = sys.intern(prefix + name)
+            if isinstance(value, dict) and value and all(isinstance(v, str) for v in value.values()):
+                for language in languages:
+                    tables[language][key] = value.get(language, value.get('en', key))
+            elif isinstance(value, dict):
+                stack.append((key + '.', value))
+            else:
+                for language in languages:
+                    tables[language][key] = value
+    return tables
+
+
+def _source_fingerprint():
+    stat = os.stat(__file__)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def load_compiled_translations(tree: dict, cache_file: str = CACHE_FILE) -> dict:
+    """Compiled tables from the cache file when it matches this source, otherwise compile (and try to cache)"""
+    fingerprint = _source_fingerprint()
+    if cache_file:
+        try:
+            with open(cache_file, 'rb') as f:
+                cached = marshal.load(f)
+            if cached.get('fingerprint') == fingerprint:
+                return {language: {sys.intern(k): v for k, v in table.items()}
+                        for language, table in cached['tables'].items()}
+        except (OSError, EOFError, ValueError, TypeError, KeyError, AttributeError):
+            pass
+    tables = compile_translations(tree)
+    if cache_file:
+        try:
+            os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+            with open(cache_file, 'wb') as f:
+                marshal.dump({'fingerprint': fingerprint, 'tables': tables}, f)
+        except OSError:
+            pass # The cache is optional: a read-only install just compiles at startup
+    return tables
+
+
+@lru_cache(maxsize=4096)
+def _format_template(template: str, arguments: tuple) -> str:
+    return template.format(**dict(arguments))
+
 
 class Translator:
     """Simple translation system for the ERP application"""
     
-    def __init__(self, language='ar'):
+    def __init__(self, language='ar', tables=None):
         """
         Initialize translator
         
         Args:
             language: 'ar' for Arabic, 'en' for English
+            tables: Compiled per-language tables (see compile_translations)
         """
         self.language = self.load_saved_language() or language
         self.translations = TRANSLATIONS
+        self.tables = tables if tables is not None else load_compiled_translations(TRANSLATIONS)
+        self._table = self.tables.get(self.language, self.tables['en'])
+        self.generation = 0 # Bumped on every language switch; widgets compare it to re-label lazily
         self.config_file = 'language_config.json'
     
     def tr(self, key, **kwargs):
@@ -31,31 +100,24 @@ class Translator:
         Returns:
             Translated string
         """
-        keys = key.split('.')
-        value = self.translations
-        
-        try:
-            for k in keys:
-                value = value[k]
-            
-            # Get translation for current language
-            if isinstance(value, dict):
-                translated = value.get(self.language, value.get('en', key))
-            else:
-                translated = value
-            
-            # Format with kwargs if provided
-            if kwargs:
-                translated = translated.format(**kwargs)
-            
+        translated = self._table.get(key, key)
+        if not kwargs:
             return translated
-        except (KeyError, TypeError):
+        try:
+            # Memoized per (template, arguments): re-labelling repeats the same calls
+            return _format_template(translated, tuple(sorted(kwargs.items())))
+        except TypeError: # Unhashable argument
+            return translated.format(**kwargs)
+        except (KeyError, IndexError, ValueError):
             return key
     
     def set_language(self, language):
         """Change current language and save it"""
-        if language in ['ar', 'en']:
+        if language in LANGUAGES:
+            if language != self.language:
+                self.generation += 1
             self.language = language
+            self._table = self.tables[language]
             self.save_language(language)
     
     def get_language(self):
@@ -544,3 +606,7 @@ def set_language(language):
 def get_language():
     """Get current language"""
     return _translator.get_language()
+
+def get_translation_generation():
+    """Changes whenever the language does"""
+    return _translator.generation
@@ -0,0 +1,335 @@
+"""
+Labeeb ERP - Audit Log
+Captures ORM changes as compact diffs and writes them to audit_log in batches from a background thread
+"""
+
+import atexit
+import contextvars
+import datetime
+import enum
+import queue
+import re
+import threading
+import time
+from decimal import Decimal
+from typing import Dict, List, Optional
+
+from sqlalchemy import event, inspect, insert
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.elements import TextClause
+
+from app.infrastructure.database import SessionLocal, engine as default_engine
+from app.domain.models import AuditLog
+
+# Derived/cache tables rewritten on every business write; auditing them would only add noise
+AUDIT_EXCLUDED_TABLES = {
+    'audit_log', 'item_cost_state', 'item_cost_layer', 'item_cost_checkpoint',
+    'customer_exposure', 'loyalty_account', 'notification_counter',
+}
+
+# Bound parameters are kept on a statement's audit entry only while there are this few of them (not for multi-row VALUES)
+AUDIT_MAX_PARAMS = 20
+
+# Target table of INSERT / UPDATE / DELETE text(); the first one found is the outer statement, after any WITH queries
+_TEXT_DML = re.compile(r'\b(INSERT\s+INTO|UPDATE|DELETE\s+FROM)\s+"?(\w+)"?', re.IGNORECASE)
+_TEXT_ACTIONS = {'INSERT': 'create', 'UPDATE': 'update', 'DELETE': 'delete'}
+
+_audit_user_id = contextvars.ContextVar('audit_user_id', default=None)
+
+
+def set_audit_user(user_id: Optional[int]):
+    """User recorded on the audit entries of the current thread/context"""
+    _audit_user_id.set(user_id)
+
+
+def _json_value(value):
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, (datetime.date, datetime.datetime, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, enum.Enum):
+        return value.value
+    if isinstance(value, (dict, list)):
+        return value
+    return str(value)
+
+
+def _entity_id(state) -> str:
+    identity = state.identity or state.mapper.primary_key_from_instance(state.obj())
+    return ','.join(str(v) for v in identity) if identity else None
+
+
+def _column_values(state) -> Dict:
+    return {attr.key: _json_value(getattr(state.obj(), attr.key)) for attr in state.mapper.column_attrs}
+
+
+def _changed_values(state):
+    before = {}
+    after = {}
+    for attr in state.mapper.column_attrs:
+        history = state.attrs[attr.key].history
+        if not history.has_changes():
+            continue
+        new = history.added[0] if history.added else None
+        if history.deleted:
+            old = history.deleted[0]
+            if old == new:
+                continue
+            before[attr.key] = _json_value(old)
+        # No deleted value: the attribute was expired when it changed, so the old value is unknown
+        after[attr.key] = _json_value(new)
+    return before, after
+
+
+def capture_flush(session: Session, flush_context):
+    """after_flush: build the audit rows of this flush (ids are assigned, pre-flush history still available)"""
+    pending = session.info.setdefault('audit_pending', [])
+    user_id = _audit_user_id.get()
+    now = datetime.datetime.now()
+    for action, objects in (('create', session.new), ('update', session.dirty), ('delete', session.deleted)):
+        for obj in objects:
+            state = inspect(obj)
+            if state.mapper.local_table.name in AUDIT_EXCLUDED_TABLES:
+                continue
+            if action == 'create':
+                before, after = None, _column_values(state)
+            elif action == 'delete':
+                before, after = _column_values(state), None
+            else:
+                before, after = _changed_values(state)
+                if not after:
+                    continue
+            pending.append({
+                'entity': state.mapper.local_table.name,
+                'entity_id': _entity_id(state),
+                'action': action,
+                'user_id': user_id if user_id is not None else getattr(obj, 'created_by', None),
+                'at': now,
+                'before': before,
+                'after': after,
+                '_captured': time.monotonic()
+            })
+
+
+def audit_bulk_write(session: Session, entity: str, action: str, details: Dict):
+    """Queue one audit entry for a set-based write the flush never sees; it is written when the session commits"""
+    session.info.setdefault('audit_pending', []).append({
+        'entity': entity,
+        'entity_id': None,
+        'action': action,
+        'user_id': _audit_user_id.get(),
+        'at': datetime.datetime.now(),
+        'before': None,
+        'after': {key: _json_value(value) for key, value in details.items()},
+        '_captured': time.monotonic()
+    })
+
+
+def _statement_target(orm_execute_state):
+    """(table, action) of a set-based write, or None for reads"""
+    statement = orm_execute_state.statement
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        table = getattr(statement, 'table', None)
+        if table is None:
+            return None
+        action = 'create' if orm_execute_state.is_insert else 'update' if orm_execute_state.is_update else 'delete'
+        return table.name, action
+    if isinstance(statement, TextClause) and not statement.text.lstrip().upper().startswith('SELECT'):
+        match = _TEXT_DML.search(statement.text)
+        if match:
+            return match.group(2), _TEXT_ACTIONS[match.group(1).split()[0].upper()]
+    return None
+
+
+def capture_statement(orm_execute_state):
+    """do_orm_execute: audit insert()/update()/delete() and text() DML, which never reach the flush.
+
+    One entry per statement with its row count and (short) parameters. Sessions
+    that audit their set-based writes themselves set info['audit_statements'] = False.
+    """
+    session = orm_execute_state.session
+    if not session.info.get('audit_statements', True):
+        return None
+    target = _statement_target(orm_execute_state)
+    if target is None or target[0] in AUDIT_EXCLUDED_TABLES:
+        return None
+    result = orm_execute_state.invoke_statement()
+    details = {'rows': getattr(result, 'rowcount', None)}
+    parameters = orm_execute_state.parameters
+    if isinstance(parameters, list):
+        details['batch'] = len(parameters) # executemany
+    else:
+        if not parameters and not isinstance(orm_execute_state.statement, TextClause):
+            parameters = orm_execute_state.statement.compile().params
+        if parameters and len(parameters) <= AUDIT_MAX_PARAMS:
+            details['params'] = {key: _json_value(value) for key, value in parameters.items()}
+    audit_bulk_write(session, target[0], target[1], details)
+    return result
+
+
+def publish_commit(session: Session):
+    pending = session.info.pop('audit_pending', None)
+    if pending:
+        get_audit_writer().submit(pending)
+
+
+def discard_rollback(session: Session):
+    session.info.pop('audit_pending', None)
+
+
+class AuditWriter:
+    """Bounded queue drained by one background thread that inserts audit rows in batches.
+
+    submit() only waits on the database when the writer falls behind: if the
+    queue stays full for put_timeout, the rest of the records are written
+    inline on the committing thread rather than lost, and counted in
+    inline_writes.
+    """
+
+    def __init__(self, bind=None, max_queue: int = 100_000, batch_size: int = 1000,
+                 flush_interval: float = 0.5, put_timeout: float = 0.1):
+        self.bind = bind or default_engine
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._metrics_lock = threading.Lock() # submit() runs on many threads, _write() on two
+        self.metrics = {
+            'enqueued': 0,
+            'written': 0,
+            'batches': 0,
+            'inline_writes': 0,
+            'errors': 0,
+            'last_batch_size': 0,
+            'last_flush_ms': 0.0,
+            'last_lag_ms': 0.0,
+            'max_lag_ms': 0.0,
+        }
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+            self._thread.start()
+        atexit.register(self.shutdown)
+
+    def submit(self, records: List[dict]):
+        enqueued = 0
+        for record in records:
+            try:
+                self._queue.put(record, timeout=self.put_timeout)
+            except queue.Full:
+                break
+            enqueued += 1
+        overflow = records[enqueued:]
+        with self._metrics_lock:
+            self.metrics['enqueued'] += enqueued
+            self.metrics['inline_writes'] += len(overflow)
+        if overflow:
+            self._write(overflow) # One batch, not a transaction per record
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def get_metrics(self) -> dict:
+        with self._metrics_lock:
+            metrics = dict(self.metrics)
+        metrics['queue_depth'] = self.queue_depth
+        return metrics
+
+    def _drain(self, first=None) -> List[dict]:
+        batch = [first] if first is not None else []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                first = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            self._write(self._drain(first))
+        # Shutdown: flush whatever is still queued
+        while True:
+            batch = self._drain()
+            if not batch:
+                break
+            self._write(batch)
+
+    def _write(self, batch: List[dict]):
+        started = time.monotonic()
+        oldest = min(record['_captured'] for record in batch)
+        rows = [{k: v for k, v in record.items() if k != '_captured'} for record in batch]
+        try:
+            with self.bind.begin() as connection:
+                # executemany; psycopg2 batches it into multi-row INSERTs
+                connection.execute(insert(AuditLog.__table__), rows)
+        except Exception as e:
+            with self._metrics_lock:
+                self.metrics['errors'] += 1
+            print(f"Error writing {len(rows)} audit log entries: {e}")
+            return
+        finished = time.monotonic()
+        lag_ms = (finished - oldest) * 1000
+        with self._metrics_lock:
+            self.metrics['written'] += len(rows)
+            self.metrics['batches'] += 1
+            self.metrics['last_batch_size'] = len(rows)
+            self.metrics['last_flush_ms'] = (finished - started) * 1000
+            self.metrics['last_lag_ms'] = lag_ms
+            self.metrics['max_lag_ms'] = max(self.metrics['max_lag_ms'], lag_ms)
+
+    def shutdown(self, timeout: float = 30.0):
+        """Stop the writer after durably flushing every queued entry"""
+        self._stop.set()
+        thread = self._thread
+        if thread is not None and thread.is_alive():
+            thread.join(timeout)
+        # Anything left (thread never started, or join timed out) is written here
+        while True:
+            batch = self._drain()
+            if not batch:
+                break
+            self._write(batch)
+
+
+# Global audit writer instance
+_audit_writer = None
+
+def get_audit_writer() -> AuditWriter:
+    """Get the global audit writer instance"""
+    global _audit_writer
+    if _audit_writer is None:
+        _audit_writer = AuditWriter()
+    return _audit_writer
+
+
+def install_audit_log(session_factory=SessionLocal, writer: AuditWriter = None) -> AuditWriter:
+    """Audit every session created by session_factory and start the background writer.
+
+    ORM unit-of-work changes are captured per row at flush; set-based
+    insert()/update()/delete() and text() DML get one entry per statement.
+    """
+    global _audit_writer
+    if writer is not None:
+        _audit_writer = writer
+    if not event.contains(session_factory, 'after_flush', capture_flush):
+        event.listen(session_factory, 'after_flush', capture_flush)
+        event.listen(session_factory, 'do_orm_execute', capture_statement)
+        event.listen(session_factory, 'after_commit', publish_commit)
+        event.listen(session_factory, 'after_rollback', discard_rollback)
+    writer = get_audit_writer()
+    writer.start()
+    return writer
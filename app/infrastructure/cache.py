@@ -0,0 +1,64 @@
+"""
+Labeeb ERP - Load-Once Cache
+In-process value loaded on first use and dropped on invalidation, shared by the lookup engines
+"""
+
+import threading
+from typing import Callable, Generic, Optional, TypeVar
+
+T = TypeVar('T')
+
+
+class LoadOnceCache(Generic[T]):
+    """Holds one value built by loader() on first get() until invalidate().
+
+    Loads run one at a time and readers of a loaded value take no lock.
+    invalidate() does not wait for a load in flight: that load is returned to
+    its caller but not kept, since it may predate the change.
+    """
+
+    def __init__(self, loader: Callable[[], T]):
+        self.loader = loader
+        self._value: Optional[T] = None
+        self._version = 0
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+
+    @property
+    def version(self) -> int:
+        """Bumped by every invalidate()"""
+        return self._version
+
+    def peek(self) -> Optional[T]:
+        """The loaded value, or None without loading it"""
+        return self._value
+
+    def get(self) -> T:
+        value = self._value
+        if value is not None:
+            return value
+        with self._load_lock: # One load at a time; invalidate() does not wait for it
+            value = self._value
+            if value is not None:
+                return value
+            version = self._version
+            value = self.loader()
+            with self._lock:
+                # Only publish if no invalidation happened while loading
+                if self._version == version:
+                    self._value = value
+            return value
+
+    def invalidate(self):
+        with self._lock:
+            self._version += 1
+            self._value = None
+
+    def update(self, version: int, apply: Callable[[T], None]) -> bool:
+        """Run apply(value) on the loaded value in place, unless it was invalidated since version was read.
+        Returns whether it ran."""
+        with self._lock:
+            if self._value is None or self._version != version:
+                return False
+            apply(self._value)
+            return True
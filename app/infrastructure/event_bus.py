@@ -0,0 +1,278 @@
+"""
+Labeeb ERP - Event Bus
+Delivers domain events to subscribers through bounded per-subscriber queues on worker threads
+"""
+
+import atexit
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+# Domain events published by the service layer after the transaction commits
+INVOICE_CREATED = 'invoice_created'
+PAYMENT_RECEIVED = 'payment_received'
+STOCK_MOVED = 'stock_moved'
+JOURNAL_POSTED = 'journal_posted'
+MASTER_DATA_IMPORTED = 'master_data_imported' # One per committed import batch
+
+# Backpressure policies applied when a subscriber's queue is full
+BLOCK = 'block' # Wait up to put_timeout for room, then drop the event
+DROP_NEWEST = 'drop_newest' # Drop the event being published
+DROP_OLDEST = 'drop_oldest' # Drop the oldest queued event to make room
+
+# Consecutive handler overruns after which a subscriber is paused (its events dropped) for SUSPEND_SECONDS
+MAX_CONSECUTIVE_TIMEOUTS = 3
+SUSPEND_SECONDS = 30.0
+
+
+class Subscriber:
+    """One subscriber's queue, worker thread and latency metrics.
+
+    Events are handed to batch_handler as a list of (event_name, data) pairs:
+    a burst is drained up to batch_size events, waiting at most batch_window
+    seconds for the batch to fill. A handler running longer than timeout
+    cannot be interrupted; the overrun is counted and, after repeated
+    overruns, the subscriber is paused so it stops holding events.
+    """
+
+    def __init__(self, name: str, batch_handler: Callable[[List[Tuple[str, Dict[str, Any]]]], None],
+                 events: Optional[Iterable[str]] = None, max_queue: int = 1000, policy: str = BLOCK,
+                 timeout: float = 5.0, put_timeout: float = 0.05, batch_size: int = 50, batch_window: float = 0.05):
+        if policy not in (BLOCK, DROP_NEWEST, DROP_OLDEST):
+            raise ValueError(f"Unknown backpressure policy: {policy}")
+        self.name = name
+        self.batch_handler = batch_handler
+        self.events = set(events) if events else None # None: all events
+        self.policy = policy
+        self.timeout = timeout
+        self.put_timeout = put_timeout
+        self.batch_size = max(batch_size, 1)
+        self.batch_window = batch_window
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stop = threading.Event()
+        self._suspended_until = 0.0
+        self._consecutive_timeouts = 0
+        self._thread = threading.Thread(target=self._run, name=f'event-bus-{name}', daemon=True)
+        self._metrics_lock = threading.Lock() # offer() runs on every publishing thread, _deliver() on the worker
+        self.metrics = {
+            'published': 0,
+            'delivered': 0,
+            'dropped': 0,
+            'errors': 0,
+            'timeouts': 0,
+            'batches': 0,
+            'last_latency_ms': 0.0,
+            'max_latency_ms': 0.0,
+            'total_latency_ms': 0.0,
+        }
+
+    def wants(self, event_name: str) -> bool:
+        return self.events is None or event_name in self.events
+
+    def start(self):
+        self._thread.start()
+
+    def _count(self, key: str, amount: int = 1):
+        with self._metrics_lock:
+            self.metrics[key] += amount
+
+    def offer(self, event: tuple) -> bool:
+        """Queue an event according to the backpressure policy; False if it was dropped"""
+        self._count('published')
+        if self._suspended_until and time.monotonic() < self._suspended_until:
+            self._count('dropped')
+            return False
+        try:
+            if self.policy == BLOCK:
+                self._queue.put(event, timeout=self.put_timeout)
+            else:
+                self._queue.put_nowait(event)
+            return True
+        except queue.Full:
+            pass
+        if self.policy == DROP_OLDEST:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                pass
+            self._count('dropped')
+            try:
+                self._queue.put_nowait(event)
+                return True
+            except queue.Full:
+                pass
+        self._count('dropped')
+        return False
+
+    def _next_batch(self, first: tuple) -> List[tuple]:
+        batch = [first]
+        deadline = time.monotonic() + self.batch_window
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            try:
+                first = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                if self._stop.is_set():
+                    return
+                continue
+            self._deliver(self._next_batch(first))
+
+    def _deliver(self, batch: List[tuple]):
+        started = time.monotonic()
+        try:
+            self.batch_handler([(event_name, data) for event_name, data, _ in batch])
+        except Exception as e:
+            self._count('errors')
+            print(f"Error in subscriber {self.name} handling {len(batch)} events: {e}")
+        finished = time.monotonic()
+
+        oldest_ms = (finished - min(published for _, _, published in batch)) * 1000
+        total_latency_ms = sum((finished - published) * 1000 for _, _, published in batch)
+        with self._metrics_lock:
+            self.metrics['delivered'] += len(batch)
+            self.metrics['batches'] += 1
+            self.metrics['last_latency_ms'] = oldest_ms
+            self.metrics['max_latency_ms'] = max(self.metrics['max_latency_ms'], oldest_ms)
+            self.metrics['total_latency_ms'] += total_latency_ms
+
+        if finished - started > self.timeout:
+            self._count('timeouts')
+            self._consecutive_timeouts += 1
+            print(f"Subscriber {self.name} took {finished - started:.1f} s for {len(batch)} events (timeout {self.timeout} s)")
+            if self._consecutive_timeouts >= MAX_CONSECUTIVE_TIMEOUTS:
+                self._suspended_until = time.monotonic() + SUSPEND_SECONDS
+                self._consecutive_timeouts = 0
+                print(f"Subscriber {self.name} paused for {SUSPEND_SECONDS:.0f} s after repeated timeouts")
+        else:
+            self._consecutive_timeouts = 0
+
+    def get_metrics(self) -> dict:
+        with self._metrics_lock:
+            metrics = dict(self.metrics)
+        metrics['queue_depth'] = self._queue.qsize()
+        total_latency_ms = metrics.pop('total_latency_ms')
+        metrics['avg_latency_ms'] = total_latency_ms / metrics['delivered'] if metrics['delivered'] else 0.0
+        metrics['suspended'] = time.monotonic() < self._suspended_until
+        return metrics
+
+    def stop(self, timeout: float = 5.0):
+        """Stop the worker once the queued events are delivered (or timeout expires)"""
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+
+
+class EventBus:
+    """Publishes events to every interested subscriber without running any handler on the caller's thread"""
+
+    def __init__(self):
+        self._subscribers: Dict[str, Subscriber] = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, name: str, batch_handler: Callable, events: Optional[Iterable[str]] = None, **options) -> Subscriber:
+        """Register a subscriber; options are passed to Subscriber (max_queue, policy, timeout, batch_size, ...)"""
+        subscriber = Subscriber(name, batch_handler, events, **options)
+        with self._lock:
+            previous = self._subscribers.get(name)
+            self._subscribers = {**self._subscribers, name: subscriber}
+        if previous is not None:
+            previous.stop()
+        subscriber.start()
+        return subscriber
+
+    def unsubscribe(self, name: str, timeout: float = 5.0):
+        with self._lock:
+            subscribers = dict(self._subscribers)
+            subscriber = subscribers.pop(name, None)
+            self._subscribers = subscribers
+        if subscriber is not None:
+            subscriber.stop(timeout)
+
+    def publish(self, event_name: str, data: Dict[str, Any]):
+        """Queue an event for its subscribers. data must be plain values, not ORM objects"""
+        subscribers = self._subscribers # Replaced, never mutated: safe to iterate without the lock
+        if not subscribers:
+            return
+        event = (event_name, data, time.monotonic())
+        for subscriber in subscribers.values():
+            if subscriber.wants(event_name):
+                subscriber.offer(event)
+
+    def get_metrics(self) -> Dict[str, dict]:
+        return {name: subscriber.get_metrics() for name, subscriber in self._subscribers.items()}
+
+    def shutdown(self, timeout: float = 5.0):
+        with self._lock:
+            subscribers = list(self._subscribers.values())
+            self._subscribers = {}
+        for subscriber in subscribers:
+            subscriber.stop(timeout)
+
+
+# Global event bus instance
+_event_bus = None
+
+def get_event_bus() -> EventBus:
+    """Get the global event bus instance"""
+    global _event_bus
+    if _event_bus is None:
+        _event_bus = EventBus()
+        atexit.register(_event_bus.shutdown)
+    return _event_bus
+
+
+def publish_event(event_name: str, data: Dict[str, Any]):
+    """Publish a domain event on the global bus"""
+    get_event_bus().publish(event_name, data)
+
+
+# ---- Event payloads ----
+
+def invoice_event_data(invoice) -> Dict[str, Any]:
+    return {
+        'invoice_id': invoice.id,
+        'company_id': invoice.company_id,
+        'branch_id': invoice.branch_id,
+        'invoice_type': invoice.invoice_type,
+        'invoice_no': invoice.invoice_no,
+        'invoice_date': invoice.invoice_date,
+        'customer_id': invoice.customer_id,
+        'supplier_id': invoice.supplier_id,
+        'total_amount': invoice.total_amount,
+        'total_tax': invoice.total_tax,
+        'currency': invoice.currency
+    }
+
+
+def payment_event_data(payment, invoice=None) -> Dict[str, Any]:
+    """Payment or InvoicePayment; the latter carries no company, so its invoice is passed"""
+    return {
+        'payment_id': payment.id,
+        'invoice_id': invoice.id if invoice is not None else payment.invoice_id,
+        'company_id': invoice.company_id if invoice is not None else payment.company_id,
+        'amount': payment.amount
+    }
+
+
+def stock_movement_event_data(movement) -> Dict[str, Any]:
+    return {
+        'movement_id': movement.id,
+        'company_id': movement.company_id,
+        'branch_id': movement.branch_id,
+        'item_id': movement.item_id,
+        'warehouse_id': movement.warehouse_id,
+        'movement_type': movement.movement_type,
+        'quantity': movement.quantity,
+        'cost': movement.cost,
+        'movement_date': movement.movement_date,
+        'ref_no': movement.ref_no
+    }
@@ -0,0 +1,152 @@
+"""
+Labeeb ERP - Notification Channel
+Pushes unread-count, item catalog and fiscal period changes to open clients over PostgreSQL LISTEN/NOTIFY, with an in-process fallback
+"""
+
+import json
+import select
+import threading
+from typing import Callable, Dict, List
+
+from app.infrastructure.database import engine as default_engine
+
+CHANNEL_NAME = 'labeeb_notifications'
+ITEM_CATALOG_CHANNEL = 'labeeb_item_catalog'
+FISCAL_PERIOD_CHANNEL = 'labeeb_fiscal_periods'
+
+
+class NotificationChannel:
+    """Delivers JSON messages to callbacks: {'user_id', 'unread_count', 'notification_id'} (plus
+    'read_ids' / 'deleted_id' when marking read or deleting) to per-user callbacks, messages without a user_id (e.g. item changes) to those subscribed with None.
+
+    On PostgreSQL the repository issues pg_notify inside the writing
+    transaction, so every client (this one included) hears about a change
+    exactly when it commits. Without a listener (other databases, or the
+    LISTEN connection failed) the repository hands the messages to
+    publish_local() after its commit instead.
+    Callbacks run on the listener thread; UI code must hop to its own thread.
+    """
+
+    def __init__(self, bind=None, channel: str = CHANNEL_NAME):
+        self.bind = bind or default_engine
+        self.channel = channel
+        self._callbacks: Dict[int, List[Callable[[dict], None]]] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.listening = False
+
+    @property
+    def uses_database(self) -> bool:
+        return self.bind.dialect.name == 'postgresql'
+
+    def subscribe(self, user_id: int, callback: Callable[[dict], None]):
+        with self._lock:
+            self._callbacks.setdefault(user_id, []).append(callback)
+
+    def unsubscribe(self, user_id: int, callback: Callable[[dict], None]):
+        with self._lock:
+            callbacks = self._callbacks.get(user_id, [])
+            if callback in callbacks:
+                callbacks.remove(callback)
+
+    def _dispatch(self, message: dict):
+        user_id = message.get('user_id')
+        with self._lock:
+            callbacks = list(self._callbacks.get(None, ()))
+            if user_id is not None:
+                callbacks = list(self._callbacks.get(user_id, ())) + callbacks
+        for callback in callbacks:
+            try:
+                callback(message)
+            except Exception as e:
+                print(f"Error delivering {self.channel} update {message}: {e}")
+
+    def publish_local(self, messages: List[dict]):
+        """Fallback delivery after commit, used only while no LISTEN connection is open"""
+        if self.listening:
+            return
+        for message in messages:
+            self._dispatch(message)
+
+    @staticmethod
+    def encode(message: dict) -> str:
+        return json.dumps(message, separators=(',', ':'))
+
+    # ---- LISTEN loop ----
+
+    def start(self):
+        """Open the LISTEN connection on a background thread (PostgreSQL only)"""
+        if not self.uses_database or (self._thread is not None and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._listen, name=f'{self.channel}-listener', daemon=True)
+        self._thread.start()
+
+    def _listen(self):
+        try:
+            raw = self.bind.raw_connection()
+        except Exception as e:
+            print(f"Notification listener unavailable, using in-process delivery: {e}")
+            return
+        try:
+            connection = raw.driver_connection
+            connection.autocommit = True
+            with connection.cursor() as cursor:
+                cursor.execute(f"LISTEN {self.channel}")
+            self.listening = True
+            while not self._stop.is_set():
+                # Wake up at least once a second to notice stop()
+                if select.select([connection], [], [], 1.0) == ([], [], []):
+                    continue
+                connection.poll()
+                while connection.notifies:
+                    notify = connection.notifies.pop(0)
+                    try:
+                        message = json.loads(notify.payload)
+                    except ValueError:
+                        continue
+                    self._dispatch(message)
+        except Exception as e:
+            print(f"Notification listener stopped, using in-process delivery: {e}")
+        finally:
+            self.listening = False
+            raw.close()
+
+    def stop(self, timeout: float = 2.0):
+        self._stop.set()
+        if self._thread is not None and self._thread.is_alive():
+            self._thread.join(timeout)
+
+
+# Global notification channel instance
+_notification_channel = None
+
+def get_notification_channel() -> NotificationChannel:
+    """Get the global notification channel instance"""
+    global _notification_channel
+    if _notification_channel is None:
+        _notification_channel = NotificationChannel()
+    return _notification_channel
+
+
+# Global item catalog channel instance
+_item_catalog_channel = None
+
+def get_item_catalog_channel() -> NotificationChannel:
+    """Get the global item catalog change channel instance"""
+    global _item_catalog_channel
+    if _item_catalog_channel is None:
+        _item_catalog_channel = NotificationChannel(channel=ITEM_CATALOG_CHANNEL)
+    return _item_catalog_channel
+
+
+# Global fiscal period channel instance
+_fiscal_period_channel = None
+
+def get_fiscal_period_channel() -> NotificationChannel:
+    """Get the global fiscal period change channel instance"""
+    global _fiscal_period_channel
+    if _fiscal_period_channel is None:
+        _fiscal_period_channel = NotificationChannel(channel=FISCAL_PERIOD_CHANNEL)
+    return _fiscal_period_channel
@@ -0,0 +1,421 @@
+"""
+Labeeb ERP - Table Partitioning
+Yearly range partitions for the high-volume history tables, and archival of closed fiscal years
+"""
+
+import gzip
+import json
+import os
+import re
+import threading
+import time
+from datetime import date
+from typing import Dict, List, Optional
+
+from sqlalchemy import text, select, union_all, table, column
+from sqlalchemy.orm import aliased
+
+from app.infrastructure.database import Base, engine as default_engine
+from app.domain.models import ArchivedPartition
+
+# Partitioned table -> partition key (a DATE or TIMESTAMP column)
+PARTITION_KEYS = {
+    'journal_line': 'entry_date',
+    'stock_movement': 'movement_date',
+    'shift_movements': 'transaction_time',
+}
+
+ARCHIVE_SCHEMA = 'archive'
+ARCHIVE_DIR = os.getenv("LABEEB_ARCHIVE_DIR", os.path.join(os.getcwd(), "archive"))
+LOCATION_SCHEMA = 0
+LOCATION_FILE = 1
+
+CONVERT_BATCH_IDS = 1_000_000 # Legacy ids copied per transaction by convert_table
+CATALOG_TTL = 60 # Seconds the archive catalog is cached for the query path
+
+
+def _year_bounds(year: int):
+    return f"'{year}-01-01'", f"'{year + 1}-01-01'"
+
+
+class PartitionManager:
+    """Creates yearly partitions, converts legacy tables and archives closed years.
+
+    Live data is a partitioned table with one partition per calendar year
+    (plus a default partition catching years that have none yet), so date
+    filtered queries only touch the years they ask for. Archiving a year
+    detaches its partition into the archive schema and, optionally, dumps it
+    to a gzip COPY file and drops the table. with_archive() puts archived
+    years back into a query when its date range reaches them.
+    """
+
+    def __init__(self, bind=None, archive_dir: str = None):
+        self.bind = bind or default_engine
+        self.archive_dir = archive_dir or ARCHIVE_DIR
+        self._catalog = None
+        self._catalog_loaded = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def uses_database(self) -> bool:
+        return self.bind.dialect.name == 'postgresql'
+
+    # ---- Introspection ----
+
+    @staticmethod
+    def _is_partitioned(connection, table_name: str) -> bool:
+        return bool(connection.execute(text(
+            "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:t))"
+        ), {'t': table_name}).scalar())
+
+    @staticmethod
+    def _partition_years(connection, table_name: str) -> Dict[int, str]:
+        """Attached yearly partitions: {year: partition name}"""
+        rows = connection.execute(text(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = to_regclass(:t)"
+        ), {'t': table_name})
+        years = {}
+        for (name,) in rows:
+            match = re.fullmatch(re.escape(table_name) + r'_y(\d{4})', name)
+            if match:
+                years[int(match.group(1))] = name
+        return years
+
+    def get_partitions(self) -> dict:
+        """{table: {'partitioned': bool, 'years': [...], 'archived': {year: location}}}"""
+        if not self.uses_database:
+            return {}
+        catalog = self._load_catalog(force=True)
+        with self.bind.connect() as connection:
+            return {
+                table_name: {
+                    'partitioned': self._is_partitioned(connection, table_name),
+                    'years': sorted(self._partition_years(connection, table_name)),
+                    'archived': {year: entry[0] for year, entry in catalog.get(table_name, {}).items()}
+                } for table_name in PARTITION_KEYS
+            }
+
+    # ---- Live partitions ----
+
+    def ensure_partitions(self, years_back: int = 0, years_ahead: int = 1):
+        """Create the yearly partitions around the current year and for every year found in a default partition"""
+        if not self.uses_database:
+            return
+        this_year = date.today().year
+        archived = self._load_catalog(force=True)
+        for table_name, key in PARTITION_KEYS.items():
+            try:
+                with self.bind.connect() as connection:
+                    if not self._is_partitioned(connection, table_name):
+                        print(f"{table_name} is not partitioned; run PartitionManager.convert_table('{table_name}') to migrate it")
+                        continue
+                    existing = self._partition_years(connection, table_name)
+                    stray = connection.execute(text(
+                        f'SELECT DISTINCT EXTRACT(YEAR FROM {key})::int FROM "{table_name}_default"'
+                    )).scalars().all()
+                wanted = set(range(this_year - years_back, this_year + years_ahead + 1)) | set(stray)
+                for year in sorted(wanted - set(existing) - set(archived.get(table_name, {}))):
+                    self.create_year_partition(table_name, year)
+            except Exception as e:
+                print(f"Error maintaining partitions of {table_name}: {e}")
+
+    def create_year_partition(self, table_name: str, year: int):
+        """Add the partition of one year, moving any rows of that year out of the default partition"""
+        key = PARTITION_KEYS[table_name]
+        name = f"{table_name}_y{year}"
+        lower, upper = _year_bounds(year)
+        default = f"{table_name}_default"
+        with self.bind.begin() as connection:
+            if year in self._partition_years(connection, table_name):
+                return
+            connection.execute(text(f'LOCK TABLE "{default}" IN ACCESS EXCLUSIVE MODE'))
+            stray = connection.execute(text(
+                f'SELECT EXISTS (SELECT 1 FROM "{default}" WHERE {key} >= {lower} AND {key} < {upper})'
+            )).scalar()
+            if not stray:
+                connection.execute(text(f'CREATE TABLE "{name}" PARTITION OF "{table_name}" FOR VALUES FROM ({lower}) TO ({upper})'))
+                return
+            # The default partition may not keep rows that a new partition covers: move them first
+            connection.execute(text(f'CREATE TABLE "{name}" (LIKE "{table_name}" INCLUDING DEFAULTS INCLUDING CONSTRAINTS)'))
+            connection.execute(text(
+                f'WITH moved AS (DELETE FROM "{default}" WHERE {key} >= {lower} AND {key} < {upper} RETURNING *) '
+                f'INSERT INTO "{name}" SELECT * FROM moved'
+            ))
+            connection.execute(text(f'ALTER TABLE "{table_name}" ATTACH PARTITION "{name}" FOR VALUES FROM ({lower}) TO ({upper})'))
+
+    # ---- Migration of existing databases ----
+
+    def convert_table(self, table_name: str, keep_legacy: bool = False, progress=None) -> int:
+        """Turn an existing unpartitioned table into the partitioned layout of the models.
+
+        One-off maintenance step; run it with the application stopped. The
+        old table is renamed to <table>_legacy, the partitioned table is
+        created from the model, and rows are copied over in id batches
+        (one transaction each). Returns the number of rows copied.
+        """
+        model_table = Base.metadata.tables[table_name]
+        key = PARTITION_KEYS[table_name]
+        legacy = f"{table_name}_legacy"
+        with self.bind.begin() as connection:
+            if self._is_partitioned(connection, table_name):
+                return 0
+            connection.execute(text(f'LOCK TABLE "{table_name}" IN ACCESS EXCLUSIVE MODE'))
+            sequence = connection.execute(text("SELECT pg_get_serial_sequence(:t, 'id')"), {'t': table_name}).scalar()
+            connection.execute(text(f'ALTER TABLE "{table_name}" RENAME TO "{legacy}"'))
+            # Free the index and sequence names the new table is created with
+            for (index_name,) in connection.execute(text(
+                "SELECT indexname FROM pg_indexes WHERE schemaname = current_schema() AND tablename = :t"
+            ), {'t': legacy}).all():
+                connection.execute(text(f'ALTER INDEX "{index_name}" RENAME TO "{index_name[:56]}_legacy"'))
+            if sequence:
+                connection.execute(text(f'ALTER SEQUENCE {sequence} RENAME TO "{legacy}_id_seq"'))
+            # Foreign keys cannot reference a partitioned table by id alone
+            for referencing, constraint in connection.execute(text(
+                "SELECT conrelid::regclass::text, conname FROM pg_constraint WHERE confrelid = to_regclass(:t) AND contype = 'f'"
+            ), {'t': legacy}).all():
+                connection.execute(text(f'ALTER TABLE {referencing} DROP CONSTRAINT "{constraint}"'))
+            model_table.create(connection)
+
+            source, key_expression = self._legacy_source(table_name, legacy)
+            years = connection.execute(text(f"SELECT DISTINCT EXTRACT(YEAR FROM {key_expression})::int FROM {source}")).scalars().all()
+            low_id, high_id = connection.execute(text(f'SELECT MIN(id), MAX(id) FROM "{legacy}"')).one()
+
+        for year in sorted(years):
+            self.create_year_partition(table_name, year)
+
+        columns = ', '.join(f'"{c.name}"' for c in model_table.columns)
+        values = ', '.join(key_expression if c.name == key else f'l."{c.name}"' for c in model_table.columns)
+        copied = 0
+        start = low_id or 0
+        while high_id is not None and start <= high_id:
+            with self.bind.begin() as connection:
+                copied += connection.execute(text(
+                    f'INSERT INTO "{table_name}" ({columns}) SELECT {values} FROM {source} '
+                    f'WHERE l.id >= :start AND l.id < :stop'
+                ), {'start': start, 'stop': start + CONVERT_BATCH_IDS}).rowcount
+            start += CONVERT_BATCH_IDS
+            if progress is not None:
+                progress(copied, None)
+
+        with self.bind.begin() as connection:
+            connection.execute(text(
+                f"SELECT setval(pg_get_serial_sequence(:t, 'id'), GREATEST((SELECT MAX(id) FROM \"{legacy}\"), 1))"
+            ), {'t': table_name})
+            legacy_count = connection.execute(text(f'SELECT COUNT(*) FROM "{legacy}"')).scalar()
+            if legacy_count != copied:
+                raise RuntimeError(f"{table_name}: copied {copied} of {legacy_count} rows; {legacy} was kept")
+            if not keep_legacy:
+                connection.execute(text(f'DROP TABLE "{legacy}"'))
+        return copied
+
+    @staticmethod
+    def _legacy_source(table_name: str, legacy: str):
+        """FROM clause over the legacy table and the expression giving each row's partition key"""
+        if table_name == 'journal_line':
+            # Lines did not carry the entry date before partitioning
+            return (f'"{legacy}" l LEFT JOIN journal_entry e ON e.id = l.entry_id', 'COALESCE(e.date, CURRENT_DATE)')
+        return f'"{legacy}" l', f'l."{PARTITION_KEYS[table_name]}"'
+
+    # ---- Archival ----
+
+    def archive_year(self, table_name: str, year: int, to_file: bool = False) -> int:
+        """Detach the partition of a closed fiscal year into the archive schema (and optionally a gzip file).
+        Returns the number of archived rows."""
+        if year >= date.today().year:
+            raise ValueError("لا يمكن أرشفة السنة الحالية أو سنة مستقبلية.")
+        name = f"{table_name}_y{year}"
+        with self.bind.begin() as connection:
+            open_periods = connection.execute(text(
+                "SELECT COUNT(*) FROM fiscal_period WHERE year = :year AND is_open"
+            ), {'year': year}).scalar()
+            if open_periods:
+                raise ValueError(f"لا يمكن أرشفة السنة المالية {year} لأنها غير مقفلة.")
+            if year not in self._partition_years(connection, table_name):
+                raise ValueError(f"لا يوجد قسم للسنة {year} في الجدول {table_name}.")
+            connection.execute(text(f'CREATE SCHEMA IF NOT EXISTS "{ARCHIVE_SCHEMA}"'))
+            connection.execute(text(f'ALTER TABLE "{table_name}" DETACH PARTITION "{name}"'))
+            connection.execute(text(f'ALTER TABLE "{name}" SET SCHEMA "{ARCHIVE_SCHEMA}"'))
+            row_count = connection.execute(text(f'SELECT COUNT(*) FROM "{ARCHIVE_SCHEMA}"."{name}"')).scalar()
+            self._save_catalog(connection, table_name, year, LOCATION_SCHEMA, name, None, row_count)
+        self._invalidate_catalog()
+        if to_file:
+            self.export_archive(table_name, year)
+        return row_count
+
+    def export_archive(self, table_name: str, year: int) -> str:
+        """Dump an archived year to a gzip COPY file (with a JSON manifest) and drop its table"""
+        name = f"{table_name}_y{year}"
+        columns = [c.name for c in Base.metadata.tables[table_name].columns]
+        os.makedirs(self.archive_dir, exist_ok=True)
+        file_path = os.path.join(self.archive_dir, f"{name}.copy.gz")
+        column_list = ', '.join(f'"{c}"' for c in columns)
+        raw = self.bind.raw_connection()
+        try:
+            with raw.cursor() as cursor, gzip.open(file_path, 'wb') as f:
+                cursor.copy_expert(f'COPY (SELECT {column_list} FROM "{ARCHIVE_SCHEMA}"."{name}") TO STDOUT', f)
+                row_count = cursor.rowcount
+            raw.commit()
+        finally:
+            raw.close()
+        with open(file_path[:-len('.copy.gz')] + '.json', 'w', encoding='utf-8') as f:
+            json.dump({'table': table_name, 'year': year, 'columns': columns, 'rows': row_count}, f)
+        with self.bind.begin() as connection:
+            connection.execute(text(f'DROP TABLE "{ARCHIVE_SCHEMA}"."{name}"'))
+            self._save_catalog(connection, table_name, year, LOCATION_FILE, None, file_path, row_count)
+        self._invalidate_catalog()
+        return file_path
+
+    def restore_archive(self, table_name: str, year: int) -> str:
+        """Load a file-only archived year back into the archive schema so queries can read it"""
+        entry = self._load_catalog(force=True).get(table_name, {}).get(year)
+        if entry is None:
+            raise ValueError(f"السنة {year} غير مؤرشفة في الجدول {table_name}.")
+        location, archive_table, file_path = entry
+        if location == LOCATION_SCHEMA:
+            return archive_table
+        name = f"{table_name}_y{year}"
+        with open(file_path[:-len('.copy.gz')] + '.json', encoding='utf-8') as f:
+            columns = json.load(f)['columns']
+        with self.bind.begin() as connection:
+            connection.execute(text(f'CREATE SCHEMA IF NOT EXISTS "{ARCHIVE_SCHEMA}"'))
+            connection.execute(text(f'CREATE TABLE "{ARCHIVE_SCHEMA}"."{name}" (LIKE "{table_name}" INCLUDING DEFAULTS)'))
+        raw = self.bind.raw_connection()
+        try:
+            with raw.cursor() as cursor, gzip.open(file_path, 'rb') as f:
+                column_list = ', '.join(f'"{c}"' for c in columns)
+                cursor.copy_expert(f'COPY "{ARCHIVE_SCHEMA}"."{name}" ({column_list}) FROM STDIN', f)
+                cursor.execute(f'CREATE INDEX ON "{ARCHIVE_SCHEMA}"."{name}" ({PARTITION_KEYS[table_name]})')
+            raw.commit()
+        finally:
+            raw.close()
+        with self.bind.begin() as connection:
+            connection.execute(text(
+                "UPDATE archived_partition SET location = :location, archive_table = :name WHERE table_name = :t AND year = :year"
+            ), {'location': LOCATION_SCHEMA, 'name': name, 't': table_name, 'year': year})
+        self._invalidate_catalog()
+        return name
+
+    def unarchive_year(self, table_name: str, year: int):
+        """Attach an archived year back to the live table (e.g. after reopening a fiscal year)"""
+        name = self.restore_archive(table_name, year)
+        lower, upper = _year_bounds(year)
+        with self.bind.begin() as connection:
+            schema = connection.execute(text("SELECT current_schema()")).scalar()
+            connection.execute(text(f'ALTER TABLE "{ARCHIVE_SCHEMA}"."{name}" SET SCHEMA "{schema}"'))
+            connection.execute(text(f'ALTER TABLE "{table_name}" ATTACH PARTITION "{name}" FOR VALUES FROM ({lower}) TO ({upper})'))
+            connection.execute(text("DELETE FROM archived_partition WHERE table_name = :t AND year = :year"), {'t': table_name, 'year': year})
+        self._invalidate_catalog()
+
+    # ---- Archive catalog ----
+
+    @staticmethod
+    def _save_catalog(connection, table_name: str, year: int, location: int, archive_table: Optional[str], file_path: Optional[str], row_count: int):
+        connection.execute(text("DELETE FROM archived_partition WHERE table_name = :t AND year = :year"), {'t': table_name, 'year': year})
+        connection.execute(ArchivedPartition.__table__.insert().values(
+            table_name=table_name, year=year, location=location, archive_table=archive_table,
+            file_path=file_path, row_count=row_count
+        ))
+
+    def _invalidate_catalog(self):
+        with self._lock:
+            self._catalog = None
+
+    def _load_catalog(self, force: bool = False) -> Dict[str, Dict[int, tuple]]:
+        """{table: {year: (location, archive_table, file_path)}}"""
+        if not self.uses_database:
+            return {}
+        with self._lock:
+            if not force and self._catalog is not None and time.monotonic() - self._catalog_loaded < CATALOG_TTL:
+                return self._catalog
+        catalog = {}
+        with self.bind.connect() as connection:
+            for table_name, year, location, archive_table, file_path in connection.execute(select(
+                ArchivedPartition.table_name, ArchivedPartition.year, ArchivedPartition.location,
+                ArchivedPartition.archive_table, ArchivedPartition.file_path
+            )):
+                catalog.setdefault(table_name, {})[year] = (location, archive_table, file_path)
+        with self._lock:
+            self._catalog = catalog
+            self._catalog_loaded = time.monotonic()
+        return catalog
+
+    def archive_tables(self, table_name: str, date_from: date = None, date_to: date = None) -> List[str]:
+        """Archive schema tables holding years of table_name inside [date_from, date_to];
+        file-only years in the range are restored first"""
+        years = self._load_catalog().get(table_name)
+        if not years:
+            return []
+        names = []
+        for year, (location, archive_table, file_path) in sorted(years.items()):
+            if (date_from is not None and year < date_from.year) or (date_to is not None and year > date_to.year):
+                continue
+            names.append(archive_table if location == LOCATION_SCHEMA else self.restore_archive(table_name, year))
+        return names
+
+
+# Global partition manager instance
+_partition_manager = None
+
+def get_partition_manager() -> PartitionManager:
+    """Get the global partition manager instance"""
+    global _partition_manager
+    if _partition_manager is None:
+        _partition_manager = PartitionManager()
+    return _partition_manager
+
+
+def with_archive(model, date_from: date = None, date_to: date = None):
+    """The model, or when [date_from, date_to] reaches archived years an alias of the model over
+    UNION ALL of the live table and those archive tables. Use its attributes in the query's filters."""
+    names = get_partition_manager().archive_tables(model.__tablename__, date_from, date_to)
+    if not names:
+        return model
+    live = model.__table__
+    parts = [select(live)]
+    for name in names:
+        archived = table(name, *[column(c.name, c.type) for c in live.columns], schema=ARCHIVE_SCHEMA)
+        parts.append(select(archived))
+    return aliased(model, union_all(*parts).subquery(f"{model.__tablename__}_with_archive"))
+
+
+def main(argv=None):
+    """Maintenance command: python -m app.infrastructure.partitioning <command> ..."""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Partition maintenance and archival of closed fiscal years")
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('status', help="List partitioned tables, live years and archived years")
+    commands.add_parser('ensure', help="Create the partitions of the current and next year")
+    convert = commands.add_parser('convert', help="Migrate an existing table to the partitioned layout (application stopped)")
+    convert.add_argument('table', choices=sorted(PARTITION_KEYS))
+    convert.add_argument('--keep-legacy', action='store_true')
+    for name, help_text in (('archive', "Detach a closed year into the archive schema"),
+                            ('restore', "Load a file-archived year back into the archive schema"),
+                            ('unarchive', "Attach an archived year back to the live table")):
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument('table', choices=sorted(PARTITION_KEYS))
+        command.add_argument('year', type=int)
+        if name == 'archive':
+            command.add_argument('--file', action='store_true', help="Also dump it to a gzip file and drop the table")
+    args = parser.parse_args(argv)
+
+    manager = get_partition_manager()
+    if not manager.uses_database:
+        raise SystemExit("Partitioning needs a PostgreSQL DATABASE_URL")
+    if args.command == 'status':
+        print(json.dumps(manager.get_partitions(), indent=2))
+    elif args.command == 'ensure':
+        manager.ensure_partitions()
+    elif args.command == 'convert':
+        print(f"{args.table}: {manager.convert_table(args.table, args.keep_legacy, lambda done, total: print(f'  {done:,} rows'))} rows copied")
+    elif args.command == 'archive':
+        print(f"{args.table} {args.year}: {manager.archive_year(args.table, args.year, args.file)} rows archived")
+    elif args.command == 'restore':
+        print(f"{args.table} {args.year}: {ARCHIVE_SCHEMA}.{manager.restore_archive(args.table, args.year)}")
+    else:
+        manager.unarchive_year(args.table, args.year)
+
+
+if __name__ == "__main__":
+    main()
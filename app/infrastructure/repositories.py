@@ -1,6 +1,10 @@
-from sqlalchemy.orm import Session, joinedload
-from app.domain.models import Account, JournalEntry, JournalLine, Customer, Supplier, Invoice, Payment, Item, StockMovement, SalesOrder, PurchaseOrder, BankTransaction, BankReconciliation, FixedAsset, Depreciation, TaxSetting, TaxReport, User, Role, Permission, UserRole, RolePermission, Company, Branch, FiscalPeriod, CostCenter, Project, Employee, Payrun, Notification, Workflow, InvoiceLine, Warehouse, Shift, ShiftMovement, InvoicePayment # Added Warehouse model
-from app.domain.settings_models import Unit, Currency, PaymentMethod, Coupon, GiftCard, LoyaltyProgram # Import new settings models and GiftCard and LoyaltyProgram
+from sqlalchemy.orm import Session, joinedload, selectinload
+from sqlalchemy import text, func, select, update, insert, case, tuple_, literal_column, literal, cast, Boolean, Date, Float, Integer, Numeric
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from app.domain.models import Account, AccountClosure, JournalEntry, JournalLine, Customer, Supplier, Invoice, Payment, Item, StockMovement, SalesOrder, PurchaseOrder, BankTransaction, BankBalanceSnapshot, BankReconciliation, FixedAsset, Depreciation, TaxSetting, TaxReport, User, Role, Permission, UserRole, RolePermission, Company, Branch, FiscalPeriod, CostCenter, Project, Employee, Payrun, Notification, Workflow, InvoiceLine, Warehouse, Shift, ShiftMovement, InvoicePayment, LoyaltyAccount, LoyaltyLedger, BankStatementLine, BankReconciliationMatch, ItemCostState, ItemCostLayer, ItemCostCheckpoint, CustomerExposure, NotificationCounter, AccountBalanceSnapshot, EliminationRule, PurchaseOrderLine, OrderConversion # Added Warehouse model
+from app.domain.settings_models import Unit, Currency, ExchangeRate, PaymentMethod, Coupon, GiftCard, LoyaltyProgram # Import new settings models and GiftCard and LoyaltyProgram
+from app.infrastructure.notification_channel import get_notification_channel, get_item_catalog_channel, get_fiscal_period_channel, CHANNEL_NAME, ITEM_CATALOG_CHANNEL, FISCAL_PERIOD_CHANNEL
+from app.infrastructure.partitioning import with_archive
 
 class AccountRepository:
     def __init__(self, db: Session):
@@ -34,6 +38,65 @@ class AccountRepository:
             self.db.commit()
         return db_account
 
+class AccountClosureRepository:
+    """Maintains the (ancestor, descendant, depth) closure of the chart of accounts. Methods do not commit."""
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def insert_account(self, account_id: int, parent_id: int = None):
+        """Links of a new leaf account: itself at depth 0 and every ancestor of its parent one level further"""
+        self.db.execute(text("""
+            INSERT INTO account_closure (ancestor_id, descendant_id, depth)
+            SELECT ancestor_id, :account_id, depth + 1 FROM account_closure WHERE descendant_id = :parent_id
+            UNION ALL
+            SELECT :account_id, :account_id, 0
+        """), {'account_id': account_id, 'parent_id': parent_id})
+
+    def is_descendant(self, ancestor_id: int, descendant_id: int) -> bool:
+        return self.db.query(AccountClosure).filter(AccountClosure.ancestor_id == ancestor_id,
+                                                    AccountClosure.descendant_id == descendant_id).first() is not None
+
+    def move_subtree(self, account_id: int, new_parent_id: int = None):
+        """Detach the account's subtree from its old ancestors and attach it under new_parent_id"""
+        params = {'account_id': account_id, 'parent_id': new_parent_id}
+        self.db.execute(text("""
+            DELETE FROM account_closure
+             WHERE descendant_id IN (SELECT descendant_id FROM account_closure WHERE ancestor_id = :account_id)
+               AND ancestor_id NOT IN (SELECT descendant_id FROM account_closure WHERE ancestor_id = :account_id)
+        """), params)
+        if new_parent_id is not None:
+            self.db.execute(text("""
+                INSERT INTO account_closure (ancestor_id, descendant_id, depth)
+                SELECT above.ancestor_id, below.descendant_id, above.depth + below.depth + 1
+                  FROM account_closure above
+                 CROSS JOIN account_closure below
+                 WHERE above.descendant_id = :parent_id AND below.ancestor_id = :account_id
+            """), params)
+
+    def is_complete(self) -> bool:
+        """Every account has its depth-0 link (False for charts created before the closure table existed)"""
+        linked = self.db.query(func.count()).select_from(AccountClosure).filter(AccountClosure.depth == 0).scalar()
+        return linked == self.db.query(func.count(Account.id)).scalar()
+
+    def rebuild(self):
+        """Recompute the whole closure from Account.parent_id"""
+        self.db.execute(text("DELETE FROM account_closure"))
+        self.db.execute(text("""
+            INSERT INTO account_closure (ancestor_id, descendant_id, depth)
+            WITH RECURSIVE tree (ancestor_id, descendant_id, depth) AS (
+                SELECT id, id, 0 FROM account
+                UNION ALL
+                SELECT tree.ancestor_id, child.id, tree.depth + 1
+                  FROM tree JOIN account child ON child.parent_id = tree.descendant_id
+            )
+            SELECT ancestor_id, descendant_id, depth FROM tree
+        """))
+
+    def get_links(self):
+        """(ancestor_id, descendant_id) pairs, the account itself included"""
+        return self.db.query(AccountClosure.ancestor_id, AccountClosure.descendant_id).all()
+
 class JournalEntryRepository:
     def __init__(self, db: Session):
         self.db = db
@@ -44,17 +107,39 @@ class JournalEntryRepository:
     def get_journal_entry_by_id(self, entry_id: int):
         return self.db.query(JournalEntry).filter(JournalEntry.id == entry_id).first()
 
+    def ref_exists(self, company_id: int, ref_no: str) -> bool:
+        return self.db.query(
+            self.db.query(JournalEntry.id).filter(JournalEntry.company_id == company_id, JournalEntry.ref_no == ref_no).exists()
+        ).scalar()
+
     def create_journal_entry(self, journal_entry: JournalEntry):
         self.db.add(journal_entry)
         self.db.commit()
         self.db.refresh(journal_entry)
         return journal_entry
 
+    def add_journal_entry(self, journal_entry: JournalEntry, lines: list):
+        """Add an entry with its lines; flushes for the entry id. Does not commit."""
+        self.db.add(journal_entry)
+        self.db.flush()
+        for line in lines:
+            line.entry_id = journal_entry.id
+            line.entry_date = journal_entry.date
+        self.db.add_all(lines)
+        self.db.flush()
+        return journal_entry
+
     def update_journal_entry(self, entry_id: int, new_data: dict):
         db_entry = self.get_journal_entry_by_id(entry_id)
         if db_entry:
+            old_date = db_entry.date
             for key, value in new_data.items():
                 setattr(db_entry, key, value)
+            if db_entry.date != old_date:
+                # Lines carry the entry date as their partition key
+                self.db.query(JournalLine).filter(
+                    JournalLine.entry_id == entry_id, JournalLine.entry_date == old_date
+                ).update({'entry_date': db_entry.date}, synchronize_session=False)
             self.db.commit()
             self.db.refresh(db_entry)
         return db_entry
@@ -70,10 +155,15 @@ class JournalLineRepository:
     def __init__(self, db: Session):
         self.db = db
 
-    def get_lines_by_entry_id(self, entry_id: int):
-        return self.db.query(JournalLine).filter(JournalLine.entry_id == entry_id).all()
+    def get_lines_by_entry_id(self, entry_id: int, entry_date=None):
+        query = self.db.query(JournalLine).filter(JournalLine.entry_id == entry_id)
+        if entry_date is not None:
+            query = query.filter(JournalLine.entry_date == entry_date) # Reads a single partition
+        return query.all()
 
     def create_journal_line(self, journal_line: JournalLine):
+        if journal_line.entry_date is None:
+            journal_line.entry_date = self.db.query(JournalEntry.date).filter(JournalEntry.id == journal_line.entry_id).scalar()
         self.db.add(journal_line)
         self.db.commit()
         self.db.refresh(journal_line)
@@ -95,6 +185,45 @@ class JournalLineRepository:
             self.db.commit()
         return db_line
 
+    @staticmethod
+    def _posted_account_lines(statement, line, company_id: int, account_id: int, date_from, date_to, branch_id: int = None):
+        statement = statement.join(JournalEntry, JournalEntry.id == line.entry_id).where(
+            line.account_id == account_id, line.entry_date >= date_from, line.entry_date <= date_to,
+            JournalEntry.company_id == company_id, JournalEntry.status == 2)
+        if branch_id:
+            statement = statement.where(JournalEntry.branch_id == branch_id)
+        return statement
+
+    def get_account_statement(self, company_id: int, account_id: int, date_from, date_to, opening, after: tuple = None,
+                              limit: int = 200, branch_id: int = None):
+        """One page of an account's posted lines in (entry_date, id) order with a running balance (archived years included).
+
+        after is the (entry_date, id) of the last row of the previous page and
+        opening the balance just before this page. The database adds a
+        SUM() OVER (ORDER BY entry_date, id) window over the page to it, and the
+        page is an index range scan on ix_journal_line_account_date, so the cost
+        does not grow with the account's size.
+        """
+        line = with_archive(JournalLine, date_from, date_to)
+        amount = func.coalesce(line.debit, 0) - func.coalesce(line.credit, 0)
+        running_balance = literal(opening, Numeric(18, 3)) + func.sum(amount).over(order_by=(line.entry_date, line.id), rows=(None, 0))
+        statement = select(
+            line.id, line.entry_date, line.entry_id, JournalEntry.ref_no, JournalEntry.period, JournalEntry.branch_id, line.memo,
+            line.debit, line.credit, line.currency, line.fx_rate, line.cost_center_id, line.project_id,
+            running_balance.label('running_balance')
+        )
+        statement = self._posted_account_lines(statement, line, company_id, account_id, date_from, date_to, branch_id)
+        if after is not None:
+            statement = statement.where(tuple_(line.entry_date, line.id) > tuple_(*after))
+        return self.db.execute(statement.order_by(line.entry_date, line.id).limit(limit)).all()
+
+    def get_account_total(self, company_id: int, account_id: int, date_from, through: tuple, branch_id: int = None):
+        """Posted (debit, credit) totals of an account from date_from up to and including the (entry_date, id) cursor through"""
+        line = with_archive(JournalLine, date_from, through[0])
+        statement = select(func.coalesce(func.sum(line.debit), 0), func.coalesce(func.sum(line.credit), 0))
+        statement = self._posted_account_lines(statement, line, company_id, account_id, date_from, through[0], branch_id)
+        return self.db.execute(statement.where(tuple_(line.entry_date, line.id) <= tuple_(*through))).one()
+
 class CustomerRepository:
     def __init__(self, db: Session):
         self.db = db
@@ -160,6 +289,8 @@ class SupplierRepository:
         return db_supplier
 
 class InvoiceRepository:
+    UNSET_BALANCE_SQL = "COALESCE(i.total_amount, 0) - COALESCE(i.amount_paid, 0)" # balance_due of an invoice saved before it was stored
+
     def __init__(self, db: Session):
         self.db = db
 
@@ -170,23 +301,38 @@ class InvoiceRepository:
         return self.db.query(Invoice).filter(Invoice.id == invoice_id).options(joinedload(Invoice.lines), joinedload(Invoice.customer), joinedload(Invoice.supplier)).first()
 
     def create_invoice(self, invoice: Invoice):
+        self.add_invoice(invoice)
+        self.db.commit()
+        self.db.refresh(invoice)
+        return invoice
+
+    def add_invoice(self, invoice: Invoice):
+        # Does not commit: checkout writes the invoice with its movements, payments and ledgers in one transaction
+        invoice.amount_paid = invoice.amount_paid or 0
+        invoice.balance_due = (invoice.total_amount or 0) - invoice.amount_paid
         self.db.add(invoice)
         self.db.flush() # Flush to get invoice.id before committing lines
         for line in invoice.lines:
             line.invoice_id = invoice.id
             self.db.add(line)
-        self.db.commit()
-        self.db.refresh(invoice)
+        exposure_repo = CustomerExposureRepository(self.db)
+        exposure_repo.adjust(invoice.customer_id, open_ar=exposure_repo.invoice_exposure(invoice))
         return invoice
 
     def update_invoice(self, invoice_id: int, new_data: dict):
         db_invoice = self.get_invoice_by_id(invoice_id)
         if db_invoice:
+            exposure_repo = CustomerExposureRepository(self.db)
+            old_customer_id, old_exposure = db_invoice.customer_id, exposure_repo.invoice_exposure(db_invoice)
             for key, value in new_data.items():
                 if key == 'lines':
                     # Handle lines update separately if needed, for now assuming they are managed via invoice relationship
                     continue
                 setattr(db_invoice, key, value)
+            if 'total_amount' in new_data:
+                db_invoice.balance_due = db_invoice.total_amount - (db_invoice.amount_paid or 0)
+            exposure_repo.adjust(old_customer_id, open_ar=-old_exposure)
+            exposure_repo.adjust(db_invoice.customer_id, open_ar=exposure_repo.invoice_exposure(db_invoice))
             self.db.commit()
             self.db.refresh(db_invoice)
         return db_invoice
@@ -194,10 +340,222 @@ class InvoiceRepository:
     def delete_invoice(self, invoice_id: int):
         db_invoice = self.get_invoice_by_id(invoice_id)
         if db_invoice:
+            exposure_repo = CustomerExposureRepository(self.db)
+            exposure_repo.adjust(db_invoice.customer_id, open_ar=-exposure_repo.invoice_exposure(db_invoice))
             self.db.delete(db_invoice)
             self.db.commit()
         return db_invoice
 
+    def apply_payment_delta(self, invoice_id: int, delta):
+        """Add a payment amount (negative to reverse) to an invoice's paid and open balance (does not commit)"""
+        if not invoice_id or not delta:
+            return
+        paid = Invoice.amount_paid + delta
+        invoice = self.db.execute(
+            update(Invoice)
+            .where(Invoice.id == invoice_id)
+            .values(
+                amount_paid=paid,
+                balance_due=Invoice.total_amount - paid,
+                # 2: Paid once covered, back to 1: Issued if a payment is reversed; cancelled invoices keep their status
+                status=case(
+                    ((Invoice.status != 3) & (Invoice.total_amount - paid <= 0), 2),
+                    (Invoice.status == 2, 1),
+                    else_=Invoice.status
+                )
+            )
+            .returning(Invoice.customer_id, Invoice.invoice_type, Invoice.status)
+            .execution_options(synchronize_session=False)
+        ).first()
+        if invoice and invoice.customer_id and invoice.status != 3:
+            sign = CustomerExposureRepository.AR_SIGN.get(invoice.invoice_type, 0)
+            CustomerExposureRepository(self.db).adjust(invoice.customer_id, open_ar=-delta * sign)
+
+    def retype_legacy_purchases(self) -> int:
+        """Purchase invoices earlier versions saved as type 2 become type 1, now that 2 is Sales Return"""
+        result = self.db.execute(
+            update(Invoice).where(Invoice.invoice_type == 2, Invoice.supplier_id.isnot(None)).values(invoice_type=1)
+            .execution_options(synchronize_session=False)
+        )
+        self.db.commit()
+        return result.rowcount
+
+    def has_unset_balances(self) -> bool:
+        """Whether any invoice predates the stored balance columns (NULL balance_due)"""
+        return self.db.query(Invoice.id).filter(Invoice.balance_due.is_(None)).first() is not None
+
+    def recalculate_balances(self, company_id: int = None) -> int:
+        """Rebuild amount_paid / balance_due from the payment tables in one statement"""
+        company_filter = "WHERE i.company_id = :company_id" if company_id is not None else ""
+        result = self.db.execute(text(f"""
+            WITH paid AS (
+                SELECT invoice_id, SUM(amount) AS amount FROM (
+                    SELECT invoice_id, amount FROM payment WHERE invoice_id IS NOT NULL
+                    UNION ALL
+                    SELECT invoice_id, amount FROM invoice_payment
+                ) p
+                GROUP BY invoice_id
+            )
+            UPDATE invoice
+               SET amount_paid = totals.amount_paid,
+                   balance_due = totals.total_amount - totals.amount_paid
+              FROM (
+                  SELECT i.id, COALESCE(i.total_amount, 0) AS total_amount, COALESCE(paid.amount, 0) AS amount_paid
+                    FROM invoice i
+                    LEFT JOIN paid ON paid.invoice_id = i.id
+                  {company_filter}
+              ) totals
+             WHERE invoice.id = totals.id
+        """), {'company_id': company_id})
+        CustomerExposureRepository(self.db).rebuild()
+        self.db.commit()
+        return result.rowcount
+
+    @staticmethod
+    def _open_items_sql(ledger: str, party_id: int = None, as_of_today: bool = True) -> str:
+        """Open items of the AR (customers) or AP (suppliers) ledger as of :as_of.
+
+        Sales returns (AR) and purchase returns (AP) count as negative balances.
+        For a past as-of date, payments made after it are added back, so only
+        invoices open now or paid after that date are read.
+        """
+        party_column = "customer_id" if ledger == 'AR' else "supplier_id"
+        invoice_types = "(0, 2)" if ledger == 'AR' else "(1, 3)"
+        return_type = 2 if ledger == 'AR' else 3
+        party_filter = f"AND i.{party_column} = :party_id" if party_id is not None else ""
+        # Invoices saved before balance_due was stored carry NULL until the startup backfill runs
+        balance_due = f"COALESCE(i.balance_due, {InvoiceRepository.UNSET_BALANCE_SQL})"
+
+        if as_of_today:
+            later_payments = ""
+            balance = balance_due
+            open_filter = "(i.balance_due <> 0 OR i.balance_due IS NULL)"
+        else:
+            later_payments = """
+                LEFT JOIN (
+                    SELECT invoice_id, SUM(amount) AS amount FROM (
+                        SELECT invoice_id, amount FROM payment WHERE payment_date > :as_of AND invoice_id IS NOT NULL
+                        UNION ALL
+                        SELECT invoice_id, amount FROM invoice_payment WHERE created_at >= CAST(:as_of AS date) + 1
+                    ) p
+                    GROUP BY invoice_id
+                ) later ON later.invoice_id = i.id"""
+            balance = f"{balance_due} + COALESCE(later.amount, 0)"
+            open_filter = "(i.balance_due <> 0 OR i.balance_due IS NULL OR later.invoice_id IS NOT NULL)"
+
+        days = "CAST(:as_of AS date) - COALESCE(i.due_date, i.invoice_date)"
+        return f"""
+            SELECT i.id, i.invoice_no, i.invoice_type, i.{party_column} AS party_id, i.invoice_date, i.due_date,
+                   i.total_amount, CASE WHEN i.invoice_type = {return_type} THEN -1 ELSE 1 END * ({balance}) AS balance,
+                   {days} AS days_overdue, i.currency, i.fx_rate
+              FROM invoice i{later_payments}
+             WHERE i.company_id = :company_id
+               AND i.invoice_type IN {invoice_types}
+               AND i.{party_column} IS NOT NULL
+               AND i.invoice_date <= :as_of
+               AND i.status <> 3
+               AND {open_filter}
+               {party_filter}
+        """
+
+    @staticmethod
+    def _aging_sql(ledger: str, buckets: tuple, party_id: int = None, detail: bool = False, as_of_today: bool = True) -> str:
+        """Open items of the AR (customers) or AP (suppliers) ledger bucketed by days past due"""
+        open_items = InvoiceRepository._open_items_sql(ledger, party_id, as_of_today)
+        bucket_cases = ["WHEN days_overdue <= 0 THEN 'not_due'"]
+        lower = 0
+        for upper in buckets:
+            bucket_cases.append(f"WHEN days_overdue <= {int(upper)} THEN '{lower + 1}-{int(upper)}'")
+            lower = int(upper)
+        bucket_cases.append(f"ELSE '{lower + 1}+'")
+        bucket = f"CASE {' '.join(bucket_cases)} END"
+
+        if detail:
+            return f"""
+                SELECT o.*, {bucket} AS bucket
+                  FROM ({open_items}) o
+                 WHERE o.balance <> 0
+                 ORDER BY o.party_id, o.due_date NULLS FIRST, o.id
+            """
+        bucket_columns = ["SUM(CASE WHEN days_overdue <= 0 THEN balance ELSE 0 END) AS not_due"]
+        lower = 0
+        for upper in buckets:
+            bucket_columns.append(f"SUM(CASE WHEN days_overdue > {lower} AND days_overdue <= {int(upper)} THEN balance ELSE 0 END) AS d{lower + 1}_{int(upper)}")
+            lower = int(upper)
+        bucket_columns.append(f"SUM(CASE WHEN days_overdue > {lower} THEN balance ELSE 0 END) AS over_{lower}")
+        return f"""
+            SELECT party_id, COUNT(*) AS open_items, SUM(balance) AS total, {', '.join(bucket_columns)}
+              FROM ({open_items}) o
+             WHERE balance <> 0
+             GROUP BY party_id
+             ORDER BY party_id
+        """
+
+    def get_aging_summary(self, company_id: int, ledger: str, as_of, buckets: tuple = (30, 60, 90), party_id: int = None, as_of_today: bool = True):
+        """One row per customer (ledger 'AR') or supplier ('AP') with its balance split into aging buckets"""
+        return self.db.execute(text(self._aging_sql(ledger, buckets, party_id, False, as_of_today)),
+                               {'company_id': company_id, 'as_of': as_of, 'party_id': party_id}).all()
+
+    def stream_open_items(self, company_id: int, ledger: str, as_of, buckets: tuple = (30, 60, 90), party_id: int = None, as_of_today: bool = True, batch_size: int = 10000):
+        """Open items with their aging bucket, streamed with a server-side cursor"""
+        result = self.db.execute(
+            text(self._aging_sql(ledger, buckets, party_id, True, as_of_today)).execution_options(stream_results=True, yield_per=batch_size),
+            {'company_id': company_id, 'as_of': as_of, 'party_id': party_id}
+        )
+        return result
+
+    def get_fx_revaluation(self, company_id: int, ledger: str, as_of, as_of_today: bool = True):
+        """Unrealized FX difference of the foreign-currency open items of a ledger, one row per currency.
+
+        Each open balance is converted at the rate in effect on :as_of (the latest
+        exchange_rate_history entry, or the currency's current rate without one)
+        and compared with the rate booked on the invoice; difference is in the
+        company's base currency.
+        """
+        return self.db.execute(text(f"""
+            WITH rates AS (
+                SELECT c.id, c.code, COALESCE((SELECT h.rate FROM exchange_rate_history h
+                                                WHERE h.currency_id = c.id AND h.rate_date <= :as_of
+                                                ORDER BY h.rate_date DESC LIMIT 1), c.exchange_rate) AS rate
+                  FROM currencies c
+            ), base AS (
+                SELECT r.code, r.rate FROM company co JOIN rates r ON r.id = co.base_currency_id WHERE co.id = :company_id
+            )
+            SELECT o.currency, COUNT(*) AS open_items, SUM(o.balance) AS balance,
+                   MAX(r.rate / base.rate) AS rate,
+                   SUM(ROUND(o.balance * (r.rate / base.rate - o.fx_rate), 3)) AS difference
+              FROM ({self._open_items_sql(ledger, None, as_of_today)}) o
+              JOIN rates r ON r.code = o.currency
+             CROSS JOIN base
+             WHERE o.currency <> base.code
+               AND o.balance <> 0
+             GROUP BY o.currency
+             ORDER BY o.currency
+        """), {'company_id': company_id, 'as_of': as_of}).all()
+
+    def _export_filter(self, statement, company_id: int, date_from, date_to, invoice_type: int = None):
+        statement = statement.where(Invoice.company_id == company_id)
+        if date_from:
+            statement = statement.where(Invoice.invoice_date >= date_from)
+        if date_to:
+            statement = statement.where(Invoice.invoice_date <= date_to)
+        if invoice_type is not None:
+            statement = statement.where(Invoice.invoice_type == invoice_type)
+        return statement
+
+    def count_invoices(self, company_id: int, date_from=None, date_to=None, invoice_type: int = None) -> int:
+        return self.db.execute(self._export_filter(select(func.count(Invoice.id)), company_id, date_from, date_to, invoice_type)).scalar()
+
+    def stream_invoices(self, company_id: int, date_from=None, date_to=None, invoice_type: int = None, batch_size: int = 5000):
+        """Invoice register rows with party names, streamed with a server-side cursor"""
+        statement = select(
+            Invoice.invoice_no, Invoice.invoice_type, Invoice.invoice_date, Invoice.due_date,
+            func.coalesce(Customer.name_ar, Supplier.name_ar), Invoice.total_amount, Invoice.total_tax,
+            Invoice.balance_due, Invoice.currency, Invoice.status
+        ).outerjoin(Customer, Customer.id == Invoice.customer_id).outerjoin(Supplier, Supplier.id == Invoice.supplier_id)
+        statement = self._export_filter(statement, company_id, date_from, date_to, invoice_type).order_by(Invoice.invoice_date, Invoice.id)
+        return self.db.execute(statement.execution_options(stream_results=True, yield_per=batch_size))
+
 class InvoiceLineRepository:
     def __init__(self, db: Session):
         self.db = db
@@ -230,6 +588,82 @@ class InvoiceLineRepository:
             self.db.commit()
         return db_line
 
+class CustomerExposureRepository:
+    """Open AR and open order exposure per customer. Methods do not commit, so
+    every adjustment lands in the same transaction as the write that caused it."""
+
+    AR_SIGN = {0: 1, 2: -1} # Sales invoices add to exposure, sales returns reduce it
+    OPEN_ORDER_STATUS = 1 # Confirmed
+    CREDIT_LOCK_CLASS = 0x4352 # Advisory lock namespace for per-customer credit checks
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    @classmethod
+    def invoice_exposure(cls, invoice: Invoice):
+        if not invoice.customer_id or invoice.status == 3:
+            return 0
+        balance_due = invoice.balance_due
+        if balance_due is None:
+            balance_due = (invoice.total_amount or 0) - (invoice.amount_paid or 0)
+        return cls.AR_SIGN.get(invoice.invoice_type, 0) * balance_due
+
+    @classmethod
+    def order_exposure(cls, order: SalesOrder):
+        return (order.total_amount or 0) if order.status == cls.OPEN_ORDER_STATUS else 0
+
+    def adjust(self, customer_id: int, open_ar=0, open_orders=0):
+        if not customer_id or (not open_ar and not open_orders):
+            return
+        statement = pg_insert(CustomerExposure).values(customer_id=customer_id, open_ar=open_ar, open_orders=open_orders)
+        self.db.execute(statement.on_conflict_do_update(
+            index_elements=['customer_id'],
+            set_={
+                'open_ar': CustomerExposure.open_ar + statement.excluded.open_ar,
+                'open_orders': CustomerExposure.open_orders + statement.excluded.open_orders,
+                'updated_at': func.now()
+            }
+        ))
+
+    def lock_customer(self, customer_id: int):
+        """Serialize credit checks of one customer until the current transaction ends"""
+        self.db.execute(text("SELECT pg_advisory_xact_lock(:lock_class, :customer_id)"),
+                        {'lock_class': self.CREDIT_LOCK_CLASS, 'customer_id': customer_id})
+
+    def get_credit_position(self, customer_id: int):
+        """Credit limit and exposure of a customer by primary key"""
+        return self.db.execute(text("""
+            SELECT c.credit_limit, COALESCE(e.open_ar, 0) AS open_ar, COALESCE(e.open_orders, 0) AS open_orders
+              FROM customer c
+              LEFT JOIN customer_exposure e ON e.customer_id = c.id
+             WHERE c.id = :customer_id
+        """), {'customer_id': customer_id}).first()
+
+    def rebuild(self):
+        """Recompute every customer's exposure from invoices and sales orders"""
+        self.db.execute(text("""
+            INSERT INTO customer_exposure (customer_id, open_ar, open_orders, updated_at)
+            SELECT customer_id, SUM(open_ar), SUM(open_orders), now() FROM (
+                SELECT customer_id, CASE invoice_type WHEN 0 THEN balance_due WHEN 2 THEN -balance_due ELSE 0 END AS open_ar, 0 AS open_orders
+                  FROM (SELECT customer_id, invoice_type, COALESCE(i.balance_due, {unset_balance}) AS balance_due
+                          FROM invoice i
+                         WHERE customer_id IS NOT NULL AND status <> 3 AND (i.balance_due <> 0 OR i.balance_due IS NULL)) open_invoices
+                UNION ALL
+                SELECT customer_id, 0, total_amount
+                  FROM sales_order
+                 WHERE status = :open_order_status
+            ) exposure
+            GROUP BY customer_id
+            ON CONFLICT (customer_id) DO UPDATE
+               SET open_ar = EXCLUDED.open_ar, open_orders = EXCLUDED.open_orders, updated_at = EXCLUDED.updated_at
+        """.format(unset_balance=InvoiceRepository.UNSET_BALANCE_SQL)), {'open_order_status': self.OPEN_ORDER_STATUS})
+        self.db.execute(text("""
+            UPDATE customer_exposure e SET open_ar = 0, open_orders = 0, updated_at = now()
+             WHERE (e.open_ar <> 0 OR e.open_orders <> 0)
+               AND NOT EXISTS (SELECT 1 FROM invoice i WHERE i.customer_id = e.customer_id AND i.status <> 3 AND (i.balance_due <> 0 OR i.balance_due IS NULL))
+               AND NOT EXISTS (SELECT 1 FROM sales_order o WHERE o.customer_id = e.customer_id AND o.status = :open_order_status)
+        """), {'open_order_status': self.OPEN_ORDER_STATUS})
+
 class PaymentRepository:
     def __init__(self, db: Session):
         self.db = db
@@ -242,6 +676,7 @@ class PaymentRepository:
 
     def create_payment(self, payment: Payment):
         self.db.add(payment)
+        InvoiceRepository(self.db).apply_payment_delta(payment.invoice_id, payment.amount)
         self.db.commit()
         self.db.refresh(payment)
         return payment
@@ -249,8 +684,11 @@ class PaymentRepository:
     def update_payment(self, payment_id: int, new_data: dict):
         db_payment = self.get_payment_by_id(payment_id)
         if db_payment:
+            invoice_repo = InvoiceRepository(self.db)
+            invoice_repo.apply_payment_delta(db_payment.invoice_id, -db_payment.amount)
             for key, value in new_data.items():
                 setattr(db_payment, key, value)
+            invoice_repo.apply_payment_delta(db_payment.invoice_id, db_payment.amount)
             self.db.commit()
             self.db.refresh(db_payment)
         return db_payment
@@ -258,6 +696,7 @@ class PaymentRepository:
     def delete_payment(self, payment_id: int):
         db_payment = self.get_payment_by_id(payment_id)
         if db_payment:
+            InvoiceRepository(self.db).apply_payment_delta(db_payment.invoice_id, -db_payment.amount)
             self.db.delete(db_payment)
             self.db.commit()
         return db_payment
@@ -275,10 +714,45 @@ class ItemRepository:
     def get_item_by_barcode(self, barcode: str):
         return self.db.query(Item).filter(Item.barcode == barcode).first()
 
+    def get_catalog_rows(self, company_id: int = None, item_ids: list = None):
+        """Active items flattened for the POS item catalog, optionally of one company or only item_ids"""
+        query = self.db.query(
+            Item.id, Item.company_id, Item.code, Item.barcode, Item.name_ar, Item.name_en, Item.unit_id,
+            Unit.name_ar.label('unit_name'), Item.sale_price, Item.min_sale_price
+        ).outerjoin(Unit, Unit.id == Item.unit_id).filter(Item.is_active == True)
+        if company_id is not None:
+            query = query.filter(Item.company_id == company_id)
+        if item_ids is not None:
+            query = query.filter(Item.id.in_(item_ids))
+        return query.all()
+
+    def _queue_change(self, company_id: int, item_ids: list = None) -> dict:
+        """Queue a NOTIFY of changed items (None: all items of the company) for the item catalogs. Does not commit."""
+        channel = get_item_catalog_channel()
+        message = {'company_id': company_id, 'item_ids': item_ids}
+        if channel.uses_database:
+            # Delivered by PostgreSQL when (and only if) the transaction commits
+            self.db.execute(text("SELECT pg_notify(:channel, :payload)"),
+                            {'channel': ITEM_CATALOG_CHANNEL, 'payload': channel.encode(message)})
+        return message
+
+    @staticmethod
+    def _announce(message: dict):
+        get_item_catalog_channel().publish_local([message])
+
+    def announce_reload(self, company_id: int):
+        """Tell every item catalog to reload a company's items, after bulk writes or a tax change"""
+        message = self._queue_change(company_id)
+        self.db.commit()
+        self._announce(message)
+
     def create_item(self, item: Item):
         self.db.add(item)
+        self.db.flush()
+        message = self._queue_change(item.company_id, [item.id])
         self.db.commit()
         self.db.refresh(item)
+        self._announce(message)
         return item
 
     def update_item(self, item_id: int, new_data: dict):
@@ -286,15 +760,19 @@ class ItemRepository:
         if db_item:
             for key, value in new_data.items():
                 setattr(db_item, key, value)
+            message = self._queue_change(db_item.company_id, [item_id])
             self.db.commit()
             self.db.refresh(db_item)
+            self._announce(message)
         return db_item
 
     def delete_item(self, item_id: int):
         db_item = self.get_item_by_id(item_id)
         if db_item:
+            message = self._queue_change(db_item.company_id, [item_id])
             self.db.delete(db_item)
             self.db.commit()
+            self._announce(message)
         return db_item
 
 class StockMovementRepository:
@@ -307,6 +785,30 @@ class StockMovementRepository:
     def get_stock_movement_by_id(self, movement_id: int):
         return self.db.query(StockMovement).filter(StockMovement.id == movement_id).first()
 
+    @staticmethod
+    def _export_filter(statement, movement, date_from, date_to, company_id: int = None):
+        if company_id is not None:
+            statement = statement.where(movement.company_id == company_id)
+        if date_from:
+            statement = statement.where(movement.movement_date >= date_from)
+        if date_to:
+            statement = statement.where(movement.movement_date <= date_to)
+        return statement
+
+    def count_movements(self, date_from=None, date_to=None, company_id: int = None) -> int:
+        movement = with_archive(StockMovement, date_from, date_to)
+        return self.db.execute(self._export_filter(select(func.count(movement.id)), movement, date_from, date_to, company_id)).scalar()
+
+    def stream_movements(self, date_from=None, date_to=None, company_id: int = None, batch_size: int = 5000):
+        """Stock movement rows with item and warehouse names (archived years included), streamed with a server-side cursor"""
+        movement = with_archive(StockMovement, date_from, date_to)
+        statement = select(
+            movement.movement_date, Item.code, Item.name_ar, Warehouse.name_ar, movement.movement_type,
+            movement.quantity, movement.cost, movement.ref_no
+        ).join(Item, Item.id == movement.item_id).outerjoin(Warehouse, Warehouse.id == movement.warehouse_id)
+        statement = self._export_filter(statement, movement, date_from, date_to, company_id).order_by(movement.movement_date, movement.id)
+        return self.db.execute(statement.execution_options(stream_results=True, yield_per=batch_size))
+
     def create_stock_movement(self, stock_movement: StockMovement):
         self.db.add(stock_movement)
         self.db.commit()
@@ -325,10 +827,203 @@ class StockMovementRepository:
     def delete_stock_movement(self, movement_id: int):
         db_movement = self.get_stock_movement_by_id(movement_id)
         if db_movement:
+            # No cascading FK from the layers: stock_movement is partitioned
+            self.db.query(ItemCostLayer).filter(ItemCostLayer.movement_id == movement_id).delete(synchronize_session=False)
             self.db.delete(db_movement)
             self.db.commit()
         return db_movement
 
+class ItemCostRepository:
+    """Costing state, FIFO layers and checkpoints per (item, warehouse). Methods do not commit."""
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    @staticmethod
+    def _movement_warehouse_filter(warehouse_id: int, movement=StockMovement):
+        return movement.warehouse_id.is_(None) if not warehouse_id else movement.warehouse_id == warehouse_id
+
+    def get_state(self, item_id: int, warehouse_id: int):
+        return self.db.get(ItemCostState, (item_id, warehouse_id))
+
+    def lock_state(self, item_id: int, warehouse_id: int, company_id: int = None):
+        """Get the state row of an (item, warehouse) for update, creating it if needed"""
+        self.db.execute(
+            pg_insert(ItemCostState)
+            .values(item_id=item_id, warehouse_id=warehouse_id, company_id=company_id,
+                    quantity_on_hand=0, total_value=0, average_cost=0)
+            .on_conflict_do_nothing(index_elements=['item_id', 'warehouse_id'])
+        )
+        return self.db.query(ItemCostState).filter(
+            ItemCostState.item_id == item_id, ItemCostState.warehouse_id == warehouse_id
+        ).with_for_update().populate_existing().one()
+
+    def get_open_layers(self, item_id: int, warehouse_id: int):
+        return self.db.query(ItemCostLayer).filter(
+            ItemCostLayer.item_id == item_id,
+            ItemCostLayer.warehouse_id == warehouse_id,
+            ItemCostLayer.remaining_quantity > 0
+        ).order_by(ItemCostLayer.layer_date, ItemCostLayer.movement_id).all()
+
+    def save_layers(self, item_id: int, warehouse_id: int, layers):
+        """Upsert the layers created or consumed by the costing engine"""
+        values = [{
+            'movement_id': layer.movement_id,
+            'item_id': item_id,
+            'warehouse_id': warehouse_id,
+            'layer_date': layer.layer_date,
+            'original_quantity': layer.original,
+            'remaining_quantity': layer.remaining,
+            'unit_cost': layer.unit_cost
+        } for layer in layers]
+        if not values:
+            return
+        statement = pg_insert(ItemCostLayer).values(values)
+        self.db.execute(statement.on_conflict_do_update(
+            index_elements=['movement_id'],
+            set_={'remaining_quantity': statement.excluded.remaining_quantity, 'unit_cost': statement.excluded.unit_cost}
+        ))
+
+    def reset_layers_after(self, item_id: int, warehouse_id: int, checkpoint_date=None):
+        """Drop layers opened after a checkpoint and close the older ones before a replay rewrites them"""
+        layers = self.db.query(ItemCostLayer).filter(ItemCostLayer.item_id == item_id, ItemCostLayer.warehouse_id == warehouse_id)
+        if checkpoint_date is None:
+            layers.delete(synchronize_session=False)
+            return
+        layers.filter(ItemCostLayer.layer_date > checkpoint_date).delete(synchronize_session=False)
+        layers.filter(ItemCostLayer.remaining_quantity > 0).update({'remaining_quantity': 0}, synchronize_session=False)
+
+    def get_latest_checkpoint(self, item_id: int, warehouse_id: int):
+        return self.db.query(ItemCostCheckpoint).filter(
+            ItemCostCheckpoint.item_id == item_id, ItemCostCheckpoint.warehouse_id == warehouse_id
+        ).order_by(ItemCostCheckpoint.checkpoint_date.desc()).first()
+
+    def delete_checkpoints_from(self, item_id: int, warehouse_id: int, from_date):
+        self.db.query(ItemCostCheckpoint).filter(
+            ItemCostCheckpoint.item_id == item_id,
+            ItemCostCheckpoint.warehouse_id == warehouse_id,
+            ItemCostCheckpoint.checkpoint_date >= from_date
+        ).delete(synchronize_session=False)
+
+    def add_checkpoint(self, item_id: int, warehouse_id: int, checkpoint_date, quantity_on_hand, total_value, average_cost, open_layers: str):
+        self.db.execute(
+            pg_insert(ItemCostCheckpoint)
+            .values(item_id=item_id, warehouse_id=warehouse_id, checkpoint_date=checkpoint_date,
+                    quantity_on_hand=quantity_on_hand, total_value=total_value,
+                    average_cost=average_cost, open_layers=open_layers)
+            .on_conflict_do_nothing()
+        )
+
+    def get_movements_after(self, item_id: int, warehouse_id: int, after_date=None):
+        """Movements of an (item, warehouse) after a date, in costing order, streamed (archived years included)"""
+        movement = with_archive(StockMovement, after_date)
+        query = self.db.query(movement).filter(
+            movement.item_id == item_id, self._movement_warehouse_filter(warehouse_id, movement)
+        )
+        if after_date is not None:
+            query = query.filter(movement.movement_date > after_date)
+        return query.order_by(movement.movement_date, movement.id).yield_per(10000)
+
+    def get_movement_pairs(self, company_id: int = None, item_ids: list = None, warehouse_id: int = None):
+        """Distinct (item_id, warehouse_id) pairs that have stock movements"""
+        query = self.db.query(StockMovement.item_id, func.coalesce(StockMovement.warehouse_id, 0)).distinct()
+        if company_id is not None:
+            query = query.filter(StockMovement.company_id == company_id)
+        if item_ids:
+            query = query.filter(StockMovement.item_id.in_(item_ids))
+        if warehouse_id is not None:
+            query = query.filter(self._movement_warehouse_filter(warehouse_id))
+        return query.all()
+
+    def get_uncosted_pairs(self):
+        """(item_id, warehouse_id) pairs that have stock movements but no costing state yet"""
+        warehouse_id = func.coalesce(StockMovement.warehouse_id, 0)
+        return self.db.query(StockMovement.item_id, warehouse_id).distinct().outerjoin(
+            ItemCostState, (ItemCostState.item_id == StockMovement.item_id) & (ItemCostState.warehouse_id == warehouse_id)
+        ).filter(ItemCostState.item_id.is_(None)).all()
+
+    def update_movement_costs(self, costs: list):
+        """Bulk update StockMovement.cost from [(movement_id, unit_cost), ...]"""
+        if costs:
+            self.db.execute(update(StockMovement), [{'id': movement_id, 'cost': unit_cost} for movement_id, unit_cost in costs])
+
+class MasterDataImportRepository:
+    """Set-based writes of the bulk master data importer. Methods do not commit."""
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def upsert_by_code(self, model, rows: list) -> dict:
+        """Multi-row INSERT ... ON CONFLICT (code) DO UPDATE of rows that carry an explicit code.
+
+        Returns {code: True if inserted, False if updated}. For company-owned
+        models a code that belongs to another company is left untouched and
+        is missing from the result.
+        """
+        if not rows:
+            return {}
+        statement = pg_insert(model).values(rows)
+        where = None
+        if hasattr(model, 'company_id'):
+            where = model.company_id == statement.excluded.company_id
+        statement = statement.on_conflict_do_update(
+            index_elements=['code'], # Unique index {table}_unique_code, created at startup on existing databases
+            set_={column: statement.excluded[column] for column in rows[0] if column != 'code'},
+            where=where
+        ).returning(model.code, literal_column('xmax = 0', Boolean))
+        return {code: inserted for code, inserted in self.db.execute(statement)}
+
+    def insert_rows(self, model, rows: list) -> int:
+        """Multi-row INSERT of new records; codes come from the model's sequence"""
+        if not rows:
+            return 0
+        return self.db.execute(insert(model).values(rows)).rowcount
+
+    def sync_code_sequence(self, model, sequence_name: str):
+        """Move a code sequence past codes inserted explicitly, so later records do not collide"""
+        table = model.__tablename__
+        self.db.execute(text(
+            f"SELECT setval('{sequence_name}', m) FROM (SELECT MAX(code) AS m FROM \"{table}\") s "
+            f"WHERE m >= (SELECT last_value FROM {sequence_name})"
+        ))
+
+    def get_items_by_code(self, company_id: int, codes: list) -> dict:
+        """{code: (id, warehouse_id, costing_method, cost_price)} of a company's items"""
+        if not codes:
+            return {}
+        rows = self.db.execute(
+            select(Item.code, Item.id, Item.warehouse_id, Item.costing_method, Item.cost_price)
+            .where(Item.company_id == company_id, Item.code.in_(codes))
+        )
+        return {code: (item_id, warehouse_id, method, cost_price) for code, item_id, warehouse_id, method, cost_price in rows}
+
+    def insert_stock_movements(self, rows: list) -> list:
+        """Multi-row INSERT of stock movements, returning (id, item_id, warehouse_id, movement_date, quantity, cost)"""
+        if not rows:
+            return []
+        return self.db.execute(
+            insert(StockMovement).values(rows).returning(
+                StockMovement.id, StockMovement.item_id, StockMovement.warehouse_id,
+                StockMovement.movement_date, StockMovement.quantity, StockMovement.cost
+            )
+        ).all()
+
+    def get_existing_cost_pairs(self, pairs: list) -> set:
+        """(item_id, warehouse_id) pairs that already have a costing state"""
+        if not pairs:
+            return set()
+        return set(self.db.execute(
+            select(ItemCostState.item_id, ItemCostState.warehouse_id)
+            .where(tuple_(ItemCostState.item_id, ItemCostState.warehouse_id).in_(pairs))
+        ).tuples())
+
+    def insert_cost_states(self, states: list, layers: list):
+        """Costing state and open FIFO layers of (item, warehouse) pairs that had none"""
+        if states:
+            self.db.execute(pg_insert(ItemCostState).values(states).on_conflict_do_nothing(index_elements=['item_id', 'warehouse_id']))
+        if layers:
+            self.db.execute(pg_insert(ItemCostLayer).values(layers).on_conflict_do_nothing(index_elements=['movement_id']))
+
 class SalesOrderRepository:
     def __init__(self, db: Session):
         self.db = db
@@ -341,6 +1036,8 @@ class SalesOrderRepository:
 
     def create_sales_order(self, sales_order: SalesOrder):
         self.db.add(sales_order)
+        exposure_repo = CustomerExposureRepository(self.db)
+        exposure_repo.adjust(sales_order.customer_id, open_orders=exposure_repo.order_exposure(sales_order))
         self.db.commit()
         self.db.refresh(sales_order)
         return sales_order
@@ -348,8 +1045,12 @@ class SalesOrderRepository:
     def update_sales_order(self, order_id: int, new_data: dict):
         db_order = self.get_sales_order_by_id(order_id)
         if db_order:
+            exposure_repo = CustomerExposureRepository(self.db)
+            old_customer_id, old_exposure = db_order.customer_id, exposure_repo.order_exposure(db_order)
             for key, value in new_data.items():
                 setattr(db_order, key, value)
+            exposure_repo.adjust(old_customer_id, open_orders=-old_exposure)
+            exposure_repo.adjust(db_order.customer_id, open_orders=exposure_repo.order_exposure(db_order))
             self.db.commit()
             self.db.refresh(db_order)
         return db_order
@@ -357,6 +1058,8 @@ class SalesOrderRepository:
     def delete_sales_order(self, order_id: int):
         db_order = self.get_sales_order_by_id(order_id)
         if db_order:
+            exposure_repo = CustomerExposureRepository(self.db)
+            exposure_repo.adjust(db_order.customer_id, open_orders=-exposure_repo.order_exposure(db_order))
             self.db.delete(db_order)
             self.db.commit()
         return db_order
@@ -393,7 +1096,121 @@ class PurchaseOrderRepository:
             self.db.commit()
         return db_order
 
+class OrderConversionRepository:
+    """Set-based writes of the order-to-invoice conversion. Methods do not commit."""
+
+    ORDER_MODELS = {0: SalesOrder, 1: PurchaseOrder}
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def get_orders(self, order_type: int, order_ids: list):
+        """Orders with their lines, locked so a concurrent run cannot convert them twice"""
+        model = self.ORDER_MODELS[order_type]
+        return self.db.query(model).filter(model.id.in_(order_ids)).options(selectinload(model.lines)).with_for_update(of=model).all()
+
+    def get_pending_order_ids(self, order_type: int, company_id: int = None) -> list:
+        """Confirmed orders without a conversion, oldest first"""
+        model = self.ORDER_MODELS[order_type]
+        query = self.db.query(model.id).filter(model.status == 1).filter(~self.db.query(OrderConversion.order_id).filter(
+            OrderConversion.order_type == order_type, OrderConversion.order_id == model.id).exists())
+        if company_id is not None:
+            query = query.filter(model.company_id == company_id)
+        return [row.id for row in query.order_by(model.order_date, model.id)]
+
+    def get_converted(self, order_type: int, order_ids: list) -> dict:
+        """order_id -> invoice_id of the orders already converted"""
+        return dict(self.db.query(OrderConversion.order_id, OrderConversion.invoice_id).filter(
+            OrderConversion.order_type == order_type, OrderConversion.order_id.in_(order_ids)).all())
+
+    def insert_invoices(self, rows: list) -> dict:
+        """Multi-row INSERT of invoices, returning invoice_no -> id"""
+        if not rows:
+            return {}
+        return dict(self.db.execute(insert(Invoice).values(rows).returning(Invoice.invoice_no, Invoice.id)).all())
+
+    def insert_journal_entries(self, rows: list) -> dict:
+        """Multi-row INSERT of journal entries, returning ref_no -> id"""
+        if not rows:
+            return {}
+        return dict(self.db.execute(insert(JournalEntry).values(rows).returning(JournalEntry.ref_no, JournalEntry.id)).all())
+
+    def insert_many(self, model, rows: list):
+        if rows:
+            self.db.execute(insert(model), rows)
+
+    def get_movements(self, movement_ids: list):
+        """Inserted movements as ORM objects in (item, warehouse) order, the lock order of the costing engine"""
+        return self.db.query(StockMovement).filter(StockMovement.id.in_(movement_ids)).order_by(
+            StockMovement.item_id, StockMovement.warehouse_id, StockMovement.id).all()
+
+    def set_order_status(self, order_type: int, order_ids: list, status: int):
+        model = self.ORDER_MODELS[order_type]
+        self.db.query(model).filter(model.id.in_(order_ids)).update({'status': status}, synchronize_session=False)
+
+class ReplenishmentRepository:
+    """Set-based reads feeding the replenishment planner. Methods do not commit."""
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def stream_weekly_demand(self, start, end, company_id: int = None, batch_size: int = 50000):
+        """Issued quantity per (item, warehouse, week since start), archived years included.
+
+        One grouped query over the whole horizon, streamed in partitions of
+        batch_size (item_id, warehouse_id, week, quantity) tuples.
+        """
+        movement = with_archive(StockMovement, start, end)
+        warehouse_id = func.coalesce(movement.warehouse_id, 0)
+        week = cast(movement.movement_date - literal(start, Date), Integer) // 7
+        statement = select(movement.item_id, warehouse_id, week, cast(func.sum(movement.quantity), Float)).where(
+            movement.movement_type == 1, movement.movement_date >= start, movement.movement_date <= end)
+        if company_id is not None:
+            statement = statement.where(movement.company_id == company_id)
+        statement = statement.group_by(movement.item_id, warehouse_id, week)
+        result = self.db.execute(statement.execution_options(stream_results=True, yield_per=batch_size))
+        for partition in result.partitions():
+            yield [tuple(row) for row in partition]
+
+    def get_items(self, company_id: int = None):
+        """Active items with their home warehouse, static reorder level and cost price"""
+        query = self.db.query(Item.id, Item.company_id, Item.warehouse_id, Item.reorder_level, Item.cost_price).filter(Item.is_active == True)
+        if company_id is not None:
+            query = query.filter(Item.company_id == company_id)
+        return query.all()
+
+    def get_on_hand(self, company_id: int = None) -> dict:
+        """(item_id, warehouse_id) -> quantity on hand from the costing state"""
+        query = self.db.query(ItemCostState.item_id, ItemCostState.warehouse_id, ItemCostState.quantity_on_hand)
+        if company_id is not None:
+            query = query.filter(ItemCostState.company_id == company_id)
+        return {(row.item_id, row.warehouse_id): float(row.quantity_on_hand or 0) for row in query}
+
+    def get_on_order(self, company_id: int = None) -> dict:
+        """(item_id, warehouse_id) -> quantity on draft or confirmed purchase orders not yet received"""
+        warehouse_id = func.coalesce(PurchaseOrderLine.warehouse_id, Item.warehouse_id)
+        query = self.db.query(PurchaseOrderLine.item_id, warehouse_id.label('warehouse_id'), func.sum(PurchaseOrderLine.quantity).label('quantity')).join(
+            PurchaseOrder, PurchaseOrder.id == PurchaseOrderLine.order_id).join(Item, Item.id == PurchaseOrderLine.item_id).filter(
+            PurchaseOrder.status.in_((0, 1)))
+        if company_id is not None:
+            query = query.filter(PurchaseOrder.company_id == company_id)
+        return {(row.item_id, row.warehouse_id): float(row.quantity or 0) for row in query.group_by(PurchaseOrderLine.item_id, warehouse_id)}
+
+    def get_last_suppliers(self, company_id: int = None) -> dict:
+        """item_id -> supplier of the item's most recent purchase invoice"""
+        query = self.db.query(InvoiceLine.item_id, Invoice.supplier_id).join(Invoice, Invoice.id == InvoiceLine.invoice_id).filter(
+            Invoice.invoice_type == 1, Invoice.status != 3, Invoice.supplier_id.isnot(None), InvoiceLine.item_id.isnot(None))
+        if company_id is not None:
+            query = query.filter(Invoice.company_id == company_id)
+        query = query.distinct(InvoiceLine.item_id).order_by(InvoiceLine.item_id, Invoice.invoice_date.desc(), Invoice.id.desc())
+        return dict(query.all())
+
+    def get_warehouse_branches(self) -> dict:
+        return dict(self.db.query(Warehouse.id, Warehouse.branch_id).all())
+
 class BankTransactionRepository:
+    BALANCE_LOCK_CLASS = 0x4242 # Advisory lock namespace for per-account balance snapshot upkeep
+
     def __init__(self, db: Session):
         self.db = db
 
@@ -404,7 +1221,9 @@ class BankTransactionRepository:
         return self.db.query(BankTransaction).filter(BankTransaction.id == transaction_id).first()
 
     def create_bank_transaction(self, bank_transaction: BankTransaction):
+        self._lock_snapshots(bank_transaction.bank_account_id)
         self.db.add(bank_transaction)
+        self._shift_snapshots(bank_transaction, 1)
         self.db.commit()
         self.db.refresh(bank_transaction)
         return bank_transaction
@@ -412,8 +1231,11 @@ class BankTransactionRepository:
     def update_bank_transaction(self, transaction_id: int, new_data: dict):
         db_transaction = self.get_bank_transaction_by_id(transaction_id)
         if db_transaction:
+            self._lock_snapshots(db_transaction.bank_account_id, new_data.get('bank_account_id'))
+            self._shift_snapshots(db_transaction, -1)
             for key, value in new_data.items():
                 setattr(db_transaction, key, value)
+            self._shift_snapshots(db_transaction, 1)
             self.db.commit()
             self.db.refresh(db_transaction)
         return db_transaction
@@ -421,10 +1243,174 @@ class BankTransactionRepository:
     def delete_bank_transaction(self, transaction_id: int):
         db_transaction = self.get_bank_transaction_by_id(transaction_id)
         if db_transaction:
+            self._lock_snapshots(db_transaction.bank_account_id)
+            self._shift_snapshots(db_transaction, -1)
             self.db.delete(db_transaction)
             self.db.commit()
         return db_transaction
 
+    # ---- Monthly balance snapshots ----
+
+    def _lock_snapshots(self, *bank_account_ids):
+        """Serialize snapshot upkeep of the accounts and bring their snapshots up to this month, before the write is added"""
+        for bank_account_id in sorted({account_id for account_id in bank_account_ids if account_id is not None}):
+            self.db.execute(text("SELECT pg_advisory_xact_lock(:lock_class, :bank_account_id)"),
+                            {'lock_class': self.BALANCE_LOCK_CLASS, 'bank_account_id': bank_account_id})
+            self.write_balance_snapshots(bank_account_id)
+
+    def _shift_snapshots(self, transaction: BankTransaction, sign: int):
+        """Add (sign 1) or remove (sign -1) a transaction from the snapshots of the months after it"""
+        amount = transaction.amount if transaction.transaction_type in (0, 2) else -transaction.amount
+        self.db.execute(
+            update(BankBalanceSnapshot)
+            .where(BankBalanceSnapshot.bank_account_id == transaction.bank_account_id,
+                   BankBalanceSnapshot.month_start > transaction.transaction_date)
+            .values(balance=BankBalanceSnapshot.balance + sign * amount)
+            .execution_options(synchronize_session=False)
+        )
+
+    def write_balance_snapshots(self, bank_account_id: int, through=None) -> int:
+        """Add the account's missing month snapshots after its latest one (from its first transaction if none) up to through, this month by default"""
+        return self.db.execute(text("""
+            WITH latest AS (
+                SELECT month_start, balance FROM bank_balance_snapshot
+                 WHERE bank_account_id = :bank_account_id
+                 ORDER BY month_start DESC LIMIT 1
+            ), monthly AS (
+                SELECT CAST(date_trunc('month', transaction_date) AS date) AS month,
+                       SUM(CASE WHEN transaction_type IN (0, 2) THEN amount ELSE -amount END) AS amount
+                  FROM bank_transaction
+                 WHERE bank_account_id = :bank_account_id
+                   AND transaction_date >= COALESCE((SELECT month_start FROM latest), CAST('-infinity' AS date))
+                 GROUP BY 1
+            ), months AS (
+                SELECT CAST(m AS date) AS month_start
+                  FROM generate_series(COALESCE((SELECT month_start FROM latest), (SELECT MIN(month) FROM monthly)) + INTERVAL '1 month',
+                                       COALESCE(CAST(:through AS date), CAST(date_trunc('month', CURRENT_DATE) AS date)), INTERVAL '1 month') m
+            )
+            INSERT INTO bank_balance_snapshot (bank_account_id, month_start, balance)
+            SELECT :bank_account_id, months.month_start,
+                   COALESCE((SELECT balance FROM latest), 0)
+                   + COALESCE((SELECT SUM(amount) FROM monthly WHERE monthly.month < months.month_start), 0)
+              FROM months
+            ON CONFLICT DO NOTHING
+        """), {'bank_account_id': bank_account_id, 'through': through}).rowcount
+
+    def get_unsnapshotted_accounts(self) -> list:
+        """Bank accounts with transactions but no balance snapshot yet, e.g. from before snapshots existed"""
+        return [row[0] for row in self.db.execute(text("""
+            SELECT DISTINCT t.bank_account_id FROM bank_transaction t
+             WHERE NOT EXISTS (SELECT 1 FROM bank_balance_snapshot s WHERE s.bank_account_id = t.bank_account_id)
+        """))]
+
+    def get_unreconciled_transactions(self, bank_account_id: int, up_to):
+        # Plain rows rather than ORM objects: the matcher only needs these columns
+        return self.db.execute(
+            select(BankTransaction.id, BankTransaction.transaction_type, BankTransaction.amount,
+                   BankTransaction.transaction_date, BankTransaction.ref_no)
+            .where(BankTransaction.bank_account_id == bank_account_id,
+                   BankTransaction.is_reconciled == False,
+                   BankTransaction.transaction_date <= up_to)
+        ).all()
+
+    def get_book_balance(self, bank_account_id: int, as_of):
+        signed_amount = case((BankTransaction.transaction_type.in_([0, 2]), BankTransaction.amount), else_=-BankTransaction.amount)
+        return self.db.execute(
+            select(func.coalesce(func.sum(signed_amount), 0))
+            .where(BankTransaction.bank_account_id == bank_account_id, BankTransaction.transaction_date <= as_of)
+        ).scalar()
+
+    def get_activity_feed(self, company_id: int = None, bank_account_id: int = None, date_from=None, date_to=None, after: tuple = None,
+                          limit: int = 100):
+        """Transactions and reconciliations as one feed, newest first, with a running balance per account.
+
+        after is the (date, type, id) cursor of the last row of the previous page.
+        The running balance is a window sum over the page added to each account's
+        balance before its oldest row on the page: the month snapshot of that row
+        plus the account's earlier rows in the same month. Neither grows with the
+        account's history or the page position.
+        """
+        params = {'limit': limit}
+        transaction_filters = ["TRUE"]
+        reconciliation_filters = ["TRUE"]
+        for column, key, value in (("company_id", "company_id", company_id), ("bank_account_id", "bank_account_id", bank_account_id)):
+            if value is not None:
+                transaction_filters.append(f"t.{column} = :{key}")
+                reconciliation_filters.append(f"r.{column} = :{key}")
+                params[key] = value
+        if date_from is not None:
+            transaction_filters.append("t.transaction_date >= :date_from")
+            reconciliation_filters.append("r.reconciliation_date >= :date_from")
+            params['date_from'] = date_from
+        if date_to is not None:
+            transaction_filters.append("t.transaction_date <= :date_to")
+            reconciliation_filters.append("r.reconciliation_date <= :date_to")
+            params['date_to'] = date_to
+        keyset_filter = "TRUE"
+        if after is not None:
+            keyset_filter = "(entry_date, entry_type, id) < (:after_date, :after_type, :after_id)"
+            params['after_date'], params['after_type'], params['after_id'] = after
+
+        return self.db.execute(text(f"""
+            WITH feed AS (
+                SELECT t.id, 'Transaction' AS entry_type, t.company_id, t.branch_id, t.bank_account_id AS account_id,
+                       t.amount, CASE WHEN t.transaction_type IN (0, 2) THEN t.amount ELSE -t.amount END AS signed_amount,
+                       t.transaction_date AS entry_date, t.description, t.ref_no
+                  FROM bank_transaction t
+                 WHERE {" AND ".join(transaction_filters)}
+                UNION ALL
+                SELECT r.id, 'Reconciliation', r.company_id, r.branch_id, r.bank_account_id,
+                       r.statement_balance, 0, r.reconciliation_date, 'Bank Reconciliation', NULL
+                  FROM bank_reconciliation r
+                 WHERE {" AND ".join(reconciliation_filters)}
+            ), page AS (
+                SELECT * FROM feed
+                 WHERE {keyset_filter}
+                 ORDER BY entry_date DESC, entry_type DESC, id DESC
+                 LIMIT :limit
+            ), oldest AS (
+                SELECT DISTINCT ON (account_id) account_id, entry_date, entry_type, id
+                  FROM page
+                 ORDER BY account_id, entry_date, entry_type, id
+            ), opening AS (
+                SELECT o.account_id, COALESCE(s.balance, 0) + COALESCE(b.balance, 0) AS balance
+                  FROM oldest o
+                  LEFT JOIN LATERAL (
+                      SELECT month_start, balance FROM bank_balance_snapshot
+                       WHERE bank_account_id = o.account_id AND month_start <= o.entry_date
+                       ORDER BY month_start DESC LIMIT 1
+                  ) s ON TRUE
+                  LEFT JOIN LATERAL (
+                      SELECT SUM(CASE WHEN t.transaction_type IN (0, 2) THEN t.amount ELSE -t.amount END) AS balance
+                        FROM bank_transaction t
+                       WHERE t.bank_account_id = o.account_id
+                         AND t.transaction_date >= COALESCE(s.month_start, CAST('-infinity' AS date))
+                         AND (t.transaction_date, 'Transaction', t.id) < (o.entry_date, o.entry_type, o.id)
+                  ) b ON TRUE
+            )
+            SELECT page.id, page.entry_type, page.company_id, page.branch_id, page.account_id, page.amount,
+                   page.entry_date, page.description, page.ref_no,
+                   c.name_en AS company_name, br.name_en AS branch_name,
+                   opening.balance + SUM(page.signed_amount) OVER (
+                       PARTITION BY page.account_id ORDER BY page.entry_date, page.entry_type, page.id
+                   ) AS running_balance
+              FROM page
+              JOIN opening ON opening.account_id = page.account_id
+              LEFT JOIN company c ON c.id = page.company_id
+              LEFT JOIN branch br ON br.id = page.branch_id
+             ORDER BY page.entry_date DESC, page.entry_type DESC, page.id DESC
+        """), params).all()
+
+    def mark_reconciled(self, transaction_ids: list, reconciliation_id: int, chunk_size: int = 10000):
+        # Does not commit: part of the reconciliation run's transaction
+        for start in range(0, len(transaction_ids), chunk_size):
+            self.db.execute(
+                update(BankTransaction)
+                .where(BankTransaction.id.in_(transaction_ids[start:start + chunk_size]))
+                .values(is_reconciled=True, reconciliation_id=reconciliation_id)
+                .execution_options(synchronize_session=False)
+            )
+
 class BankReconciliationRepository:
     def __init__(self, db: Session):
         self.db = db
@@ -457,6 +1443,46 @@ class BankReconciliationRepository:
             self.db.commit()
         return db_reconciliation
 
+    def bulk_create_matches(self, rows: list, chunk_size: int = 10000):
+        # Does not commit: part of the reconciliation run's transaction
+        for start in range(0, len(rows), chunk_size):
+            self.db.execute(insert(BankReconciliationMatch), rows[start:start + chunk_size])
+
+class BankStatementLineRepository:
+    def __init__(self, db: Session):
+        self.db = db
+
+    def bulk_create_lines(self, rows: list) -> int:
+        # executemany through insertmanyvalues; the caller commits once per import.
+        # Lines already imported (same account and line_hash) are skipped; returns the number inserted.
+        if not rows:
+            return 0
+        statement = pg_insert(BankStatementLine).on_conflict_do_nothing(index_elements=['bank_account_id', 'line_hash'])
+        return len(self.db.execute(statement.returning(BankStatementLine.id), rows).all())
+
+    def get_unmatched_lines(self, bank_account_id: int, up_to):
+        return self.db.execute(
+            select(BankStatementLine.id, BankStatementLine.amount, BankStatementLine.statement_date, BankStatementLine.ref_no)
+            .where(BankStatementLine.bank_account_id == bank_account_id,
+                   BankStatementLine.is_matched == False,
+                   BankStatementLine.statement_date <= up_to)
+        ).all()
+
+    def get_statement_total(self, bank_account_id: int, as_of):
+        return self.db.execute(
+            select(func.coalesce(func.sum(BankStatementLine.amount), 0))
+            .where(BankStatementLine.bank_account_id == bank_account_id, BankStatementLine.statement_date <= as_of)
+        ).scalar()
+
+    def mark_matched(self, line_ids: list, reconciliation_id: int, chunk_size: int = 10000):
+        for start in range(0, len(line_ids), chunk_size):
+            self.db.execute(
+                update(BankStatementLine)
+                .where(BankStatementLine.id.in_(line_ids[start:start + chunk_size]))
+                .values(is_matched=True, reconciliation_id=reconciliation_id)
+                .execution_options(synchronize_session=False)
+            )
+
 class FixedAssetRepository:
     def __init__(self, db: Session):
         self.db = db
@@ -546,6 +1572,15 @@ class TaxSettingRepository:
             self.db.refresh(db_setting)
         return db_setting
 
+    def get_default_tax_setting_id(self, company_id: int):
+        """Active tax setting applied to invoices that do not name one"""
+        return self.db.query(func.min(TaxSetting.id)).filter(TaxSetting.company_id == company_id, TaxSetting.is_active == True).scalar()
+
+    def get_default_tax_rates(self) -> dict:
+        """company_id -> rate of the company's default (lowest id active) tax setting"""
+        default_ids = select(func.min(TaxSetting.id)).where(TaxSetting.is_active == True).group_by(TaxSetting.company_id)
+        return dict(self.db.query(TaxSetting.company_id, TaxSetting.tax_rate).filter(TaxSetting.id.in_(default_ids)).all())
+
     def delete_tax_setting(self, setting_id: int):
         db_setting = self.get_tax_setting_by_id(setting_id)
         if db_setting:
@@ -585,6 +1620,69 @@ class TaxReportRepository:
             self.db.commit()
         return db_report
 
+    def get_reports_for_period(self, company_id: int, report_period: str, branch_id: int = None):
+        return self.db.query(TaxReport).filter(
+            TaxReport.company_id == company_id,
+            TaxReport.report_period == report_period,
+            TaxReport.branch_id == branch_id if branch_id is not None else TaxReport.branch_id.is_(None)
+        ).all()
+
+    def has_submitted_report(self, company_id: int, start_date, end_date, branch_id: int = None) -> bool:
+        query = self.db.query(TaxReport.id).filter(
+            TaxReport.company_id == company_id,
+            TaxReport.start_date == start_date,
+            TaxReport.end_date == end_date,
+            TaxReport.status == 1
+        )
+        query = query.filter(TaxReport.branch_id == branch_id) if branch_id is not None else query.filter(TaxReport.branch_id.is_(None))
+        return self.db.query(query.exists()).scalar()
+
+    def aggregate_invoice_tax(self, company_id: int, start_date, end_date, branch_id: int = None):
+        """Output and input tax per tax setting over a date range in one grouped query.
+
+        Sales returns reduce output tax and purchase returns reduce input tax.
+        Invoices without a tax setting fall back to the company's default one.
+        """
+        branch_filter = "AND i.branch_id = :branch_id" if branch_id is not None else ""
+        return self.db.execute(text(f"""
+            WITH default_setting AS (
+                SELECT MIN(id) AS id FROM tax_setting WHERE company_id = :company_id AND is_active
+            )
+            SELECT COALESCE(i.tax_setting_id, d.id) AS tax_setting_id,
+                   SUM(CASE i.invoice_type WHEN 0 THEN i.total_tax WHEN 2 THEN -i.total_tax ELSE 0 END) AS output_tax,
+                   SUM(CASE i.invoice_type WHEN 1 THEN i.total_tax WHEN 3 THEN -i.total_tax ELSE 0 END) AS input_tax,
+                   SUM(CASE i.invoice_type WHEN 0 THEN i.total_amount WHEN 2 THEN -i.total_amount ELSE 0 END) AS taxable_sales,
+                   COUNT(*) AS invoice_count
+              FROM invoice i
+             CROSS JOIN default_setting d
+             WHERE i.company_id = :company_id
+               AND i.invoice_date BETWEEN :start_date AND :end_date
+               AND i.status <> 3
+               {branch_filter}
+             GROUP BY COALESCE(i.tax_setting_id, d.id)
+        """), {'company_id': company_id, 'start_date': start_date, 'end_date': end_date, 'branch_id': branch_id}).all()
+
+    def apply_invoice_tax_delta(self, company_id: int, branch_id: int, tax_setting_id: int, invoice_date, output_delta, input_delta) -> int:
+        """Add one invoice's tax to the draft reports covering its date (does not commit)"""
+        result = self.db.execute(
+            update(TaxReport)
+            .where(
+                TaxReport.company_id == company_id,
+                TaxReport.tax_setting_id == tax_setting_id,
+                TaxReport.status == 0,
+                TaxReport.start_date <= invoice_date,
+                TaxReport.end_date >= invoice_date,
+                (TaxReport.branch_id.is_(None)) | (TaxReport.branch_id == branch_id)
+            )
+            .values(
+                total_sales_tax=TaxReport.total_sales_tax + output_delta,
+                total_purchase_tax=TaxReport.total_purchase_tax + input_delta,
+                net_tax_payable=TaxReport.net_tax_payable + output_delta - input_delta
+            )
+            .execution_options(synchronize_session=False)
+        )
+        return result.rowcount
+
 class UserRepository:
     def __init__(self, db: Session):
         self.db = db
@@ -595,6 +1693,9 @@ class UserRepository:
     def get_user_by_id(self, user_id: int):
         return self.db.query(User).filter(User.id == user_id).first()
 
+    def get_user_by_email(self, email: str):
+        return self.db.query(User).filter(User.email == email).first()
+
     def create_user(self, user: User):
         self.db.add(user)
         self.db.commit()
@@ -755,10 +1856,26 @@ class FiscalPeriodRepository:
     def get_fiscal_period_by_id(self, period_id: int):
         return self.db.query(FiscalPeriod).filter(FiscalPeriod.id == period_id).first()
 
+    def queue_change(self, company_id: int) -> dict:
+        """Queue a NOTIFY that a company's fiscal periods changed, for every terminal's closed period map. Does not commit."""
+        channel = get_fiscal_period_channel()
+        message = {'company_id': company_id}
+        if channel.uses_database:
+            # Delivered by PostgreSQL when (and only if) the transaction commits
+            self.db.execute(text("SELECT pg_notify(:channel, :payload)"),
+                            {'channel': FISCAL_PERIOD_CHANNEL, 'payload': channel.encode(message)})
+        return message
+
+    @staticmethod
+    def announce(message: dict):
+        get_fiscal_period_channel().publish_local([message])
+
     def create_fiscal_period(self, fiscal_period: FiscalPeriod):
         self.db.add(fiscal_period)
+        message = self.queue_change(fiscal_period.company_id)
         self.db.commit()
         self.db.refresh(fiscal_period)
+        self.announce(message)
         return fiscal_period
 
     def update_fiscal_period(self, period_id: int, new_data: dict):
@@ -766,15 +1883,28 @@ class FiscalPeriodRepository:
         if db_period:
             for key, value in new_data.items():
                 setattr(db_period, key, value)
+            message = self.queue_change(db_period.company_id)
             self.db.commit()
             self.db.refresh(db_period)
+            self.announce(message)
         return db_period
 
+    def is_range_closed(self, company_id: int, start_date, end_date) -> bool:
+        """True when a closed fiscal period covers the whole date range"""
+        return self.db.query(self.db.query(FiscalPeriod.id).filter(
+            FiscalPeriod.company_id == company_id,
+            FiscalPeriod.is_open == False,
+            FiscalPeriod.start_date <= start_date,
+            FiscalPeriod.end_date >= end_date
+        ).exists()).scalar()
+
     def delete_fiscal_period(self, period_id: int):
         db_period = self.get_fiscal_period_by_id(period_id)
         if db_period:
+            message = self.queue_change(db_period.company_id)
             self.db.delete(db_period)
             self.db.commit()
+            self.announce(message)
         return db_period
 
 class WarehouseRepository:
@@ -809,6 +1939,205 @@ class WarehouseRepository:
             self.db.commit()
         return db_warehouse
 
+class PeriodCloseRepository:
+    """Validation, closing entries and balance snapshots of fiscal period close. Methods do not commit."""
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def get_closed_periods(self):
+        return self.db.query(FiscalPeriod.company_id, FiscalPeriod.start_date, FiscalPeriod.end_date).filter(
+            FiscalPeriod.is_open == False).order_by(FiscalPeriod.company_id, FiscalPeriod.start_date).all()
+
+    def has_open_period_before(self, company_id: int, start_date) -> bool:
+        return self.db.query(self.db.query(FiscalPeriod.id).filter(
+            FiscalPeriod.company_id == company_id, FiscalPeriod.is_open == True, FiscalPeriod.end_date < start_date
+        ).exists()).scalar()
+
+    def has_closed_period_after(self, company_id: int, end_date) -> bool:
+        return self.db.query(self.db.query(FiscalPeriod.id).filter(
+            FiscalPeriod.company_id == company_id, FiscalPeriod.is_open == False, FiscalPeriod.start_date > end_date
+        ).exists()).scalar()
+
+    def count_unposted_entries(self, company_id: int, start_date, end_date) -> int:
+        """Draft and approved entries dated inside the period"""
+        return self.db.query(func.count(JournalEntry.id)).filter(
+            JournalEntry.company_id == company_id, JournalEntry.date >= start_date, JournalEntry.date <= end_date,
+            JournalEntry.status.in_((0, 1))
+        ).scalar()
+
+    def get_unbalanced_entries(self, company_id: int, start_date, end_date, limit: int = 20):
+        """Posted entries of the period whose lines do not balance"""
+        return self.db.execute(text("""
+            SELECT e.id, e.ref_no, SUM(l.debit) - SUM(l.credit) AS difference
+              FROM journal_entry e
+              JOIN journal_line l ON l.entry_id = e.id AND l.entry_date >= :start_date AND l.entry_date <= :end_date
+             WHERE e.company_id = :company_id AND e.status = 2 AND e.date >= :start_date AND e.date <= :end_date
+             GROUP BY e.id, e.ref_no
+            HAVING SUM(l.debit) <> SUM(l.credit)
+             ORDER BY e.id
+             LIMIT :limit
+        """), {'company_id': company_id, 'start_date': start_date, 'end_date': end_date, 'limit': limit}).all()
+
+    def get_income_balances(self, company_id: int, start_date, end_date):
+        """Net posted balance (debit - credit) of every revenue and expense account per branch over the period"""
+        return self.db.execute(text("""
+            SELECT e.branch_id, l.account_id, SUM(l.debit) - SUM(l.credit) AS balance
+              FROM journal_line l
+              JOIN journal_entry e ON e.id = l.entry_id
+              JOIN account a ON a.id = l.account_id
+             WHERE e.company_id = :company_id AND e.status = 2
+               AND l.entry_date >= :start_date AND l.entry_date <= :end_date
+               AND a.type IN (3, 4)
+               AND (e.ref_no IS NULL OR e.ref_no NOT LIKE 'YEC-%')
+             GROUP BY e.branch_id, l.account_id
+            HAVING SUM(l.debit) <> SUM(l.credit)
+             ORDER BY e.branch_id, l.account_id
+        """), {'company_id': company_id, 'start_date': start_date, 'end_date': end_date}).all()
+
+    def insert_closing_entries(self, company_id: int, entry_date, ref_no: str, created_by: int, entries: dict) -> int:
+        """Insert posted closing entries, one per branch: entries maps branch_id to its line dicts"""
+        posted_at = func.now()
+        line_rows = []
+        for branch_id, lines in entries.items():
+            entry = JournalEntry(company_id=company_id, branch_id=branch_id, date=entry_date, period=entry_date.strftime('%Y-%m'),
+                                 ref_no=ref_no, created_by=created_by, status=2, posted_by=created_by, posted_at=posted_at)
+            self.db.add(entry)
+            self.db.flush()
+            line_rows.extend(dict(line, entry_id=entry.id, entry_date=entry_date) for line in lines)
+        if line_rows:
+            self.db.execute(insert(JournalLine), line_rows)
+        return len(entries)
+
+    def delete_entries_by_ref(self, company_id: int, ref_no: str) -> int:
+        entry_ids = [row.id for row in self.db.query(JournalEntry.id).filter(JournalEntry.company_id == company_id, JournalEntry.ref_no == ref_no)]
+        if not entry_ids:
+            return 0
+        self.db.query(JournalLine).filter(JournalLine.entry_id.in_(entry_ids)).delete(synchronize_session=False)
+        return self.db.query(JournalEntry).filter(JournalEntry.id.in_(entry_ids)).delete(synchronize_session=False)
+
+    def get_latest_snapshot_date(self, company_id: int, on_or_before):
+        return self.db.query(func.max(AccountBalanceSnapshot.as_of)).filter(
+            AccountBalanceSnapshot.company_id == company_id, AccountBalanceSnapshot.as_of <= on_or_before
+        ).scalar()
+
+    def write_snapshot(self, company_id: int, fiscal_period_id: int, as_of, previous=None) -> int:
+        """Closing balances per account and branch: the previous snapshot plus the posted lines after it"""
+        previous_rows = "" if previous is None else """
+                SELECT branch_id, account_id, debit, credit
+                  FROM account_balance_snapshot
+                 WHERE company_id = :company_id AND as_of = :previous
+                UNION ALL"""
+        line_filter = "l.entry_date <= :as_of" if previous is None else "l.entry_date > :previous AND l.entry_date <= :as_of"
+        result = self.db.execute(text(f"""
+            INSERT INTO account_balance_snapshot (company_id, as_of, branch_id, account_id, fiscal_period_id, debit, credit)
+            SELECT :company_id, :as_of, branch_id, account_id, :fiscal_period_id, SUM(debit), SUM(credit)
+              FROM ({previous_rows}
+                SELECT COALESCE(e.branch_id, 0), l.account_id, l.debit, l.credit
+                  FROM journal_line l
+                  JOIN journal_entry e ON e.id = l.entry_id
+                 WHERE e.company_id = :company_id AND e.status = 2 AND {line_filter}
+              ) balances (branch_id, account_id, debit, credit)
+             GROUP BY branch_id, account_id
+            ON CONFLICT (company_id, as_of, branch_id, account_id)
+            DO UPDATE SET debit = EXCLUDED.debit, credit = EXCLUDED.credit, fiscal_period_id = EXCLUDED.fiscal_period_id
+        """), {'company_id': company_id, 'fiscal_period_id': fiscal_period_id, 'as_of': as_of, 'previous': previous})
+        return result.rowcount
+
+    def delete_snapshots(self, company_id: int, from_date) -> int:
+        return self.db.query(AccountBalanceSnapshot).filter(
+            AccountBalanceSnapshot.company_id == company_id, AccountBalanceSnapshot.as_of >= from_date
+        ).delete(synchronize_session=False)
+
+    def _balance_rows(self, company_id: int, as_of, branch_id: int = None):
+        """SQL of (account_id, debit, credit) rows up to as_of: the nearest snapshot and the posted lines after it, with its parameters"""
+        snapshot = self.get_latest_snapshot_date(company_id, as_of)
+        snapshot_rows = ""
+        if snapshot is not None:
+            snapshot_rows = f"""
+                SELECT account_id, debit, credit
+                  FROM account_balance_snapshot
+                 WHERE company_id = :company_id AND as_of = :snapshot {"AND branch_id = :branch_id" if branch_id else ""}
+                UNION ALL"""
+        line_filter = "l.entry_date <= :as_of" if snapshot is None else "l.entry_date > :snapshot AND l.entry_date <= :as_of"
+        sql = f"""{snapshot_rows}
+                SELECT l.account_id, l.debit, l.credit
+                  FROM journal_line l
+                  JOIN journal_entry e ON e.id = l.entry_id
+                 WHERE e.company_id = :company_id AND e.status = 2 AND {line_filter}
+                   {"AND e.branch_id = :branch_id" if branch_id else ""}"""
+        return sql, {'company_id': company_id, 'as_of': as_of, 'snapshot': snapshot, 'branch_id': branch_id}
+
+    def get_account_balances(self, company_id: int, as_of, branch_id: int = None):
+        """Posted debit and credit totals per account up to as_of, from the nearest snapshot and the lines after it"""
+        balance_rows, params = self._balance_rows(company_id, as_of, branch_id)
+        return self.db.execute(text(f"""
+            SELECT account_id, SUM(debit) AS debit, SUM(credit) AS credit
+              FROM ({balance_rows}
+              ) balances
+             GROUP BY account_id
+        """), params).all()
+
+    def get_account_balance(self, company_id: int, account_id: int, as_of, branch_id: int = None):
+        """Posted (debit, credit) totals of one account up to as_of, from the nearest snapshot and the lines after it"""
+        balance_rows, params = self._balance_rows(company_id, as_of, branch_id)
+        return self.db.execute(text(f"""
+            SELECT COALESCE(SUM(debit), 0) AS debit, COALESCE(SUM(credit), 0) AS credit
+              FROM ({balance_rows}
+              ) balances
+             WHERE account_id = :account_id
+        """), {**params, 'account_id': account_id}).one()
+
+    def get_rollup_balances(self, company_id: int, as_of, branch_id: int = None):
+        """Posted debit and credit totals of every account's whole subtree (the account itself included).
+
+        Lines are summed per account first, then spread to every ancestor in
+        one grouped join on the closure, so a group's total costs no more than
+        its number of descendant accounts.
+        """
+        balance_rows, params = self._balance_rows(company_id, as_of, branch_id)
+        return self.db.execute(text(f"""
+            SELECT c.ancestor_id AS account_id, SUM(b.debit) AS debit, SUM(b.credit) AS credit
+              FROM (SELECT account_id, SUM(debit) AS debit, SUM(credit) AS credit
+                      FROM ({balance_rows}
+                      ) balances
+                     GROUP BY account_id) b
+              JOIN account_closure c ON c.descendant_id = b.account_id
+             GROUP BY c.ancestor_id
+        """), params).all()
+
+class EliminationRuleRepository:
+    def __init__(self, db: Session):
+        self.db = db
+
+    def get_active_rules(self):
+        return self.db.query(EliminationRule).filter(EliminationRule.is_active == True).order_by(EliminationRule.id).all()
+
+    def get_all_rules(self):
+        return self.db.query(EliminationRule).order_by(EliminationRule.id).all()
+
+    def create_rule(self, rule: EliminationRule):
+        self.db.add(rule)
+        self.db.commit()
+        self.db.refresh(rule)
+        return rule
+
+    def update_rule(self, rule_id: int, new_data: dict):
+        db_rule = self.db.query(EliminationRule).filter(EliminationRule.id == rule_id).first()
+        if db_rule:
+            for key, value in new_data.items():
+                setattr(db_rule, key, value)
+            self.db.commit()
+            self.db.refresh(db_rule)
+        return db_rule
+
+    def delete_rule(self, rule_id: int):
+        db_rule = self.db.query(EliminationRule).filter(EliminationRule.id == rule_id).first()
+        if db_rule:
+            self.db.delete(db_rule)
+            self.db.commit()
+        return db_rule
+
 class CostCenterRepository:
     def __init__(self, db: Session):
         self.db = db
@@ -938,6 +2267,11 @@ class PayrunRepository:
         return db_payrun
 
 class NotificationRepository:
+    """Notifications and per-user unread counters. Every write adjusts
+    notification_counter in its own transaction and announces the new count
+    on the notification channel, so clients never poll the table."""
+    PUSHED_IDS_LIMIT = 500 # Larger read_ids lists are left out; pg_notify payloads are capped at 8000 bytes
+
     def __init__(self, db: Session):
         self.db = db
 
@@ -947,28 +2281,132 @@ class NotificationRepository:
     def get_notification_by_id(self, notification_id: int):
         return self.db.query(Notification).filter(Notification.id == notification_id).first()
 
+    def get_user_notifications(self, user_id: int = None, is_read: bool = None, after: tuple = None, limit: int = 50):
+        """Newest first, keyset-paginated: after is the (created_at, id) of the last row already shown"""
+        query = self.db.query(Notification)
+        if user_id is not None:
+            query = query.filter(Notification.user_id == user_id)
+        if is_read is not None:
+            query = query.filter(Notification.is_read == is_read)
+        if after:
+            query = query.filter(tuple_(Notification.created_at, Notification.id) < tuple_(*after))
+        return query.order_by(Notification.created_at.desc(), Notification.id.desc()).limit(limit).all()
+
+    def get_unread_count(self, user_id: int) -> int:
+        return self.db.query(NotificationCounter.unread_count).filter(NotificationCounter.user_id == user_id).scalar() or 0
+
+    def _adjust_unread(self, deltas: dict, notification_ids: dict = None, details: dict = None) -> list:
+        """Apply {user_id: delta} to the unread counters and queue a NOTIFY per user. Does not commit.
+
+        details ({user_id: {...}}) adds what changed, e.g. read_ids or deleted_id, so clients can
+        patch the rows they show instead of re-querying them.
+        """
+        channel = get_notification_channel()
+        messages = []
+        for user_id, delta in deltas.items():
+            if not delta:
+                continue
+            statement = pg_insert(NotificationCounter).values(user_id=user_id, unread_count=max(delta, 0))
+            unread_count = self.db.execute(statement.on_conflict_do_update(
+                index_elements=['user_id'],
+                set_={'unread_count': func.greatest(NotificationCounter.unread_count + delta, 0), 'updated_at': func.now()}
+            ).returning(NotificationCounter.unread_count)).scalar()
+            message = {'user_id': user_id, 'unread_count': unread_count,
+                       'notification_id': (notification_ids or {}).get(user_id)}
+            message.update((details or {}).get(user_id, {}))
+            messages.append(message)
+            if channel.uses_database:
+                # Delivered by PostgreSQL when (and only if) the transaction commits
+                self.db.execute(text("SELECT pg_notify(:channel, :payload)"),
+                                {'channel': CHANNEL_NAME, 'payload': channel.encode(message)})
+        return messages
+
+    @staticmethod
+    def _announce(messages: list):
+        if messages:
+            get_notification_channel().publish_local(messages)
+
     def create_notification(self, notification: Notification):
         self.db.add(notification)
+        self.db.flush()
+        messages = self._adjust_unread({notification.user_id: 0 if notification.is_read else 1},
+                                       {notification.user_id: notification.id})
         self.db.commit()
         self.db.refresh(notification)
+        self._announce(messages)
         return notification
 
+    def create_notifications(self, rows: list):
+        """Insert many notifications (dicts of column values) in one executemany"""
+        if not rows:
+            return 0
+        self.db.execute(insert(Notification), rows)
+        deltas = {}
+        for row in rows:
+            if not row.get('is_read'):
+                deltas[row['user_id']] = deltas.get(row['user_id'], 0) + 1
+        messages = self._adjust_unread(deltas)
+        self.db.commit()
+        self._announce(messages)
+        return len(rows)
+
     def update_notification(self, notification_id: int, new_data: dict):
         db_notification = self.get_notification_by_id(notification_id)
         if db_notification:
+            old_user_id, was_unread = db_notification.user_id, not db_notification.is_read
             for key, value in new_data.items():
                 setattr(db_notification, key, value)
+            deltas = {}
+            if was_unread:
+                deltas[old_user_id] = -1
+            if not db_notification.is_read:
+                deltas[db_notification.user_id] = deltas.get(db_notification.user_id, 0) + 1
+            self.db.flush()
+            messages = self._adjust_unread(deltas, {user_id: notification_id for user_id in deltas})
             self.db.commit()
             self.db.refresh(db_notification)
+            self._announce(messages)
         return db_notification
 
+    def mark_read(self, user_id: int, notification_ids: list = None) -> int:
+        """Mark a user's unread notifications (all, or only the given ids) as read in one UPDATE"""
+        statement = update(Notification).where(Notification.user_id == user_id, Notification.is_read == False)
+        if notification_ids is not None:
+            statement = statement.where(Notification.id.in_(notification_ids))
+        marked = self.db.execute(statement.values(is_read=True).execution_options(synchronize_session=False)).rowcount
+        details = None
+        if notification_ids is not None and len(notification_ids) <= self.PUSHED_IDS_LIMIT:
+            details = {user_id: {'read_ids': list(notification_ids)}}
+        messages = self._adjust_unread({user_id: -marked}, details=details)
+        self.db.commit()
+        self._announce(messages)
+        return marked
+
     def delete_notification(self, notification_id: int):
         db_notification = self.get_notification_by_id(notification_id)
         if db_notification:
             self.db.delete(db_notification)
+            self.db.flush()
+            messages = self._adjust_unread({db_notification.user_id: 0 if db_notification.is_read else -1},
+                                           details={db_notification.user_id: {'deleted_id': notification_id}})
             self.db.commit()
+            self._announce(messages)
         return db_notification
 
+    def rebuild_counters(self):
+        """Recompute every user's unread counter from the notification table"""
+        self.db.execute(text("""
+            INSERT INTO notification_counter (user_id, unread_count, updated_at)
+            SELECT user_id, COUNT(*), now() FROM notification WHERE NOT is_read GROUP BY user_id
+            ON CONFLICT (user_id) DO UPDATE SET unread_count = EXCLUDED.unread_count, updated_at = EXCLUDED.updated_at
+        """))
+        self.db.execute(text("""
+            UPDATE notification_counter c SET unread_count = 0, updated_at = now()
+             WHERE c.unread_count <> 0
+               AND NOT EXISTS (SELECT 1 FROM notification n WHERE n.user_id = c.user_id AND NOT n.is_read)
+        """))
+        self.db.commit()
+
 class WorkflowRepository:
     def __init__(self, db: Session):
         self.db = db
@@ -979,6 +2417,9 @@ class WorkflowRepository:
     def get_workflow_by_id(self, workflow_id: int):
         return self.db.query(Workflow).filter(Workflow.id == workflow_id).first()
 
+    def get_active_workflows(self):
+        return self.db.query(Workflow).filter(Workflow.is_active == True).order_by(Workflow.id).all()
+
     def create_workflow(self, workflow: Workflow):
         self.db.add(workflow)
         self.db.commit()
@@ -1065,6 +2506,32 @@ class CurrencyRepository:
             self.db.commit()
         return db_currency
 
+class ExchangeRateRepository:
+    def __init__(self, db: Session):
+        self.db = db
+
+    def get_all_rates(self):
+        return self.db.query(ExchangeRate).order_by(ExchangeRate.currency_id, ExchangeRate.rate_date).all()
+
+    def get_rates_by_currency(self, currency_id: int):
+        return self.db.query(ExchangeRate).filter(ExchangeRate.currency_id == currency_id).order_by(ExchangeRate.rate_date).all()
+
+    def get_latest_rate_date(self, currency_id: int):
+        return self.db.query(func.max(ExchangeRate.rate_date)).filter(ExchangeRate.currency_id == currency_id).scalar()
+
+    def set_rate(self, currency_id: int, rate_date, rate, created_by: int = 1):
+        statement = pg_insert(ExchangeRate).values(currency_id=currency_id, rate_date=rate_date, rate=rate, created_by=created_by)
+        self.db.execute(statement.on_conflict_do_update(
+            index_elements=[ExchangeRate.currency_id, ExchangeRate.rate_date],
+            set_={'rate': statement.excluded.rate, 'created_by': statement.excluded.created_by, 'created_at': func.now()}
+        ))
+        self.db.commit()
+
+    def delete_rate(self, currency_id: int, rate_date):
+        deleted = self.db.query(ExchangeRate).filter(ExchangeRate.currency_id == currency_id, ExchangeRate.rate_date == rate_date).delete()
+        self.db.commit()
+        return deleted
+
 class PaymentMethodRepository:
     def __init__(self, db: Session):
         self.db = db
@@ -1175,16 +2642,25 @@ class InvoicePaymentRepository:
         self.db = db
 
     def create_invoice_payment(self, invoice_payment: InvoicePayment):
-        self.db.add(invoice_payment)
+        self.add_invoice_payment(invoice_payment)
         self.db.commit()
         self.db.refresh(invoice_payment)
         return invoice_payment
 
+    def add_invoice_payment(self, invoice_payment: InvoicePayment):
+        # Does not commit, like InvoiceRepository.add_invoice
+        self.db.add(invoice_payment)
+        InvoiceRepository(self.db).apply_payment_delta(invoice_payment.invoice_id, invoice_payment.amount)
+        self.db.flush()
+        return invoice_payment
+
     def get_payments_by_invoice_id(self, invoice_id: int):
         return self.db.query(InvoicePayment).filter(InvoicePayment.invoice_id == invoice_id).options(joinedload(InvoicePayment.payment_method)).all()
 
     def delete_invoice_payments_by_invoice_id(self, invoice_id: int):
+        total = self.db.query(func.sum(InvoicePayment.amount)).filter(InvoicePayment.invoice_id == invoice_id).scalar()
         self.db.query(InvoicePayment).filter(InvoicePayment.invoice_id == invoice_id).delete()
+        InvoiceRepository(self.db).apply_payment_delta(invoice_id, -(total or 0))
         self.db.commit()
 
 class GiftCardRepository:
@@ -1249,3 +2725,145 @@ class LoyaltyProgramRepository:
             self.db.commit()
             self.db.refresh(db_program)
         return db_program
+
+
+class LoyaltyLedgerRepository:
+    def __init__(self, db: Session):
+        self.db = db
+
+    def get_account(self, company_id: int, customer_id: int):
+        return self.db.get(LoyaltyAccount, (company_id, customer_id))
+
+    def get_entries_by_customer(self, company_id: int, customer_id: int, limit: int = 100):
+        return self.db.query(LoyaltyLedger).filter(
+            LoyaltyLedger.company_id == company_id,
+            LoyaltyLedger.customer_id == customer_id
+        ).order_by(LoyaltyLedger.created_at.desc()).limit(limit).all()
+
+    def add_accrual(self, entry: LoyaltyLedger):
+        # Does not commit: the accrual is part of the caller's checkout transaction
+        self.db.add(entry)
+        account_insert = pg_insert(LoyaltyAccount).values(
+            company_id=entry.company_id,
+            customer_id=entry.customer_id,
+            points_balance=entry.points,
+            cashback_balance=entry.cashback_amount,
+            lifetime_points=entry.points,
+            tier=0
+        )
+        self.db.execute(account_insert.on_conflict_do_update(
+            index_elements=[LoyaltyAccount.company_id, LoyaltyAccount.customer_id],
+            set_={
+                'points_balance': LoyaltyAccount.points_balance + account_insert.excluded.points_balance,
+                'cashback_balance': LoyaltyAccount.cashback_balance + account_insert.excluded.cashback_balance,
+                'lifetime_points': LoyaltyAccount.lifetime_points + account_insert.excluded.lifetime_points,
+                'updated_at': func.now()
+            }
+        ))
+        self.db.flush()
+        return entry
+
+    def redeem_points(self, company_id: int, customer_id: int, points: int, as_of, invoice_id: int = None):
+        # Sweep the customer's accruals that expired since the last scheduled run, so the balance
+        # checked below only holds points that can still be redeemed
+        self._expire_due(as_of, company_id, customer_id)
+
+        # Guarded decrement: returns None without touching anything if the balance is insufficient
+        updated = self.db.execute(text("""
+            UPDATE loyalty_account
+               SET points_balance = points_balance - :points, updated_at = now()
+             WHERE company_id = :company_id AND customer_id = :customer_id AND points_balance >= :points
+         RETURNING points_balance
+        """), {'company_id': company_id, 'customer_id': customer_id, 'points': points}).scalar()
+        if updated is None:
+            self.db.rollback()
+            return None
+
+        # Consume the oldest unexpired accruals first so expiry only removes what is left
+        self.db.execute(text("""
+            WITH ordered AS (
+                SELECT id, remaining_points,
+                       SUM(remaining_points) OVER (ORDER BY created_at, id) - remaining_points AS consumed_before
+                  FROM loyalty_ledger
+                 WHERE company_id = :company_id AND customer_id = :customer_id
+                   AND entry_type = 0 AND remaining_points > 0
+                   AND (expires_at IS NULL OR expires_at > :as_of)
+            )
+            UPDATE loyalty_ledger l
+               SET remaining_points = l.remaining_points - LEAST(o.remaining_points, :points - o.consumed_before)
+              FROM ordered o
+             WHERE l.id = o.id AND o.consumed_before < :points
+        """), {'company_id': company_id, 'customer_id': customer_id, 'points': points, 'as_of': as_of})
+
+        entry = LoyaltyLedger(
+            company_id=company_id,
+            customer_id=customer_id,
+            invoice_id=invoice_id,
+            entry_type=1, # Redemption
+            points=-points,
+            cashback_amount=0,
+            remaining_points=0
+        )
+        self.db.add(entry)
+        self.db.commit()
+        self.db.refresh(entry)
+        return entry
+
+    def expire_due_points(self, as_of):
+        result = self._expire_due(as_of)
+        self.db.commit()
+        return result.rowcount
+
+    def _expire_due(self, as_of, company_id: int = None, customer_id: int = None):
+        # Set-based: zero the remaining points of every due accrual (of one customer, if given), write one
+        # expiry entry per customer and decrement the balances in a single statement. Does not commit.
+        customer_filter = "AND company_id = :company_id AND customer_id = :customer_id" if customer_id is not None else ""
+        return self.db.execute(text(f"""
+            WITH due AS (
+                SELECT id, company_id, customer_id, remaining_points
+                  FROM loyalty_ledger
+                 WHERE entry_type = 0 AND remaining_points > 0 AND expires_at <= :as_of
+                   {customer_filter}
+                   FOR UPDATE SKIP LOCKED
+            ), cleared AS (
+                UPDATE loyalty_ledger l
+                   SET remaining_points = 0
+                  FROM due
+                 WHERE l.id = due.id
+             RETURNING due.company_id, due.customer_id, due.remaining_points
+            ), per_customer AS (
+                SELECT company_id, customer_id, SUM(remaining_points) AS points
+                  FROM cleared
+                 GROUP BY company_id, customer_id
+            ), expiry_entries AS (
+                INSERT INTO loyalty_ledger (company_id, customer_id, entry_type, points, cashback_amount, remaining_points, created_at)
+                SELECT company_id, customer_id, 2, -points, 0, 0, now()
+                  FROM per_customer
+            )
+            UPDATE loyalty_account a
+               SET points_balance = GREATEST(a.points_balance - p.points, 0), updated_at = now()
+              FROM per_customer p
+             WHERE a.company_id = p.company_id AND a.customer_id = p.customer_id
+        """), {'as_of': as_of, 'company_id': company_id, 'customer_id': customer_id})
+
+    def recalculate_tiers(self, since, silver_points: int, gold_points: int):
+        # Tier is based on points accrued since the given date; only changed rows are written
+        result = self.db.execute(text("""
+            WITH rolling AS (
+                SELECT a.company_id, a.customer_id,
+                       CASE WHEN COALESCE(SUM(l.points), 0) >= :gold THEN 2
+                            WHEN COALESCE(SUM(l.points), 0) >= :silver THEN 1
+                            ELSE 0 END AS tier
+                  FROM loyalty_account a
+                  LEFT JOIN loyalty_ledger l
+                    ON l.company_id = a.company_id AND l.customer_id = a.customer_id
+                   AND l.entry_type = 0 AND l.created_at >= :since
+                 GROUP BY a.company_id, a.customer_id
+            )
+            UPDATE loyalty_account a
+               SET tier = r.tier, updated_at = now()
+              FROM rolling r
+             WHERE a.company_id = r.company_id AND a.customer_id = r.customer_id AND a.tier <> r.tier
+        """), {'since': since, 'silver': silver_points, 'gold': gold_points})
+        self.db.commit()
+        return result.rowcount
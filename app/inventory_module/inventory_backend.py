@@ -12,7 +12,7 @@ from typing import List, Dict, Optional
 
 from app.infrastructure.database import get_session
 from app.infrastructure.repositories import (
-    ItemRepository, StockMovementRepository, WarehouseRepository,
+    ItemRepository, WarehouseRepository,
     UnitRepository
 )
 from app.domain.models import Item, StockMovement, Warehouse
@@ -41,8 +41,6 @@ class InventoryBackend(QObject):
         """Create a new stock movement"""
         try:
             with get_session() as db:
-                stock_repo = StockMovementRepository(db)
-                
                 movement = StockMovement(
                     item_id=movement_data['item_id'],
                     movement_type=movement_data['movement_type'],
@@ -57,8 +55,17 @@ class InventoryBackend(QObject):
                     created_by=movement_data.get('user_id', 1)
                 )
                 
-                created_movement = stock_repo.create_stock_movement(movement)
+                db.add(movement)
+                db.flush()
+                
+                # Cost the movement and update the item's FIFO layers / average cost
+                costing_service = self.services.get('costing_service')
+                if costing_service:
+                    costing_service.apply_movement_in_transaction(db, movement)
+                
                 db.commit()
+                db.refresh(movement)
+                created_movement = movement
                 
                 self.stock_movement_created.emit(self._format_stock_movement(created_movement))
                 return True
@@ -186,8 +193,6 @@ class InventoryBackend(QObject):
         """Transfer stock between warehouses"""
         try:
             with get_session() as db:
-                stock_repo = StockMovementRepository(db)
-                
                 # Out from source warehouse
                 movement_out = StockMovement(
                     item_id=item_id,
@@ -199,20 +204,28 @@ class InventoryBackend(QObject):
                     company_id=1,
                     branch_id=1
                 )
-                stock_repo.create_stock_movement(movement_out)
+                db.add(movement_out)
+                db.flush()
+                costing_service = self.services.get('costing_service')
+                if costing_service:
+                    costing_service.apply_movement_in_transaction(db, movement_out)
                 
-                # In to destination warehouse
+                # In to destination warehouse, at the cost it left the source with
                 movement_in = StockMovement(
                     item_id=item_id,
                     movement_type=2,  # Transfer In
                     quantity=Decimal(str(quantity)),
+                    cost=movement_out.cost,
                     movement_date=date.today(),
                     warehouse_id=to_warehouse,
                     memo=f"Transfer from Warehouse {from_warehouse}: {notes}",
                     company_id=1,
                     branch_id=1
                 )
-                stock_repo.create_stock_movement(movement_in)
+                db.add(movement_in)
+                db.flush()
+                if costing_service:
+                    costing_service.apply_movement_in_transaction(db, movement_in)
                 
                 db.commit()
                 return True
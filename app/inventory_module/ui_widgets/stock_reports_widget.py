@@ -11,7 +11,9 @@ from PySide6.QtWidgets import (
 from PySide6.QtCore import Qt, QDate
 
 from app.ui.base_widget import TranslatableWidget
-from app.i18n.translations import tr
+from app.ui.export_worker import ask_export_path, start_export
+from app.application.export_engine import export_rows, TablePageRenderer
+from app.i18n.translations import tr, get_language
 
 
 class StockReportsWidget(TranslatableWidget):
@@ -22,6 +24,7 @@ class StockReportsWidget(TranslatableWidget):
         
         self.backend = backend
         self.inventory_service = inventory_service
+        self.export_worker = None
         
         self.init_ui()
     
@@ -269,11 +272,51 @@ class StockReportsWidget(TranslatableWidget):
         except Exception as e:
             QMessageBox.critical(self, tr('common.error'), f"Error: {str(e)}")
     
+    def _table_contents(self):
+        """Headers and rows of the report currently shown"""
+        headers = [self.report_table.horizontalHeaderItem(c).text() if self.report_table.horizontalHeaderItem(c) else ""
+                   for c in range(self.report_table.columnCount())]
+        rows = []
+        for r in range(self.report_table.rowCount()):
+            rows.append([self.report_table.item(r, c).text() if self.report_table.item(r, c) else ""
+                         for c in range(self.report_table.columnCount())])
+        return headers, rows
+    
     def export_report(self):
-        QMessageBox.information(self, tr('common.info'), tr('common.feature_coming_soon'))
+        report_type = self.report_type_combo.currentIndex()
+        file_path = ask_export_path(self, self.report_type_combo.currentText())
+        if not file_path:
+            return
+        title = self.report_type_combo.currentText()
+        rtl = get_language() == 'ar'
+        
+        if report_type == 1:
+            # Movements can run to millions of rows: stream them from the database, not from the table
+            date_from = self.from_date_input.date().toPython()
+            date_to = self.to_date_input.date().toPython()
+            headers = [tr('inventory.movement_date'), tr('inventory.item_code'), tr('inventory.item_name'), tr('inventory.warehouse'),
+                       tr('inventory.movement_type'), tr('inventory.quantity'), tr('inventory.cost_price'), tr('inventory.reference')]
+            job = lambda progress, cancelled: self.inventory_service.export_stock_movements(
+                file_path, date_from, date_to, headers=headers, progress=progress, cancelled=cancelled, title=title, rtl=rtl
+            )
+        else:
+            headers, rows = self._table_contents()
+            job = lambda progress, cancelled: export_rows(
+                file_path, headers, rows, len(rows), progress, cancelled, title=title, rtl=rtl
+            )
+        self.export_worker = start_export(self, job, title)
     
     def print_report(self):
-        QMessageBox.information(self, tr('common.info'), tr('common.feature_coming_soon'))
+        from PySide6.QtPrintSupport import QPrinter, QPrintDialog
+        
+        printer = QPrinter(QPrinter.HighResolution)
+        dialog = QPrintDialog(printer, self)
+        if dialog.exec() != QPrintDialog.Accepted:
+            return
+        headers, rows = self._table_contents()
+        renderer = TablePageRenderer(printer, headers, self.report_type_combo.currentText(), get_language() == 'ar')
+        renderer.write_rows(rows)
+        renderer.close()
     
     def refresh_data(self):
         self.generate_report()
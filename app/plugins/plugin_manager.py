@@ -6,13 +6,22 @@ Allows extending functionality through plugins
 import os
 import importlib
 import inspect
-from typing import Dict, List, Any, Callable
+from typing import Dict, List, Any, Callable, Tuple
 from pathlib import Path
 
+from app.infrastructure.event_bus import get_event_bus, BLOCK
+
 
 class PluginInterface:
     """Base interface for all plugins"""
     
+    # Event delivery: events are handled on the plugin's own worker thread
+    subscribed_events = None # Event names to receive; None for all
+    event_queue_size = 1000
+    event_policy = BLOCK # Backpressure when the queue is full (see app.infrastructure.event_bus)
+    event_timeout = 5.0 # Seconds a batch may take before it counts as an overrun
+    event_batch_size = 50
+    
     def __init__(self):
         self.name = "Base Plugin"
         self.version = "1.0.0"
@@ -42,13 +51,19 @@ class PluginInterface:
     def on_event(self, event_name: str, data: Dict[str, Any]):
         """Handle application events"""
         pass
+    
+    def on_events(self, events: List[Tuple[str, Dict[str, Any]]]):
+        """Handle a burst of events; override to process them in one go"""
+        for event_name, data in events:
+            self.on_event(event_name, data)
 
 
 class PluginManager:
     """Manages loading, activation, and execution of plugins"""
     
-    def __init__(self, plugins_dir: str = "app/plugins"):
+    def __init__(self, plugins_dir: str = "app/plugins", event_bus=None):
         self.plugins_dir = Path(plugins_dir)
+        self.event_bus = event_bus or get_event_bus()
         self.plugins: Dict[str, PluginInterface] = {}
         self.active_plugins: Dict[str, PluginInterface] = {}
         self.event_handlers: Dict[str, List[Callable]] = {}
@@ -95,6 +110,11 @@ class PluginManager:
             plugin = self.plugins[plugin_name]
             plugin.activate()
             self.active_plugins[plugin_name] = plugin
+            self.event_bus.subscribe(
+                plugin_name, plugin.on_events, plugin.subscribed_events,
+                max_queue=plugin.event_queue_size, policy=plugin.event_policy,
+                timeout=plugin.event_timeout, batch_size=plugin.event_batch_size
+            )
             print(f"Activated plugin: {plugin_name}")
             return True
         return False
@@ -103,6 +123,7 @@ class PluginManager:
         """Deactivate a plugin"""
         if plugin_name in self.active_plugins:
             plugin = self.active_plugins[plugin_name]
+            self.event_bus.unsubscribe(plugin_name) # Delivers the events already queued
             plugin.deactivate()
             del self.active_plugins[plugin_name]
             print(f"Deactivated plugin: {plugin_name}")
@@ -122,12 +143,12 @@ class PluginManager:
         return self.active_plugins
     
     def trigger_event(self, event_name: str, data: Dict[str, Any]):
-        """Trigger an event for all active plugins"""
-        for plugin in self.active_plugins.values():
-            try:
-                plugin.on_event(event_name, data)
-            except Exception as e:
-                print(f"Error in plugin {plugin.name} handling event {event_name}: {e}")
+        """Queue an event for all active plugins; handlers run on the plugins' worker threads"""
+        self.event_bus.publish(event_name, data)
+    
+    def get_event_metrics(self) -> Dict[str, dict]:
+        """Queue depth, drops, timeouts and latency per active plugin"""
+        return self.event_bus.get_metrics()
     
     def get_all_menu_items(self) -> List[Dict[str, Any]]:
         """Get menu items from all active plugins"""
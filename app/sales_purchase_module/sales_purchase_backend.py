@@ -12,7 +12,7 @@ from typing import List, Dict, Optional
 
 from app.infrastructure.database import get_session
 from app.infrastructure.repositories import (
-    InvoiceRepository, InvoiceLineRepository, StockMovementRepository,
+    InvoiceRepository, InvoiceLineRepository,
     CustomerRepository, SupplierRepository, ItemRepository,
     InvoicePaymentRepository, SalesOrderRepository, PurchaseOrderRepository
 )
@@ -20,6 +20,11 @@ from app.domain.models import (
     Invoice, InvoiceLine, StockMovement, Customer, Supplier, Item,
     InvoicePayment, SalesOrder, PurchaseOrder
 )
+from app.application.fx_engine import get_exchange_rates
+from app.infrastructure.event_bus import (
+    publish_event, invoice_event_data, payment_event_data, stock_movement_event_data,
+    INVOICE_CREATED, PAYMENT_RECEIVED, STOCK_MOVED
+)
 
 
 class SalesPurchaseBackend(QObject):
@@ -49,8 +54,20 @@ class SalesPurchaseBackend(QObject):
         try:
             with get_session() as db:
                 invoice_repo = InvoiceRepository(db)
-                stock_repo = StockMovementRepository(db)
                 payment_repo = InvoicePaymentRepository(db)
+                costing_service = self.services.get('costing_service')
+                
+                # Enforce the customer's credit limit on the unpaid part of the sale
+                arap_service = self.services.get('arap_service')
+                on_credit = Decimal(0)
+                if arap_service and invoice_data.get('customer_id'):
+                    paid_now = sum(Decimal(str(p['amount'])) for p in invoice_data.get('payments', []))
+                    on_credit = Decimal(str(invoice_data['total'])) - paid_now
+                    if on_credit > 0 and not arap_service.check_credit(invoice_data['customer_id'], on_credit)['allowed']:
+                        raise ValueError("تجاوز الحد الائتماني للعميل.")
+                    # Re-check under the customer's credit lock before writing anything; it is held until the checkout commits
+                    if on_credit > 0:
+                        arap_service.reserve_credit_in_transaction(db, invoice_data['customer_id'], on_credit)
                 
                 # Create invoice
                 invoice = Invoice(
@@ -59,7 +76,10 @@ class SalesPurchaseBackend(QObject):
                     invoice_type=0,  # Sales
                     customer_id=invoice_data.get('customer_id'),
                     currency=invoice_data.get('currency', 'SAR'),
+                    fx_rate=get_exchange_rates().base_rate(invoice_data.get('company_id', 1), invoice_data.get('currency', 'SAR'),
+                                                           invoice_data['invoice_date']),
                     total_amount=Decimal(str(invoice_data['total'])),
+                    total_tax=sum((Decimal(str(item_data.get('tax', 0))) for item_data in invoice_data['items']), Decimal(0)),
                     discount_percentage=Decimal(str(invoice_data.get('discount', 0))),
                     charges=Decimal(str(invoice_data.get('charges', 0))),
                     memo=invoice_data.get('notes', ''),
@@ -70,6 +90,8 @@ class SalesPurchaseBackend(QObject):
                 )
                 
                 # Add invoice lines
+                stock_movements = []
+                costed_lines = []
                 for item_data in invoice_data['items']:
                     line = InvoiceLine(
                         item_id=item_data['item_id'],
@@ -92,12 +114,18 @@ class SalesPurchaseBackend(QObject):
                         branch_id=invoice_data.get('branch_id', 1),
                         warehouse_id=invoice_data.get('warehouse_id')
                     )
-                    stock_repo.create_stock_movement(stock_movement)
+                    db.add(stock_movement)
+                    db.flush()
+                    stock_movements.append(stock_movement)
+                    if costing_service:
+                        costed_lines.append((line, costing_service.apply_movement_in_transaction(db, stock_movement)))
                 
                 # Save invoice
-                created_invoice = invoice_repo.create_invoice(invoice)
+                created_invoice = invoice_repo.add_invoice(invoice)
+                line_costs = {line.id: cost for line, cost in costed_lines} # Lines have their ids once the invoice is flushed
                 
                 # Add payments
+                invoice_payments = []
                 if 'payments' in invoice_data:
                     for payment_data in invoice_data['payments']:
                         payment = InvoicePayment(
@@ -106,12 +134,26 @@ class SalesPurchaseBackend(QObject):
                             amount=Decimal(str(payment_data['amount'])),
                             transaction_details=payment_data.get('transaction_details')
                         )
-                        payment_repo.create_invoice_payment(payment)
+                        invoice_payments.append(payment_repo.add_invoice_payment(payment))
+                
+                # Accrue loyalty points in the same transaction as the sale
+                loyalty_ledger_service = self.services.get('loyalty_ledger_service')
+                if loyalty_ledger_service and created_invoice.customer_id:
+                    loyalty_ledger_service.accrue_in_transaction(
+                        db, created_invoice.company_id, created_invoice.customer_id,
+                        created_invoice.total_amount, created_invoice.id
+                    )
+                
+                # Keep draft tax reports of the invoice's period up to date
+                tax_service = self.services.get('tax_service')
+                if tax_service:
+                    tax_service.apply_invoice_in_transaction(db, created_invoice)
                 
                 db.commit()
+                self._publish_invoice_events(created_invoice, stock_movements, invoice_payments)
                 
                 # Emit signal
-                self.sales_invoice_created.emit(self._format_invoice(created_invoice))
+                self.sales_invoice_created.emit(self._format_invoice(created_invoice, line_costs or None))
                 return True
                 
         except Exception as e:
@@ -210,17 +252,20 @@ class SalesPurchaseBackend(QObject):
         try:
             with get_session() as db:
                 invoice_repo = InvoiceRepository(db)
-                stock_repo = StockMovementRepository(db)
                 payment_repo = InvoicePaymentRepository(db)
+                costing_service = self.services.get('costing_service')
                 
                 # Create invoice
                 invoice = Invoice(
                     invoice_no=invoice_data['invoice_no'],
                     invoice_date=invoice_data['invoice_date'],
-                    invoice_type=2,  # Purchase
+                    invoice_type=1,  # Purchase
                     supplier_id=invoice_data.get('supplier_id'),
                     currency=invoice_data.get('currency', 'SAR'),
+                    fx_rate=get_exchange_rates().base_rate(invoice_data.get('company_id', 1), invoice_data.get('currency', 'SAR'),
+                                                           invoice_data['invoice_date']),
                     total_amount=Decimal(str(invoice_data['total'])),
+                    total_tax=sum((Decimal(str(item_data.get('tax', 0))) for item_data in invoice_data['items']), Decimal(0)),
                     discount_percentage=Decimal(str(invoice_data.get('discount', 0))),
                     charges=Decimal(str(invoice_data.get('charges', 0))),
                     memo=invoice_data.get('notes', ''),
@@ -231,6 +276,7 @@ class SalesPurchaseBackend(QObject):
                 )
                 
                 # Add invoice lines
+                stock_movements = []
                 for item_data in invoice_data['items']:
                     line = InvoiceLine(
                         item_id=item_data['item_id'],
@@ -247,18 +293,24 @@ class SalesPurchaseBackend(QObject):
                         item_id=item_data['item_id'],
                         movement_type=0,  # In
                         quantity=Decimal(str(item_data['quantity'])),
+                        cost=Decimal(str(item_data['price'])),
                         movement_date=invoice_data['invoice_date'],
                         memo=f"Purchase Invoice {invoice_data['invoice_no']}",
                         company_id=invoice_data.get('company_id', 1),
                         branch_id=invoice_data.get('branch_id', 1),
                         warehouse_id=invoice_data.get('warehouse_id')
                     )
-                    stock_repo.create_stock_movement(stock_movement)
+                    db.add(stock_movement)
+                    db.flush()
+                    stock_movements.append(stock_movement)
+                    if costing_service:
+                        costing_service.apply_movement_in_transaction(db, stock_movement)
                 
                 # Save invoice
-                created_invoice = invoice_repo.create_invoice(invoice)
+                created_invoice = invoice_repo.add_invoice(invoice)
                 
                 # Add payments
+                invoice_payments = []
                 if 'payments' in invoice_data:
                     for payment_data in invoice_data['payments']:
                         payment = InvoicePayment(
@@ -267,9 +319,15 @@ class SalesPurchaseBackend(QObject):
                             amount=Decimal(str(payment_data['amount'])),
                             transaction_details=payment_data.get('transaction_details')
                         )
-                        payment_repo.create_invoice_payment(payment)
+                        invoice_payments.append(payment_repo.add_invoice_payment(payment))
+                
+                # Keep draft tax reports of the invoice's period up to date
+                tax_service = self.services.get('tax_service')
+                if tax_service:
+                    tax_service.apply_invoice_in_transaction(db, created_invoice)
                 
                 db.commit()
+                self._publish_invoice_events(created_invoice, stock_movements, invoice_payments)
                 
                 # Emit signal
                 self.purchase_invoice_created.emit(self._format_invoice(created_invoice))
@@ -288,7 +346,7 @@ class SalesPurchaseBackend(QObject):
                     joinedload(Invoice.supplier),
                     joinedload(Invoice.lines).joinedload(InvoiceLine.item),
                     joinedload(Invoice.payments)
-                ).filter(Invoice.invoice_type == 2).order_by(Invoice.invoice_date.desc()).all()
+                ).filter(Invoice.invoice_type == 1).order_by(Invoice.invoice_date.desc()).all()
                 
                 return [self._format_invoice(inv) for inv in invoices]
         except Exception as e:
@@ -297,8 +355,16 @@ class SalesPurchaseBackend(QObject):
     
     # ==================== Helper Methods ====================
     
-    def _format_invoice(self, invoice: Invoice) -> Dict:
-        """Format invoice for display"""
+    def _publish_invoice_events(self, invoice: Invoice, stock_movements: List[StockMovement], invoice_payments: List[InvoicePayment]):
+        """Publish the committed invoice, its stock movements and payments to plugins"""
+        publish_event(INVOICE_CREATED, invoice_event_data(invoice))
+        for stock_movement in stock_movements:
+            publish_event(STOCK_MOVED, stock_movement_event_data(stock_movement))
+        for payment in invoice_payments:
+            publish_event(PAYMENT_RECEIVED, payment_event_data(payment, invoice))
+    
+    def _format_invoice(self, invoice: Invoice, line_costs: Dict[int, Decimal] = None) -> Dict:
+        """Format invoice for display; line_costs, the COGS of each line id as costed at sale, is carried as 'cogs'"""
         if not invoice:
             return {}
         
@@ -312,6 +378,7 @@ class SalesPurchaseBackend(QObject):
         for line in invoice.lines:
             item_name = line.item.name_ar if line.item else "Unknown"
             items.append({
+                'id': line.id,
                 'item_id': line.item_id,
                 'item_name': item_name,
                 'quantity': float(line.quantity),
@@ -320,6 +387,8 @@ class SalesPurchaseBackend(QObject):
                 'total': float(line.total_line_amount),
                 'notes': line.memo
             })
+            if line_costs and line.id in line_costs:
+                items[-1]['cogs'] = line_costs[line.id]
         
         payments = []
         for payment in invoice.payments:
@@ -338,6 +407,7 @@ class SalesPurchaseBackend(QObject):
             'invoice_type': invoice.invoice_type,
             'customer_id': invoice.customer_id,
             'supplier_id': invoice.supplier_id,
+            'company_id': invoice.company_id,
             'customer_name': customer_name,
             'currency': invoice.currency,
             'subtotal': float(sum(line.total_line_amount for line in invoice.lines)),
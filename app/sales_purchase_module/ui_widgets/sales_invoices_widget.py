@@ -493,7 +493,7 @@ class SalesInvoicesWidget(TranslatableWidget):
         item_id = self.item_combo.currentData()
         if item_id:
             try:
-                item = self.inventory_service.get_item_by_id(item_id)
+                item = self.inventory_service.get_catalog_item(item_id)
                 if item:
                     self.price_input.setValue(float(item.sale_price))
                     self.calculate_line_total()
@@ -0,0 +1,75 @@
+from PySide6.QtWidgets import QDialog, QVBoxLayout, QHBoxLayout, QLabel, QPushButton, QTableWidget, QTableWidgetItem, QMessageBox, QHeaderView
+from app.ui.styles import BUTTON_STYLE, TABLE_STYLE
+from app.i18n.translations import tr
+
+class AccountStatementDialog(QDialog):
+    """Posted lines of one account with a running balance, loaded a page at a time"""
+
+    PAGE_SIZE = 200
+
+    def __init__(self, journal_service, company_id, account, date_from, date_to, branch_id=None, parent=None):
+        super().__init__(parent)
+        self.journal_service = journal_service
+        self.company_id = company_id
+        self.account = account
+        self.date_from = date_from
+        self.date_to = date_to
+        self.branch_id = branch_id or None
+        self.next_cursor = None
+        self.balance_forward = None
+        self.init_ui()
+        self.load_page()
+
+    def init_ui(self):
+        self.setWindowTitle(f"Account Statement - {self.account.code} {self.account.name_ar}")
+        self.resize(1000, 600)
+
+        main_layout = QVBoxLayout(self)
+
+        header_layout = QHBoxLayout()
+        header_layout.addWidget(QLabel(f"{self.account.code} - {self.account.name_ar}"))
+        header_layout.addWidget(QLabel(f"{self.date_from} → {self.date_to}"))
+        self.opening_label = QLabel()
+        header_layout.addWidget(self.opening_label)
+        main_layout.addLayout(header_layout)
+
+        self.statement_table = QTableWidget()
+        self.statement_table.setColumnCount(6)
+        self.statement_table.setHorizontalHeaderLabels(["Date", "Ref No", "Memo", "Debit", "Credit", "Balance"])
+        self.statement_table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        self.statement_table.setStyleSheet(TABLE_STYLE)
+        self.statement_table.setAlternatingRowColors(True)
+        main_layout.addWidget(self.statement_table)
+
+        self.load_more_button = QPushButton("Load More")
+        self.load_more_button.setStyleSheet(BUTTON_STYLE)
+        self.load_more_button.clicked.connect(self.load_page)
+        main_layout.addWidget(self.load_more_button)
+
+    def load_page(self):
+        try:
+            page = self.journal_service.get_account_statement(
+                self.company_id, self.account.id, self.date_from, self.date_to, self.branch_id,
+                after=self.next_cursor, balance_forward=self.balance_forward, limit=self.PAGE_SIZE
+            )
+        except Exception as e:
+            QMessageBox.critical(self, tr('common.error'), f"Error loading account statement: {str(e)}")
+            return
+
+        if page['opening_balance'] is not None and self.next_cursor is None:
+            self.opening_label.setText(f"Opening Balance: {page['opening_balance']:,.2f}")
+
+        row = self.statement_table.rowCount()
+        self.statement_table.setRowCount(row + len(page['lines']))
+        for line in page['lines']:
+            self.statement_table.setItem(row, 0, QTableWidgetItem(str(line['date'])))
+            self.statement_table.setItem(row, 1, QTableWidgetItem(line['ref_no'] or ""))
+            self.statement_table.setItem(row, 2, QTableWidgetItem(line['memo'] or ""))
+            self.statement_table.setItem(row, 3, QTableWidgetItem(f"{line['debit']:,.2f}" if line['debit'] else ""))
+            self.statement_table.setItem(row, 4, QTableWidgetItem(f"{line['credit']:,.2f}" if line['credit'] else ""))
+            self.statement_table.setItem(row, 5, QTableWidgetItem(f"{line['running_balance']:,.2f}"))
+            row += 1
+
+        self.next_cursor = page['next']
+        self.balance_forward = page['balance_forward']
+        self.load_more_button.setEnabled(self.next_cursor is not None)
@@ -89,6 +89,7 @@ class BalanceSheetWidget(QWidget):
         
         # Get all accounts
         accounts = self.account_service.get_all_accounts()
+        balances = self.journal_service.get_account_balances(company_id, as_of_date, branch_id)
         
         # Categorize accounts
         assets = []
@@ -96,7 +97,7 @@ class BalanceSheetWidget(QWidget):
         equity = []
         
         for account in accounts:
-            balance = self.calculate_account_balance(account.id, as_of_date, company_id, branch_id)
+            balance = abs(balances.get(account.id, Decimal('0.00')))  # Absolute value for balance sheet
             
             if balance == 0:
                 continue
@@ -116,29 +117,6 @@ class BalanceSheetWidget(QWidget):
         # Display balance sheet
         self.display_balance_sheet(assets, liabilities, equity, total_assets, total_liabilities, total_equity)
     
-    def calculate_account_balance(self, account_id, as_of_date, company_id, branch_id):
-        """Calculate account balance up to a specific date"""
-        all_entries = self.journal_service.get_all_journal_entries()
-        balance = Decimal('0.00')
-        
-        for entry in all_entries:
-            if entry.date > as_of_date:
-                continue
-            if entry.company_id != company_id:
-                continue
-            if branch_id and entry.branch_id != branch_id:
-                continue
-            if entry.status != 2:  # Only posted entries
-                continue
-            
-            entry_with_lines = self.journal_service.get_journal_entry_with_lines(entry.id)
-            if entry_with_lines and entry_with_lines.lines:
-                for line in entry_with_lines.lines:
-                    if line.account_id == account_id:
-                        balance += (line.debit - line.credit)
-        
-        return abs(balance)  # Return absolute value for balance sheet
-    
     def display_balance_sheet(self, assets, liabilities, equity, total_assets, total_liabilities, total_equity):
         """Display the balance sheet"""
         self.balance_sheet_table.setRowCount(0)
@@ -1,4 +1,4 @@
-from PySide6.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QLabel, QLineEdit, QPushButton, QTableWidget, QTableWidgetItem, QMessageBox, QDateEdit, QSpinBox, QCheckBox, QComboBox
+from PySide6.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QLabel, QLineEdit, QPushButton, QTableWidget, QTableWidgetItem, QMessageBox, QDateEdit, QSpinBox, QCheckBox, QComboBox, QFileDialog
 from PySide6.QtCore import QDate
 from app.application.services import CashBankService, AccountService
 #from app.infrastructure.database import get_db # No longer needed
@@ -33,6 +33,14 @@ class BankReconciliationWidget(QWidget):
         form_layout.addWidget(self.statement_balance_input)
         form_layout.addWidget(add_button)
 
+        import_button = QPushButton("Import Statement")
+        import_button.clicked.connect(self.import_bank_statement)
+        form_layout.addWidget(import_button)
+
+        auto_reconcile_button = QPushButton("Auto Reconcile")
+        auto_reconcile_button.clicked.connect(self.auto_reconcile)
+        form_layout.addWidget(auto_reconcile_button)
+
         main_layout.addLayout(form_layout)
 
         # Bank Reconciliation table
@@ -79,6 +87,48 @@ class BankReconciliationWidget(QWidget):
         except Exception as e:
             QMessageBox.critical(self, "Error", f"An error occurred: {e}")
 
+    def import_bank_statement(self):
+        try:
+            bank_account_id = int(self.bank_account_id_input.text())
+        except ValueError:
+            QMessageBox.warning(self, "Input Error", "Please enter a valid Bank Account ID.")
+            return
+
+        file_path, _ = QFileDialog.getOpenFileName(self, "Import Bank Statement", "", "Bank Statements (*.csv *.xml *.sta *.mt940 *.940 *.txt)")
+        if not file_path:
+            return
+        try:
+            # Assuming company_id is 1 for now
+            count = self.cash_bank_service.import_bank_statement(company_id=1, bank_account_id=bank_account_id, file_path=file_path)
+            QMessageBox.information(self, "Success", f"Imported {count} statement lines.")
+        except Exception as e:
+            QMessageBox.critical(self, "Error", f"An error occurred: {e}")
+
+    def auto_reconcile(self):
+        try:
+            bank_account_id = int(self.bank_account_id_input.text())
+            statement_balance = Decimal(self.statement_balance_input.text()) if self.statement_balance_input.text() else None
+        except Exception:
+            QMessageBox.warning(self, "Input Error", "Please enter valid numbers for Bank Account ID and Statement Balance.")
+            return
+        try:
+            # Assuming company_id is 1 for now
+            summary = self.cash_bank_service.auto_reconcile(
+                company_id=1,
+                bank_account_id=bank_account_id,
+                reconciliation_date=self.reconciliation_date_input.date().toPythonDate(),
+                statement_balance=statement_balance
+            )
+            self.load_bank_reconciliations()
+            QMessageBox.information(
+                self, "Auto Reconcile",
+                f"Matched {summary['matched_lines']} of {summary['statement_lines']} statement lines "
+                f"and {summary['matched_transactions']} of {summary['book_transactions']} book transactions.\n"
+                f"Difference: {summary['difference']}"
+            )
+        except Exception as e:
+            QMessageBox.critical(self, "Error", f"An error occurred: {e}")
+
     def clear_form(self):
         self.bank_account_id_input.clear()
         self.reconciliation_date_input.setDate(QDate.currentDate())
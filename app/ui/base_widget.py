@@ -5,7 +5,7 @@ All widgets should inherit from this to support dynamic language switching
 
 from PySide6.QtWidgets import QWidget, QPushButton, QLabel, QGroupBox, QTableWidget
 from PySide6.QtCore import Qt
-from app.i18n.translations import tr, get_language
+from app.i18n.translations import tr, get_language, get_translation_generation
 
 
 class TranslatableWidget(QWidget):
@@ -14,47 +14,43 @@ class TranslatableWidget(QWidget):
     def __init__(self, parent=None):
         super().__init__(parent)
         self._translation_keys = {}  # Store translation keys for dynamic update
+        self._translation_generation = get_translation_generation()
     
     def refresh_translations(self):
         """Refresh all translatable elements - override in subclasses"""
+        self._translation_generation = get_translation_generation()
+        
         # Update layout direction for this widget and all children
-        current_lang = get_language()
-        if current_lang == 'ar':
-            self.setLayoutDirection(Qt.RightToLeft)
-            # Apply to all child widgets
-            for child in self.findChildren(QWidget):
-                child.setLayoutDirection(Qt.RightToLeft)
-        else:
-            self.setLayoutDirection(Qt.LeftToRight)
-            # Apply to all child widgets
-            for child in self.findChildren(QWidget):
-                child.setLayoutDirection(Qt.LeftToRight)
+        direction = Qt.RightToLeft if get_language() == 'ar' else Qt.LeftToRight
+        self.setLayoutDirection(direction)
+        children = self.findChildren(QWidget)
+        for child in children:
+            child.setLayoutDirection(direction)
         
         # Update all stored translation keys
-        self._update_translations()
+        self._update_translations(children)
     
-    def _update_translations(self):
-        """Update all widgets with stored translation keys"""
-        # Update buttons
-        for button in self.findChildren(QPushButton):
-            if hasattr(button, '_translation_key'):
-                button.setText(tr(button._translation_key))
-        
-        # Update labels
-        for label in self.findChildren(QLabel):
-            if hasattr(label, '_translation_key'):
-                label.setText(tr(label._translation_key))
-        
-        # Update group boxes
-        for groupbox in self.findChildren(QGroupBox):
-            if hasattr(groupbox, '_translation_key'):
-                groupbox.setTitle(tr(groupbox._translation_key))
-        
-        # Update table headers
-        for table in self.findChildren(QTableWidget):
-            if hasattr(table, '_header_keys'):
-                headers = [tr(key) for key in table._header_keys]
-                table.setHorizontalHeaderLabels(headers)
+    def translations_stale(self) -> bool:
+        """True when the language changed since this widget was last labelled"""
+        return self._translation_generation != get_translation_generation()
+    
+    def showEvent(self, event):
+        # Widgets hidden during a language switch are re-labelled when they are next shown
+        if self.translations_stale():
+            self.refresh_translations()
+        super().showEvent(event)
+    
+    def _update_translations(self, children=None):
+        """Update all widgets with stored translation keys (one pass over the children)"""
+        for child in children if children is not None else self.findChildren(QWidget):
+            key = getattr(child, '_translation_key', None)
+            if key is not None:
+                if isinstance(child, QGroupBox):
+                    child.setTitle(tr(key))
+                elif isinstance(child, (QPushButton, QLabel)):
+                    child.setText(tr(key))
+            elif isinstance(child, QTableWidget) and hasattr(child, '_header_keys'):
+                child.setHorizontalHeaderLabels([tr(header_key) for header_key in child._header_keys])
     
     def set_translatable_text(self, widget, translation_key):
         """Set text with translation key for dynamic updates"""
@@ -5,6 +5,8 @@ from app.application.services import CashBankService, CompanyService # Added Com
 from decimal import Decimal
 
 class CashBankWidget(QWidget):
+    PAGE_SIZE = 100
+
     def __init__(self, cash_bank_service, company_service, branch_service, parent=None):
         super().__init__(parent)
         self.cash_bank_service = cash_bank_service
@@ -65,11 +67,15 @@ class CashBankWidget(QWidget):
 
         # Cash/Bank Entries table
         self.cash_bank_table = QTableWidget()
-        self.cash_bank_table.setColumnCount(8) # Increased column count
-        self.cash_bank_table.setHorizontalHeaderLabels(["ID", "Company", "Branch", "Account ID", "Type", "Amount", "Date", "Description"])
+        self.cash_bank_table.setColumnCount(9) # Increased column count
+        self.cash_bank_table.setHorizontalHeaderLabels(["ID", "Company", "Branch", "Account ID", "Type", "Amount", "Date", "Description", "Running Balance"])
         self.cash_bank_table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch) # Stretch columns
         main_layout.addWidget(self.cash_bank_table)
 
+        self.load_more_button = QPushButton("Load More")
+        self.load_more_button.clicked.connect(self.load_more_cash_bank_entries)
+        main_layout.addWidget(self.load_more_button)
+
         main_layout.addStretch(1) # Add stretch to push content upwards and fill remaining space
 
         self.setLayout(main_layout)
@@ -91,13 +97,18 @@ class CashBankWidget(QWidget):
 
     def load_cash_bank_entries(self):
         self.cash_bank_table.setRowCount(0)
-        entries = self.cash_bank_service.get_all_cash_bank_entries()
-        self.cash_bank_table.setRowCount(len(entries))
-        for row, entry in enumerate(entries):
-            company = self.company_service.get_company_by_id(entry['company_id'])
-            company_name = company.name_en if company else "Unknown Company"
-            branch = self.branch_service.get_branch_by_id(entry['branch_id'])
-            branch_name = branch.name_en if branch else "Unknown Branch"
+        self.next_cursor = None
+        self.load_more_cash_bank_entries()
+
+    def load_more_cash_bank_entries(self):
+        # Entries are fetched one page at a time, newest first
+        page = self.cash_bank_service.get_all_cash_bank_entries(after=self.next_cursor, limit=self.PAGE_SIZE)
+        entries = page['entries']
+        first_row = self.cash_bank_table.rowCount()
+        self.cash_bank_table.setRowCount(first_row + len(entries))
+        for row, entry in enumerate(entries, start=first_row):
+            company_name = entry['company_name'] or "Unknown Company"
+            branch_name = entry['branch_name'] or "Unknown Branch"
 
             self.cash_bank_table.setItem(row, 0, QTableWidgetItem(str(entry['id'])))
             self.cash_bank_table.setItem(row, 1, QTableWidgetItem(company_name))
@@ -107,6 +118,9 @@ class CashBankWidget(QWidget):
             self.cash_bank_table.setItem(row, 5, QTableWidgetItem(str(entry['amount'])))
             self.cash_bank_table.setItem(row, 6, QTableWidgetItem(str(entry['date'])))
             self.cash_bank_table.setItem(row, 7, QTableWidgetItem(entry['description']))
+            self.cash_bank_table.setItem(row, 8, QTableWidgetItem(str(entry['running_balance'])))
+        self.next_cursor = page['next']
+        self.load_more_button.setEnabled(self.next_cursor is not None)
 
     def add_cash_bank_entry(self):
         try:
@@ -0,0 +1,82 @@
+"""
+Labeeb ERP - Export Worker
+Runs a streaming export on a background thread with a cancellable progress dialog
+"""
+
+from PySide6.QtWidgets import QFileDialog, QProgressDialog, QMessageBox
+from PySide6.QtCore import QThread, Signal, Qt
+
+from app.application.export_engine import ExportCancelled
+from app.i18n.translations import tr
+
+EXPORT_FILTERS = "CSV (*.csv);;Excel (*.xlsx);;PDF (*.pdf)"
+_FILTER_EXTENSIONS = {'CSV (*.csv)': '.csv', 'Excel (*.xlsx)': '.xlsx', 'PDF (*.pdf)': '.pdf'}
+
+
+class ExportWorker(QThread):
+    """Calls job(progress, cancelled) off the UI thread and reports progress through signals"""
+
+    progress = Signal(int, int) # Rows written, total rows (0 when unknown)
+    completed = Signal(int)
+    failed = Signal(str)
+
+    def __init__(self, job, parent=None):
+        super().__init__(parent)
+        self.job = job
+        self._cancelled = False
+
+    def cancel(self):
+        self._cancelled = True
+
+    def run(self):
+        try:
+            count = self.job(self._report_progress, lambda: self._cancelled)
+        except ExportCancelled:
+            return
+        except Exception as e:
+            self.failed.emit(str(e))
+            return
+        self.completed.emit(count)
+
+    def _report_progress(self, done: int, total: int):
+        self.progress.emit(done, total or 0)
+
+
+def ask_export_path(parent, default_name: str):
+    """Ask for the export file; the extension picks the format"""
+    file_path, selected_filter = QFileDialog.getSaveFileName(parent, tr('common.export'), default_name, EXPORT_FILTERS)
+    if file_path and '.' not in file_path.rsplit('/', 1)[-1]:
+        file_path += _FILTER_EXTENSIONS.get(selected_filter, '.csv')
+    return file_path
+
+
+def start_export(parent, job, title: str):
+    """Run an export job with a progress dialog; returns the worker (keep a reference while it runs)"""
+    dialog = QProgressDialog(title, tr('common.cancel'), 0, 0, parent)
+    dialog.setWindowModality(Qt.WindowModal)
+    dialog.setMinimumDuration(300)
+
+    worker = ExportWorker(job, parent)
+
+    def on_progress(done, total):
+        if total and dialog.maximum() != total:
+            dialog.setMaximum(total)
+        dialog.setValue(min(done, total) if total else 0)
+        dialog.setLabelText(f"{title}: {done:,}" + (f" / {total:,}" if total else ""))
+
+    def on_completed(count):
+        dialog.close()
+        QMessageBox.information(parent, tr('common.success'), f"{title}: {count:,}")
+
+    def on_failed(message):
+        dialog.close()
+        QMessageBox.critical(parent, tr('common.error'), message)
+
+    worker.progress.connect(on_progress)
+    worker.completed.connect(on_completed)
+    worker.failed.connect(on_failed)
+    worker.finished.connect(dialog.close)
+    worker.finished.connect(worker.deleteLater)
+    dialog.canceled.connect(worker.cancel)
+    worker.start()
+    return worker
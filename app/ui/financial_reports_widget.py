@@ -13,6 +13,7 @@ from decimal import Decimal
 from datetime import datetime
 
 from app.application.services import AccountService, JournalService, CompanyService, BranchService
+from app.application.period_close_engine import is_closing_entry
 from app.ui.styles import BUTTON_STYLE, TABLE_STYLE, GROUPBOX_STYLE
 from app.i18n.translations import tr
 
@@ -93,11 +94,12 @@ class BalanceSheetReportWidget(QWidget):
         
         # Get all accounts
         accounts = self.account_service.get_all_accounts()
+        balances = self.journal_service.get_account_balances(company_id, as_of_date, branch_id)
         
         # Calculate balances for each account
         account_balances = {}
         for account in accounts:
-            balance = self.calculate_account_balance(account.id, as_of_date, company_id, branch_id)
+            balance = balances.get(account.id, Decimal('0.00'))
             account_balances[account.id] = {
                 'account': account,
                 'balance': balance
@@ -131,32 +133,6 @@ class BalanceSheetReportWidget(QWidget):
         self.display_balance_sheet(assets, liabilities, equity, 
                                    total_assets, total_liabilities, total_equity)
     
-    def calculate_account_balance(self, account_id, as_of_date, company_id, branch_id):
-        """Calculate account balance up to a specific date"""
-        # Get all journal entries up to the date
-        all_entries = self.journal_service.get_all_journal_entries()
-        
-        balance = Decimal('0.00')
-        
-        for entry in all_entries:
-            if entry.date > as_of_date:
-                continue
-            if entry.company_id != company_id:
-                continue
-            if branch_id and entry.branch_id != branch_id:
-                continue
-            if entry.status != 2:  # Only posted entries
-                continue
-            
-            # Get lines for this entry
-            entry_with_lines = self.journal_service.get_journal_entry_with_lines(entry.id)
-            if entry_with_lines and entry_with_lines.lines:
-                for line in entry_with_lines.lines:
-                    if line.account_id == account_id:
-                        balance += (line.debit - line.credit)
-        
-        return balance
-    
     def display_balance_sheet(self, assets, liabilities, equity, 
                               total_assets, total_liabilities, total_equity):
         """Display the balance sheet"""
@@ -367,6 +343,8 @@ class IncomeStatementReportWidget(QWidget):
                 continue
             if entry.status != 2:  # Only posted entries
                 continue
+            if is_closing_entry(entry):  # Year-end closing would zero the period's result
+                continue
             
             entry_with_lines = self.journal_service.get_journal_entry_with_lines(entry.id)
             if entry_with_lines and entry_with_lines.lines:
@@ -2,6 +2,7 @@ from PySide6.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QLabel, QPushBu
 from PySide6.QtCore import QDate
 from PySide6.QtGui import QFont, QColor
 from app.application.services import AccountService, CompanyService, JournalService, BranchService
+from app.application.period_close_engine import is_closing_entry
 from app.ui.styles import BUTTON_STYLE, TABLE_STYLE, GROUPBOX_STYLE
 from app.i18n.translations import tr
 from decimal import Decimal
@@ -132,6 +133,8 @@ class IncomeStatementWidget(QWidget):
                 continue
             if entry.status != 2:  # Only posted entries
                 continue
+            if is_closing_entry(entry):  # Year-end closing would zero the period's result
+                continue
             
             entry_with_lines = self.journal_service.get_journal_entry_with_lines(entry.id)
             if entry_with_lines and entry_with_lines.lines:
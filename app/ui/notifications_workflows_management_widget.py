@@ -6,7 +6,7 @@ from PySide6.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QTabWidget,
                                QTableWidget, QTableWidgetItem, QPushButton, QLabel,
                                QLineEdit, QComboBox, QMessageBox, QGroupBox, 
                                QFormLayout, QHeaderView, QTextEdit, QCheckBox)
-from PySide6.QtCore import Qt, QDate, QTimer
+from PySide6.QtCore import Qt, QDate, QObject, Signal
 from datetime import datetime
 
 from app.application.services import NotificationsWorkflowsService, IAMService, CompanyService
@@ -14,21 +14,31 @@ from app.ui.styles import BUTTON_STYLE, TABLE_STYLE, GROUPBOX_STYLE
 from app.i18n.translations import tr
 
 
+class _NotificationBridge(QObject):
+    """Moves unread-count pushes from the listener thread to the UI thread"""
+    changed = Signal(dict)
+
+
 class NotificationsWidget(QWidget):
     """Widget for managing notifications"""
     
+    PAGE_SIZE = 50
+    
     def __init__(self, notifications_workflows_service, iam_service, company_service, parent=None):
         super().__init__(parent)
         self.notifications_workflows_service = notifications_workflows_service
         self.iam_service = iam_service
         self.company_service = company_service
+        self.usernames = {}
+        self.last_cursor = None
         self.init_ui()
         self.load_notifications()
         
-        # Auto-refresh every 30 seconds
-        self.refresh_timer = QTimer()
-        self.refresh_timer.timeout.connect(self.load_notifications)
-        self.refresh_timer.start(30000)  # 30 seconds
+        # Unread counts are pushed on every change instead of polling the table
+        self.bridge = _NotificationBridge()
+        self.bridge.changed.connect(self.on_notification_update)
+        self.notifications_workflows_service.subscribe_notifications(None, self.bridge.changed.emit)
+        self.destroyed.connect(lambda: self.notifications_workflows_service.unsubscribe_notifications(None, self.bridge.changed.emit))
     
     def init_ui(self):
         main_layout = QVBoxLayout(self)
@@ -38,13 +48,18 @@ class NotificationsWidget(QWidget):
         
         self.user_combo = QComboBox()
         self.load_users()
+        self.user_combo.currentIndexChanged.connect(self.load_notifications)
         filter_layout.addWidget(QLabel("User:"))
         filter_layout.addWidget(self.user_combo)
         
+        self.unread_badge = QLabel()
+        filter_layout.addWidget(self.unread_badge)
+        
         self.status_combo = QComboBox()
         self.status_combo.addItem("All", None)
         self.status_combo.addItem("Unread", False)
         self.status_combo.addItem("Read", True)
+        self.status_combo.currentIndexChanged.connect(self.load_notifications)
         filter_layout.addWidget(QLabel(tr('common.status') + ":"))
         filter_layout.addWidget(self.status_combo)
         
@@ -58,6 +73,11 @@ class NotificationsWidget(QWidget):
         self.mark_read_button.clicked.connect(self.mark_as_read)
         filter_layout.addWidget(self.mark_read_button)
         
+        self.mark_all_read_button = QPushButton("Mark All as Read")
+        self.mark_all_read_button.setStyleSheet(BUTTON_STYLE)
+        self.mark_all_read_button.clicked.connect(self.mark_all_as_read)
+        filter_layout.addWidget(self.mark_all_read_button)
+        
         filter_layout.addStretch()
         main_layout.addLayout(filter_layout)
         
@@ -73,6 +93,11 @@ class NotificationsWidget(QWidget):
         
         main_layout.addWidget(self.notifications_table)
         
+        self.load_more_button = QPushButton("Load More")
+        self.load_more_button.setStyleSheet(BUTTON_STYLE)
+        self.load_more_button.clicked.connect(self.load_more_notifications)
+        main_layout.addWidget(self.load_more_button)
+        
         # Create notification section
         create_group = QGroupBox("Create Notification")
         create_group.setStyleSheet(GROUPBOX_STYLE)
@@ -101,6 +126,7 @@ class NotificationsWidget(QWidget):
         self.user_combo.addItem("All Users", None)
         users = self.iam_service.get_all_users()
         for user in users:
+            self.usernames[user.id] = user.username
             self.user_combo.addItem(user.username, user.id)
     
     def load_users_for_create(self):
@@ -111,42 +137,119 @@ class NotificationsWidget(QWidget):
             self.target_user_combo.addItem(user.username, user.id)
     
     def load_notifications(self):
-        """Load all notifications"""
+        """Load the first page of notifications for the selected user and status"""
         self.notifications_table.setRowCount(0)
-        
+        self.last_cursor = None
+        self.load_more_notifications()
+        self.update_unread_badge()
+    
+    def load_more_notifications(self):
+        """Append the next page of notifications"""
         user_id = self.user_combo.currentData()
         is_read = self.status_combo.currentData()
         
-        # Get all notifications
-        notifications = self.notifications_workflows_service.get_all_notifications()
+        notifications = self.notifications_workflows_service.get_user_notifications(
+            user_id, is_read, self.last_cursor, self.PAGE_SIZE
+        )
         
-        # Filter
-        filtered = []
+        row = self.notifications_table.rowCount()
+        self.notifications_table.setRowCount(row + len(notifications))
         for notif in notifications:
-            if user_id and notif.user_id != user_id:
-                continue
-            if is_read is not None and notif.is_read != is_read:
-                continue
-            filtered.append(notif)
-        
-        self.notifications_table.setRowCount(len(filtered))
-        for row, notif in enumerate(filtered):
-            user = self.iam_service.get_user_by_id(notif.user_id)
-            username = user.username if user else "Unknown"
-            
-            status = "Read" if notif.is_read else "Unread"
-            
-            self.notifications_table.setItem(row, 0, QTableWidgetItem(str(notif.id)))
-            self.notifications_table.setItem(row, 1, QTableWidgetItem(username))
-            self.notifications_table.setItem(row, 2, QTableWidgetItem(notif.message))
-            self.notifications_table.setItem(row, 3, QTableWidgetItem(status))
-            self.notifications_table.setItem(row, 4, QTableWidgetItem(str(notif.created_at)))
-            
-            # Delete button
-            delete_btn = QPushButton(tr('common.delete'))
-            delete_btn.setStyleSheet(BUTTON_STYLE)
-            delete_btn.clicked.connect(lambda checked, nid=notif.id: self.delete_notification(nid))
-            self.notifications_table.setCellWidget(row, 5, delete_btn)
+            self._fill_row(row, notif)
+            row += 1
+        
+        if notifications:
+            self.last_cursor = (notifications[-1].created_at, notifications[-1].id)
+        self.load_more_button.setEnabled(len(notifications) == self.PAGE_SIZE)
+    
+    def _fill_row(self, row: int, notif):
+        """Write one notification into a table row"""
+        username = self.usernames.get(notif.user_id, "Unknown")
+        
+        status = "Read" if notif.is_read else "Unread"
+        
+        self.notifications_table.setItem(row, 0, QTableWidgetItem(str(notif.id)))
+        user_item = QTableWidgetItem(username)
+        user_item.setData(Qt.UserRole, notif.user_id)
+        self.notifications_table.setItem(row, 1, user_item)
+        self.notifications_table.setItem(row, 2, QTableWidgetItem(notif.message))
+        self.notifications_table.setItem(row, 3, QTableWidgetItem(status))
+        self.notifications_table.setItem(row, 4, QTableWidgetItem(str(notif.created_at)))
+        
+        # Delete button
+        delete_btn = QPushButton(tr('common.delete'))
+        delete_btn.setStyleSheet(BUTTON_STYLE)
+        delete_btn.clicked.connect(lambda checked, nid=notif.id: self.delete_notification(nid))
+        self.notifications_table.setCellWidget(row, 5, delete_btn)
+    
+    def _find_row(self, notif_id: int):
+        """Row showing a notification, or None when it is not on the loaded pages"""
+        for row in range(self.notifications_table.rowCount()):
+            item = self.notifications_table.item(row, 0)
+            if item is not None and int(item.text()) == notif_id:
+                return row
+        return None
+    
+    def _remove_row(self, notif_id: int):
+        row = self._find_row(notif_id)
+        if row is not None:
+            self.notifications_table.removeRow(row)
+    
+    def _set_read(self, row: int):
+        """Show a loaded row as read, dropping it when only unread notifications are listed"""
+        if self.status_combo.currentData() is False:
+            self.notifications_table.removeRow(row)
+        else:
+            self.notifications_table.setItem(row, 3, QTableWidgetItem("Read"))
+    
+    def _show_notification(self, notif_id: int):
+        """Replace a loaded row with the notification's current state, or put a new one on top"""
+        notif = self.notifications_workflows_service.get_notification_by_id(notif_id)
+        row = self._find_row(notif_id)
+        is_read = self.status_combo.currentData()
+        if notif is None or (is_read is not None and notif.is_read != is_read):
+            if row is not None:
+                self.notifications_table.removeRow(row)
+            return
+        if row is None:
+            row = 0
+            self.notifications_table.insertRow(row)
+        self._fill_row(row, notif)
+    
+    def update_unread_badge(self, unread_count: int = None):
+        """Show the selected user's unread count"""
+        user_id = self.user_combo.currentData()
+        if user_id is None:
+            self.unread_badge.setText("")
+            return
+        if unread_count is None:
+            unread_count = self.notifications_workflows_service.get_unread_count(user_id)
+        self.unread_badge.setText(f"Unread: {unread_count}")
+    
+    def on_notification_update(self, message: dict):
+        """Pushed when a user's unread count changes; patches the loaded rows instead of reloading the page"""
+        user_id = self.user_combo.currentData()
+        if user_id is not None and message['user_id'] != user_id:
+            return
+        self.update_unread_badge(message['unread_count'])
+        if message.get('deleted_id') is not None:
+            self._remove_row(message['deleted_id'])
+        elif message.get('read_ids') is not None:
+            for notif_id in message['read_ids']:
+                row = self._find_row(notif_id)
+                if row is not None:
+                    self._set_read(row)
+        elif message.get('notification_id') is not None:
+            self._show_notification(message['notification_id'])
+        elif message['unread_count'] == 0:
+            # All of the user's notifications were marked read
+            for row in reversed(range(self.notifications_table.rowCount())):
+                if self.notifications_table.item(row, 3).text() == "Unread" and \
+                        self.notifications_table.item(row, 1).data(Qt.UserRole) == message['user_id']:
+                    self._set_read(row)
+        else:
+            # Bulk inserts and long read_ids lists do not say which rows changed
+            self.load_notifications()
     
     def mark_as_read(self):
         """Mark selected notifications as read"""
@@ -163,7 +266,14 @@ class NotificationsWidget(QWidget):
                 print(f"Error marking notification {notif_id} as read: {e}")
         
         QMessageBox.information(self, tr('common.success'), "Notifications marked as read")
-        self.load_notifications()
+    
+    def mark_all_as_read(self):
+        """Mark every unread notification of the selected user as read"""
+        user_id = self.user_combo.currentData()
+        if user_id is None:
+            QMessageBox.warning(self, tr('common.warning'), "Please select a user")
+            return
+        self.notifications_workflows_service.mark_all_notifications_as_read(user_id)
     
     def send_notification(self):
         """Send new notification"""
@@ -186,7 +296,6 @@ class NotificationsWidget(QWidget):
             
             QMessageBox.information(self, tr('common.success'), "Notification sent successfully")
             self.message_input.clear()
-            self.load_notifications()
         except Exception as e:
             QMessageBox.critical(self, tr('common.error'), f"Error: {str(e)}")
     
@@ -200,7 +309,7 @@ class NotificationsWidget(QWidget):
             try:
                 self.notifications_workflows_service.delete_notification(notif_id)
                 QMessageBox.information(self, tr('common.success'), tr('messages.delete_success'))
-                self.load_notifications()
+                self._remove_row(notif_id) # A read notification changes no counter, so no update is pushed
             except Exception as e:
                 QMessageBox.critical(self, tr('common.error'), f"Error: {str(e)}")
 
@@ -13,7 +13,8 @@ from decimal import Decimal
 from datetime import date
 
 from app.ui.base_widget import TranslatableWidget
-from app.i18n.translations import tr
+from app.ui.export_worker import ask_export_path, start_export
+from app.i18n.translations import tr, get_language
 
 
 class SalesInvoicesPage(TranslatableWidget):
@@ -232,6 +233,10 @@ class SalesInvoicesPage(TranslatableWidget):
         refresh_btn.clicked.connect(self.refresh_data)
         search_layout.addWidget(refresh_btn)
         
+        export_btn = QPushButton(tr('common.export'))
+        export_btn.clicked.connect(self.export_invoices)
+        search_layout.addWidget(export_btn)
+        
         layout.addLayout(search_layout)
         
         # Invoices Table
@@ -502,6 +507,23 @@ class SalesInvoicesPage(TranslatableWidget):
             
             self.invoices_table.setRowHidden(row, not show_row)
     
+    def export_invoices(self):
+        """تصدير سجل فواتير المبيعات"""
+        branch = self.branch_service.get_branch_by_id(self.branch_combo.currentData()) if self.branch_combo.currentData() else None
+        if not branch:
+            QMessageBox.warning(self, tr('common.warning'), "Please select a branch")
+            return
+        title = tr('sales.sales_invoices')
+        file_path = ask_export_path(self, title)
+        if not file_path:
+            return
+        rtl = get_language() == 'ar'
+        # The register is streamed from the database, not read from the table, so it is complete at any size
+        job = lambda progress, cancelled: self.arap_service.export_invoices(
+            branch.company_id, file_path, invoice_type=0, progress=progress, cancelled=cancelled, title=title, rtl=rtl
+        )
+        self.export_worker = start_export(self, job, title)
+    
     def load_invoice(self, row, column):
         """تحميل فاتورة للتعديل"""
         # Implement loading invoice data
@@ -1,7 +1,7 @@
 from PySide6.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QLabel, QPushButton, QTableWidget, QTableWidgetItem, QMessageBox, QDateEdit, QComboBox, QFormLayout, QGroupBox, QHeaderView
 from PySide6.QtCore import QDate
 from PySide6.QtGui import QFont, QColor
-from app.application.services import TaxService, CompanyService, BranchService, AccountService, JournalService
+from app.application.services import TaxService, CompanyService, BranchService
 from app.ui.styles import BUTTON_STYLE, TABLE_STYLE, GROUPBOX_STYLE
 from app.i18n.translations import tr
 from decimal import Decimal
@@ -102,85 +102,31 @@ class TaxReportWidget(QWidget):
             QMessageBox.information(self, "No Data", "No tax settings found for the selected company")
             return
         
-        # Calculate tax amounts for each tax setting
+        # Output tax per tax setting, aggregated from the invoices in one query
+        totals = {t['tax_setting_id']: t for t in self.tax_service.compute_tax_totals(company_id, from_date, to_date, branch_id or None)}
+        company = self.company_service.get_company_by_id(company_id)
+        company_name = company.name_en if company else "Unknown"
+        branch = self.branch_service.get_branch_by_id(branch_id) if branch_id else None
+        branch_name = branch.name_en if branch else "All Branches"
+
         tax_reports = []
-        
         for tax_setting in company_tax_settings:
-            # Calculate total taxable amount and tax collected
-            taxable_amount, tax_amount = self.calculate_tax_amounts(
-                tax_setting, company_id, branch_id, from_date, to_date
-            )
-            
-            if taxable_amount > 0 or tax_amount > 0:
-                company = self.company_service.get_company_by_id(company_id)
-                company_name = company.name_en if company else "Unknown"
-                
-                branch = self.branch_service.get_branch_by_id(branch_id) if branch_id else None
-                branch_name = branch.name_en if branch else "All Branches"
-                
-                tax_reports.append({
-                    'company_name': company_name,
-                    'branch_name': branch_name,
-                    'tax_name': tax_setting.tax_name,
-                    'tax_rate': tax_setting.tax_rate,
-                    'taxable_amount': taxable_amount,
-                    'tax_amount': tax_amount,
-                    'period': f"{from_date} to {to_date}"
-                })
+            total = totals.get(tax_setting.id)
+            if not total:
+                continue
+            tax_reports.append({
+                'company_name': company_name,
+                'branch_name': branch_name,
+                'tax_name': tax_setting.tax_name_en or tax_setting.tax_name_ar,
+                'tax_rate': tax_setting.tax_rate * 100,
+                'taxable_amount': total['taxable_sales'],
+                'tax_amount': total['total_sales_tax'],
+                'period': f"{from_date} to {to_date}"
+            })
         
         # Display reports
         self.display_tax_reports(tax_reports)
     
-    def calculate_tax_amounts(self, tax_setting, company_id, branch_id, from_date, to_date):
-        """Calculate taxable amount and tax collected for a tax setting"""
-        # Simplified calculation based on revenue accounts
-        account_service = AccountService()
-        journal_service = JournalService()
-        
-        # Get revenue accounts
-        accounts = account_service.get_all_accounts()
-        revenue_accounts = [acc for acc in accounts if acc.type == 3]  # Revenue type
-        
-        total_revenue = Decimal('0.00')
-        
-        # Calculate total revenue for the period
-        for account in revenue_accounts:
-            balance = self.calculate_account_period_balance(
-                account.id, from_date, to_date, company_id, branch_id, journal_service
-            )
-            total_revenue += abs(balance)  # Revenue is normally credit, so we take absolute
-        
-        # Calculate taxable amount (assuming all revenue is taxable for simplicity)
-        taxable_amount = total_revenue
-        
-        # Calculate tax amount
-        tax_amount = taxable_amount * (tax_setting.tax_rate / Decimal('100'))
-        
-        return taxable_amount, tax_amount
-    
-    def calculate_account_period_balance(self, account_id, from_date, to_date, company_id, branch_id, journal_service):
-        """Calculate account balance for a specific period"""
-        all_entries = journal_service.get_all_journal_entries()
-        balance = Decimal('0.00')
-        
-        for entry in all_entries:
-            if entry.date < from_date or entry.date > to_date:
-                continue
-            if entry.company_id != company_id:
-                continue
-            if branch_id and entry.branch_id != branch_id:
-                continue
-            if entry.status != 2:  # Only posted entries
-                continue
-            
-            entry_with_lines = journal_service.get_journal_entry_with_lines(entry.id)
-            if entry_with_lines and entry_with_lines.lines:
-                for line in entry_with_lines.lines:
-                    if line.account_id == account_id:
-                        balance += (line.credit - line.debit)  # Revenue convention
-        
-        return balance
-    
     def display_tax_reports(self, tax_reports):
         """Display the tax reports"""
         self.tax_reports_table.setRowCount(len(tax_reports))
@@ -1,8 +1,9 @@
 from PySide6.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QLabel, QPushButton, QTableWidget, QTableWidgetItem, QMessageBox, QDateEdit, QComboBox, QFormLayout, QGroupBox, QHeaderView
-from PySide6.QtCore import QDate
+from PySide6.QtCore import QDate, Qt
 from PySide6.QtGui import QFont, QColor
 from app.application.services import AccountService, CompanyService, JournalService, BranchService
 from app.ui.styles import BUTTON_STYLE, TABLE_STYLE, GROUPBOX_STYLE
+from app.ui.account_statement_dialog import AccountStatementDialog
 from app.i18n.translations import tr
 from decimal import Decimal
 
@@ -54,6 +55,7 @@ class TrialBalanceWidget(QWidget):
         self.trial_balance_table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
         self.trial_balance_table.setStyleSheet(TABLE_STYLE)
         self.trial_balance_table.setAlternatingRowColors(True)
+        self.trial_balance_table.cellDoubleClicked.connect(self.open_account_statement) # Drill down to the ledger lines
         main_layout.addWidget(self.trial_balance_table)
 
         main_layout.addStretch(1) # Add stretch to push content upwards and fill remaining space
@@ -89,6 +91,7 @@ class TrialBalanceWidget(QWidget):
         
         # Get all accounts
         accounts = self.account_service.get_all_accounts()
+        balances = self.journal_service.get_account_balances(company_id, as_of_date, branch_id)
         
         # Calculate balances
         account_balances = []
@@ -96,7 +99,7 @@ class TrialBalanceWidget(QWidget):
         total_credits = Decimal('0.00')
         
         for account in accounts:
-            balance = self.calculate_account_balance(account.id, as_of_date, company_id, branch_id)
+            balance = balances.get(account.id, Decimal('0.00'))
             
             if balance == 0:
                 continue
@@ -128,29 +131,6 @@ class TrialBalanceWidget(QWidget):
         # Display trial balance
         self.display_trial_balance(account_balances, total_debits, total_credits)
     
-    def calculate_account_balance(self, account_id, as_of_date, company_id, branch_id):
-        """Calculate account balance up to a specific date"""
-        all_entries = self.journal_service.get_all_journal_entries()
-        balance = Decimal('0.00')
-        
-        for entry in all_entries:
-            if entry.date > as_of_date:
-                continue
-            if entry.company_id != company_id:
-                continue
-            if branch_id and entry.branch_id != branch_id:
-                continue
-            if entry.status != 2:  # Only posted entries
-                continue
-            
-            entry_with_lines = self.journal_service.get_journal_entry_with_lines(entry.id)
-            if entry_with_lines and entry_with_lines.lines:
-                for line in entry_with_lines.lines:
-                    if line.account_id == account_id:
-                        balance += (line.debit - line.credit)
-        
-        return balance
-    
     def display_trial_balance(self, account_balances, total_debits, total_credits):
         """Display the trial balance"""
         self.trial_balance_table.setRowCount(len(account_balances) + 2)  # +2 for totals and balance check
@@ -161,7 +141,9 @@ class TrialBalanceWidget(QWidget):
             debit = data['debit']
             credit = data['credit']
             
-            self.trial_balance_table.setItem(row, 0, QTableWidgetItem(str(account.code)))
+            code_item = QTableWidgetItem(str(account.code))
+            code_item.setData(Qt.UserRole, account)
+            self.trial_balance_table.setItem(row, 0, code_item)
             self.trial_balance_table.setItem(row, 1, QTableWidgetItem(account.name_ar))
             self.trial_balance_table.setItem(row, 2, QTableWidgetItem(f"{debit:,.2f}" if debit > 0 else ""))
             self.trial_balance_table.setItem(row, 3, QTableWidgetItem(f"{credit:,.2f}" if credit > 0 else ""))
@@ -188,6 +170,17 @@ class TrialBalanceWidget(QWidget):
         else:
             balance_item.setBackground(QColor(255, 107, 107))  # Light red
     
+    def open_account_statement(self, row, column):
+        """Open the posted lines of the double-clicked account, from the start of the as-of year"""
+        code_item = self.trial_balance_table.item(row, 0)
+        account = code_item.data(Qt.UserRole) if code_item else None
+        if account is None:
+            return
+        as_of_date = self.end_date_input.date().toPython()
+        dialog = AccountStatementDialog(self.journal_service, self.company_id_input.currentData(), account,
+                                        as_of_date.replace(month=1, day=1), as_of_date, self.branch_id_input.currentData(), self)
+        dialog.exec()
+
     def add_total_row(self, row, label, debit_total, credit_total):
         """Add totals row"""
         label_item = QTableWidgetItem(label)
@@ -0,0 +1,62 @@
+"""
+Labeeb ERP - AR Aging Benchmark
+Seeds 1M open sales invoices and times the grouped aging query and the full-ledger CSV export
+
+Needs a PostgreSQL DATABASE_URL with at least one company, branch and customer.
+Everything is seeded inside one transaction that is rolled back at the end.
+"""
+
+import csv
+import os
+import tempfile
+import time
+from datetime import date
+
+from sqlalchemy import text
+
+from app.infrastructure.database import get_session, engine
+from app.infrastructure.repositories import InvoiceRepository
+
+INVOICE_COUNT = 1_000_000
+CUSTOMER_SPREAD = 5_000
+
+
+def run(scale: float = 1.0):
+    count = max(int(INVOICE_COUNT * scale), 1)
+    if engine.dialect.name != 'postgresql':
+        raise SystemExit("The aging benchmark needs a PostgreSQL DATABASE_URL")
+
+    with get_session() as db:
+        company_id, branch_id = db.execute(text("SELECT company_id, id FROM branch ORDER BY id LIMIT 1")).one()
+        customer_ids = [row[0] for row in db.execute(text("SELECT id FROM customer ORDER BY id LIMIT :n"), {'n': CUSTOMER_SPREAD})]
+        if not customer_ids:
+            raise SystemExit("The aging benchmark needs at least one customer")
+
+        started = time.perf_counter()
+        db.execute(text("""
+            INSERT INTO invoice (company_id, branch_id, customer_id, invoice_type, invoice_no, invoice_date, due_date,
+                                 total_amount, total_tax, amount_paid, balance_due, currency, status)
+            SELECT :company_id, :branch_id, (:customer_ids)[1 + g % cardinality(:customer_ids)], 0,
+                   'AGING-BENCH-' || g, CURRENT_DATE - (g % 200), CURRENT_DATE - (g % 200) + 30,
+                   100 + g % 900, 0, (g % 3) * 10, 100 + g % 900 - (g % 3) * 10, 'SAR', 1
+              FROM generate_series(1, :count) g
+        """), {'company_id': company_id, 'branch_id': branch_id, 'customer_ids': customer_ids, 'count': count})
+        db.execute(text("ANALYZE invoice"))
+        print(f"Seeded {count:,} open invoices in {time.perf_counter() - started:.1f} s")
+
+        repo = InvoiceRepository(db)
+        started = time.perf_counter()
+        rows = repo.get_aging_summary(company_id, 'AR', date.today())
+        print(f"Aging summary: {len(rows):,} customers in {time.perf_counter() - started:.2f} s")
+
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', newline='', delete=False) as output:
+            started = time.perf_counter()
+            writer = csv.writer(output)
+            count = 0
+            for batch in repo.stream_open_items(company_id, 'AR', date.today()).partitions():
+                writer.writerows(tuple(r) for r in batch)
+                count += len(batch)
+            print(f"Full-ledger export: {count:,} open items in {time.perf_counter() - started:.2f} s")
+        os.unlink(output.name)
+
+        db.rollback()
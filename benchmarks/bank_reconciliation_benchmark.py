@@ -0,0 +1,56 @@
+"""
+Labeeb ERP - Bank Reconciliation Benchmark
+Auto-matches 100k statement lines against book transactions in memory
+"""
+
+import random
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+
+from app.application.bank_reconciliation_engine import MatchEntry, ReconciliationMatcher
+
+LINE_COUNT = 100_000
+START_DATE = date(2024, 1, 1)
+
+
+def build_data(count: int):
+    statement_lines = []
+    book_entries = []
+    book_id = 0
+    for line_id in range(count):
+        day = START_DATE + timedelta(days=random.randrange(365))
+        amount = Decimal(random.randint(-500_000, 500_000)) / 100 or Decimal(1)
+        ref = f"REF{line_id:07d}" if random.random() < 0.6 else None
+        statement_lines.append(MatchEntry(line_id, amount, day, ref))
+
+        kind = random.random()
+        book_day = day + timedelta(days=random.randint(-2, 2))
+        if kind < 0.85: # One-to-one
+            book_id += 1
+            book_entries.append(MatchEntry(book_id, amount, book_day, ref))
+        elif kind < 0.95: # Batched: the statement line is the sum of two book entries
+            half = (amount / 2).quantize(Decimal('0.01'))
+            for part in (half, amount - half):
+                book_id += 1
+                book_entries.append(MatchEntry(book_id, part, day, f"BATCH{line_id}"))
+        # else: no book entry, stays unmatched
+    random.shuffle(book_entries)
+    return statement_lines, book_entries
+
+
+def run(scale: float = 1.0):
+    random.seed(7)
+    statement_lines, book_entries = build_data(max(int(LINE_COUNT * scale), 1))
+    print(f"{len(statement_lines)} statement lines, {len(book_entries)} book transactions")
+
+    started = time.perf_counter()
+    matches = ReconciliationMatcher(date_window_days=3).match(statement_lines, book_entries)
+    elapsed = time.perf_counter() - started
+
+    rules = {}
+    matched_lines = 0
+    for rule, line_ids, _ in matches:
+        rules[rule] = rules.get(rule, 0) + 1
+        matched_lines += len(line_ids)
+    print(f"Matched {matched_lines} lines in {elapsed:.2f} s: {rules}")
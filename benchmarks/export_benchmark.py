@@ -0,0 +1,44 @@
+"""
+Labeeb ERP - Export Benchmark
+Streams 10M synthetic stock movement rows to CSV and XLSX and reports time, progress and peak memory
+"""
+
+import os
+import resource
+import tempfile
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+
+from app.application.export_engine import export_rows
+
+ROW_COUNT = 10_000_000
+HEADERS = ['Date', 'Item Code', 'Item', 'Warehouse', 'Type', 'Quantity', 'Unit Cost', 'Reference']
+
+
+def movement_rows(count: int):
+    start = date(2024, 1, 1)
+    for i in range(count):
+        yield (start + timedelta(days=i % 365), 1000 + i % 5000, f"صنف {i % 5000}", "المستودع الرئيسي",
+               "Out" if i % 3 else "In", Decimal(i % 50 + 1), Decimal('12.500'), f"REF-{i}")
+
+
+def run(scale: float = 1.0):
+    count = max(int(ROW_COUNT * scale), 1)
+    step = max(count // 10, 1)
+
+    for extension in ('csv', 'xlsx'):
+        file_path = os.path.join(tempfile.gettempdir(), f"export_benchmark.{extension}")
+        reported = [0]
+
+        def progress(done, total):
+            if done - reported[0] >= step or done == total:
+                reported[0] = done
+                print(f"  {extension}: {done:,} / {total:,} rows, max RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024} MB")
+
+        started = time.perf_counter()
+        written = export_rows(file_path, HEADERS, movement_rows(count), count, progress)
+        elapsed = time.perf_counter() - started
+        print(f"{extension}: {written:,} rows in {elapsed:.1f} s ({written / elapsed:,.0f} rows/s), "
+              f"{os.path.getsize(file_path) / 1e6:,.0f} MB file")
+        os.remove(file_path)
@@ -0,0 +1,58 @@
+"""
+Labeeb ERP - Master Data Import Benchmark
+Imports 1M items and their opening stock from generated CSV files through MasterDataImportService
+
+Needs a PostgreSQL DATABASE_URL with at least one company, warehouse and unit.
+The imported rows are committed chunk by chunk: run it against a scratch database.
+"""
+
+import csv
+import os
+import resource
+import tempfile
+import time
+from datetime import date
+
+from sqlalchemy import text
+
+from app.infrastructure.database import get_session, engine
+from app.application.services import MasterDataImportService
+
+ITEM_COUNT = 1_000_000
+CODE_OFFSET = 50_000_000 # Keeps generated codes clear of existing items
+
+
+def write_files(directory: str, count: int, warehouse: str, unit: str):
+    items_path = os.path.join(directory, 'items.csv')
+    stock_path = os.path.join(directory, 'opening_stock.csv')
+    with open(items_path, 'w', newline='', encoding='utf-8') as items, open(stock_path, 'w', newline='', encoding='utf-8') as stock:
+        item_writer = csv.writer(items)
+        stock_writer = csv.writer(stock)
+        item_writer.writerow(['code', 'name_ar', 'name_en', 'barcode', 'unit', 'warehouse', 'sale_price', 'cost_price', 'costing_method'])
+        stock_writer.writerow(['item_code', 'warehouse', 'quantity', 'cost'])
+        for i in range(count):
+            code = CODE_OFFSET + i
+            item_writer.writerow([code, f"صنف {i}", f"Item {i}", f"BM{code}", unit, warehouse, '12.500', '8.250', i % 2])
+            stock_writer.writerow([code, warehouse, i % 90 + 10, '8.250'])
+    return items_path, stock_path
+
+
+def run(scale: float = 1.0):
+    if engine.dialect.name != 'postgresql':
+        raise SystemExit("The import benchmark needs a PostgreSQL DATABASE_URL")
+    count = max(int(ITEM_COUNT * scale), 1)
+
+    with get_session() as db:
+        company_id, warehouse_id = db.execute(text("SELECT company_id, id FROM warehouse ORDER BY id LIMIT 1")).one()
+        unit_code = db.execute(text("SELECT code FROM units ORDER BY id LIMIT 1")).scalar()
+
+    service = MasterDataImportService()
+    with tempfile.TemporaryDirectory() as directory:
+        items_path, stock_path = write_files(directory, count, str(warehouse_id), unit_code)
+        for label, import_file in (('items', lambda: service.import_items(company_id, items_path)),
+                           ('opening stock', lambda: service.import_opening_stock(company_id, stock_path, date.today()))):
+            started = time.perf_counter()
+            result = import_file()
+            elapsed = time.perf_counter() - started
+            print(f"{label}: {result.as_dict()} in {elapsed:.1f} s ({result.processed / elapsed:,.0f} rows/s), "
+                  f"max RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024} MB")
@@ -0,0 +1,63 @@
+"""
+Labeeb ERP - Promotion Engine Benchmark
+Evaluates POS baskets against a compiled rule set of 10k coupons and loyalty programs
+"""
+
+import random
+import timeit
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from app.application.promotion_engine import PromotionEngine, PromotionRule
+
+RULE_COUNT = 10_000
+LOYALTY_PROGRAM_COUNT = 20
+BASKET_LINES = 20
+ITERATIONS = 20_000
+
+
+def build_rules(count: int):
+    now = datetime.now()
+    rules = []
+    for i in range(count):
+        rules.append(PromotionRule(
+            id=i,
+            source='coupon',
+            code=f"PROMO{i:05d}",
+            kind='percentage' if i % 2 else 'fixed_amount',
+            value=Decimal(random.randint(1, 30)),
+            min_purchase=Decimal(random.randint(0, 200)),
+            valid_from=now - timedelta(days=1),
+            valid_until=now + timedelta(days=30),
+            priority=random.randint(0, 10),
+            is_stackable=bool(i % 5)
+        ))
+    for i in range(LOYALTY_PROGRAM_COUNT):
+        rules.append(PromotionRule(
+            id=count + i,
+            source='loyalty',
+            kind='points' if i % 2 else 'cashback',
+            value=Decimal("0.5"),
+            min_purchase=Decimal(i * 50)
+        ))
+    return rules
+
+
+def run(scale: float = 1.0):
+    count = max(int(RULE_COUNT * scale), 1)
+    random.seed(42)
+    rules = build_rules(count)
+    engine = PromotionEngine(loader=lambda company_id: rules)
+
+    load_time = timeit.timeit(lambda: (engine.invalidate(1), engine.get_rule_set(1)), number=10) / 10
+    print(f"Compile {len(rules)} rules: {load_time * 1000:.2f} ms")
+
+    basket = [{'item_id': i, 'quantity': random.randint(1, 5), 'price': round(random.uniform(1, 100), 2)} for i in range(BASKET_LINES)]
+    codes = [f"PROMO{random.randrange(count):05d}" for _ in range(3)]
+
+    engine.evaluate(1, basket, codes) # Warm the cache
+    elapsed = timeit.timeit(lambda: engine.evaluate(1, basket, codes), number=ITERATIONS)
+    print(f"Evaluate {BASKET_LINES}-line basket with {len(codes)} coupons: {elapsed / ITERATIONS * 1_000_000:.1f} µs/basket")
+
+    result = engine.evaluate(1, basket, codes)
+    print(f"Sample result: subtotal={result['subtotal']} discount={result['total_discount']} total={result['total']} points={result['points_earned']} cashback={result['cashback']}")
@@ -0,0 +1,52 @@
+"""
+Labeeb ERP - Replenishment Benchmark
+Plans 100k (item, warehouse) pairs over three years of weekly sales history
+
+Rows are generated in the shape ReplenishmentRepository.stream_weekly_demand
+yields them, so this times the engine alone; the grouped query is measured by
+EXPLAIN ANALYZE against a real database.
+"""
+
+import time
+
+import numpy as np
+
+from app.application.replenishment_engine import PlanParameters, demand_matrix, plan_pairs
+
+ITEM_COUNT = 100_000
+WAREHOUSE_COUNT = 3
+SELLING_WEEK_SHARE = 0.4 # Share of weeks in which an item sells in its warehouse
+PARTITION_SIZE = 50_000
+
+
+def generate_partitions(parameters: PlanParameters, item_count: int, seed: int = 7):
+    """(item_id, warehouse_id, week, quantity) tuples in partitions, like the streamed query"""
+    rng = np.random.default_rng(seed)
+    weeks = parameters.history_weeks
+    items = np.repeat(np.arange(1, item_count + 1), weeks)
+    week_index = np.tile(np.arange(weeks), item_count)
+    selling = rng.random(len(items)) < SELLING_WEEK_SHARE
+    items, week_index = items[selling], week_index[selling]
+    warehouses = 1 + items % WAREHOUSE_COUNT
+    season = 1 + 0.5 * np.sin(2 * np.pi * week_index / 52)
+    quantities = np.round(rng.gamma(2.0, 5.0, len(items)) * season, 3)
+    rows = list(zip(items.tolist(), warehouses.tolist(), week_index.tolist(), quantities.tolist()))
+    return [rows[start:start + PARTITION_SIZE] for start in range(0, len(rows), PARTITION_SIZE)]
+
+
+def run(scale: float = 1.0):
+    count = max(int(ITEM_COUNT * scale), 1)
+    parameters = PlanParameters()
+    partitions = generate_partitions(parameters, count)
+    print(f"Generated {sum(len(p) for p in partitions):,} weekly demand rows for {count:,} items")
+
+    started = time.perf_counter()
+    item_ids, warehouse_ids, demand = demand_matrix(partitions, parameters.history_weeks)
+    built = time.perf_counter()
+    pairs = len(item_ids)
+    on_hand = np.random.default_rng(11).uniform(0, 60, pairs)
+    result = plan_pairs(demand, on_hand, np.zeros(pairs), np.zeros(pairs), parameters)
+    planned = time.perf_counter()
+
+    print(f"Demand matrix: {pairs:,} pairs x {parameters.history_weeks} weeks in {built - started:.2f} s")
+    print(f"Plan: {int((result['suggested'] > 0).sum()):,} suggestions in {planned - built:.2f} s")
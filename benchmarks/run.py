@@ -0,0 +1,51 @@
+"""
+Labeeb ERP - Benchmark Runner
+Runs the engine and database benchmarks by name, at full or reduced size
+
+Run from the project root: python -m benchmarks.run [name ...] [--scale 0.1]
+Without names every benchmark runs. In-memory benchmarks need no database;
+aging and import need a PostgreSQL DATABASE_URL.
+"""
+
+import argparse
+import importlib
+import os
+import time
+
+# name: (module, needs a database)
+BENCHMARKS = {
+    'promotion': ('benchmarks.promotion_engine_benchmark', False),
+    'reconciliation': ('benchmarks.bank_reconciliation_benchmark', False),
+    'costing': ('benchmarks.costing_engine_benchmark', False),
+    'export': ('benchmarks.export_benchmark', False),
+    'catalog': ('benchmarks.item_catalog_benchmark', False),
+    'replenishment': ('benchmarks.replenishment_benchmark', False),
+    'aging': ('benchmarks.aging_benchmark', True),
+    'import': ('benchmarks.import_benchmark', True),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Labeeb ERP benchmarks")
+    parser.add_argument('names', nargs='*', metavar='name',
+                        help=f"benchmarks to run ({', '.join(BENCHMARKS)}); all when omitted")
+    parser.add_argument('--scale', type=float, default=1.0, help="multiplies every benchmark's data size")
+    args = parser.parse_args()
+    names = args.names or list(BENCHMARKS)
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmark: {', '.join(unknown)}")
+
+    if not any(BENCHMARKS[name][1] for name in names):
+        os.environ.setdefault("DATABASE_URL", "sqlite://") # The engines never touch the database here
+
+    for name in names:
+        module_name, _ = BENCHMARKS[name]
+        print(f"== {name} (scale {args.scale:g})")
+        started = time.perf_counter()
+        importlib.import_module(module_name).run(args.scale)
+        print(f"== {name}: {time.perf_counter() - started:.1f} s\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,7 +3,7 @@ import os
 
 from PySide6.QtWidgets import QApplication, QMainWindow, QVBoxLayout, QWidget, QStackedWidget, QPushButton, QMenuBar, QMenu, QHBoxLayout, QListWidget, QDialog
 from PySide6.QtGui import QIcon
-from PySide6.QtCore import Qt, QSize, QCoreApplication
+from PySide6.QtCore import Qt, QSize, QCoreApplication, QTimer
 # import resources_rc # Removed the import for compiled resources
 from datetime import date # Import date for journal entries
 from decimal import Decimal # Import Decimal for financial calculations
@@ -29,7 +29,7 @@ from app.application.services import (
     NotificationsWorkflowsService,
     ReportingService,
     GeneralConfigurationService,
-    UnitService, CurrencyService, PaymentMethodService, CouponService, ShiftService, LoyaltyProgramService, GiftCardService, WarehouseService # Added new services
+    UnitService, CurrencyService, PaymentMethodService, CouponService, ShiftService, LoyaltyProgramService, GiftCardService, WarehouseService, LoyaltyLedgerService, InventoryCostingService # Added new services
 )
 
 from app.ui.accounts import AccountsWidget
@@ -60,9 +60,28 @@ from app.settings_module.ui_widgets.settings_window import SettingsWindow # Impo
 from werkzeug.security import generate_password_hash # Import generate_password_hash
 from datetime import datetime
 from app.i18n.translations import tr, get_language, _translator
+from app.infrastructure.audit import install_audit_log
+from app.application.workflow_engine import get_workflow_runtime
+from app.infrastructure.notification_channel import get_notification_channel
+from app.infrastructure.partitioning import get_partition_manager
+from app.application.item_catalog_engine import get_item_catalog
+from app.application.period_close_engine import get_closed_period_map
 
 # Initialize the database
 init_db()
+get_partition_manager().ensure_partitions() # Yearly partitions of the history tables
+AccountService().ensure_account_closure() # Backfills the account hierarchy closure
+InventoryCostingService().ensure_cost_state() # Backfills the costing state of items moved before costing existed
+ARAPService().ensure_invoice_types() # Retypes purchase invoices saved as type 2 by earlier versions
+ARAPService().ensure_invoice_balances() # Backfills amount_paid / balance_due of invoices saved before they were stored
+ARAPService().rebuild_customer_exposure() # Credit checks read the stored exposure; recompute it from open invoices and orders
+CashBankService().ensure_balance_snapshots() # Month snapshots the cash/bank feed's running balances start from
+NotificationsWorkflowsService().rebuild_notification_counters() # Unread badges read the stored counters; recount them from the notification table
+audit_writer = install_audit_log()
+get_workflow_runtime().start() # Runs active workflows on domain events
+get_notification_channel().start() # Pushes unread-count changes to this client
+get_item_catalog().start() # Warms this terminal's item catalog in the background and keeps it fresh
+get_closed_period_map().start() # Drops the closed period map when any terminal changes a fiscal period
 
 class MainWindow(QMainWindow):
     # Placeholder Account IDs (in a real ERP, these would be configurable)
@@ -154,6 +173,13 @@ class MainWindow(QMainWindow):
         self.loyalty_program_service = LoyaltyProgramService() # New: LoyaltyProgramService instantiation
         self.gift_card_service = GiftCardService() # New: GiftCardService instantiation
         self.warehouse_service = WarehouseService() # New: WarehouseService instantiation
+        self.loyalty_ledger_service = LoyaltyLedgerService()
+        self.inventory_costing_service = InventoryCostingService()
+
+        # Loyalty points expiry and tier recalculation run hourly in the background
+        self.loyalty_jobs_timer = QTimer(self)
+        self.loyalty_jobs_timer.timeout.connect(self.loyalty_ledger_service.run_scheduled_jobs)
+        self.loyalty_jobs_timer.start(60 * 60 * 1000)
 
         # Initialize Sales & Purchase Backend
         from app.sales_purchase_module.sales_purchase_backend import SalesPurchaseBackend
@@ -166,13 +192,17 @@ class MainWindow(QMainWindow):
             branch_service=self.branch_service,
             company_service=self.company_service,
             currency_service=self.currency_service,
-            warehouse_service=self.warehouse_service
+            warehouse_service=self.warehouse_service,
+            loyalty_ledger_service=self.loyalty_ledger_service,
+            tax_service=self.tax_service,
+            costing_service=self.inventory_costing_service
         )
 
         # Initialize Inventory Backend
         from app.inventory_module.inventory_backend import InventoryBackend
         self.inventory_backend = InventoryBackend()
         self.inventory_backend.set_services(
+            costing_service=self.inventory_costing_service,
             inventory_service=self.inventory_service,
             warehouse_service=self.warehouse_service,
             unit_service=self.unit_service
@@ -193,6 +223,9 @@ class MainWindow(QMainWindow):
         # Instantiate the Settings window
         # self.settings_window = SettingsWindow(self.current_company_id, self.unit_service, self.currency_service, self.payment_method_service, self.loyalty_program_service) # Moved instantiation
 
+        # Post the journal entries of sales invoices created from the sales screens
+        self.sales_purchase_backend.sales_invoice_created.connect(self._handle_invoice_event)
+
         # Connect POSBackend signals to MainWindow slots for cross-module communication
         self.pos_backend.sales_invoice_created.connect(self._handle_invoice_event)
         self.pos_backend.return_invoice_created.connect(self._handle_invoice_event)
@@ -298,18 +331,24 @@ class MainWindow(QMainWindow):
         self.refresh_all_widgets()
     
     def refresh_all_widgets(self):
-        """Refresh translations for all widgets"""
-        for widget_name, widget in self.widgets.items():
-            if hasattr(widget, 'refresh_translations'):
-                try:
-                    widget.refresh_translations()
-                except Exception as e:
-                    print(f"Error refreshing {widget_name}: {e}")
-        
-        # Refresh current widget display
+        """Refresh translations of the visible widget now; the others are refreshed when next shown"""
+        self.stale_translation_widgets = {
+            id(widget) for widget in self.widgets.values() if hasattr(widget, 'refresh_translations')
+        }
         current_widget = self.stacked_widget.currentWidget()
         if current_widget:
-            self.stacked_widget.setCurrentWidget(current_widget)
+            self.refresh_widget_translations(current_widget)
+    
+    def refresh_widget_translations(self, widget):
+        """Refresh a widget's translations if the language changed since it was last shown"""
+        stale = getattr(self, 'stale_translation_widgets', None)
+        if not stale or id(widget) not in stale:
+            return
+        stale.discard(id(widget))
+        try:
+            widget.refresh_translations()
+        except Exception as e:
+            print(f"Error refreshing {type(widget).__name__}: {e}")
 
     def populate_sidebar(self):
         """Populate sidebar with module names"""
@@ -364,6 +403,7 @@ class MainWindow(QMainWindow):
         else:
             widget = self.widgets.get(widget_key)
             if widget:
+                self.refresh_widget_translations(widget)
                 self.stacked_widget.setCurrentWidget(widget)
 
     def create_menu(self):
@@ -445,14 +485,15 @@ class MainWindow(QMainWindow):
         else:
             widget = self.widgets.get(name)
             if widget:
+                self.refresh_widget_translations(widget)
                 self.stacked_widget.setCurrentWidget(widget)
 
     def _handle_invoice_event(self, invoice_data: dict):
-        """ A slot to handle invoice creation events from POSBackend.
+        """ A slot to handle invoice creation events from POSBackend and SalesPurchaseBackend.
         This triggers the creation of accounting entries.
         """
         print(f"[MainWindow] Received invoice event: {invoice_data.get('invoice_no', 'N/A')}")
-        invoice_type = invoice_data.get("invoice_type") # 0 for Sales, 1 for Return
+        invoice_type = invoice_data.get("invoice_type") # 0 Sales, 1 Purchase, 2 Sales Return, 3 Purchase Return
 
         company_id = invoice_data.get("company_id", 1) # Default to 1
         branch_id = invoice_data.get("branch_id", 1)   # Default to 1
@@ -460,8 +501,8 @@ class MainWindow(QMainWindow):
         entry_date = date.fromisoformat(invoice_date_str) if isinstance(invoice_date_str, str) else invoice_date_str
         
         payment_method = invoice_data.get("payment_method")
-        total_amount = Decimal(str(invoice_data.get("total_amount", 0.0)))
-        discount_percentage = Decimal(str(invoice_data.get("discount_percentage", 0.0)))
+        total_amount = Decimal(str(invoice_data.get("total", 0.0)))
+        discount_percentage = Decimal(str(invoice_data.get("discount", 0.0)))
         charges = Decimal(str(invoice_data.get("charges", 0.0)))
         coupon_discount_amount = Decimal(str(invoice_data.get("coupon_discount", 0.0))) # New: Get coupon discount
         loyalty_discount_amount = Decimal(str(invoice_data.get("loyalty_discount_amount", 0.0))) # New: Get loyalty discount
@@ -479,7 +520,7 @@ class MainWindow(QMainWindow):
         # We need to reverse calculate gross sales and the actual discount amount for accounting entries.
         # This assumes total_amount is inclusive of charges and net of discount.
         # Gross sales before any discounts or charges at the item level
-        gross_items_amount = sum(Decimal(str(line['quantity'])) * Decimal(str(line['price'])) for line in invoice_data.get('lines', []))
+        gross_items_amount = sum(Decimal(str(line['quantity'])) * Decimal(str(line['price'])) for line in invoice_data.get('items', []))
         
         # Total discount amount (from percentage)
         overall_discount_amount = gross_items_amount * (discount_percentage / 100)
@@ -540,6 +581,16 @@ class MainWindow(QMainWindow):
                         "memo": f"Sales Invoice {invoice_no} - {payment_method}"
                     })
             
+            # The unpaid rest of a credit sale is owed by the customer
+            debited = sum(line["debit"] for line in journal_lines)
+            if customer_id and total_amount > debited:
+                journal_lines.append({
+                    "account_id": self.ACCOUNTS_RECEIVABLE_ID,
+                    "debit": total_amount - debited,
+                    "credit": Decimal(0),
+                    "memo": f"Sales Invoice {invoice_no} - On Credit"
+                })
+            
             # 2. Credit: Sales Revenue
             if sales_revenue_credit > 0:
                 journal_lines.append({
@@ -569,10 +620,13 @@ class MainWindow(QMainWindow):
 
             # 5. Cost of Goods Sold Entry (Debit: COGS, Credit: Inventory)
             total_cogs = Decimal(0)
-            for line in invoice_data.get('lines', []):
-                item_cost = Decimal(str(line.get('cost_price', 0.0)))
+            for line in invoice_data.get('items', []):
                 item_quantity = Decimal(str(line.get('quantity', 0)))
-                total_cogs += item_cost * item_quantity
+                if line.get('cogs') is not None:
+                    # Costed when the stock movement was recorded; the costing state has already moved past this issue
+                    total_cogs += Decimal(str(line['cogs']))
+                else:
+                    total_cogs += Decimal(str(line.get('cost_price', 0.0))) * item_quantity
             
             if total_cogs > 0:
                 journal_lines.append({
@@ -588,7 +642,7 @@ class MainWindow(QMainWindow):
                     "memo": f"Inventory reduction for Sales Invoice {invoice_no}"
                 })
 
-        elif invoice_type == 1: # Return Invoice
+        elif invoice_type == 2: # Sales Return Invoice
             print(f"[MainWindow] Creating accounting entries for Return Invoice {invoice_no}")
 
             # 1. Debit: Sales Returns
@@ -644,7 +698,7 @@ class MainWindow(QMainWindow):
             # 3. Debit: Inventory (for returned items)
             # 4. Credit: COGS (reverse of sales COGS)
             total_cogs_returned = Decimal(0)
-            for line in invoice_data.get('lines', []):
+            for line in invoice_data.get('items', []):
                 item_cost = Decimal(str(line.get('cost_price', 0.0)))
                 item_quantity = Decimal(str(line.get('quantity', 0)))
                 total_cogs_returned += item_cost * item_quantity
@@ -791,4 +845,5 @@ if __name__ == "__main__":
 
     window = MainWindow()
     window.showMaximized()
+    app.aboutToQuit.connect(audit_writer.shutdown) # Flush queued audit entries before exit
     sys.exit(app.exec())